@@ -0,0 +1,44 @@
+-- Stripe webhook event log
+
+-- Every verified webhook is stored before it is acknowledged, so events
+-- survive restarts and duplicates from Stripe retries are ignored by id.
+CREATE TABLE IF NOT EXISTS stripe_events (
+    id VARCHAR(255) PRIMARY KEY,
+    type VARCHAR(100) NOT NULL,
+    payload JSONB NOT NULL,
+    status VARCHAR(50) DEFAULT 'pending',
+    attempts INTEGER DEFAULT 0,
+    last_error TEXT,
+    received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    claimed_at TIMESTAMP,
+    processed_at TIMESTAMP,
+    CONSTRAINT valid_event_status CHECK (status IN ('pending', 'processing', 'processed', 'failed'))
+);
+
+CREATE INDEX IF NOT EXISTS idx_stripe_events_pending ON stripe_events(received_at)
+    WHERE status IN ('pending', 'failed', 'processing');
+
+-- One billing record per invoice, so replayed invoice events upsert
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_billing_records_invoice_id
+    ON billing_records(stripe_invoice_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_stripe_customer_id
+    ON users(stripe_customer_id);
+
+-- A failed concurrent build leaves an INVALID index that IF NOT EXISTS
+-- would skip on every later run; stop instead of carrying on without it
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_index WHERE indexrelid = 'idx_billing_records_invoice_id'::regclass
+               AND NOT indisvalid) THEN
+        RAISE EXCEPTION 'index idx_billing_records_invoice_id is INVALID'
+            USING HINT = 'Resolve duplicate billing_records.stripe_invoice_id rows, run '
+                         'DROP INDEX CONCURRENTLY idx_billing_records_invoice_id and migrate again';
+    END IF;
+    IF EXISTS (SELECT 1 FROM pg_index WHERE indexrelid = 'idx_users_stripe_customer_id'::regclass
+               AND NOT indisvalid) THEN
+        RAISE EXCEPTION 'index idx_users_stripe_customer_id is INVALID'
+            USING HINT = 'Run DROP INDEX CONCURRENTLY idx_users_stripe_customer_id and migrate again';
+    END IF;
+END
+$$;
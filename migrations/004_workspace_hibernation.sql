@@ -0,0 +1,26 @@
+-- Idle workspace hibernation
+
+-- Workspaces stopped by the idle detector are marked 'hibernated' so they can
+-- be told apart from workspaces the user stopped explicitly
+ALTER TABLE workspaces DROP CONSTRAINT IF EXISTS valid_status;
+ALTER TABLE workspaces ADD CONSTRAINT valid_status
+    CHECK (status IN ('running', 'stopped', 'error', 'hibernated'));
+
+ALTER TABLE workspaces ADD COLUMN IF NOT EXISTS hibernated_at TIMESTAMP;
+
+-- The idle sweep reads last_active_at for all running workspaces at once
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_workspace_usage_stats_workspace_id
+    ON workspace_usage_stats(workspace_id);
+
+-- HibernationManager.touch upserts on this index; a failed concurrent build
+-- leaves it INVALID and IF NOT EXISTS would skip it on every later run
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_index WHERE indexrelid = 'idx_workspace_usage_stats_workspace_id'::regclass
+               AND NOT indisvalid) THEN
+        RAISE EXCEPTION 'index idx_workspace_usage_stats_workspace_id is INVALID'
+            USING HINT = 'Remove duplicate workspace_usage_stats.workspace_id rows, run '
+                         'DROP INDEX CONCURRENTLY idx_workspace_usage_stats_workspace_id and migrate again';
+    END IF;
+END
+$$;
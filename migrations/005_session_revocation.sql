@@ -0,0 +1,47 @@
+-- Session revocation
+
+-- API processes record each token on first use and mark it revoked on
+-- logout; the revoked, unexpired hashes are cached in Redis and in memory
+
+-- The unique index below cannot be built over duplicate hashes: keep the
+-- first row recorded for each token. Runs before the ALTER so the scan
+-- does not hold its exclusive lock.
+DELETE FROM sessions WHERE id IN (
+    SELECT id FROM (
+        SELECT id, ROW_NUMBER() OVER (PARTITION BY token_hash ORDER BY created_at, id) AS copy
+        FROM sessions
+    ) copies
+    WHERE copy > 1
+);
+ALTER TABLE sessions ADD COLUMN IF NOT EXISTS revoked_at TIMESTAMP;
+
+-- One row per token, so first-use recording and logout can upsert
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_sessions_token_hash_unique
+    ON sessions(token_hash);
+
+-- A failed concurrent build leaves an INVALID index that IF NOT EXISTS
+-- would skip on every later run; stop instead of carrying on without it
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_index WHERE indexrelid = 'idx_sessions_token_hash_unique'::regclass
+               AND NOT indisvalid) THEN
+        RAISE EXCEPTION 'index idx_sessions_token_hash_unique is INVALID'
+            USING HINT = 'Remove duplicate sessions.token_hash rows, run '
+                         'DROP INDEX CONCURRENTLY idx_sessions_token_hash_unique and migrate again';
+    END IF;
+END
+$$;
+DROP INDEX CONCURRENTLY IF EXISTS idx_sessions_token_hash;
+
+-- Processes reload the revoked set periodically
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_sessions_revoked
+    ON sessions(expires_at) WHERE revoked_at IS NOT NULL;
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_index WHERE indexrelid = 'idx_sessions_revoked'::regclass AND NOT indisvalid) THEN
+        RAISE EXCEPTION 'index idx_sessions_revoked is INVALID'
+            USING HINT = 'Run DROP INDEX CONCURRENTLY idx_sessions_revoked and migrate again';
+    END IF;
+END
+$$;
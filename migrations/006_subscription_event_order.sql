@@ -0,0 +1,6 @@
+-- Subscription event ordering
+
+-- Stripe does not deliver events in order and several workers apply them at
+-- once; each user keeps the creation time of the newest subscription event
+-- applied, and older events are skipped
+ALTER TABLE users ADD COLUMN IF NOT EXISTS subscription_event_at TIMESTAMP;
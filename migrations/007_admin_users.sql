@@ -0,0 +1,5 @@
+-- Administrators
+
+-- Admin endpoints (profiling) are open to users flagged here; grant with
+-- UPDATE users SET is_admin = TRUE WHERE email = '...'
+ALTER TABLE users ADD COLUMN IF NOT EXISTS is_admin BOOLEAN NOT NULL DEFAULT FALSE;
@@ -0,0 +1,5 @@
+-- Log out everywhere
+
+-- Tokens of a user issued before this time are refused, including tokens
+-- never recorded in sessions; set by "log out everywhere"
+ALTER TABLE users ADD COLUMN IF NOT EXISTS sessions_revoked_before TIMESTAMP;
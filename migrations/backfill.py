@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""Online, resumable backfills for large tables
+
+Rewriting `memory_bank` or `container_metrics` with a single UPDATE holds row
+locks on the whole table and produces one huge transaction. A backfill instead
+walks the table in primary-key order, one small batch per transaction, and
+records the last processed key so an interrupted run resumes where it left off.
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+from typing import Callable, Optional
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+IDENTIFIER_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+class Backfill:
+    """Definition of a keyset-batched UPDATE
+
+    `set_clause` is the body of the UPDATE's SET list and may reference the
+    table's columns directly. `where` restricts which rows need the backfill;
+    keeping it selective (e.g. `new_column IS NULL`) makes reruns cheap.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        table: str,
+        set_clause: str,
+        where: str = "TRUE",
+        key: str = "id",
+        batch_size: int = 1000,
+        sleep_seconds: float = 0.1,
+    ):
+        for identifier in (table, key):
+            if not IDENTIFIER_RE.match(identifier):
+                raise ValueError(f"Invalid identifier: {identifier}")
+        if batch_size <= 0:
+            raise ValueError("batch_size must be positive")
+
+        self.name = name
+        self.table = table
+        self.set_clause = set_clause
+        self.where = where
+        self.key = key
+        self.batch_size = batch_size
+        self.sleep_seconds = sleep_seconds
+
+    def batch_sql(self, resume: bool) -> str:
+        """UPDATE for the next batch, returning its last key and row count"""
+        after = f"{self.key} > %(last_key)s AND " if resume else ""
+        return f"""
+            WITH batch AS (
+                SELECT {self.key} FROM {self.table}
+                WHERE {after}({self.where})
+                ORDER BY {self.key}
+                LIMIT %(batch_size)s
+            ), updated AS (
+                UPDATE {self.table} AS t SET {self.set_clause}
+                FROM batch WHERE t.{self.key} = batch.{self.key}
+                RETURNING 1
+            )
+            SELECT
+                (SELECT {self.key}::text FROM batch ORDER BY {self.key} DESC LIMIT 1) AS last_key,
+                (SELECT count(*) FROM updated) AS updated
+        """
+
+class Throttle:
+    """Pause between batches while replicas lag or the primary is busy"""
+
+    def __init__(
+        self,
+        max_replication_lag: float = 5.0,
+        max_active_queries: Optional[int] = None,
+        check_interval: float = 1.0,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.max_replication_lag = max_replication_lag
+        self.max_active_queries = max_active_queries
+        self.check_interval = check_interval
+        self.sleep = sleep
+
+    def replication_lag(self, cursor) -> float:
+        """Worst replay lag across streaming replicas, in seconds"""
+        cursor.execute("""
+            SELECT COALESCE(MAX(EXTRACT(EPOCH FROM replay_lag)), 0) AS lag
+            FROM pg_stat_replication
+        """)
+        return float(cursor.fetchone()["lag"])
+
+    def active_queries(self, cursor) -> int:
+        """Number of other sessions currently running a query"""
+        cursor.execute("""
+            SELECT count(*) AS active FROM pg_stat_activity
+            WHERE state = 'active' AND pid <> pg_backend_pid()
+        """)
+        return int(cursor.fetchone()["active"])
+
+    def wait(self, cursor) -> float:
+        """Block until the database is healthy enough for the next batch"""
+        waited = 0.0
+        while True:
+            lag = self.replication_lag(cursor)
+            busy = (
+                self.max_active_queries is not None
+                and self.active_queries(cursor) > self.max_active_queries
+            )
+            if lag <= self.max_replication_lag and not busy:
+                return waited
+            reason = f"replication lag {lag:.1f}s" if lag > self.max_replication_lag else "database busy"
+            print(f"  … throttling ({reason})")
+            self.sleep(self.check_interval)
+            waited += self.check_interval
+
+class BackfillRunner:
+    def __init__(self, conn, throttle: Optional[Throttle] = None,
+                 statement_timeout: str = "30s", sleep: Callable[[float], None] = time.sleep):
+        self.conn = conn
+        self.cursor = conn.cursor(cursor_factory=RealDictCursor)
+        self.throttle = throttle or Throttle()
+        self.statement_timeout = statement_timeout
+        self.sleep = sleep
+
+    def create_progress_table(self):
+        """Create the checkpoint table"""
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS backfill_progress (
+                name VARCHAR(255) PRIMARY KEY,
+                last_key TEXT,
+                rows_updated BIGINT DEFAULT 0,
+                status VARCHAR(50) DEFAULT 'running',
+                started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        self.conn.commit()
+
+    def load_checkpoint(self, name: str):
+        """Get the saved progress of a backfill, if any"""
+        self.cursor.execute(
+            "SELECT last_key, rows_updated, status FROM backfill_progress WHERE name = %s",
+            (name,)
+        )
+        return self.cursor.fetchone()
+
+    def run(self, backfill: Backfill, restart: bool = False) -> int:
+        """Run a backfill to completion, resuming from its checkpoint"""
+        self.create_progress_table()
+
+        checkpoint = None if restart else self.load_checkpoint(backfill.name)
+        if checkpoint and checkpoint["status"] == "completed":
+            print(f"Backfill {backfill.name} already completed")
+            return 0
+
+        last_key = checkpoint["last_key"] if checkpoint else None
+        total = checkpoint["rows_updated"] if checkpoint else 0
+        if last_key is not None:
+            print(f"Resuming {backfill.name} after {backfill.key}={last_key} ({total} rows done)")
+        else:
+            print(f"Starting backfill {backfill.name} on {backfill.table}")
+
+        while True:
+            self.throttle.wait(self.cursor)
+            self.conn.commit()
+
+            start = time.monotonic()
+            self.cursor.execute("SET LOCAL statement_timeout = %s", (self.statement_timeout,))
+            self.cursor.execute(
+                backfill.batch_sql(resume=last_key is not None),
+                {"last_key": last_key, "batch_size": backfill.batch_size}
+            )
+            row = self.cursor.fetchone()
+
+            if row["last_key"] is None:
+                self.save_checkpoint(backfill.name, last_key, total, "completed")
+                self.conn.commit()
+                print(f"✓ Backfill {backfill.name} completed: {total} rows updated")
+                return total
+
+            last_key = row["last_key"]
+            total += row["updated"]
+            # Checkpoint in the batch's own transaction so a crash never
+            # records progress that was not committed, or vice versa
+            self.save_checkpoint(backfill.name, last_key, total, "running")
+            self.conn.commit()
+
+            elapsed_ms = int((time.monotonic() - start) * 1000)
+            print(f"  batch up to {last_key}: {row['updated']} rows in {elapsed_ms} ms ({total} total)")
+
+            if backfill.sleep_seconds:
+                self.sleep(backfill.sleep_seconds)
+
+    def save_checkpoint(self, name: str, last_key: Optional[str], rows_updated: int, status: str):
+        self.cursor.execute("""
+            INSERT INTO backfill_progress (name, last_key, rows_updated, status)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (name) DO UPDATE SET
+                last_key = EXCLUDED.last_key,
+                rows_updated = EXCLUDED.rows_updated,
+                status = EXCLUDED.status,
+                updated_at = CURRENT_TIMESTAMP
+        """, (name, last_key, rows_updated, status))
+
+    def status(self):
+        """Show progress of all backfills"""
+        self.create_progress_table()
+        self.cursor.execute(
+            "SELECT name, last_key, rows_updated, status, updated_at FROM backfill_progress ORDER BY name"
+        )
+        rows = self.cursor.fetchall()
+        if not rows:
+            print("No backfills recorded")
+            return
+        for row in rows:
+            marker = "✓" if row["status"] == "completed" else "…"
+            print(f"  {marker} {row['name']}: {row['rows_updated']} rows, "
+                  f"last key {row['last_key']}, updated {row['updated_at']}")
+
+def main():
+    """Main CLI interface"""
+    parser = argparse.ArgumentParser(description="Run online backfills")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run", help="Run or resume a backfill")
+    run.add_argument("name", help="Checkpoint name; reuse it to resume")
+    run.add_argument("--table", required=True)
+    run.add_argument("--set", dest="set_clause", required=True, help="SET list, e.g. \"col = expr\"")
+    run.add_argument("--where", default="TRUE", help="Rows still needing the backfill")
+    run.add_argument("--key", default="id")
+    run.add_argument("--batch-size", type=int, default=1000)
+    run.add_argument("--sleep", type=float, default=0.1, help="Seconds between batches")
+    run.add_argument("--max-replication-lag", type=float, default=5.0)
+    run.add_argument("--max-active-queries", type=int)
+    run.add_argument("--statement-timeout", default="30s")
+    run.add_argument("--restart", action="store_true", help="Ignore the saved checkpoint")
+
+    subparsers.add_parser("status", help="Show backfill progress")
+
+    args = parser.parse_args()
+
+    database_url = os.getenv('DATABASE_URL')
+    if not database_url:
+        print("Error: DATABASE_URL environment variable not set")
+        sys.exit(1)
+
+    conn = psycopg2.connect(database_url)
+
+    try:
+        if args.command == "run":
+            runner = BackfillRunner(
+                conn,
+                throttle=Throttle(args.max_replication_lag, args.max_active_queries),
+                statement_timeout=args.statement_timeout,
+            )
+            runner.run(
+                Backfill(
+                    args.name, args.table, args.set_clause,
+                    where=args.where, key=args.key,
+                    batch_size=args.batch_size, sleep_seconds=args.sleep,
+                ),
+                restart=args.restart,
+            )
+        else:
+            BackfillRunner(conn).status()
+    except Exception as e:
+        conn.rollback()
+        print(f"Backfill failed: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,132 @@
 #!/usr/bin/env python3
 """Database migration tool for ClaudeOSaar"""
 
+import hashlib
 import os
 import psycopg2
 from psycopg2.extras import RealDictCursor
+import re
 import sys
+import time
 from datetime import datetime
 from pathlib import Path
+from typing import Dict, List, Optional
+
+# Name of the session-level advisory lock that serializes concurrent runners
+# (e.g. several API pods running `migrate.py up` at boot). Its key is the
+# first 8 bytes of the name's SHA-256 as a signed bigint, which other tools
+# on the same database are unlikely to pick by accident.
+MIGRATION_LOCK_NAME = "claudeosaar.migrations"
+MIGRATION_LOCK_ID = int.from_bytes(hashlib.sha256(MIGRATION_LOCK_NAME.encode()).digest()[:8], "big", signed=True)
+
+# Fail fast instead of queueing DDL behind long-running queries, which would
+# block every other query on the table for as long as we wait.
+LOCK_TIMEOUT = os.getenv("MIGRATION_LOCK_TIMEOUT", "5s")
+
+# Statements that PostgreSQL refuses to run inside a transaction block
+NON_TRANSACTIONAL_RE = re.compile(
+    r"^\s*(CREATE\s+(UNIQUE\s+)?INDEX\s+CONCURRENTLY"
+    r"|DROP\s+INDEX\s+CONCURRENTLY"
+    r"|REINDEX\s+.*\bCONCURRENTLY\b"
+    r"|VACUUM\b"
+    r"|ALTER\s+TYPE\s+\S+\s+ADD\s+VALUE)",
+    re.IGNORECASE | re.DOTALL,
+)
+
+def split_sql_statements(sql: str) -> List[str]:
+    """Split a SQL script into statements, respecting quotes, comments and $$ bodies"""
+    statements = []
+    current = []
+    i = 0
+    length = len(sql)
+
+    while i < length:
+        char = sql[i]
+
+        # Line comment
+        if sql.startswith("--", i):
+            end = sql.find("\n", i)
+            end = length if end == -1 else end
+            current.append(sql[i:end])
+            i = end
+            continue
+
+        # Block comment
+        if sql.startswith("/*", i):
+            end = sql.find("*/", i + 2)
+            end = length if end == -1 else end + 2
+            current.append(sql[i:end])
+            i = end
+            continue
+
+        # Quoted string or identifier
+        if char in ("'", '"'):
+            end = i + 1
+            while end < length:
+                if sql[end] == char:
+                    # Doubled quote is an escaped quote
+                    if end + 1 < length and sql[end + 1] == char:
+                        end += 2
+                        continue
+                    break
+                end += 1
+            current.append(sql[i:end + 1])
+            i = end + 1
+            continue
+
+        # Dollar-quoted body ($$ ... $$ or $tag$ ... $tag$)
+        if char == "$":
+            match = re.match(r"\$[A-Za-z_]*\$", sql[i:])
+            if match:
+                tag = match.group(0)
+                end = sql.find(tag, i + len(tag))
+                end = length if end == -1 else end + len(tag)
+                current.append(sql[i:end])
+                i = end
+                continue
+
+        if char == ";":
+            statement = "".join(current).strip()
+            if _has_code(statement):
+                statements.append(statement)
+            current = []
+        else:
+            current.append(char)
+        i += 1
+
+    statement = "".join(current).strip()
+    if _has_code(statement):
+        statements.append(statement)
+
+    return statements
+
+def _has_code(statement: str) -> bool:
+    """Check whether a statement contains anything besides comments"""
+    stripped = re.sub(r"--[^\n]*|/\*.*?\*/", "", statement, flags=re.DOTALL)
+    return bool(stripped.strip())
+
+def _strip_leading_comments(statement: str) -> str:
+    return re.sub(r"^(\s*(--[^\n]*|/\*.*?\*/))*\s*", "", statement, flags=re.DOTALL)
+
+def is_transactional(statement: str) -> bool:
+    """Whether a statement may run inside a transaction block"""
+    return not NON_TRANSACTIONAL_RE.match(_strip_leading_comments(statement))
+
+def file_checksum(content: str) -> str:
+    """SHA-256 checksum of a migration file"""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+class MigrationDriftError(Exception):
+    """Raised when an applied migration file was modified after it ran"""
 
 class DatabaseMigration:
-    def __init__(self, database_url: str):
+    def __init__(self, database_url: str, migrations_dir: Optional[Path] = None):
         self.conn = psycopg2.connect(database_url)
         self.cursor = self.conn.cursor(cursor_factory=RealDictCursor)
-        self.migrations_dir = Path(__file__).parent
-        
+        self.migrations_dir = migrations_dir or Path(__file__).parent
+        self._files: Optional[List[str]] = None
+        self._contents: Dict[str, str] = {}
+
     def create_migrations_table(self):
         """Create migrations tracking table"""
         self.cursor.execute("""
@@ -23,115 +136,258 @@ class DatabaseMigration:
                 applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         """)
+        self.cursor.execute("ALTER TABLE migrations ADD COLUMN IF NOT EXISTS checksum VARCHAR(64)")
+        self.cursor.execute("ALTER TABLE migrations ADD COLUMN IF NOT EXISTS duration_ms INTEGER")
         self.conn.commit()
-    
+
+    def acquire_lock(self):
+        """Block until no other runner holds the migration lock"""
+        self.cursor.execute("SELECT pg_try_advisory_lock(%s) AS locked", (MIGRATION_LOCK_ID,))
+        if not self.cursor.fetchone()["locked"]:
+            print("Waiting for another migration runner to finish...")
+            self.cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        self.conn.commit()
+
+    def release_lock(self):
+        """Release the migration lock"""
+        self.cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+        self.conn.commit()
+
+    def migration_files(self) -> List[str]:
+        """List migration files once per run, excluding rollback scripts"""
+        if self._files is None:
+            self._files = sorted(
+                f for f in os.listdir(self.migrations_dir)
+                if f.endswith('.sql') and not f.startswith('rollback_')
+            )
+        return self._files
+
+    def read_migration(self, filename: str) -> str:
+        """Read a migration file, caching its content"""
+        if filename not in self._contents:
+            with open(self.migrations_dir / filename, 'r') as f:
+                self._contents[filename] = f.read()
+        return self._contents[filename]
+
     def get_applied_migrations(self):
         """Get list of already applied migrations"""
-        self.cursor.execute("SELECT filename FROM migrations ORDER BY filename")
-        return {row['filename'] for row in self.cursor.fetchall()}
-    
+        return set(self.get_applied_checksums())
+
+    def get_applied_checksums(self) -> Dict[str, Optional[str]]:
+        """Get recorded checksums of applied migrations, keyed by filename"""
+        self.cursor.execute("SELECT filename, checksum FROM migrations ORDER BY filename")
+        return {row['filename']: row['checksum'] for row in self.cursor.fetchall()}
+
+    def read_applied_checksums(self) -> Dict[str, Optional[str]]:
+        """Like get_applied_checksums, but without creating or altering the tracking table"""
+        self.cursor.execute("SELECT to_regclass('migrations') IS NOT NULL AS tracked")
+        if not self.cursor.fetchone()["tracked"]:
+            return {}
+        # to_jsonb reads a checksum column that older tables do not have as NULL
+        self.cursor.execute("SELECT filename, to_jsonb(m)->>'checksum' AS checksum FROM migrations m ORDER BY filename")
+        return {row['filename']: row['checksum'] for row in self.cursor.fetchall()}
+
     def get_pending_migrations(self):
         """Get list of pending migrations"""
         applied = self.get_applied_migrations()
-        all_migrations = sorted([
-            f for f in os.listdir(self.migrations_dir)
-            if f.endswith('.sql') and f not in applied
-        ])
-        return all_migrations
-    
+        return [f for f in self.migration_files() if f not in applied]
+
+    def detect_drift(self, applied: Dict[str, Optional[str]]) -> List[str]:
+        """Return applied migrations whose file content no longer matches"""
+        drifted = []
+        for filename, checksum in applied.items():
+            if checksum is None or filename not in self.migration_files():
+                continue
+            if file_checksum(self.read_migration(filename)) != checksum:
+                drifted.append(filename)
+        return drifted
+
+    def record_missing_checksums(self, applied: Dict[str, Optional[str]]):
+        """Adopt checksums for migrations applied before checksums were tracked"""
+        for filename, checksum in applied.items():
+            if checksum is None and filename in self.migration_files():
+                self.cursor.execute(
+                    "UPDATE migrations SET checksum = %s WHERE filename = %s",
+                    (file_checksum(self.read_migration(filename)), filename)
+                )
+        self.conn.commit()
+
+    def plan_migration(self, filename: str) -> List[Dict[str, object]]:
+        """Split a migration into steps, grouping statements by transactionality"""
+        steps: List[Dict[str, object]] = []
+        for statement in split_sql_statements(self.read_migration(filename)):
+            transactional = is_transactional(statement)
+            if transactional and steps and steps[-1]["transactional"]:
+                steps[-1]["statements"].append(statement)
+            else:
+                steps.append({"transactional": transactional, "statements": [statement]})
+        return steps
+
     def apply_migration(self, filename: str):
         """Apply a single migration"""
-        filepath = self.migrations_dir / filename
         print(f"Applying migration: {filename}")
-        
+        content = self.read_migration(filename)
+        steps = self.plan_migration(filename)
+        start = time.monotonic()
+
         try:
-            with open(filepath, 'r') as f:
-                migration_sql = f.read()
-            
-            # Execute migration
-            self.cursor.execute(migration_sql)
-            
+            for step in steps:
+                if step["transactional"]:
+                    self.cursor.execute("SET LOCAL lock_timeout = %s", (LOCK_TIMEOUT,))
+                    for statement in step["statements"]:
+                        self.cursor.execute(statement)
+                    # Commit before any non-transactional step; a file
+                    # without such steps still commits exactly once below.
+                    if step is not steps[-1]:
+                        self.conn.commit()
+                else:
+                    self.conn.commit()
+                    self.conn.autocommit = True
+                    try:
+                        for statement in step["statements"]:
+                            self.cursor.execute(statement)
+                    finally:
+                        self.conn.autocommit = False
+
             # Record migration
+            duration_ms = int((time.monotonic() - start) * 1000)
             self.cursor.execute(
-                "INSERT INTO migrations (filename) VALUES (%s)",
-                (filename,)
+                "INSERT INTO migrations (filename, checksum, duration_ms) VALUES (%s, %s, %s)",
+                (filename, file_checksum(content), duration_ms)
             )
-            
+
             self.conn.commit()
-            print(f"✓ Applied: {filename}")
-            
+            print(f"✓ Applied: {filename} ({duration_ms} ms)")
+
         except Exception as e:
             self.conn.rollback()
             print(f"✗ Failed: {filename}")
+            if any(not step["transactional"] for step in steps):
+                print("Note: non-transactional steps are not rolled back; "
+                      "drop any INVALID indexes before retrying")
             print(f"Error: {e}")
             raise
-    
-    def run_migrations(self):
+
+    def run_migrations(self, dry_run: bool = False, allow_drift: bool = False):
         """Run all pending migrations"""
-        self.create_migrations_table()
-        
-        pending = self.get_pending_migrations()
-        
-        if not pending:
-            print("No pending migrations")
-            return
-        
-        print(f"Found {len(pending)} pending migrations:")
-        for migration in pending:
-            print(f"  - {migration}")
-        
-        print("\nApplying migrations...")
-        
+        # Lock first: concurrent CREATE TABLE IF NOT EXISTS can still collide
+        # on the table's type and unique index
+        self.acquire_lock()
+
+        try:
+            if dry_run:
+                # A plan runs no DDL, not even for the tracking table
+                applied = self.read_applied_checksums()
+            else:
+                self.create_migrations_table()
+                # Re-read under the lock: another runner may have just finished
+                applied = self.get_applied_checksums()
+            drifted = self.detect_drift(applied)
+            if drifted:
+                for migration in drifted:
+                    print(f"  ! {migration} changed after it was applied")
+                if not allow_drift:
+                    raise MigrationDriftError(
+                        f"{len(drifted)} applied migration(s) modified: {', '.join(drifted)}"
+                    )
+
+            pending = [f for f in self.migration_files() if f not in applied]
+
+            if not pending:
+                print("No pending migrations")
+                return
+
+            if dry_run:
+                self.print_plan(pending)
+                return
+
+            self.record_missing_checksums(applied)
+
+            print(f"Found {len(pending)} pending migrations:")
+            for migration in pending:
+                print(f"  - {migration}")
+
+            print("\nApplying migrations...")
+
+            for migration in pending:
+                self.apply_migration(migration)
+
+            print(f"\n✓ Successfully applied {len(pending)} migrations")
+        finally:
+            self.release_lock()
+
+    def print_plan(self, pending: List[str]):
+        """Show what `up` would execute, without touching the schema"""
+        print(f"Plan: {len(pending)} pending migrations (dry run)")
         for migration in pending:
-            self.apply_migration(migration)
-        
-        print(f"\n✓ Successfully applied {len(pending)} migrations")
-    
+            print(f"\n{migration}  sha256={file_checksum(self.read_migration(migration))[:12]}")
+            for step in self.plan_migration(migration):
+                mode = "transaction" if step["transactional"] else "autocommit"
+                for statement in step["statements"]:
+                    first_line = _strip_leading_comments(statement).splitlines()[0]
+                    print(f"  [{mode}] {first_line[:100]}")
+
     def rollback_migration(self, filename: str):
         """Rollback a specific migration (if rollback script exists)"""
         rollback_file = self.migrations_dir / f"rollback_{filename}"
-        
+
         if not rollback_file.exists():
             print(f"No rollback script found for {filename}")
             return
-        
+
         print(f"Rolling back migration: {filename}")
-        
+        self.acquire_lock()
+
         try:
             with open(rollback_file, 'r') as f:
                 rollback_sql = f.read()
-            
+
             self.cursor.execute(rollback_sql)
             self.cursor.execute(
                 "DELETE FROM migrations WHERE filename = %s",
                 (filename,)
             )
-            
+
             self.conn.commit()
             print(f"✓ Rolled back: {filename}")
-            
+
         except Exception as e:
             self.conn.rollback()
             print(f"✗ Rollback failed: {filename}")
             print(f"Error: {e}")
             raise
-    
+        finally:
+            self.release_lock()
+
     def status(self):
         """Show migration status"""
-        self.create_migrations_table()
-        
-        applied = self.get_applied_migrations()
-        pending = self.get_pending_migrations()
-        
+        self.acquire_lock()
+        try:
+            self.create_migrations_table()
+        finally:
+            self.release_lock()
+
+        self.cursor.execute(
+            "SELECT filename, applied_at, duration_ms FROM migrations ORDER BY filename"
+        )
+        rows = self.cursor.fetchall()
+        applied = self.get_applied_checksums()
+        pending = [f for f in self.migration_files() if f not in applied]
+        drifted = set(self.detect_drift(applied))
+
         print("Migration Status:")
         print(f"Applied: {len(applied)}")
         print(f"Pending: {len(pending)}")
-        
-        if applied:
+        if drifted:
+            print(f"Drifted: {len(drifted)}")
+
+        if rows:
             print("\nApplied migrations:")
-            for migration in sorted(applied):
-                print(f"  ✓ {migration}")
-        
+            for row in rows:
+                marker = "!" if row['filename'] in drifted else "✓"
+                duration = f" ({row['duration_ms']} ms)" if row['duration_ms'] is not None else ""
+                print(f"  {marker} {row['filename']}{duration}")
+
         if pending:
             print("\nPending migrations:")
             for migration in pending:
@@ -140,27 +396,33 @@ class DatabaseMigration:
 def main():
     """Main CLI interface"""
     if len(sys.argv) < 2:
-        print("Usage: python migrate.py [up|down|status]")
+        print("Usage: python migrate.py [up [--dry-run] [--allow-drift]|plan|down <filename>|status]")
         sys.exit(1)
-    
+
     command = sys.argv[1]
+    flags = set(sys.argv[2:])
     database_url = os.getenv('DATABASE_URL')
-    
+
     if not database_url:
         print("Error: DATABASE_URL environment variable not set")
         sys.exit(1)
-    
+
     migration = DatabaseMigration(database_url)
-    
+
     try:
         if command == 'up':
-            migration.run_migrations()
+            migration.run_migrations(
+                dry_run='--dry-run' in flags,
+                allow_drift='--allow-drift' in flags
+            )
+        elif command == 'plan':
+            migration.run_migrations(dry_run=True, allow_drift=True)
         elif command == 'down' and len(sys.argv) > 2:
             migration.rollback_migration(sys.argv[2])
         elif command == 'status':
             migration.status()
         else:
-            print("Invalid command. Use: up, down <filename>, or status")
+            print("Invalid command. Use: up [--dry-run], plan, down <filename>, or status")
             sys.exit(1)
     except Exception as e:
         print(f"Migration failed: {e}")
@@ -169,4 +431,4 @@ def main():
         migration.conn.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,113 @@
+import asyncio
+import os
+import uuid
+from typing import Dict, Optional
+
+from fastapi import HTTPException
+
+from ..db import Database, get_database
+from ..profiling import span
+
+PRICE_IDS = {
+    "pro": os.getenv("STRIPE_PRICE_PRO", "price_1234567890"),  # Replace with actual Stripe price IDs
+    "enterprise": os.getenv("STRIPE_PRICE_ENTERPRISE", "price_0987654321"),
+}
+
+_stripe = None
+
+def get_stripe():
+    """The Stripe SDK, imported and configured on first use
+
+    Importing it takes a noticeable part of API startup, and most processes
+    serve many requests before the first billing call.
+    """
+    global _stripe
+    if _stripe is None:
+        import stripe
+
+        stripe.api_key = stripe.api_key or os.getenv("STRIPE_SECRET_KEY")
+        stripe.api_base = os.getenv("STRIPE_API_BASE", stripe.api_base)
+        _stripe = stripe
+    return _stripe
+
+class BillingService:
+    """Stripe operations for the billing endpoints
+
+    The Stripe SDK is blocking, so calls run in worker threads. Every write
+    carries an idempotency key, which makes client retries and our own
+    concurrent requests for the same user resolve to a single Stripe object.
+    """
+
+    def __init__(self, db: Database, price_ids: Optional[Dict[str, str]] = None):
+        self.db = db
+        self.price_ids = price_ids or PRICE_IDS
+        self._customer_ids: Dict[str, str] = {}
+
+    async def get_or_create_customer(self, user_id: str, email: str) -> str:
+        """Return the user's Stripe customer id, creating the customer once"""
+        customer_id = self._customer_ids.get(user_id)
+        if customer_id:
+            return customer_id
+
+        row = await self.db.fetchone(
+            "SELECT stripe_customer_id FROM users WHERE id = %s", (user_id,)
+        )
+        customer_id = row["stripe_customer_id"] if row else None
+
+        if not customer_id:
+            with span("stripe.customer.create"):
+                customer = await asyncio.to_thread(
+                    get_stripe().Customer.create,
+                    email=email,
+                    metadata={"user_id": user_id},
+                    idempotency_key=f"customer-{user_id}",
+                )
+            # Only the first writer wins; a concurrent request re-reads it
+            row = await self.db.fetchone(
+                """
+                UPDATE users SET stripe_customer_id = COALESCE(stripe_customer_id, %s)
+                WHERE id = %s RETURNING stripe_customer_id
+                """,
+                (customer.id, user_id),
+            )
+            customer_id = row["stripe_customer_id"] if row else customer.id
+
+        self._customer_ids[user_id] = customer_id
+        return customer_id
+
+    async def create_subscription(self, user_id: str, email: str, tier: str,
+                                  idempotency_key: Optional[str] = None) -> dict:
+        """Create a Stripe subscription awaiting first payment"""
+        if tier not in self.price_ids:
+            raise HTTPException(status_code=400, detail="Invalid tier")
+
+        customer_id = await self.get_or_create_customer(user_id, email)
+
+        # Without a client-supplied key each request is its own attempt; the
+        # SDK's network retries of it reuse the key. Stripe scopes keys to the
+        # whole account, so a client's key is namespaced to its user and tier.
+        key = f"subscription-{user_id}-{tier}-{idempotency_key or uuid.uuid4()}"
+        with span("stripe.subscription.create"):
+            subscription = await asyncio.to_thread(
+                get_stripe().Subscription.create,
+                customer=customer_id,
+                items=[{"price": self.price_ids[tier]}],
+                payment_behavior="default_incomplete",
+                expand=["latest_invoice.payment_intent"],
+                metadata={"user_id": user_id, "tier": tier},
+                idempotency_key=key,
+            )
+
+        return {
+            "subscription_id": subscription.id,
+            "client_secret": subscription.latest_invoice.payment_intent.client_secret
+        }
+
+_billing_service: Optional[BillingService] = None
+
+def get_billing_service() -> BillingService:
+    """FastAPI dependency returning the process-wide billing service"""
+    global _billing_service
+    if _billing_service is None:
+        _billing_service = BillingService(get_database())
+    return _billing_service
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import os
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from ..db import Database, get_database
+from ..logging import logger
+from ..redis_client import REDIS_URL, get_redis
+
+TIER_CACHE_TTL = float(os.getenv("TIER_CACHE_TTL", "60"))
+TIER_CHANNEL = os.getenv("TIER_CHANNEL", "claudeosaar:tiers")
+
+class TierCache:
+    """Short-lived cache of users.subscription_tier
+
+    JWTs carry the tier that was current at login, which goes stale as soon
+    as a subscription changes. Reading the tier from the database keeps
+    limits correct; caching it keeps that read off the hot path. Webhook
+    processing updates entries when Stripe reports a change, in every
+    process when Redis is configured and otherwise only in the one that
+    processed the event.
+    """
+
+    def __init__(self, db: Database, ttl: float = TIER_CACHE_TTL, get_redis: Optional[Callable] = None):
+        self.db = db
+        self.ttl = ttl
+        self.get_redis = get_redis
+        self._entries: Dict[str, Tuple[str, float]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def get(self, user_id: str, default: str = "free") -> str:
+        """Return the user's current tier, falling back to `default`"""
+        entry = self._entries.get(user_id)
+        now = time.monotonic()
+        if entry and entry[1] > now:
+            return entry[0]
+
+        row = await self.db.fetchone(
+            "SELECT subscription_tier FROM users WHERE id = %s", (user_id,)
+        )
+        tier = row["subscription_tier"] if row and row["subscription_tier"] else default
+        self._entries[user_id] = (tier, now + self.ttl)
+        return tier
+
+    def peek(self, user_id: str) -> Optional[str]:
+        """The cached tier if still fresh, without going to the database"""
+        entry = self._entries.get(user_id)
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+        return None
+
+    def set(self, user_id: str, tier: str):
+        self._entries[user_id] = (tier, time.monotonic() + self.ttl)
+
+    def invalidate(self, user_id: Optional[str] = None):
+        """Drop one user's entry, or all entries"""
+        if user_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(user_id, None)
+
+    def _redis(self):
+        return self.get_redis() if self.get_redis else None
+
+    async def publish(self, user_id: str, tier: str):
+        """Set a user's tier here and in every other process's cache"""
+        self.set(user_id, tier)
+        redis = self._redis()
+        if redis is None:
+            return
+        try:
+            await redis.publish(TIER_CHANNEL, json.dumps([user_id, tier]))
+        except Exception as e:
+            # Other processes see the change when their entry expires
+            logger.warning({"message": "Failed to publish tier change", "error": str(e)})
+
+    async def _listen(self):
+        redis = self._redis()
+        while True:
+            pubsub = redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(TIER_CHANNEL)
+                # Changes published while unsubscribed were missed
+                self.invalidate()
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        user_id, tier = json.loads(message["data"])
+                        self.set(user_id, tier)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning({"message": "Tier change subscription failed", "error": str(e)})
+            finally:
+                close = getattr(pubsub, "aclose", None) or pubsub.close
+                try:
+                    await close()
+                except Exception:
+                    pass
+            await asyncio.sleep(1)
+
+    def start(self):
+        if self._task is None and self._redis() is not None:
+            self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+_tier_cache: Optional[TierCache] = None
+
+def get_tier_cache() -> TierCache:
+    """Process-wide tier cache"""
+    global _tier_cache
+    if _tier_cache is None:
+        _tier_cache = TierCache(get_database(), get_redis=get_redis if REDIS_URL else None)
+    return _tier_cache
@@ -0,0 +1,268 @@
+import asyncio
+import json
+import os
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from prometheus_client import Counter, Gauge
+
+from ..db import Database, get_database
+from ..logging import logger
+from .service import PRICE_IDS, get_stripe
+from .tiers import TierCache, get_tier_cache
+
+STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
+WEBHOOK_WORKERS = int(os.getenv("STRIPE_WEBHOOK_WORKERS", "4"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("STRIPE_WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_MAX_ATTEMPTS = 5
+# Pending or failed events not picked up from the queue are re-read this often
+WEBHOOK_SWEEP_INTERVAL = float(os.getenv("STRIPE_WEBHOOK_SWEEP_INTERVAL", "30"))
+
+webhook_events_total = Counter(
+    'claudeosaar_stripe_webhook_events_total',
+    'Stripe webhook events by outcome',
+    ['type', 'outcome']
+)
+webhook_queue_depth = Gauge(
+    'claudeosaar_stripe_webhook_queue_depth',
+    'Stripe webhook events waiting for a worker',
+    multiprocess_mode='livesum'
+)
+
+ACTIVE_SUBSCRIPTION_STATUSES = {"active", "trialing", "past_due"}
+
+router = APIRouter()
+
+class WebhookProcessor:
+    """Persist-then-process pipeline for Stripe events
+
+    The endpoint only verifies, stores and enqueues; a small pool of workers
+    applies the events. Each event is claimed with a conditional UPDATE, so
+    duplicates delivered by Stripe (or re-read by the sweeper) run once.
+    Subscription events change a user's tier only if they were created no
+    earlier than the last one applied, since Stripe may deliver them out of
+    order and workers may finish them out of order.
+    """
+
+    def __init__(self, db: Database, tiers: TierCache, workers: int = WEBHOOK_WORKERS,
+                 queue_size: int = WEBHOOK_QUEUE_SIZE, price_ids: Optional[Dict[str, str]] = None):
+        self.db = db
+        self.tiers = tiers
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.tier_by_price = {price: tier for tier, price in (price_ids or PRICE_IDS).items()}
+        self._tasks: List[asyncio.Task] = []
+
+    async def ingest(self, event: dict):
+        """Store a verified event and hand it to the workers"""
+        await self.db.execute(
+            """
+            INSERT INTO stripe_events (id, type, payload)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (id) DO NOTHING
+            """,
+            (event["id"], event["type"], json.dumps(event))
+        )
+        try:
+            self.queue.put_nowait(event["id"])
+        except asyncio.QueueFull:
+            # Already persisted; the sweeper will pick it up
+            logger.warning({"message": "Webhook queue full", "event_id": event["id"]})
+        webhook_queue_depth.set(self.queue.qsize())
+
+    def start(self):
+        """Start the worker pool and the pending-event sweeper"""
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._sweeper()))
+
+    async def stop(self, timeout: float = 0):
+        """Let workers finish queued events for up to `timeout`, then cancel them
+
+        Events still queued or in progress stay in the database and are
+        picked up by the next process.
+        """
+        if self._tasks and timeout > 0:
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning({"message": "Webhook queue not drained before shutdown",
+                                "pending": self.queue.qsize()})
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        while True:
+            event_id = await self.queue.get()
+            webhook_queue_depth.set(self.queue.qsize())
+            try:
+                await self.process(event_id)
+            except Exception as e:
+                logger.error({"message": "Webhook worker error", "event_id": event_id, "error": str(e)})
+            finally:
+                self.queue.task_done()
+
+    async def _sweeper(self):
+        # The first sweep recovers events left over from a previous process
+        while True:
+            try:
+                await self.enqueue_pending()
+            except Exception as e:
+                logger.error({"message": "Webhook sweep failed", "error": str(e)})
+            await asyncio.sleep(WEBHOOK_SWEEP_INTERVAL)
+
+    async def enqueue_pending(self) -> int:
+        """Queue events left pending by a full queue, a crash or a failure"""
+        rows = await self.db.fetchall(
+            """
+            SELECT id FROM stripe_events
+            WHERE status IN ('pending', 'failed', 'processing') AND attempts < %s
+            ORDER BY received_at
+            LIMIT %s
+            """,
+            (WEBHOOK_MAX_ATTEMPTS, max(self.queue.maxsize - self.queue.qsize(), 0))
+        )
+        for row in rows:
+            self.queue.put_nowait(row["id"])
+        return len(rows)
+
+    async def process(self, event_id: str) -> bool:
+        """Apply one event if no other worker has; returns whether it ran"""
+        row = await self.db.fetchone(
+            """
+            UPDATE stripe_events
+            SET status = 'processing', attempts = attempts + 1, claimed_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND attempts < %s
+              AND (status IN ('pending', 'failed')
+                   OR (status = 'processing' AND claimed_at < CURRENT_TIMESTAMP - INTERVAL '5 minutes'))
+            RETURNING type, payload
+            """,
+            (event_id, WEBHOOK_MAX_ATTEMPTS)
+        )
+        if row is None:
+            return False
+
+        event_type = row["type"]
+        payload = row["payload"]
+        if isinstance(payload, str):
+            payload = json.loads(payload)
+
+        try:
+            await self.handle(event_type, payload["data"]["object"], payload.get("created"))
+        except Exception as e:
+            await self.db.execute(
+                "UPDATE stripe_events SET status = 'failed', last_error = %s WHERE id = %s",
+                (str(e), event_id)
+            )
+            webhook_events_total.labels(type=event_type, outcome="failed").inc()
+            raise
+
+        await self.db.execute(
+            "UPDATE stripe_events SET status = 'processed', processed_at = CURRENT_TIMESTAMP, last_error = NULL WHERE id = %s",
+            (event_id,)
+        )
+        webhook_events_total.labels(type=event_type, outcome="processed").inc()
+        return True
+
+    async def handle(self, event_type: str, obj: dict, created: Optional[int] = None):
+        """Dispatch an event to its handler; unknown types are acknowledged"""
+        if event_type in ("customer.subscription.created", "customer.subscription.updated"):
+            tier = self.subscription_tier(obj) if obj.get("status") in ACTIVE_SUBSCRIPTION_STATUSES else "free"
+            await self.set_tier(obj["customer"], tier, created)
+        elif event_type == "customer.subscription.deleted":
+            await self.set_tier(obj["customer"], "free", created)
+        elif event_type in ("invoice.paid", "invoice.payment_succeeded", "invoice.payment_failed"):
+            await self.record_invoice(obj, "paid" if event_type != "invoice.payment_failed" else "failed")
+
+    def subscription_tier(self, subscription: dict) -> str:
+        tier = (subscription.get("metadata") or {}).get("tier")
+        if tier:
+            return tier
+        for item in (subscription.get("items") or {}).get("data", []):
+            price_id = (item.get("price") or {}).get("id")
+            if price_id in self.tier_by_price:
+                return self.tier_by_price[price_id]
+        return "free"
+
+    async def set_tier(self, customer_id: str, tier: str, created: Optional[int] = None):
+        """Apply a tier unless a newer subscription event was applied already"""
+        # users uses TIMESTAMP without time zone, in UTC
+        created_at = datetime.fromtimestamp(created, timezone.utc).replace(tzinfo=None) if created else None
+        rows = await self.db.fetchall(
+            """
+            UPDATE users SET subscription_tier = %s,
+                subscription_event_at = COALESCE(%s, subscription_event_at)
+            WHERE stripe_customer_id = %s
+              AND (%s IS NULL OR subscription_event_at IS NULL OR subscription_event_at <= %s)
+            RETURNING id
+            """,
+            (tier, created_at, customer_id, created_at, created_at)
+        )
+        if not rows:
+            logger.info({"message": "Subscription event skipped", "customer": customer_id, "tier": tier,
+                         "reason": "unknown customer or newer event applied"})
+            return
+        for row in rows:
+            await self.tiers.publish(str(row["id"]), tier)
+        logger.info({"message": "Subscription tier updated", "customer": customer_id, "tier": tier})
+
+    async def record_invoice(self, invoice: dict, status: str):
+        amount = invoice.get("amount_paid") if status == "paid" else invoice.get("amount_due")
+        await self.db.execute(
+            """
+            INSERT INTO billing_records (user_id, stripe_subscription_id, stripe_invoice_id, amount, currency, status)
+            SELECT id, %s, %s, %s, %s, %s FROM users WHERE stripe_customer_id = %s
+            ON CONFLICT (stripe_invoice_id) DO UPDATE SET
+                status = EXCLUDED.status,
+                amount = EXCLUDED.amount
+            """,
+            (
+                invoice.get("subscription"),
+                invoice["id"],
+                Decimal(amount or 0) / 100,
+                (invoice.get("currency") or "eur").upper(),
+                status,
+                invoice["customer"],
+            )
+        )
+
+_processor: Optional[WebhookProcessor] = None
+
+def get_webhook_processor() -> WebhookProcessor:
+    """Process-wide webhook processor"""
+    global _processor
+    if _processor is None:
+        _processor = WebhookProcessor(get_database(), get_tier_cache())
+    return _processor
+
+@router.post("/api/billing/webhook")
+async def stripe_webhook(
+    request: Request,
+    processor: WebhookProcessor = Depends(get_webhook_processor)
+):
+    """Receive Stripe webhooks; processing happens asynchronously"""
+    if not STRIPE_WEBHOOK_SECRET:
+        raise HTTPException(status_code=503, detail="Webhooks not configured")
+
+    payload = await request.body()
+    signature = request.headers.get("stripe-signature")
+    stripe = get_stripe()
+
+    try:
+        stripe.WebhookSignature.verify_header(
+            payload.decode("utf-8"), signature, STRIPE_WEBHOOK_SECRET,
+            stripe.Webhook.DEFAULT_TOLERANCE
+        )
+        event = json.loads(payload)
+    except (stripe.error.SignatureVerificationError, ValueError):
+        webhook_events_total.labels(type="unknown", outcome="rejected").inc()
+        raise HTTPException(status_code=400, detail="Invalid signature")
+
+    await processor.ingest(event)
+    webhook_events_total.labels(type=event["type"], outcome="received").inc()
+    return {"received": True}
@@ -0,0 +1,97 @@
+import asyncio
+import functools
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from prometheus_client import Counter
+
+# Entries kept per SingleFlight for micro-caching before the oldest are dropped
+COALESCE_MAX_ENTRIES = int(os.getenv("COALESCE_MAX_ENTRIES", "10000"))
+
+coalesced_requests_total = Counter(
+    'claudeosaar_coalesced_requests_total',
+    'Reads by how they were answered: leader (did the backend call), joined (shared '
+    'an in-flight call) or cached (within the micro-cache TTL)',
+    ['name', 'outcome']
+)
+
+class SingleFlight:
+    """Share one in-flight call, and optionally its result for `ttl` seconds, among identical reads
+
+    The call runs as its own task, so a caller that goes away does not
+    cancel it for the others. Failures are shared with the callers already
+    waiting but never cached. Results are shared objects: callers must not
+    mutate them.
+    """
+
+    def __init__(self, name: str, ttl: float = 0.0, max_entries: int = COALESCE_MAX_ENTRIES):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._cache: Dict[Hashable, Tuple[Any, float]] = {}
+        self._leader = coalesced_requests_total.labels(name=name, outcome="leader")
+        self._joined = coalesced_requests_total.labels(name=name, outcome="joined")
+        self._cached = coalesced_requests_total.labels(name=name, outcome="cached")
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable]):
+        if self.ttl:
+            entry = self._cache.get(key)
+            if entry is not None:
+                if entry[1] > time.monotonic():
+                    self._cached.inc()
+                    return entry[0]
+                del self._cache[key]
+
+        task = self._inflight.get(key)
+        if task is None:
+            self._leader.inc()
+            task = asyncio.ensure_future(call())
+            self._inflight[key] = task
+            task.add_done_callback(functools.partial(self._done, key))
+        else:
+            self._joined.inc()
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        # Retrieves the exception even when every caller has gone away
+        failed = task.cancelled() or task.exception() is not None
+        if self._inflight.get(key) is not task:
+            return  # invalidated while running
+        del self._inflight[key]
+        if failed or not self.ttl:
+            return
+        self._cache[key] = (task.result(), time.monotonic() + self.ttl)
+        while len(self._cache) > self.max_entries:
+            del self._cache[next(iter(self._cache))]
+
+    def invalidate(self, *prefix):
+        """Drop cached results whose key tuple starts with `prefix`; everything if empty
+
+        Calls already in flight still complete for their callers, but their
+        results are not cached.
+        """
+        n = len(prefix)
+        for key in [key for key in self._cache if key[:n] == prefix]:
+            del self._cache[key]
+        for key in [key for key in self._inflight if key[:n] == prefix]:
+            del self._inflight[key]
+
+def coalesced(flight: SingleFlight, *params: str):
+    """Endpoint decorator: identical concurrent requests share one execution
+
+    Requests are identical when they hit the same endpoint as the same user
+    (`current_user["user_id"]`) with the same values of `params`. The key
+    starts with the first of `params`, so `flight.invalidate(value)` drops
+    every cached response for it.
+    """
+    def decorate(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(**kwargs):
+            user: Optional[dict] = kwargs.get("current_user")
+            key = (*(kwargs[param] for param in params), endpoint.__name__,
+                   user.get("user_id") if user else None)
+            return await flight.do(key, lambda: endpoint(**kwargs))
+        return wrapper
+    return decorate
@@ -0,0 +1,171 @@
+import asyncio
+import os
+import time
+import urllib.request
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from prometheus_client import Gauge
+
+from .logging import logger
+
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "10"))
+HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "2"))
+# Dependencies without which this instance should not receive traffic;
+# failures of the others only mark it degraded
+HEALTH_CRITICAL = [
+    name.strip() for name in os.getenv("HEALTH_CRITICAL", "postgres,docker").split(",") if name.strip()
+]
+
+dependency_up = Gauge(
+    'claudeosaar_dependency_up',
+    'Whether the last probe of a dependency succeeded',
+    ['dependency'],
+    multiprocess_mode='livemostrecent'
+)
+dependency_latency = Gauge(
+    'claudeosaar_dependency_probe_latency_seconds',
+    'Latency of the last probe of a dependency',
+    ['dependency'],
+    multiprocess_mode='livemostrecent'
+)
+
+class Probe:
+    """A named dependency check; `check` raises or times out on failure"""
+
+    def __init__(self, name: str, check: Callable[[], Awaitable], critical: bool = False):
+        self.name = name
+        self.check = check
+        self.critical = critical
+        self.up: Optional[bool] = None
+        self.latency: Optional[float] = None
+        self.error: Optional[str] = None
+        self.checked_at: Optional[float] = None
+
+    def report(self, now: float) -> dict:
+        return {
+            "status": "unknown" if self.up is None else ("up" if self.up else "down"),
+            "critical": self.critical,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "age_seconds": round(now - self.checked_at, 1) if self.checked_at else None,
+            "error": self.error,
+        }
+
+class HealthMonitor:
+    """Probe dependencies in the background and serve cached results
+
+    Probes run concurrently every `interval` seconds, so health endpoints
+    cost a dictionary read no matter how often they are polled. A result
+    older than three intervals counts as down: it means the probe loop
+    itself is stuck.
+    """
+
+    def __init__(self, probes: List[Probe], interval: float = HEALTH_PROBE_INTERVAL,
+                 timeout: float = HEALTH_PROBE_TIMEOUT):
+        self.probes: Dict[str, Probe] = {probe.name: probe for probe in probes}
+        self.interval = interval
+        self.timeout = timeout
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_probe(self, probe: Probe):
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(probe.check(), self.timeout)
+            probe.up, probe.error = True, None
+        except Exception as e:
+            if probe.up is not False:
+                logger.warning({"message": "Dependency probe failed", "dependency": probe.name,
+                                "error": repr(e)})
+            probe.up = False
+            probe.error = "timeout" if isinstance(e, asyncio.TimeoutError) else repr(e)
+        probe.latency = time.monotonic() - start
+        probe.checked_at = time.time()
+        dependency_up.labels(dependency=probe.name).set(1 if probe.up else 0)
+        dependency_latency.labels(dependency=probe.name).set(probe.latency)
+
+    async def probe_all(self):
+        await asyncio.gather(*(self.run_probe(probe) for probe in self.probes.values()))
+
+    def _fresh_up(self, probe: Probe, now: float) -> bool:
+        return bool(probe.up) and now - probe.checked_at <= self.interval * 3
+
+    def status(self) -> str:
+        """Overall status: ok, degraded (a non-critical dependency is down) or down"""
+        now = time.time()
+        status = "ok"
+        for probe in self.probes.values():
+            if self._fresh_up(probe, now):
+                continue
+            if probe.critical:
+                return "down"
+            status = "degraded"
+        return status
+
+    @property
+    def ready(self) -> bool:
+        return self.status() != "down"
+
+    def report(self) -> dict:
+        now = time.time()
+        return {
+            "status": self.status(),
+            "dependencies": {name: probe.report(now) for name, probe in self.probes.items()},
+        }
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await self.probe_all()
+            await asyncio.sleep(self.interval)
+
+def postgres_probe(db) -> Callable[[], Awaitable]:
+    async def check():
+        await db.fetchone("SELECT 1")
+    return check
+
+def docker_probe(scheduler) -> Callable[[], Awaitable]:
+    """Up while at least one Docker node answers a ping"""
+    async def check():
+        results = await asyncio.to_thread(scheduler._map, lambda node: node.client.ping())
+        errors = [result for _, result in results if isinstance(result, Exception)]
+        if len(errors) == len(results):
+            raise errors[0]
+    return check
+
+def redis_probe(get_redis: Callable) -> Callable[[], Awaitable]:
+    async def check():
+        await get_redis().ping()
+    return check
+
+def http_probe(url: str) -> Callable[[], Awaitable]:
+    """GET `url` and expect a 2xx; for services like Qdrant's /readyz"""
+    def get():
+        with urllib.request.urlopen(url, timeout=HEALTH_PROBE_TIMEOUT) as response:
+            if response.status >= 300:
+                raise RuntimeError(f"HTTP {response.status}")
+
+    async def check():
+        await asyncio.to_thread(get)
+    return check
+
+def default_probes(db, scheduler, get_redis: Optional[Callable] = None, qdrant_url: Optional[str] = None,
+                   images=None, critical: List[str] = HEALTH_CRITICAL) -> List[Probe]:
+    """Postgres and Docker, plus Redis, Qdrant and workspace images when configured"""
+    checks = {"postgres": postgres_probe(db), "docker": docker_probe(scheduler)}
+    if get_redis is not None:
+        checks["redis"] = redis_probe(get_redis)
+    if qdrant_url:
+        checks["qdrant"] = http_probe(qdrant_url.rstrip("/") + "/readyz")
+    if images is not None:
+        # Not critical by default; add "images" to HEALTH_CRITICAL to keep
+        # traffic away until the workspace image is pulled
+        checks["images"] = images.probe
+    return [Probe(name, check, critical=name in critical) for name, check in checks.items()]
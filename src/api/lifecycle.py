@@ -0,0 +1,127 @@
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from .logging import logger
+
+# Seconds between SIGTERM and closing the listening socket. Readiness fails
+# during this window so load balancers stop routing here while requests that
+# still arrive are served normally.
+SHUTDOWN_DRAIN_DELAY = float(os.getenv("SHUTDOWN_DRAIN_DELAY", "5"))
+# Budget for finishing in-flight requests and stopping background jobs; keep
+# DRAIN_DELAY + TIMEOUT below the orchestrator's grace period (30s on k8s)
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "20"))
+
+class Lifecycle:
+    """Process state shared by readiness checks, request tracking and shutdown"""
+
+    def __init__(self):
+        self.state = "starting"
+        self.in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.deadline: Optional[float] = None
+        self._stoppers: List[Tuple[str, Callable[[float], Awaitable]]] = []
+        self._drain_callbacks: List[Callable[[], None]] = []
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    @property
+    def draining(self) -> bool:
+        return self.state in ("draining", "stopped")
+
+    def mark_ready(self):
+        if self.state != "draining":
+            self.state = "ready"
+            self.deadline = None
+
+    def begin_drain(self, deadline: Optional[float] = None):
+        """Fail readiness from now on; `deadline` bounds the whole shutdown"""
+        if not self.draining:
+            self.state = "draining"
+            self.deadline = deadline
+            logger.info({"message": "Draining", "in_flight": self.in_flight})
+            for callback in self._drain_callbacks:
+                callback()
+
+    def on_drain(self, callback: Callable[[], None]):
+        """Call `callback` when draining starts, e.g. to end long-lived streams"""
+        self._drain_callbacks.append(callback)
+
+    def on_shutdown(self, name: str, stop: Callable[[float], Awaitable]):
+        """Register `stop(timeout)` to run at shutdown, in reverse registration order"""
+        self._stoppers.append((name, stop))
+
+    async def wait_idle(self, timeout: float) -> bool:
+        """Wait until no request is in flight; False if the deadline passed"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def shutdown(self, timeout: float = SHUTDOWN_TIMEOUT):
+        """Drain requests, then stop background jobs, all within `timeout`
+
+        When a SIGTERM started the drain, the deadline set then is kept, so
+        time uvicorn spent finishing requests counts against the same budget.
+        """
+        self.begin_drain()
+        deadline = self.deadline or time.monotonic() + timeout
+
+        if not await self.wait_idle(max(deadline - time.monotonic(), 0)):
+            logger.warning({"message": "Shutdown deadline reached with requests in flight",
+                            "in_flight": self.in_flight})
+
+        for name, stop in reversed(self._stoppers):
+            remaining = max(deadline - time.monotonic(), 0)
+            try:
+                await asyncio.wait_for(stop(remaining), remaining + 1)
+            except Exception as e:
+                logger.error({"message": "Shutdown step failed", "step": name, "error": repr(e)})
+
+        self._stoppers = []
+        self._drain_callbacks = []
+        self.state = "stopped"
+        logger.info({"message": "Shutdown complete"})
+        for handler in logger.handlers:
+            handler.flush()
+
+class InFlightMiddleware:
+    """Count HTTP requests until their response body is fully sent
+
+    Written as plain ASGI so streaming responses are counted until they
+    finish. While draining, responses carry `Connection: close` so keep-alive
+    clients reconnect to another instance.
+    """
+
+    def __init__(self, app, lifecycle: Lifecycle):
+        self.app = app
+        self.lifecycle = lifecycle
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        lifecycle = self.lifecycle
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and lifecycle.draining:
+                message["headers"] = [
+                    (k, v) for k, v in message.get("headers", []) if k.lower() != b"connection"
+                ] + [(b"connection", b"close")]
+            await send(message)
+
+        lifecycle.in_flight += 1
+        lifecycle._idle.clear()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            lifecycle.in_flight -= 1
+            if not lifecycle.in_flight:
+                lifecycle._idle.set()
+
+lifecycle = Lifecycle()
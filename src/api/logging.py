@@ -1,13 +1,24 @@
 import logging
+import os
 import sys
 from pathlib import Path
 from logging.handlers import RotatingFileHandler
 from pythonjsonlogger import jsonlogger
 
-# Create logs directory if it doesn't exist
-Path("logs").mkdir(exist_ok=True)
+# Directory for the rotating log files; empty logs to stdout only
+LOG_DIR = os.getenv("LOG_DIR", "logs")
 
-def setup_logging(app_name: str = "claudeosaar"):
+class LazyRotatingFileHandler(RotatingFileHandler):
+    """Rotating file handler that opens its file, and creates its directory, on the first record"""
+
+    def __init__(self, filename, **kwargs):
+        super().__init__(filename, delay=True, **kwargs)
+
+    def _open(self):
+        Path(self.baseFilename).parent.mkdir(parents=True, exist_ok=True)
+        return super()._open()
+
+def setup_logging(app_name: str = "claudeosaar", log_dir: str = LOG_DIR):
     """Setup structured logging configuration"""
     
     # Create logger
@@ -24,10 +35,13 @@ def setup_logging(app_name: str = "claudeosaar"):
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setFormatter(json_formatter)
     logger.addHandler(console_handler)
+
+    if not log_dir:
+        return logger
     
     # File handler with rotation
-    file_handler = RotatingFileHandler(
-        f"logs/{app_name}.log",
+    file_handler = LazyRotatingFileHandler(
+        f"{log_dir}/{app_name}.log",
         maxBytes=10485760,  # 10MB
         backupCount=5
     )
@@ -35,8 +49,8 @@ def setup_logging(app_name: str = "claudeosaar"):
     logger.addHandler(file_handler)
     
     # Error file handler
-    error_handler = RotatingFileHandler(
-        f"logs/{app_name}_error.log",
+    error_handler = LazyRotatingFileHandler(
+        f"{log_dir}/{app_name}_error.log",
         maxBytes=10485760,  # 10MB
         backupCount=5
     )
@@ -53,17 +67,25 @@ logger = setup_logging()
 async def log_requests(request, call_next):
     """Log all incoming requests"""
     import time
+    from .profiling import collect_spans
+
     start_time = time.time()
     
-    response = await call_next(request)
+    with collect_spans() as spans:
+        response = await call_next(request)
     
     process_time = time.time() - start_time
-    logger.info({
+    record = {
         "method": request.method,
         "path": request.url.path,
         "status_code": response.status_code,
         "process_time": process_time,
         "client_ip": request.client.host
-    })
+    }
+    if spans:
+        # Time spent waiting on Docker, Stripe and the database, per call kind
+        record["spans"] = {name: {"calls": calls, "seconds": round(seconds, 6)}
+                           for name, (calls, seconds) in spans.items()}
+    logger.info(record)
     
     return response
\ No newline at end of file
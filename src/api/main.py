@@ -1,22 +1,85 @@
+import asyncio
 import os
 import uuid
+from contextlib import aclosing, asynccontextmanager
 from datetime import datetime, timedelta
 from typing import Optional
+from urllib.parse import parse_qs
 
-import docker
-import jwt
-import stripe
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
-from prometheus_client import Counter, Histogram, Gauge, generate_latest
-from starlette.responses import Response
+from prometheus_client import Counter, Histogram, Gauge
+from starlette.responses import JSONResponse, Response, StreamingResponse
 
+from .billing.service import BillingService, get_billing_service
+from .billing.tiers import TierCache, get_tier_cache
+from .billing.webhooks import get_webhook_processor, router as webhook_router
+from .coalesce import SingleFlight, coalesced
+from .db import get_database
+from .health import HealthMonitor, default_probes
+from .lifecycle import InFlightMiddleware, lifecycle
+from .metrics import render_metrics
+from .profiling import Profiler, folded
 from .logging import logger, log_requests
+from .middleware.load_shed import LoadShedder, LoadShedMiddleware
 from .middleware.rate_limit import RateLimitMiddleware
+from .redis_client import REDIS_URL, close_redis, get_redis
+from .sessions import SessionStore, token_hash
+from .workspaces.admission import AdmissionController
+from .workspaces.disk_usage import DiskUsageTracker
+from .workspaces.events import WorkspaceEvents, sse_frame
+from .workspaces.exec import ExecManager, describe, exec_event, workspace_owner
+from .workspaces.files import MEDIA_TYPES, WorkspaceFiles, archive_filename, check_compression, parse_range
+from .workspaces.hibernation import HibernationManager
+from .workspaces.images import WORKSPACE_IMAGE, ImageManager
+from .workspaces.reconciler import Reconciler
+from .workspaces.resources import tier_resources
+from .workspaces import scheduler as scheduling
+from .workspaces.scheduler import WorkspaceScheduler
+from .workspaces.snapshots import SnapshotManager
+from .workspaces.terminal import TerminalProxy
 
-app = FastAPI(title="ClaudeOSaar API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start background jobs; on shutdown drain requests and stop them in reverse order"""
+    lifecycle.on_shutdown("database", lambda timeout: asyncio.to_thread(get_database().close))
+    lifecycle.on_shutdown("redis", lambda timeout: close_redis())
+    sessions.start()
+    lifecycle.on_shutdown("sessions", lambda timeout: sessions.stop())
+    get_tier_cache().start()
+    lifecycle.on_shutdown("tiers", lambda timeout: get_tier_cache().stop())
+    health.start()
+    lifecycle.on_shutdown("health", lambda timeout: health.stop())
+    scheduler.start()
+    lifecycle.on_shutdown("scheduler", lambda timeout: scheduler.stop())
+    images.start()
+    lifecycle.on_shutdown("images", lambda timeout: images.stop())
+    admission.start()
+    lifecycle.on_shutdown("admission", lambda timeout: admission.stop())
+    reconciler.start()
+    lifecycle.on_shutdown("reconciler", lambda timeout: reconciler.stop())
+    events.start()
+    lifecycle.on_shutdown("events", lambda timeout: events.stop())
+    lifecycle.on_drain(events.close_streams)
+    hibernation.start()
+    lifecycle.on_shutdown("hibernation", lambda timeout: hibernation.stop())
+    snapshots.start()
+    lifecycle.on_shutdown("snapshots", lambda timeout: snapshots.stop())
+    disk_usage.start()
+    lifecycle.on_shutdown("disk_usage", lambda timeout: disk_usage.stop())
+    profiler.start()
+    lifecycle.on_shutdown("profiler", lambda timeout: profiler.stop())
+    webhooks = get_webhook_processor()
+    webhooks.start()
+    lifecycle.on_shutdown("webhooks", webhooks.stop)
+    lifecycle.on_shutdown("terminals", terminals.close_all)
+    lifecycle.mark_ready()
+    yield
+    await lifecycle.shutdown()
+
+app = FastAPI(title="ClaudeOSaar API", lifespan=lifespan)
 
 # Prometheus metrics
 http_requests_total = Counter(
@@ -32,13 +95,16 @@ http_request_duration = Histogram(
 active_workspaces = Gauge(
     'claudeosaar_active_workspaces',
     'Number of active workspaces',
-    ['tier']
+    ['tier'],
+    multiprocess_mode='livesum'
 )
 
 # Middleware
-app.add_middleware(RateLimitMiddleware, calls_per_minute=60)
+app.add_middleware(RateLimitMiddleware, calls_per_minute=int(os.getenv("RATE_LIMIT_PER_MINUTE", "60")))
 app.middleware("http")(log_requests)
 
+app.include_router(webhook_router)
+
 # CORS configuration
 app.add_middleware(
     CORSMiddleware,
@@ -47,17 +113,53 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Sheds before rate limiting and logging so a rejection costs little;
+# request_tier is defined with the JWT helpers below
+load_shedder = LoadShedder()
+app.add_middleware(LoadShedMiddleware, shedder=load_shedder, classify=lambda scope: request_tier(scope))
+# Outermost, so requests are counted until their last byte is sent
+app.add_middleware(InFlightMiddleware, lifecycle=lifecycle)
 
 # Initialize services
-stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
-docker_client = docker.from_env()
+scheduler = WorkspaceScheduler.from_env()
+images = ImageManager(scheduler)
+scheduler.images = images
+admission = AdmissionController(scheduler, get_redis=get_redis if REDIS_URL else None)
+exec_manager = ExecManager()
+terminals = TerminalProxy()
+workspace_files = WorkspaceFiles()
+snapshots = SnapshotManager()
+events = WorkspaceEvents(scheduler, get_redis=get_redis if REDIS_URL else None)
+hibernation = HibernationManager(scheduler, get_database(), on_sample=events.resource_sample)
+disk_usage = DiskUsageTracker(get_database())
+# Identical concurrent reads, e.g. from a dashboard with many tabs open,
+# share one backend call; results are reused for the TTL in seconds
+workspace_reads = SingleFlight("workspace", ttl=float(os.getenv("WORKSPACE_READ_CACHE_TTL", "1")))
+memory_searches = SingleFlight("memory_search", ttl=float(os.getenv("MEMORY_SEARCH_CACHE_TTL", "5")))
+profiler = Profiler()
 security = HTTPBearer()
 
+def forget_workspace(name: str):
+    """Return a removed workspace container's node and quota reservations"""
+    scheduler.release(name)
+    admission.release(name)
+
+reconciler = Reconciler(scheduler, get_database(), released=forget_workspace)
+health = HealthMonitor(default_probes(
+    get_database(), scheduler,
+    get_redis=get_redis if REDIS_URL else None,
+    qdrant_url=os.getenv("QDRANT_URL"),
+    images=images
+))
+
 # JWT configuration
 JWT_SECRET = os.getenv("JWT_SECRET", "your-secret-key")
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_DELTA = timedelta(hours=24)
 
+sessions = SessionStore(get_database(), get_redis=get_redis if REDIS_URL else None,
+                        token_lifetime=JWT_EXPIRATION_DELTA.total_seconds())
+
 class User(BaseModel):
     id: str
     email: str
@@ -75,53 +177,117 @@ class WorkspaceResponse(BaseModel):
     container_id: Optional[str]
     terminal_url: Optional[str]
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
+class SnapshotCreate(BaseModel):
+    name: Optional[str] = None
+
+class ExecRequest(BaseModel):
+    command: str
+    workdir: str = "/workspace"
+
+def decode_token(token: str):
+    """Decode a JWT, raising 401 if it is expired or invalid"""
+    import jwt
+
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        return payload
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    # In memory: no database or Redis round trip per request
+    sessions.check(token, payload)
+    return payload
+
+def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return decode_token(credentials.credentials)
+
+async def verify_admin(current_user = Depends(verify_token)):
+    """Like verify_token, but only for users flagged `is_admin` in the users table"""
+    row = await get_database().fetchone("SELECT is_admin FROM users WHERE id = %s", (current_user.get("user_id"),))
+    if not row or not row["is_admin"]:
+        raise HTTPException(status_code=403, detail="Admin role required")
+    return current_user
+
+def request_tier(scope) -> str:
+    """Load-shedding priority of a request: the caller's tier, or free if anonymous
+
+    Runs before admission, so it never queries the database: the cached
+    billing tier is used when there is one, else the token's claim.
+    """
+    import jwt
+
+    token = None
+    for name, value in scope["headers"]:
+        if name == b"authorization" and value[:7].lower() == b"bearer ":
+            token = value[7:].decode("latin-1")
+    if token is None:
+        token = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("token", [None])[0]
+    if token is None:
+        return "free"
+    try:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except jwt.InvalidTokenError:
+        return "free"
+    return get_tier_cache().peek(payload.get("user_id")) or payload.get("subscription_tier", "free")
 
 @app.post("/api/workspaces", response_model=WorkspaceResponse)
 async def create_workspace(
     workspace: WorkspaceCreate,
-    current_user = Depends(verify_token)
+    current_user = Depends(verify_token),
+    tiers: TierCache = Depends(get_tier_cache)
 ):
     """Create a new Claude workspace container"""
     workspace_id = str(uuid.uuid4())
     
-    # Determine resource limits based on subscription tier
-    tier_limits = {
-        "free": {"mem_limit": "512m", "cpu_quota": 50000},
-        "pro": {"mem_limit": "2g", "cpu_quota": 200000},
-        "enterprise": {"mem_limit": "8g", "cpu_quota": 400000}
-    }
+    # Determine resource limits based on subscription tier. The token's tier
+    # is stale after an upgrade; prefer the billing record.
+    tier = await tiers.get(current_user["user_id"], default=current_user.get("subscription_tier", "free"))
+    limits = tier_resources(tier)
+    name = f"claude-workspace-{workspace_id}"
     
-    limits = tier_limits.get(current_user.get("subscription_tier", "free"))
-    
-    # Create container
-    container = docker_client.containers.run(
-        "claudeosaar/workspace:latest",
-        name=f"claude-workspace-{workspace_id}",
-        environment={
-            "CLAUDE_API_KEY": workspace.claude_api_key,
-            "WORKSPACE_ID": workspace_id,
-            "USER_ID": current_user["user_id"]
-        },
-        volumes={
-            f"/user_mounts/{current_user['user_id']}/{workspace_id}": {
-                "bind": "/workspace",
-                "mode": "rw"
-            }
-        },
-        mem_limit=limits["mem_limit"],
-        cpu_quota=limits["cpu_quota"],
-        detach=True,
-        network="claude-net"
-    )
+    # Create container on the node chosen by the scheduler, once the user's
+    # quota and cluster capacity allow it
+    async with admission.admit(current_user["user_id"], tier, name, **limits):
+        container = await asyncio.to_thread(
+            scheduler.containers.run,
+            WORKSPACE_IMAGE,
+            name=name,
+            environment={
+                "CLAUDE_API_KEY": workspace.claude_api_key,
+                "WORKSPACE_ID": workspace_id,
+                "USER_ID": current_user["user_id"]
+            },
+            labels={
+                "claudeosaar.workspace_id": workspace_id,
+                "claudeosaar.user_id": current_user["user_id"],
+                "claudeosaar.tier": tier
+            },
+            volumes={
+                f"/user_mounts/{current_user['user_id']}/{workspace_id}": {
+                    "bind": "/workspace",
+                    "mode": "rw"
+                }
+            },
+            mem_limit=limits["mem_limit"],
+            cpu_quota=limits["cpu_quota"],
+            detach=True,
+            network="claude-net"
+        )
+
+        # Without a row the reconciler would treat the container as an orphan
+        try:
+            await get_database().execute(
+                """
+                INSERT INTO workspaces (id, user_id, name, container_id, status, resource_tier)
+                VALUES (%s, %s, %s, %s, 'running', %s)
+                """,
+                (workspace_id, current_user["user_id"], workspace.name, container.id, tier)
+            )
+        except Exception as e:
+            logger.error({"message": "Failed to record workspace", "workspace_id": workspace_id, "error": str(e)})
+            await asyncio.to_thread(container.remove, force=True)
+            scheduler.release(name)
+            raise HTTPException(status_code=503, detail="Failed to create workspace")
     
     return WorkspaceResponse(
         id=workspace_id,
@@ -132,13 +298,14 @@ async def create_workspace(
     )
 
 @app.get("/api/workspaces/{workspace_id}")
+@coalesced(workspace_reads, "workspace_id")
 async def get_workspace(
     workspace_id: str,
     current_user = Depends(verify_token)
 ):
     """Get workspace details"""
     try:
-        container = docker_client.containers.get(f"claude-workspace-{workspace_id}")
+        container = await asyncio.to_thread(scheduler.containers.get, f"claude-workspace-{workspace_id}")
         return WorkspaceResponse(
             id=workspace_id,
             name=container.name,
@@ -146,7 +313,7 @@ async def get_workspace(
             container_id=container.id,
             terminal_url=f"/terminal/{workspace_id}"
         )
-    except docker.errors.NotFound:
+    except scheduling.NotFound:
         raise HTTPException(status_code=404, detail="Workspace not found")
 
 @app.delete("/api/workspaces/{workspace_id}")
@@ -155,48 +322,327 @@ async def delete_workspace(
     current_user = Depends(verify_token)
 ):
     """Delete a workspace"""
+    container = await get_owned_container(workspace_id, current_user, wake=False)
+    # stop() waits up to 10s for the process to exit
+    await asyncio.to_thread(container.stop)
+    await asyncio.to_thread(container.remove)
+    forget_workspace(f"claude-workspace-{workspace_id}")
+    workspace_reads.invalidate(workspace_id)
+    await delete_workspace_record(workspace_id)
+    await snapshots.delete_all(current_user["user_id"], workspace_id)
+    return {"message": "Workspace deleted successfully"}
+
+async def delete_workspace_record(workspace_id: str):
     try:
-        container = docker_client.containers.get(f"claude-workspace-{workspace_id}")
-        container.stop()
-        container.remove()
-        return {"message": "Workspace deleted successfully"}
-    except docker.errors.NotFound:
+        await get_database().execute("DELETE FROM workspaces WHERE id = %s", (workspace_id,))
+    except Exception as e:
+        # The reconciler marks the row as 'error' once it sees the container gone
+        logger.warning({"message": "Failed to delete workspace record",
+                        "workspace_id": workspace_id, "error": str(e)})
+
+async def get_owned_container(workspace_id: str, current_user: dict, wake: bool = True):
+    """Look up a workspace container, hiding containers of other users
+
+    With `wake=False` the container is returned in whatever state it is in.
+    """
+    try:
+        container = await asyncio.to_thread(
+            scheduler.containers.get, f"claude-workspace-{workspace_id}"
+        )
+    except scheduling.NotFound:
+        raise HTTPException(status_code=404, detail="Workspace not found")
+    if workspace_owner(container) != current_user["user_id"]:
         raise HTTPException(status_code=404, detail="Workspace not found")
+    if not wake:
+        return container
+    # Wake workspaces the idle detector hibernated
+    await hibernation.ensure_running(container, workspace_id)
+    if container.status != "running":
+        raise HTTPException(status_code=409, detail=f"Workspace is {container.status}")
+    return container
+
+@app.post("/api/workspaces/{workspace_id}/execute")
+async def execute_command(
+    workspace_id: str,
+    request: ExecRequest,
+    stream: bool = False,
+    current_user = Depends(verify_token),
+    tiers: TierCache = Depends(get_tier_cache)
+):
+    """Run a command in the workspace; `?stream=true` returns NDJSON chunks"""
+    container = await get_owned_container(workspace_id, current_user)
+    tier = await tiers.get(current_user["user_id"], default=current_user.get("subscription_tier", "free"))
+    logger.info({
+        "message": "Executing command",
+        "workspace_id": workspace_id,
+        "command": describe(request.command)
+    })
+
+    if not stream:
+        async with exec_manager.slot(current_user["user_id"], tier):
+            return await exec_manager.run(container, request.command, tier, request.workdir)
+
+    async def body():
+        # aclosing: the command is killed before its slot is given back
+        async with exec_manager.slot(current_user["user_id"], tier), \
+                aclosing(exec_manager.ndjson(container, request.command, tier, request.workdir)) as chunks:
+            async for chunk in chunks:
+                yield chunk
+
+    # Reject before the 200 status line is sent; the slot is taken in body()
+    exec_manager.check_capacity(current_user["user_id"], tier)
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+@app.websocket("/api/workspaces/{workspace_id}/execute/ws")
+async def execute_command_ws(websocket: WebSocket, workspace_id: str, token: str):
+    """Run a command and push output frames over a WebSocket
+
+    The client sends {"command": ..., "workdir": ...} as its first message and
+    receives {"type": "stdout" | "stderr", "data": ...} frames followed by
+    {"type": "exit", "exit_code": ...} or {"type": "timeout", ...}.
+    """
+    await websocket.accept()
+    try:
+        current_user = decode_token(token)
+        container = await get_owned_container(workspace_id, current_user)
+        tiers = get_tier_cache()
+        tier = await tiers.get(current_user["user_id"], default=current_user.get("subscription_tier", "free"))
+        request = ExecRequest(**await websocket.receive_json())
+
+        async with exec_manager.slot(current_user["user_id"], tier), \
+                aclosing(exec_manager.stream(container, request.command, tier, request.workdir)) as chunks:
+            async for kind, value in chunks:
+                # send_json waits for the transport, so a slow client slows the reader
+                await websocket.send_json(exec_event(kind, value))
+        await websocket.close()
+    except HTTPException as e:
+        await websocket.send_json({"type": "error", "status": e.status_code, "detail": e.detail})
+        await websocket.close(code=1008 if e.status_code in (401, 404) else 1013)
+    except WebSocketDisconnect:
+        pass
+
+@app.websocket("/terminal/{workspace_id}")
+async def terminal(websocket: WebSocket, workspace_id: str, token: str, cols: int = 80, rows: int = 24):
+    """Interactive shell in the workspace
+
+    The token is checked once at connect; after that frames are relayed
+    between the client and the container's TTY without further per-message
+    work. See TerminalProxy for the frame format.
+    """
+    await websocket.accept()
+    try:
+        current_user = decode_token(token)
+        container = await get_owned_container(workspace_id, current_user)
+        tier = await get_tier_cache().get(current_user["user_id"],
+                                          default=current_user.get("subscription_tier", "free"))
+        async with terminals.open(current_user["user_id"], tier, container, cols, rows) as session:
+            await terminals.relay(websocket, session, on_input=lambda: hibernation.touch(workspace_id))
+    except HTTPException as e:
+        await websocket.send_json({"type": "error", "status": e.status_code, "detail": e.detail})
+        await websocket.close(code=1008 if e.status_code in (401, 404) else 1013)
+    except WebSocketDisconnect:
+        pass
+
+@app.get("/api/events")
+async def workspace_events(token: str):
+    """Server-sent events for the caller's workspaces
+
+    The stream opens with a "snapshot" event listing every workspace and its
+    status, then carries "status" and "resources" events as they happen. A
+    "resync" event means some events were missed and the client should
+    refetch. The token is a query parameter because EventSource cannot set
+    headers.
+    """
+    current_user = decode_token(token)
+
+    async def body():
+        yield "retry: 2000\n\n"
+        async for event in events.stream(current_user["user_id"]):
+            yield sse_frame(event)
+
+    return StreamingResponse(body(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.websocket("/api/events/ws")
+async def workspace_events_ws(websocket: WebSocket, token: str):
+    """The same events as /api/events, as JSON WebSocket frames; quiet periods send {"type": "ping"}"""
+    await websocket.accept()
+    try:
+        current_user = decode_token(token)
+        async for event in events.stream(current_user["user_id"]):
+            await websocket.send_json(event or {"type": "ping"})
+        # Service restart: reconnect, to another replica if this one is draining
+        await websocket.close(code=1012)
+    except HTTPException as e:
+        await websocket.send_json({"type": "error", "status": e.status_code, "detail": e.detail})
+        await websocket.close(code=1008)
+    except WebSocketDisconnect:
+        pass
+
+@app.get("/api/workspaces/{workspace_id}/usage")
+async def get_workspace_usage(
+    workspace_id: str,
+    current_user = Depends(verify_token),
+    tiers: TierCache = Depends(get_tier_cache)
+):
+    """Disk space used by the workspace against its tier's storage quota"""
+    await get_owned_container(workspace_id, current_user, wake=False)
+    tier = await tiers.get(current_user["user_id"], default=current_user.get("subscription_tier", "free"))
+    used = await disk_usage.usage(current_user["user_id"], workspace_id)
+    quota = disk_usage.quota(tier)
+    return {
+        "workspace_id": workspace_id,
+        "disk_usage_bytes": used,
+        "quota_bytes": quota,
+        "over_quota": used is not None and used > quota
+    }
+
+@app.get("/api/workspaces/{workspace_id}/archive")
+async def download_archive(
+    workspace_id: str,
+    path: str = ".",
+    compression: Optional[str] = None,
+    current_user = Depends(verify_token)
+):
+    """Stream a file or directory under /workspace as a tar archive, optionally gzip or zstd"""
+    compression = check_compression(compression)
+    container = await get_owned_container(workspace_id, current_user)
+    chunks = await workspace_files.archive(container, current_user["user_id"], workspace_id, path, compression)
+    return StreamingResponse(chunks, media_type=MEDIA_TYPES[compression], headers={
+        "Content-Disposition": f'attachment; filename="{archive_filename(path, compression)}"'
+    })
+
+@app.put("/api/workspaces/{workspace_id}/archive", status_code=204)
+async def upload_archive(
+    workspace_id: str,
+    request: Request,
+    path: str = ".",
+    compression: Optional[str] = None,
+    current_user = Depends(verify_token),
+    tiers: TierCache = Depends(get_tier_cache)
+):
+    """Extract a tar archive from the request body into a directory under /workspace
+
+    The compression comes from `?compression=` or Content-Encoding; the body
+    is passed on to the daemon as it arrives.
+    """
+    compression = check_compression(compression or request.headers.get("content-encoding"))
+    container = await get_owned_container(workspace_id, current_user)
+    tier = await tiers.get(current_user["user_id"], default=current_user.get("subscription_tier", "free"))
+    # Content-Length rejects large uploads early; chunked ones are counted as they stream
+    remaining = await disk_usage.check_quota(current_user["user_id"], workspace_id, tier,
+                                             incoming=int(request.headers.get("content-length") or 0))
+    await workspace_files.extract(container, path, request.stream(), compression, limit=remaining)
+    disk_usage.invalidate(current_user["user_id"], workspace_id)
+    await hibernation.touch(workspace_id)
+    return Response(status_code=204)
+
+@app.get("/api/workspaces/{workspace_id}/files")
+async def download_file(
+    workspace_id: str,
+    path: str,
+    range: Optional[str] = Header(None),
+    if_range: Optional[str] = Header(None),
+    current_user = Depends(verify_token)
+):
+    """Download one file; honours Range and If-Range so interrupted downloads resume"""
+    container = await get_owned_container(workspace_id, current_user)
+    info, handle = await workspace_files.stat(container, current_user["user_id"], workspace_id, path)
+    headers = {"Accept-Ranges": "bytes", "ETag": info.etag,
+               "Content-Disposition": f'attachment; filename="{info.name}"'}
+    # A stale If-Range means the file changed since the partial download
+    requested = parse_range(range, info.size) if not if_range or if_range == info.etag else None
+    if requested is None:
+        headers["Content-Length"] = str(info.size)
+        return StreamingResponse(workspace_files.read_range(handle, 0, info.size),
+                                 media_type="application/octet-stream", headers=headers)
+    headers["Content-Length"] = str(requested.length)
+    headers["Content-Range"] = requested.content_range
+    return StreamingResponse(workspace_files.read_range(handle, requested.start, requested.length),
+                             status_code=206, media_type="application/octet-stream", headers=headers)
+
+@app.post("/api/workspaces/{workspace_id}/snapshots")
+async def create_snapshot(
+    workspace_id: str,
+    request: SnapshotCreate,
+    current_user = Depends(verify_token),
+    tiers: TierCache = Depends(get_tier_cache)
+):
+    """Checkpoint the workspace files; only data changed since the last snapshot is stored"""
+    await get_owned_container(workspace_id, current_user, wake=False)
+    tier = await tiers.get(current_user["user_id"], default=current_user.get("subscription_tier", "free"))
+    return await snapshots.create(current_user["user_id"], workspace_id, tier, request.name)
+
+@app.get("/api/workspaces/{workspace_id}/snapshots")
+async def list_snapshots(
+    workspace_id: str,
+    current_user = Depends(verify_token)
+):
+    """List a workspace's snapshots, oldest first"""
+    await get_owned_container(workspace_id, current_user, wake=False)
+    return await snapshots.list(current_user["user_id"], workspace_id)
+
+@app.post("/api/workspaces/{workspace_id}/snapshots/{snapshot_id}/restore")
+async def restore_snapshot(
+    workspace_id: str,
+    snapshot_id: str,
+    current_user = Depends(verify_token)
+):
+    """Roll the workspace files back to a snapshot"""
+    await get_owned_container(workspace_id, current_user, wake=False)
+    return await snapshots.restore(current_user["user_id"], workspace_id, snapshot_id)
+
+@app.delete("/api/workspaces/{workspace_id}/snapshots/{snapshot_id}")
+async def delete_snapshot(
+    workspace_id: str,
+    snapshot_id: str,
+    current_user = Depends(verify_token)
+):
+    """Delete a snapshot; chunks no other snapshot uses are freed later"""
+    await get_owned_container(workspace_id, current_user, wake=False)
+    await snapshots.delete(current_user["user_id"], workspace_id, snapshot_id)
+    return {"message": "Snapshot deleted successfully"}
+
+@app.post("/api/auth/logout", status_code=204)
+async def logout(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Revoke the token this request was made with, on every API process"""
+    payload = decode_token(credentials.credentials)
+    await sessions.revoke(credentials.credentials, payload)
+    return Response(status_code=204)
+
+@app.post("/api/auth/logout-all")
+async def logout_all(current_user = Depends(verify_token)):
+    """Revoke every session of the caller, including this one"""
+    return {"revoked": await sessions.revoke_all(current_user["user_id"])}
+
+@app.get("/api/auth/sessions")
+async def list_sessions(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """The caller's active sessions; `current` marks the one making this request"""
+    payload = decode_token(credentials.credentials)
+    current = token_hash(credentials.credentials)
+    return [
+        {"id": row["id"], "created_at": row["created_at"], "expires_at": row["expires_at"],
+         "current": row["token_hash"] == current}
+        for row in await sessions.list(payload["user_id"])
+    ]
 
 @app.post("/api/billing/create-subscription")
 async def create_subscription(
     tier: str,
-    current_user = Depends(verify_token)
+    idempotency_key: Optional[str] = Header(None),
+    current_user = Depends(verify_token),
+    billing: BillingService = Depends(get_billing_service)
 ):
     """Create Stripe subscription"""
-    price_ids = {
-        "pro": "price_1234567890",  # Replace with actual Stripe price IDs
-        "enterprise": "price_0987654321"
-    }
-    
-    if tier not in price_ids:
-        raise HTTPException(status_code=400, detail="Invalid tier")
-    
-    # Create Stripe customer if not exists
-    customer = stripe.Customer.create(
-        email=current_user["email"],
-        metadata={"user_id": current_user["user_id"]}
+    return await billing.create_subscription(
+        current_user["user_id"],
+        current_user["email"],
+        tier,
+        idempotency_key=idempotency_key
     )
-    
-    # Create subscription
-    subscription = stripe.Subscription.create(
-        customer=customer.id,
-        items=[{"price": price_ids[tier]}],
-        payment_behavior="default_incomplete",
-        expand=["latest_invoice.payment_intent"]
-    )
-    
-    return {
-        "subscription_id": subscription.id,
-        "client_secret": subscription.latest_invoice.payment_intent.client_secret
-    }
 
 @app.get("/api/memory-bank/search")
+@coalesced(memory_searches, "workspace_id", "query")
 async def search_memory_bank(
     query: str,
     workspace_id: str,
@@ -224,11 +670,57 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "timestamp": datetime.utcnow()}
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe; fails while starting, draining, or a critical dependency is down"""
+    if not lifecycle.ready:
+        return JSONResponse({"status": lifecycle.state}, status_code=503)
+    status = health.status()
+    return JSONResponse({"status": status}, status_code=503 if status == "down" else 200)
+
+@app.get("/health/deep")
+async def deep_health_check():
+    """Cached per-dependency status and probe latency"""
+    report = health.report()
+    return JSONResponse(report, status_code=503 if report["status"] == "down" else 200)
+
+@app.get("/api/admin/profile")
+async def profile(
+    seconds: float = 10,
+    interval_ms: float = 5,
+    idle: bool = False,
+    current_user = Depends(verify_admin)
+):
+    """Sample this worker's stacks for `seconds` and return them in folded form
+
+    Feed the output to flamegraph.pl or open it in speedscope. Only the
+    worker that serves the request is profiled; X-Profile-Pid names it.
+    """
+    sampler = await profiler.profile(seconds, interval_ms / 1000, include_idle=idle)
+    logger.info({"message": "Profile taken", "user_id": current_user.get("user_id"),
+                 "seconds": seconds, "samples": sampler.samples})
+    return Response(folded(sampler.stacks), media_type="text/plain", headers={
+        "X-Profile-Pid": str(os.getpid()), "X-Profile-Samples": str(sampler.samples)
+    })
+
+@app.get("/api/admin/profiles")
+async def list_profiles(current_user = Depends(verify_admin)):
+    """Continuous profiles on this host, oldest first"""
+    return [{"name": path.name, "size": path.stat().st_size} for path in await asyncio.to_thread(profiler.files)]
+
+@app.get("/api/admin/profiles/{name}")
+async def get_profile(name: str, current_user = Depends(verify_admin)):
+    """One continuous profile in folded form"""
+    for path in await asyncio.to_thread(profiler.files):
+        if path.name == name:
+            return Response(await asyncio.to_thread(path.read_bytes), media_type="text/plain")
+    raise HTTPException(status_code=404, detail="Profile not found")
+
 @app.get("/metrics")
 async def metrics():
     """Prometheus metrics endpoint"""
-    return Response(generate_latest(), media_type="text/plain")
+    return Response(render_metrics(), media_type="text/plain")
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=6600)
\ No newline at end of file
+    from .server import serve
+    serve(app)
\ No newline at end of file
@@ -0,0 +1,34 @@
+import os
+import shutil
+from pathlib import Path
+
+from prometheus_client import CollectorRegistry, generate_latest
+
+# Set by the multi-worker launcher before any worker imports the app; each
+# worker then writes its samples to files in this directory.
+MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+def multiprocess_dir():
+    return os.getenv(MULTIPROC_DIR_ENV) or os.getenv(MULTIPROC_DIR_ENV.lower())
+
+def render_metrics() -> bytes:
+    """Metrics of this process, or of all workers in multiprocess mode"""
+    if not multiprocess_dir():
+        return generate_latest()
+    from prometheus_client import multiprocess
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+def reset_multiprocess_dir(path: str):
+    """Create an empty directory for worker metric files"""
+    shutil.rmtree(path, ignore_errors=True)
+    Path(path).mkdir(parents=True, exist_ok=True)
+
+def mark_worker_dead(pid: int):
+    """Drop a dead worker's live gauges from the aggregate"""
+    if multiprocess_dir():
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(pid)
@@ -1,3 +1,4 @@
+import os
 from datetime import datetime, timedelta
 from typing import Optional
 
@@ -14,12 +15,14 @@ JWT_EXPIRATION_DELTA = timedelta(hours=24)
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create a JWT access token"""
     to_encode = data.copy()
+    issued = datetime.utcnow()
     if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+        expire = issued + expires_delta
     else:
-        expire = datetime.utcnow() + JWT_EXPIRATION_DELTA
+        expire = issued + JWT_EXPIRATION_DELTA
     
-    to_encode.update({"exp": expire})
+    # iat lets "log out everywhere" refuse tokens issued before it
+    to_encode.update({"exp": expire, "iat": issued})
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
@@ -0,0 +1,294 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+LOAD_SHED_ENABLED = os.getenv("LOAD_SHED_ENABLED", "true").lower() == "true"
+# Concurrency limit per worker process: where it starts and the range AIMD keeps it in
+LOAD_SHED_INITIAL_LIMIT = int(os.getenv("LOAD_SHED_INITIAL_LIMIT", "32"))
+LOAD_SHED_MIN_LIMIT = int(os.getenv("LOAD_SHED_MIN_LIMIT", "4"))
+LOAD_SHED_MAX_LIMIT = int(os.getenv("LOAD_SHED_MAX_LIMIT", "256"))
+# A response slower than this multiple of its route's no-load latency means
+# the server is saturated, and the limit is cut by LOAD_SHED_BACKOFF
+LOAD_SHED_LATENCY_TOLERANCE = float(os.getenv("LOAD_SHED_LATENCY_TOLERANCE", "2.0"))
+LOAD_SHED_BACKOFF = float(os.getenv("LOAD_SHED_BACKOFF", "0.9"))
+# Seconds of history for the no-load latency, so it follows deploys and slow drift
+LOAD_SHED_BASELINE_WINDOW = float(os.getenv("LOAD_SHED_BASELINE_WINDOW", "60"))
+# Added to the threshold so a sub-millisecond baseline does not make jitter look like overload
+LOAD_SHED_LATENCY_SLACK = float(os.getenv("LOAD_SHED_LATENCY_SLACK", "0.005"))
+
+def _priority(tier: str, share: str, queue: str, timeout: str) -> dict:
+    prefix = f"LOAD_SHED_{tier.upper()}"
+    return {
+        "share": float(os.getenv(f"{prefix}_SHARE", share)),
+        "queue": int(os.getenv(f"{prefix}_QUEUE", queue)),
+        "timeout": float(os.getenv(f"{prefix}_QUEUE_TIMEOUT", timeout)),
+    }
+
+# Highest priority first. `share` is the fraction of the limit a tier may
+# fill, so the last slots are kept for paying tiers; waiting requests are
+# admitted in this order. Unknown and anonymous callers count as free.
+TIER_PRIORITY = {
+    "enterprise": _priority("enterprise", "1.0", "256", "5"),
+    "pro": _priority("pro", "0.9", "64", "2"),
+    "free": _priority("free", "0.7", "16", "0.5"),
+}
+
+# Probes, metrics, profiling and Stripe must get through an overloaded server
+EXEMPT_PATHS = {"/health", "/health/deep", "/ready", "/metrics", "/api/admin/profile", "/api/admin/profiles",
+               "/api/billing/webhook"}
+
+# Routes whose latency follows the request (payload size, the command run,
+# Docker or Stripe) rather than server load: they hold a slot like any
+# other but do not feed the latency signal
+UNSAMPLED_ROUTES = {
+    "POST /api/workspaces",
+    "DELETE /api/workspaces/{workspace_id}",
+    "POST /api/workspaces/{workspace_id}/execute",
+    "GET /api/workspaces/{workspace_id}/archive",
+    "PUT /api/workspaces/{workspace_id}/archive",
+    "POST /api/workspaces/{workspace_id}/snapshots",
+    "POST /api/workspaces/{workspace_id}/snapshots/{snapshot_id}/restore",
+    "POST /api/billing/create-subscription",
+}
+
+concurrency_limit = Gauge(
+    'claudeosaar_load_shed_limit',
+    'Adaptive concurrency limit',
+    multiprocess_mode='livesum'
+)
+requests_admitted_in_flight = Gauge(
+    'claudeosaar_load_shed_in_flight',
+    'Requests admitted by the load shedder and not yet responding',
+    multiprocess_mode='livesum'
+)
+queue_depth = Gauge(
+    'claudeosaar_load_shed_queue_depth',
+    'Requests waiting for a concurrency slot',
+    ['tier'],
+    multiprocess_mode='livesum'
+)
+queue_wait = Histogram(
+    'claudeosaar_load_shed_queue_wait_seconds',
+    'Time requests waited for a concurrency slot',
+    ['tier'],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5)
+)
+requests_shed_total = Counter(
+    'claudeosaar_requests_shed_total',
+    'Requests rejected with 503 because the server was saturated',
+    ['tier', 'reason']
+)
+
+class Shed(Exception):
+    """A request turned away so admitted ones keep their latency"""
+
+    def __init__(self, tier: str, reason: str):
+        super().__init__(f"{tier}: {reason}")
+        self.tier = tier
+        self.reason = reason
+
+class AdaptiveLimit:
+    """AIMD concurrency limit driven by response latency
+
+    Each route's no-load latency is the lowest seen for it over the last
+    `window` seconds, so a route that is always slow is not mistaken for
+    overload. A response slower than `tolerance` times its route's baseline
+    means requests are queueing inside the server, and the limit is
+    multiplied by `backoff`, once per round: only requests started after
+    the previous cut can cut again. Otherwise the limit grows by one per
+    limit's worth of responses, while it is actually in use or, until it is
+    back to its initial value, after a cut.
+    """
+
+    def __init__(self, initial: int = LOAD_SHED_INITIAL_LIMIT, min_limit: int = LOAD_SHED_MIN_LIMIT,
+                 max_limit: int = LOAD_SHED_MAX_LIMIT, tolerance: float = LOAD_SHED_LATENCY_TOLERANCE,
+                 backoff: float = LOAD_SHED_BACKOFF, window: float = LOAD_SHED_BASELINE_WINDOW,
+                 slack: float = LOAD_SHED_LATENCY_SLACK):
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.initial = self.limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.window = window
+        self.slack = slack
+        # route -> [minimum latency of the previous window, of the current
+        # one, end of the current one]
+        self._baselines: Dict[str, list] = {}
+        self._last_cut = 0.0
+        concurrency_limit.set(self.limit)
+
+    def baseline(self, route: str = "") -> float:
+        entry = self._baselines.get(route)
+        return min(entry[0], entry[1]) if entry else float("inf")
+
+    def sample(self, started: float, latency: float, in_flight: int, route: str = ""):
+        now = started + latency
+        entry = self._baselines.get(route)
+        if entry is None:
+            entry = self._baselines[route] = [float("inf"), float("inf"), now + self.window]
+        elif now >= entry[2]:
+            entry[:] = [entry[1], float("inf"), now + self.window]
+        entry[1] = min(entry[1], latency)
+
+        if latency > min(entry[0], entry[1]) * self.tolerance + self.slack:
+            if started >= self._last_cut:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._last_cut = now
+        elif in_flight >= self.limit / 2:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        elif self.limit < self.initial:
+            self.limit = min(self.initial, self.limit + 1 / self.limit)
+        concurrency_limit.set(self.limit)
+
+class LoadShedder:
+    """Admit requests up to the adaptive limit, paying tiers first
+
+    Past its share of the limit a request waits in its tier's queue; freed
+    slots go to the highest-priority waiter. A request is shed when its
+    queue is full or it waited longer than its tier's timeout, so under
+    overload free-tier traffic is turned away before paid traffic waits.
+    """
+
+    def __init__(self, limit: Optional[AdaptiveLimit] = None, tiers: Optional[Dict[str, dict]] = None):
+        self.limit = limit or AdaptiveLimit()
+        self.tiers = tiers or TIER_PRIORITY
+        self.in_flight = 0
+        self._queues: Dict[str, Deque[asyncio.Future]] = {tier: deque() for tier in self.tiers}
+
+    def policy_for(self, tier: str) -> tuple:
+        if tier not in self.tiers:
+            tier = "free" if "free" in self.tiers else list(self.tiers)[-1]
+        return tier, self.tiers[tier]
+
+    def _fits(self, policy: dict) -> bool:
+        return self.in_flight < max(1.0, self.limit.limit * policy["share"])
+
+    def _waiting_ahead(self, tier: str) -> bool:
+        # Tiers are ordered highest priority first; equal priority queues FIFO
+        for name, queue in self._queues.items():
+            if queue:
+                return True
+            if name == tier:
+                return False
+        return False
+
+    def _take(self):
+        self.in_flight += 1
+        requests_admitted_in_flight.set(self.in_flight)
+
+    async def acquire(self, tier: str):
+        """Take a slot for a request of `tier`, waiting if need be; raises Shed"""
+        tier, policy = self.policy_for(tier)
+        if self._fits(policy) and not self._waiting_ahead(tier):
+            self._take()
+            return
+        queue = self._queues[tier]
+        if len(queue) >= policy["queue"]:
+            requests_shed_total.labels(tier=tier, reason="queue_full").inc()
+            raise Shed(tier, "queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue.append(waiter)
+        queue_depth.labels(tier=tier).set(len(queue))
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, policy["timeout"])
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as the wait ended; hand the slot on
+                self.release()
+            elif waiter in queue:
+                queue.remove(waiter)
+            queue_depth.labels(tier=tier).set(len(queue))
+            if isinstance(e, asyncio.TimeoutError):
+                requests_shed_total.labels(tier=tier, reason="timeout").inc()
+                raise Shed(tier, "timeout") from None
+            raise
+        finally:
+            queue_wait.labels(tier=tier).observe(time.monotonic() - start)
+
+    def release(self, started: Optional[float] = None, route: str = ""):
+        """Free a slot; `started` (time.monotonic() at admission) feeds the latency signal"""
+        if started is not None:
+            self.limit.sample(started, time.monotonic() - started, self.in_flight, route)
+        self.in_flight -= 1
+        requests_admitted_in_flight.set(self.in_flight)
+        self._grant()
+
+    def _grant(self):
+        for tier, queue in self._queues.items():
+            while queue and self._fits(self.tiers[tier]):
+                waiter = queue.popleft()
+                if waiter.done():
+                    continue
+                self._take()
+                waiter.set_result(None)
+            queue_depth.labels(tier=tier).set(len(queue))
+            if queue:
+                # Lower tiers may not pass a higher one still waiting
+                return
+
+class LoadShedMiddleware:
+    """Concurrency-limit HTTP requests by tier, answering 503 when shed
+
+    A slot is held until the response starts, so the latency signal is the
+    time to first byte and long streaming bodies do not pin slots. Latency
+    is attributed to the matched route's template; routes in `unsampled` do
+    not feed it. `classify(scope)` names the request's tier. WebSockets pass
+    through.
+    """
+
+    def __init__(self, app, shedder: LoadShedder, classify: Callable[[dict], str],
+                 exempt=EXEMPT_PATHS, unsampled=UNSAMPLED_ROUTES, enabled: bool = LOAD_SHED_ENABLED):
+        self.app = app
+        self.shedder = shedder
+        self.classify = classify
+        self.exempt = exempt
+        self.unsampled = unsampled
+        self.enabled = enabled
+
+    def _release(self, scope, started: float):
+        # Routing has run by now and left the matched route in the scope
+        path = getattr(scope.get("route"), "path", None)
+        route = f"{scope['method']} {path}" if path else "unmatched"
+        if route in self.unsampled:
+            self.shedder.release()
+        else:
+            self.shedder.release(started, route)
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http" or scope["path"] in self.exempt:
+            return await self.app(scope, receive, send)
+
+        shedder = self.shedder
+        try:
+            await shedder.acquire(self.classify(scope))
+        except Shed as e:
+            body = json.dumps({"detail": "Server is overloaded, retry shortly", "reason": e.reason}).encode()
+            await send({"type": "http.response.start", "status": 503, "headers": [
+                (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                (b"retry-after", b"1")]})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        started = time.monotonic()
+        held = True
+
+        async def send_wrapper(message):
+            nonlocal held
+            if held and message["type"] == "http.response.start":
+                held = False
+                self._release(scope, started)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if held:
+                self._release(scope, started)
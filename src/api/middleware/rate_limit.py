@@ -16,8 +16,8 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
         # Get client IP
         client_ip = request.client.host
         
-        # Skip rate limiting for health checks
-        if request.url.path in ["/health", "/docs", "/openapi.json"]:
+        # Skip rate limiting for health checks and Stripe webhooks
+        if request.url.path in ["/health", "/health/deep", "/ready", "/docs", "/openapi.json", "/api/billing/webhook"]:
             return await call_next(request)
         
         # Current timestamp
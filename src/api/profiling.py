@@ -0,0 +1,211 @@
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+from collections import Counter as Tally
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+from prometheus_client import Histogram
+
+from .logging import logger
+
+# Sampling period of on-demand profiles, and the longest one allowed
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+# Continuous profiling writes one folded-stack file per period here; empty disables it
+CONTINUOUS_PROFILE_DIR = os.getenv("CONTINUOUS_PROFILE_DIR", "")
+# Low rate keeps the overhead of always-on sampling well under 1% of a core
+CONTINUOUS_PROFILE_INTERVAL = float(os.getenv("CONTINUOUS_PROFILE_INTERVAL", "0.1"))
+CONTINUOUS_PROFILE_PERIOD = float(os.getenv("CONTINUOUS_PROFILE_PERIOD", "60"))
+CONTINUOUS_PROFILE_KEEP = int(os.getenv("CONTINUOUS_PROFILE_KEEP", "120"))
+
+# Leaf frames of threads parked waiting for work: the event loop in select(),
+# idle pool workers and lock waits
+IDLE_LEAVES = {
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+}
+
+span_duration = Histogram(
+    'claudeosaar_span_seconds',
+    'Time spent in calls to Docker, Stripe and the database',
+    ['span'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+
+# Per-request totals of span time; set by collect_spans around each request
+_request_spans: ContextVar[Optional[Dict[str, List[float]]]] = ContextVar("request_spans", default=None)
+
+@contextmanager
+def span(name: str):
+    """Time a call to an external system; totals are added to the request's log line"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        span_duration.labels(span=name).observe(elapsed)
+        spans = _request_spans.get()
+        if spans is not None:
+            entry = spans.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += elapsed
+
+@contextmanager
+def collect_spans():
+    """Collect spans entered in this context, including worker threads it starts"""
+    spans: Dict[str, List[float]] = {}
+    token = _request_spans.set(spans)
+    try:
+        yield spans
+    finally:
+        _request_spans.reset(token)
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class SamplingProfiler:
+    """Statistical profiler that samples the stacks of every thread in this process
+
+    A background thread reads `sys._current_frames()` every `interval`
+    seconds and counts each stack in folded form (root first, frames joined
+    by ";"), which flamegraph.pl, speedscope and Pyroscope read directly.
+    Coroutines appear on the event loop thread's stack while they run.
+    Threads waiting for work are skipped unless `include_idle` is set.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL, include_idle: bool = False):
+        self.interval = interval
+        self.include_idle = include_idle
+        self.stacks: Tally = Tally()
+        self.samples = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="profiler")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def take(self) -> Tally:
+        """Stacks counted so far, resetting the counts"""
+        with self._lock:
+            stacks, self.stacks = self.stacks, Tally()
+        return stacks
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            sampled = []
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                code = frame.f_code
+                if not self.include_idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_LEAVES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                sampled.append(";".join(reversed(stack)))
+            with self._lock:
+                self.samples += 1
+                self.stacks.update(sampled)
+
+def folded(stacks: Tally) -> str:
+    """flamegraph.pl input: one "frame;frame;... count" line per stack"""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+class Profiler:
+    """On-demand profiles for the admin API, plus optional continuous profiling to disk
+
+    Profiles cover only the worker process that serves the request; with
+    several workers, continuous profiles are written per process.
+    """
+
+    def __init__(self, directory: str = CONTINUOUS_PROFILE_DIR, interval: float = CONTINUOUS_PROFILE_INTERVAL,
+                 period: float = CONTINUOUS_PROFILE_PERIOD, keep: int = CONTINUOUS_PROFILE_KEEP):
+        self.directory = Path(directory) if directory else None
+        self.interval = interval
+        self.period = period
+        self.keep = keep
+        self._busy = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def profile(self, seconds: float, interval: float = PROFILE_INTERVAL,
+                      include_idle: bool = False) -> SamplingProfiler:
+        """Sample this process for `seconds`; one profile at a time"""
+        if not 0 < seconds <= PROFILE_MAX_SECONDS:
+            raise HTTPException(status_code=400, detail=f"seconds must be in (0, {PROFILE_MAX_SECONDS:g}]")
+        if self._busy:
+            raise HTTPException(status_code=409, detail="A profile is already running in this process")
+        self._busy = True
+        sampler = SamplingProfiler(max(interval, 0.001), include_idle)
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            await asyncio.to_thread(sampler.stop)
+            self._busy = False
+        return sampler
+
+    def files(self) -> List[Path]:
+        """Continuous profiles on disk, oldest first"""
+        if self.directory is None or not self.directory.is_dir():
+            return []
+        return sorted(self.directory.glob("profile-*.folded"), key=lambda path: (path.stat().st_mtime, path.name))
+
+    def _write(self, stacks: Tally):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S.%fZ")
+        path = self.directory / f"profile-{socket.gethostname()}-{os.getpid()}-{stamp}.folded"
+        temporary = path.with_suffix(".tmp")
+        temporary.write_text(folded(stacks))
+        temporary.replace(path)
+        for old in self.files()[:-self.keep or None]:
+            old.unlink(missing_ok=True)
+
+    def start(self):
+        if self.directory is not None and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        sampler = SamplingProfiler(self.interval)
+        sampler.start()
+        try:
+            while True:
+                await asyncio.sleep(self.period)
+                stacks = sampler.take()
+                if not stacks:
+                    continue
+                try:
+                    await asyncio.to_thread(self._write, stacks)
+                except OSError as e:
+                    logger.warning({"message": "Failed to write continuous profile", "error": str(e)})
+        finally:
+            await asyncio.to_thread(sampler.stop)
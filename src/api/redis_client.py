@@ -0,0 +1,25 @@
+import os
+
+REDIS_URL = os.getenv("REDIS_URL")
+
+_redis = None
+
+def get_redis():
+    """Process-wide asyncio Redis client, or None if REDIS_URL is unset
+
+    The client connects lazily, so calling this at import or startup is cheap.
+    """
+    global _redis
+    if _redis is None and REDIS_URL:
+        import redis.asyncio
+
+        _redis = redis.asyncio.Redis.from_url(REDIS_URL, health_check_interval=30)
+    return _redis
+
+async def close_redis():
+    global _redis
+    if _redis is not None:
+        # redis-py 5 renamed close() to aclose()
+        close = getattr(_redis, "aclose", None) or _redis.close
+        await close()
+        _redis = None
@@ -0,0 +1,203 @@
+"""Production entry point for the API
+
+    python -m src.api.server --workers 4
+
+The supervisor binds the listening socket once and forks the workers, which
+all accept from it. The app is given as an import string and only imported
+inside each worker, so Docker, database and Redis clients are created per
+worker instead of being inherited over fork. With more than one worker,
+Prometheus runs in multiprocess mode and `/metrics` on any worker reports
+the sum over all of them.
+"""
+
+import argparse
+import importlib.util
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+from typing import Dict, Optional
+
+import uvicorn
+
+from .lifecycle import SHUTDOWN_DRAIN_DELAY, SHUTDOWN_TIMEOUT, lifecycle
+
+APP = "src.api.main:app"
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("API_PORT", "6600"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# Seconds an idle keep-alive connection stays open; keep it above the load
+# balancer's idle timeout so the proxy never reuses a connection we closed
+SERVER_KEEPALIVE = int(os.getenv("SERVER_KEEPALIVE", "75"))
+SERVER_BACKLOG = int(os.getenv("SERVER_BACKLOG", "2048"))
+SERVER_LOOP = os.getenv("SERVER_LOOP", "auto")
+SERVER_HTTP = os.getenv("SERVER_HTTP", "auto")
+# Workers that die this soon after starting are not restarted in a loop
+WORKER_MIN_UPTIME = 5.0
+STARTUP_FAILURE = 3
+
+def _pick(preferred: str, fallback: str) -> str:
+    return preferred if importlib.util.find_spec(preferred) else fallback
+
+def build_config(app=APP, host: str = SERVER_HOST, port: int = SERVER_PORT, workers: int = WEB_CONCURRENCY,
+                 loop: str = SERVER_LOOP, http: str = SERVER_HTTP, **kwargs) -> uvicorn.Config:
+    """uvicorn config with uvloop and httptools when they are installed"""
+    return uvicorn.Config(
+        app,
+        host=host,
+        port=port,
+        workers=workers,
+        loop=_pick("uvloop", "asyncio") if loop == "auto" else loop,
+        http=_pick("httptools", "h11") if http == "auto" else http,
+        timeout_keep_alive=kwargs.pop("timeout_keep_alive", SERVER_KEEPALIVE),
+        backlog=kwargs.pop("backlog", SERVER_BACKLOG),
+        timeout_graceful_shutdown=kwargs.pop("timeout_graceful_shutdown", int(SHUTDOWN_TIMEOUT)),
+        proxy_headers=True,
+        **kwargs,
+    )
+
+def bind_socket(config: uvicorn.Config) -> socket.socket:
+    """Bind the listening socket so accepted connections get TCP_NODELAY
+
+    uvicorn creates it with protocol 0, and asyncio only disables Nagle's
+    algorithm on sockets that say IPPROTO_TCP. Without it, a response sent as
+    headers then body waits for the client's delayed ACK, about 40 ms per
+    request on a keep-alive connection.
+    """
+    sock = config.bind_socket()
+    if sock.family in (socket.AF_INET, socket.AF_INET6) and sock.proto == 0:
+        sock = socket.socket(sock.family, sock.type, socket.IPPROTO_TCP, fileno=sock.detach())
+    return sock
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn server that fails readiness for a while before exiting on SIGTERM"""
+
+    def __init__(self, config: uvicorn.Config, drain_delay: float = SHUTDOWN_DRAIN_DELAY):
+        super().__init__(config)
+        self.drain_delay = drain_delay
+        self.drain_until: Optional[float] = None
+
+    def handle_exit(self, sig, frame):
+        # A second signal, or Ctrl+C, exits without the delay
+        if sig == signal.SIGTERM and self.drain_until is None and self.drain_delay > 0:
+            self.drain_until = time.monotonic() + self.drain_delay
+            lifecycle.begin_drain(deadline=self.drain_until + SHUTDOWN_TIMEOUT)
+            return
+        super().handle_exit(sig, frame)
+
+    async def on_tick(self, counter) -> bool:
+        if self.drain_until is not None and time.monotonic() >= self.drain_until:
+            self.should_exit = True
+        return await super().on_tick(counter)
+
+def serve(app=APP, **kwargs):
+    """Run a single worker in this process"""
+    config = build_config(app, workers=1, **kwargs)
+    server = DrainingServer(config)
+    server.run()
+    if not server.started:
+        sys.exit(STARTUP_FAILURE)
+
+class Supervisor:
+    """Pre-fork worker supervisor
+
+    Workers are restarted when they die. SIGTERM and SIGINT are forwarded to
+    every worker, which then drains and exits on its own schedule.
+    """
+
+    def __init__(self, config: uvicorn.Config, workers: int):
+        self.config = config
+        self.workers = workers
+        self.children: Dict[int, float] = {}
+        self.stopping = False
+        self.exit_code = 0
+        self.socket = None
+
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = time.monotonic()
+            return
+        # Worker: uvicorn installs its own handlers in run()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, signal.SIG_DFL)
+        code = 0
+        try:
+            server = DrainingServer(self.config)
+            server.run(sockets=[self.socket])
+            code = 0 if server.started else STARTUP_FAILURE
+        except BaseException:
+            code = 1
+        finally:
+            os._exit(code)
+
+    def signal_workers(self, sig, frame=None):
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM if sig == signal.SIGTERM else sig)
+            except ProcessLookupError:
+                pass
+
+    def run(self) -> int:
+        from .metrics import mark_worker_dead
+
+        self.socket = bind_socket(self.config)
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, self.signal_workers)
+        for _ in range(self.workers):
+            self.spawn()
+        print(f"Started {self.workers} workers on {self.config.host}:{self.config.port} "
+              f"(loop={self.config.loop}, http={self.config.http})", flush=True)
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            started = self.children.pop(pid, None)
+            if started is None:
+                continue
+            mark_worker_dead(pid)
+            code = os.waitstatus_to_exitcode(status)
+            if self.stopping:
+                continue
+            if code == STARTUP_FAILURE or time.monotonic() - started < WORKER_MIN_UPTIME:
+                print(f"Worker {pid} failed to start (exit {code}); shutting down", flush=True)
+                self.exit_code = STARTUP_FAILURE
+                self.signal_workers(signal.SIGTERM)
+                continue
+            print(f"Worker {pid} exited with {code}; restarting", flush=True)
+            self.spawn()
+
+        self.socket.close()
+        return self.exit_code
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the ClaudeOSaar API")
+    parser.add_argument("--app", default=APP, help="ASGI app import string")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY)
+    parser.add_argument("--loop", default=SERVER_LOOP, help="auto, uvloop or asyncio")
+    parser.add_argument("--http", default=SERVER_HTTP, help="auto, httptools or h11")
+    args = parser.parse_args()
+
+    config_args = dict(host=args.host, port=args.port, loop=args.loop, http=args.http)
+    if args.workers <= 1:
+        serve(args.app, **config_args)
+        return
+
+    # Must be set before prometheus_client is imported by a worker
+    if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = os.path.join(tempfile.gettempdir(), "claudeosaar-metrics")
+    from .metrics import reset_multiprocess_dir
+
+    reset_multiprocess_dir(os.environ["PROMETHEUS_MULTIPROC_DIR"])
+    config = build_config(args.app, workers=args.workers, **config_args)
+    sys.exit(Supervisor(config, args.workers).run())
+
+if __name__ == "__main__":
+    main()
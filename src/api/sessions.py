@@ -0,0 +1,356 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import HTTPException
+from prometheus_client import Counter, Gauge
+
+from .db import Database
+from .logging import logger
+
+SESSION_CHANNEL = os.getenv("SESSION_CHANNEL", "claudeosaar:sessions:revocations")
+SESSION_REVOKED_KEY = os.getenv("SESSION_REVOKED_KEY", "claudeosaar:sessions:revoked")
+SESSION_CUTOFF_KEY = os.getenv("SESSION_CUTOFF_KEY", "claudeosaar:sessions:cutoffs")
+# Longest lifetime of an issued token (main passes JWT_EXPIRATION_DELTA): a
+# user's "log out everywhere" cutoff is kept this long, and tokens without
+# iat were issued this long before exp
+SESSION_TOKEN_LIFETIME = 24 * 3600.0
+# Seconds between batched writes of newly seen tokens to the sessions table
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "1"))
+# Seconds between reloads of revocations from Postgres, which repair missed
+# messages and a Redis that lost its data
+SESSION_SYNC_INTERVAL = float(os.getenv("SESSION_SYNC_INTERVAL", "60"))
+# Token hashes per process known to be recorded already
+SESSION_SEEN_CACHE = int(os.getenv("SESSION_SEEN_CACHE", "100000"))
+
+sessions_revoked = Gauge(
+    'claudeosaar_sessions_revoked',
+    'Revoked, unexpired tokens held in memory for revocation checks',
+    multiprocess_mode='livemax'
+)
+session_revocations_total = Counter(
+    'claudeosaar_session_revocations_total',
+    'Tokens revoked, by how: one session (logout) or every session of a user',
+    ['scope']
+)
+revoked_token_rejections_total = Counter(
+    'claudeosaar_revoked_token_rejections_total',
+    'Requests refused because their token was revoked'
+)
+
+def token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def _timestamp(epoch: float) -> datetime:
+    # sessions uses TIMESTAMP without time zone, in UTC
+    return datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None)
+
+def _epoch(value: datetime) -> float:
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+class SessionStore:
+    """Session records in Postgres with revocation checks that stay in memory
+
+    Tokens are recorded in `sessions` the first time a process sees them,
+    in batches off the request path. Logging out marks the row revoked, adds
+    the hash to a Redis sorted set scored by expiry, and publishes it; every
+    process keeps the revoked, unexpired hashes in a set, so checking a
+    token is one hash and one lookup. Logging out everywhere also sets a
+    per-user cutoff, propagated the same way, that refuses tokens issued
+    before it whether or not they were recorded. Processes load both from
+    Redis at startup and reload them from Postgres periodically, which also
+    covers messages missed while Redis was unreachable.
+    """
+
+    def __init__(self, db: Database, get_redis: Optional[Callable] = None,
+                 flush_interval: float = SESSION_FLUSH_INTERVAL, sync_interval: float = SESSION_SYNC_INTERVAL,
+                 seen_cache: int = SESSION_SEEN_CACHE, token_lifetime: float = SESSION_TOKEN_LIFETIME):
+        self.db = db
+        self.get_redis = get_redis
+        self.flush_interval = flush_interval
+        self.sync_interval = sync_interval
+        self.seen_cache = seen_cache
+        self.token_lifetime = token_lifetime
+        # token hash -> expiry (epoch seconds)
+        self._revoked: Dict[str, float] = {}
+        # user id -> tokens issued before this are refused (epoch seconds)
+        self._cutoffs: Dict[str, float] = {}
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        # (user_id, token hash, expiry) waiting to be recorded; appended from
+        # the threads FastAPI runs sync dependencies in
+        self._pending: deque = deque()
+        self._seen_lock = threading.Lock()
+        self._tasks: List[asyncio.Task] = []
+
+    def _redis(self):
+        return self.get_redis() if self.get_redis else None
+
+    # Request path
+
+    def check(self, token: str, payload: dict):
+        """Raise 401 if the token was revoked; otherwise note it for recording"""
+        digest = token_hash(token)
+        cutoff = self._cutoffs.get(payload.get("user_id"))
+        if digest in self._revoked or (cutoff is not None and self._issued(payload) < cutoff):
+            revoked_token_rejections_total.inc()
+            raise HTTPException(status_code=401, detail="Token revoked")
+        with self._seen_lock:
+            if digest in self._seen:
+                self._seen.move_to_end(digest)
+                return
+            self._seen[digest] = None
+            if len(self._seen) > self.seen_cache:
+                self._seen.popitem(last=False)
+        expires = payload.get("exp")
+        if payload.get("user_id") and expires:
+            self._pending.append((payload["user_id"], digest, float(expires)))
+
+    def is_revoked(self, token: str) -> bool:
+        return token_hash(token) in self._revoked
+
+    def _issued(self, payload: dict) -> float:
+        if "iat" in payload:
+            return float(payload["iat"])
+        if "exp" in payload:
+            return float(payload["exp"]) - self.token_lifetime
+        # Never expires: only refused if issued before any cutoff
+        return float("-inf")
+
+    # Writes
+
+    async def flush(self):
+        """Record the tokens seen since the last flush"""
+        batch = []
+        while self._pending:
+            batch.append(self._pending.popleft())
+        if not batch:
+            return
+        users, digests, expiries = zip(*batch)
+        try:
+            await self.db.execute(
+                """
+                INSERT INTO sessions (user_id, token_hash, expires_at)
+                SELECT * FROM unnest(%s::uuid[], %s::varchar[], %s::timestamp[])
+                ON CONFLICT (token_hash) DO NOTHING
+                """,
+                (list(users), list(digests), [_timestamp(expiry) for expiry in expiries])
+            )
+        except Exception:
+            # Recorded on their next use instead
+            with self._seen_lock:
+                for digest in digests:
+                    self._seen.pop(digest, None)
+            raise
+
+    async def revoke(self, token: str, payload: dict):
+        """Log one token out, everywhere"""
+        digest = token_hash(token)
+        expires = float(payload["exp"])
+        await self.db.execute(
+            """
+            INSERT INTO sessions (user_id, token_hash, expires_at, revoked_at)
+            VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (token_hash) DO UPDATE SET revoked_at = COALESCE(sessions.revoked_at, EXCLUDED.revoked_at)
+            """,
+            (payload["user_id"], digest, _timestamp(expires))
+        )
+        session_revocations_total.labels(scope="session").inc()
+        await self._announce([(digest, expires)])
+
+    async def revoke_all(self, user_id: str) -> int:
+        """Log out every session of a user; the number of recorded sessions revoked"""
+        # iat has whole seconds: a token issued earlier in this second
+        # outlives the cutoff, one issued right after it is not refused
+        cutoff = float(int(time.time()))
+        await self.db.execute(
+            "UPDATE users SET sessions_revoked_before = GREATEST(sessions_revoked_before, %s) WHERE id = %s",
+            (_timestamp(cutoff), user_id)
+        )
+        # Recorded rows are marked too, so listings show them as revoked
+        await self.flush()
+        rows = await self.db.fetchall(
+            """
+            UPDATE sessions SET revoked_at = CURRENT_TIMESTAMP
+            WHERE user_id = %s AND revoked_at IS NULL AND expires_at > CURRENT_TIMESTAMP
+            RETURNING token_hash, expires_at
+            """,
+            (user_id,)
+        )
+        session_revocations_total.labels(scope="user").inc(len(rows))
+        await self._announce([(row["token_hash"], _epoch(row["expires_at"])) for row in rows], [(user_id, cutoff)])
+        return len(rows)
+
+    async def list(self, user_id: str) -> List[dict]:
+        """The user's active sessions, oldest first"""
+        await self.flush()
+        return await self.db.fetchall(
+            """
+            SELECT id::text AS id, token_hash, created_at, expires_at FROM sessions
+            WHERE user_id = %s AND revoked_at IS NULL AND expires_at > CURRENT_TIMESTAMP
+            ORDER BY created_at
+            """,
+            (user_id,)
+        )
+
+    # Propagation
+
+    def _add(self, entries: Iterable[Tuple[str, float]]):
+        now = time.time()
+        for digest, expires in entries:
+            if expires > now:
+                self._revoked[digest] = expires
+        sessions_revoked.set(len(self._revoked))
+
+    def _cut(self, cutoffs: Iterable[Tuple[str, float]]):
+        oldest = time.time() - self.token_lifetime
+        for user_id, cutoff in cutoffs:
+            if cutoff > max(oldest, self._cutoffs.get(user_id, oldest)):
+                self._cutoffs[user_id] = cutoff
+
+    def _prune(self):
+        now = time.time()
+        for digest in [digest for digest, expires in self._revoked.items() if expires <= now]:
+            del self._revoked[digest]
+        sessions_revoked.set(len(self._revoked))
+        # Every token issued before these cutoffs has expired
+        for user_id in [user_id for user_id, cutoff in self._cutoffs.items() if cutoff <= now - self.token_lifetime]:
+            del self._cutoffs[user_id]
+
+    async def _announce(self, entries: List[Tuple[str, float]], cutoffs: List[Tuple[str, float]] = ()):
+        """Apply revocations here at once, then tell the other processes"""
+        if not entries and not cutoffs:
+            return
+        self._add(entries)
+        self._cut(cutoffs)
+        redis = self._redis()
+        if redis is None:
+            return
+        try:
+            if entries:
+                await redis.zadd(SESSION_REVOKED_KEY, dict(entries))
+            if cutoffs:
+                await redis.zadd(SESSION_CUTOFF_KEY, dict(cutoffs))
+            await redis.publish(SESSION_CHANNEL, json.dumps({"tokens": entries, "users": list(cutoffs)}))
+        except Exception as e:
+            # Postgres has the revocation; other processes pick it up on their next sync
+            logger.warning({"message": "Failed to publish session revocation", "error": str(e)})
+
+    async def load(self):
+        """Fill the revoked set and cutoffs from Redis, or from Postgres without it"""
+        redis = self._redis()
+        if redis is not None:
+            try:
+                now = time.time()
+                await redis.zremrangebyscore(SESSION_REVOKED_KEY, "-inf", now)
+                entries = await redis.zrangebyscore(SESSION_REVOKED_KEY, now, "+inf", withscores=True)
+                oldest = now - self.token_lifetime
+                await redis.zremrangebyscore(SESSION_CUTOFF_KEY, "-inf", oldest)
+                cutoffs = await redis.zrangebyscore(SESSION_CUTOFF_KEY, oldest, "+inf", withscores=True)
+                self._add((_text(digest), expires) for digest, expires in entries)
+                self._cut((_text(user_id), cutoff) for user_id, cutoff in cutoffs)
+                return
+            except Exception as e:
+                logger.warning({"message": "Failed to load revoked sessions from Redis", "error": str(e)})
+        await self.sync()
+
+    async def sync(self):
+        """Reload revocations and cutoffs from Postgres, the record, and copy them back into Redis"""
+        rows = await self.db.fetchall(
+            """
+            SELECT token_hash, expires_at FROM sessions
+            WHERE revoked_at IS NOT NULL AND expires_at > CURRENT_TIMESTAMP
+            """
+        )
+        entries = [(row["token_hash"], _epoch(row["expires_at"])) for row in rows]
+        rows = await self.db.fetchall(
+            "SELECT id::text AS user_id, sessions_revoked_before FROM users WHERE sessions_revoked_before > %s",
+            (_timestamp(time.time() - self.token_lifetime),)
+        )
+        cutoffs = [(row["user_id"], _epoch(row["sessions_revoked_before"])) for row in rows]
+        self._add(entries)
+        self._cut(cutoffs)
+        self._prune()
+        redis = self._redis()
+        if redis is not None and (entries or cutoffs):
+            try:
+                if entries:
+                    await redis.zadd(SESSION_REVOKED_KEY, dict(entries))
+                if cutoffs:
+                    await redis.zadd(SESSION_CUTOFF_KEY, dict(cutoffs))
+            except Exception as e:
+                logger.warning({"message": "Failed to copy revoked sessions to Redis", "error": str(e)})
+
+    async def _listen(self):
+        redis = self._redis()
+        while True:
+            pubsub = redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(SESSION_CHANNEL)
+                # Revocations published before the subscription took effect
+                await self.load()
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        update = json.loads(message["data"])
+                        self._add(tuple(entry) for entry in update["tokens"])
+                        self._cut(tuple(entry) for entry in update["users"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning({"message": "Session revocation subscription failed", "error": str(e)})
+            finally:
+                close = getattr(pubsub, "aclose", None) or pubsub.close
+                try:
+                    await close()
+                except Exception:
+                    pass
+            await asyncio.sleep(1)
+
+    async def _run(self):
+        next_sync = time.monotonic() + self.sync_interval
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() >= next_sync:
+                    next_sync = time.monotonic() + self.sync_interval
+                    await self.sync()
+                else:
+                    self._prune()
+            except Exception as e:
+                logger.warning({"message": "Session bookkeeping failed", "error": str(e)})
+
+    # Lifecycle
+
+    def start(self):
+        if self._tasks:
+            return
+        if self._redis() is not None:
+            self._tasks.append(asyncio.create_task(self._listen()))
+        else:
+            self._tasks.append(asyncio.create_task(self._initial_sync()))
+        self._tasks.append(asyncio.create_task(self._run()))
+
+    async def _initial_sync(self):
+        try:
+            await self.sync()
+        except Exception as e:
+            logger.warning({"message": "Failed to load revoked sessions", "error": str(e)})
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.warning({"message": "Failed to record sessions at shutdown", "error": str(e)})
@@ -0,0 +1,350 @@
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+from prometheus_client import Counter, Gauge
+
+from ..logging import logger
+from .resources import CPU_PERIOD, parse_memory, reservation
+
+def _quota(tier: str, default: int) -> int:
+    return int(os.getenv(f"WORKSPACE_QUOTA_{tier.upper()}", str(default)))
+
+# Per-user limits on committed workspaces, counting hibernated ones: they
+# keep their limits and come back on access
+TIER_QUOTAS = {
+    "free": {"workspaces": _quota("free", 1), "memory": "1g", "cpus": 1},
+    "pro": {"workspaces": _quota("pro", 5), "memory": "10g", "cpus": 10},
+    "enterprise": {"workspaces": _quota("enterprise", 20), "memory": "160g", "cpus": 80},
+}
+
+# Creates waiting for host capacity; beyond this they are rejected at once
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "32"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "20"))
+ADMISSION_SYNC_INTERVAL = float(os.getenv("ADMISSION_SYNC_INTERVAL", "60"))
+# Capacity freed on other API instances is only seen by polling
+ADMISSION_POLL_INTERVAL = 1.0
+# With Redis, each user's commitments live in a hash under this prefix
+# (container name -> "memory millicpus committed-at"), plus one hash of
+# container name -> owner, shared by all API instances
+ADMISSION_KEY_PREFIX = os.getenv("ADMISSION_KEY_PREFIX", "claudeosaar:admission:")
+ADMISSION_OWNERS_KEY = f"{ADMISSION_KEY_PREFIX}owners"
+
+# Check the user's quota and commit the new container in one step.
+# KEYS: usage hash, owners; ARGV: user, name, memory, millicpus, committed
+# at, then the quota's workspaces, memory and millicpus
+_COMMIT = """
+if redis.call("HEXISTS", KEYS[1], ARGV[2]) == 1 then return "ok" end
+local count, memory, cpus = 1, tonumber(ARGV[3]), tonumber(ARGV[4])
+for _, entry in ipairs(redis.call("HVALS", KEYS[1])) do
+    local used_memory, used_cpus = string.match(entry, "^(%d+) (%d+)")
+    count = count + 1
+    memory = memory + tonumber(used_memory)
+    cpus = cpus + tonumber(used_cpus)
+end
+if count > tonumber(ARGV[6]) then return "workspaces" end
+if memory > tonumber(ARGV[7]) then return "memory" end
+if cpus > tonumber(ARGV[8]) then return "cpus" end
+redis.call("HSET", KEYS[1], ARGV[2], ARGV[3] .. " " .. ARGV[4] .. " " .. ARGV[5])
+redis.call("HSET", KEYS[2], ARGV[2], ARGV[1])
+return "ok"
+"""
+
+# KEYS: owners, the owner's usage hash; ARGV: name, owner
+_RELEASE = """
+if redis.call("HGET", KEYS[1], ARGV[1]) == ARGV[2] then redis.call("HDEL", KEYS[1], ARGV[1]) end
+return redis.call("HDEL", KEYS[2], ARGV[1])
+"""
+
+# Replace a user's commitments with the containers listed, keeping those
+# committed after the listing started. KEYS: usage hash, owners; ARGV: user,
+# listing started at, then name and "memory millicpus" per container
+_SYNC = """
+local listed = {}
+for i = 3, #ARGV, 2 do listed[ARGV[i]] = ARGV[i + 1] end
+local current = redis.call("HGETALL", KEYS[1])
+for i = 1, #current, 2 do
+    local name = current[i]
+    local committed = tonumber(string.match(current[i + 1], " ([%d.]+)$"))
+    if not listed[name] and committed < tonumber(ARGV[2]) then
+        redis.call("HDEL", KEYS[1], name)
+        if redis.call("HGET", KEYS[2], name) == ARGV[1] then redis.call("HDEL", KEYS[2], name) end
+    end
+end
+for name, usage in pairs(listed) do
+    redis.call("HSET", KEYS[1], name, usage .. " " .. ARGV[2])
+    redis.call("HSET", KEYS[2], name, ARGV[1])
+end
+return 0
+"""
+
+def _millicpus(cpus: float) -> int:
+    return int(round(cpus * 1000))
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+admission_rejected_total = Counter(
+    'claudeosaar_admission_rejected_total',
+    'Workspace creates rejected by admission control',
+    ['tier', 'reason']
+)
+admission_queued = Gauge(
+    'claudeosaar_admission_queued',
+    'Workspace creates waiting for host capacity',
+    multiprocess_mode='livesum'
+)
+
+class AdmissionController:
+    """Gate workspace creation on per-user quotas and cluster capacity
+
+    Each user's committed workspaces are kept in memory, so a check is a
+    dictionary lookup plus a sum over at most a quota's worth of entries.
+    The map is rebuilt from container labels every sync interval, which also
+    picks up workspaces created or removed through other API instances.
+    With Redis configured, the commitments are shared: one Lua script checks
+    the quota and commits, so creates through different instances cannot
+    both pass, and nothing is held while the container is created. The sync
+    also repairs the shared commitments; this instance's view is the
+    fallback while Redis is unreachable. Creates that fit the quota but find
+    no node with room wait in a bounded queue for capacity to free up
+    instead of failing immediately.
+    """
+
+    def __init__(self, scheduler, quotas: Optional[Dict[str, dict]] = None,
+                 queue_size: int = ADMISSION_QUEUE_SIZE, queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+                 sync_interval: float = ADMISSION_SYNC_INTERVAL, get_redis: Optional[Callable] = None):
+        self.scheduler = scheduler
+        self.get_redis = get_redis
+        self.quotas = quotas or TIER_QUOTAS
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.sync_interval = sync_interval
+        # user id -> container name -> (memory bytes, CPUs, committed at)
+        self._committed: Dict[str, Dict[str, Tuple[int, float, float]]] = {}
+        self._owners: Dict[str, str] = {}
+        self._waiting = 0
+        self._freed = asyncio.Event()
+        self._synced = False
+        self._task: Optional[asyncio.Task] = None
+        self._releases: Set[asyncio.Task] = set()
+
+    def quota_for(self, tier: str) -> dict:
+        return self.quotas.get(tier, self.quotas["free"])
+
+    def usage(self, user_id: str) -> Tuple[int, int, float]:
+        """(workspaces, memory bytes, CPUs) committed by a user"""
+        entries = self._committed.get(user_id, {}).values()
+        return len(entries), sum(e[0] for e in entries), sum(e[1] for e in entries)
+
+    def check_quota(self, user_id: str, tier: str, memory: int, cpus: float):
+        """Raise 403 if one more workspace of this size exceeds the user's quota"""
+        quota = self.quota_for(tier)
+        count, used_memory, used_cpus = self.usage(user_id)
+        if count + 1 > quota["workspaces"]:
+            self._reject(tier, "workspaces")
+        elif used_memory + memory > parse_memory(quota["memory"]):
+            self._reject(tier, "memory")
+        elif used_cpus + cpus > quota["cpus"] + 1e-9:
+            self._reject(tier, "cpus")
+
+    def _reject(self, tier: str, exceeded: str):
+        quota = self.quota_for(tier)
+        if exceeded == "workspaces":
+            reason = f"Workspace limit reached. Maximum {quota['workspaces']} for the {tier} tier."
+        elif exceeded == "memory":
+            reason = f"Memory quota of {quota['memory']} for the {tier} tier exceeded."
+        else:
+            reason = f"CPU quota of {quota['cpus']} for the {tier} tier exceeded."
+        admission_rejected_total.labels(tier=tier, reason="quota").inc()
+        raise HTTPException(status_code=403, detail=reason)
+
+    @asynccontextmanager
+    async def admit(self, user_id: str, tier: str, name: str, mem_limit, cpu_quota):
+        """Commit quota for a new workspace container while it is created
+
+        The commitment is rolled back if the body raises.
+        """
+        if not self._synced:
+            await self.sync()
+        memory, cpus = reservation(mem_limit, cpu_quota)
+        if not await self._commit_shared(user_id, tier, name, memory, cpus):
+            # Check and commit without awaiting in between, so concurrent
+            # requests to this instance cannot both pass the check
+            self.check_quota(user_id, tier, memory, cpus)
+        self._commit(user_id, name, memory, cpus)
+        try:
+            await self._wait_for_capacity(tier, memory, cpus)
+            yield
+        except BaseException:
+            self.release(name)
+            raise
+
+    def _redis(self):
+        return self.get_redis() if self.get_redis else None
+
+    @staticmethod
+    def _usage_key(user_id: str) -> str:
+        return f"{ADMISSION_KEY_PREFIX}usage:{user_id}"
+
+    async def _commit_shared(self, user_id: str, tier: str, name: str, memory: int, cpus: float) -> bool:
+        """Check and commit in Redis, raising 403 over quota; False if Redis is not available"""
+        redis = self._redis()
+        if redis is None:
+            return False
+        quota = self.quota_for(tier)
+        try:
+            result = await redis.eval(
+                _COMMIT, 2, self._usage_key(user_id), ADMISSION_OWNERS_KEY,
+                user_id, name, memory, _millicpus(cpus), repr(time.time()),
+                quota["workspaces"], parse_memory(quota["memory"]), _millicpus(quota["cpus"])
+            )
+        except Exception as e:
+            # Fall back to this instance's view rather than refusing creates
+            logger.warning({"message": "Shared admission check unavailable", "error": str(e)})
+            return False
+        if _text(result) != "ok":
+            self._reject(tier, _text(result))
+        return True
+
+    async def _wait_for_capacity(self, tier: str, memory: int, cpus: float):
+        if self.scheduler.has_capacity(memory, cpus):
+            return
+        if self._waiting >= self.queue_size:
+            admission_rejected_total.labels(tier=tier, reason="queue_full").inc()
+            raise HTTPException(status_code=503, detail="Cluster at capacity, try again later",
+                                headers={"Retry-After": str(int(self.queue_timeout))})
+
+        self._waiting += 1
+        admission_queued.inc()
+        deadline = time.monotonic() + self.queue_timeout
+        try:
+            while not self.scheduler.has_capacity(memory, cpus):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    admission_rejected_total.labels(tier=tier, reason="capacity").inc()
+                    raise HTTPException(status_code=503, detail="Cluster at capacity, try again later",
+                                        headers={"Retry-After": str(int(self.queue_timeout))})
+                self._freed.clear()
+                try:
+                    await asyncio.wait_for(self._freed.wait(), min(remaining, ADMISSION_POLL_INTERVAL))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._waiting -= 1
+            admission_queued.dec()
+
+    def _commit(self, user_id: str, name: str, memory: int, cpus: float):
+        self._committed.setdefault(user_id, {})[name] = (memory, cpus, time.monotonic())
+        self._owners[name] = user_id
+
+    def release(self, name: str):
+        """Return a removed workspace's share of its owner's quota"""
+        user_id = self._owners.pop(name, None)
+        if self._redis() is not None:
+            try:
+                task = asyncio.get_running_loop().create_task(self._release_shared(name, user_id))
+            except RuntimeError:
+                # No event loop: the next sync drops it
+                pass
+            else:
+                self._releases.add(task)
+                task.add_done_callback(self._releases.discard)
+        if user_id is None:
+            return
+        entries = self._committed.get(user_id, {})
+        entries.pop(name, None)
+        if not entries:
+            self._committed.pop(user_id, None)
+        self._freed.set()
+
+    async def _release_shared(self, name: str, user_id: Optional[str]):
+        redis = self._redis()
+        try:
+            if user_id is None:
+                # Committed through another instance
+                user_id = _text(await redis.hget(ADMISSION_OWNERS_KEY, name))
+                if user_id is None:
+                    return
+            await redis.eval(_RELEASE, 2, ADMISSION_OWNERS_KEY, self._usage_key(user_id), name, user_id)
+        except Exception as e:
+            logger.warning({"message": "Failed to release shared admission usage", "error": str(e)})
+
+    async def sync(self):
+        """Rebuild committed usage from the workspace containers on all nodes"""
+        started = time.monotonic()
+        started_at = time.time()
+        try:
+            containers = await asyncio.to_thread(
+                self.scheduler.containers.list, all=True, filters={"label": "claudeosaar.user_id"}
+            )
+        except Exception as e:
+            # Includes a partial listing, which would undercount
+            logger.warning({"message": "Failed to sync admission usage", "error": str(e)})
+            return
+
+        committed = self._merge(containers, self._committed, started)
+        self._committed = committed
+        self._owners = {name: user_id for user_id, entries in committed.items() for name in entries}
+        self._synced = True
+        self._freed.set()
+        await self._sync_shared(containers, started_at)
+
+    async def _sync_shared(self, containers: List, started_at: float):
+        """Repair the shared commitments of every user with containers or commitments"""
+        redis = self._redis()
+        if redis is None:
+            return
+        listed: Dict[str, List] = {}
+        for container in containers:
+            memory, cpus = self._limits(container)
+            listed.setdefault(container.labels["claudeosaar.user_id"], []).extend(
+                [container.name, f"{memory} {_millicpus(cpus)}"])
+        try:
+            owners = await redis.hgetall(ADMISSION_OWNERS_KEY)
+            for user_id in set(listed) | {_text(owner) for owner in owners.values()}:
+                await redis.eval(_SYNC, 2, self._usage_key(user_id), ADMISSION_OWNERS_KEY,
+                                 user_id, repr(started_at), *listed.get(user_id, []))
+        except Exception as e:
+            logger.warning({"message": "Failed to sync shared admission usage", "error": str(e)})
+
+    @staticmethod
+    def _limits(container) -> Tuple[int, float]:
+        host_config = container.attrs.get("HostConfig", {})
+        memory = host_config.get("Memory") or 0
+        cpus = (host_config.get("CpuQuota") or 0) / (host_config.get("CpuPeriod") or CPU_PERIOD)
+        return memory, cpus
+
+    @staticmethod
+    def _merge(containers: List, current: Dict[str, Dict[str, Tuple[int, float, float]]],
+               started: float) -> Dict[str, Dict[str, Tuple[int, float, float]]]:
+        committed: Dict[str, Dict[str, Tuple[int, float, float]]] = {}
+        for container in containers:
+            memory, cpus = AdmissionController._limits(container)
+            user_id = container.labels["claudeosaar.user_id"]
+            committed.setdefault(user_id, {})[container.name] = (memory, cpus, started)
+        # Keep commitments made while the listing was in flight
+        for user_id, entries in current.items():
+            for name, entry in entries.items():
+                if entry[2] >= started:
+                    committed.setdefault(user_id, {})[name] = entry
+        return committed
+
+    def start(self):
+        """Periodically re-sync usage with the Docker nodes"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await self.sync()
+            await asyncio.sleep(self.sync_interval)
@@ -0,0 +1,35 @@
+"""Gear-hash chunk boundaries for snapshots
+
+Pure Python and CPU-bound, so snapshots run it in worker processes rather
+than on the API's threads. Worker processes import this module on their
+own; keep it free of the API's imports.
+"""
+
+import hashlib
+
+# Gear table for the rolling hash; derived from a fixed seed because chunk
+# boundaries, and with them deduplication, must be the same in every process.
+# Entries stay below 2**63 so the hash never needs masking to 64 bits.
+_GEAR = [int.from_bytes(hashlib.sha256(b"claudeosaar-gear-%d" % i).digest()[:8], "big") >> 1 for i in range(256)]
+
+def cut(data: bytes, min_size: int, avg_size: int, max_size: int, mask_small: int, mask_large: int) -> int:
+    """Length of the first chunk of `data`"""
+    n = len(data)
+    if n <= min_size:
+        return n
+    gear, h = _GEAR, 0
+    normal = min(avg_size, n)
+    i = min_size
+    mask = mask_small
+    for b in data[min_size:normal]:
+        h = (h >> 1) + gear[b]
+        i += 1
+        if not h & mask:
+            return i
+    mask = mask_large
+    for b in data[normal:min(max_size, n)]:
+        h = (h >> 1) + gear[b]
+        i += 1
+        if not h & mask:
+            return i
+    return i
@@ -0,0 +1,502 @@
+import asyncio
+import errno
+import os
+import random
+import re
+import stat
+import struct
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+from prometheus_client import Gauge, Histogram
+
+from ..db import Database
+from ..logging import logger
+from .files import USER_MOUNTS_ROOT
+
+GIB = 1024 ** 3
+
+# Soft storage quotas: API writes to a workspace over its quota are refused,
+# but processes inside the container are not stopped
+TIER_STORAGE_QUOTAS = {"free": 5 * GIB, "pro": 50 * GIB, "enterprise": 100 * GIB}
+
+# Seconds between incremental refreshes
+DISK_USAGE_INTERVAL = float(os.getenv("DISK_USAGE_INTERVAL", "15"))
+# Workspaces scanned concurrently; bounds the metadata I/O of a refresh
+DISK_SCAN_THREADS = int(os.getenv("DISK_SCAN_THREADS", "4"))
+# Without inotify, changed directories are found by their mtime, which
+# misses files growing in place; those workspaces are fully rescanned this
+# often, staggered so they do not all run at once
+DISK_FULL_RESCAN_INTERVAL = float(os.getenv("DISK_FULL_RESCAN_INTERVAL", "3600"))
+# Seconds between rows written to container_metrics
+DISK_USAGE_RECORD_INTERVAL = float(os.getenv("DISK_USAGE_RECORD_INTERVAL", "300"))
+DISK_USAGE_INOTIFY = os.getenv("DISK_USAGE_INOTIFY", "true").lower() == "true"
+
+workspace_disk_bytes = Gauge(
+    'claudeosaar_workspace_disk_bytes',
+    'Disk space used by all workspace directories on this host',
+    multiprocess_mode='livemax'
+)
+disk_scan_duration = Histogram(
+    'claudeosaar_disk_scan_seconds',
+    'Time to bring workspace disk usage up to date',
+    ['mode']
+)
+
+_UUID = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+# inotify(7) event bits
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+_EVENT = struct.Struct("iIII")
+
+class Inotify:
+    """Minimal inotify binding over libc; raises OSError where unsupported"""
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        try:
+            init, self._add, self._rm = libc.inotify_init1, libc.inotify_add_watch, libc.inotify_rm_watch
+        except AttributeError:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self._add.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._get_errno = ctypes.get_errno
+        self.fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(self._get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path: str) -> int:
+        wd = self._add(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            code = self._get_errno()
+            raise OSError(code, os.strerror(code), path)
+        return wd
+
+    def rm_watch(self, wd: int):
+        self._rm(self.fd, wd)
+
+    def read(self) -> List[Tuple[int, int, str]]:
+        """Pending (watch descriptor, mask, name) events"""
+        try:
+            data = os.read(self.fd, 256 * 1024)
+        except BlockingIOError:
+            return []
+        events, offset = [], 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class _Dir:
+    __slots__ = ("mtime_ns", "bytes", "subdirs", "wd")
+
+    def __init__(self, mtime_ns: int, size: int, subdirs: FrozenSet[str]):
+        self.mtime_ns = mtime_ns
+        self.bytes = size
+        self.subdirs = subdirs
+        self.wd: Optional[int] = None
+
+class _Workspace:
+    """Usage index of one workspace: allocated bytes per directory"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.dirs: Dict[str, _Dir] = {}
+        self.total = 0
+        self.watched = False
+        self.scanned_at: Optional[float] = None
+        self.next_full_scan = 0.0
+        self.lock = threading.Lock()
+
+def _join(parent: str, name: str) -> str:
+    return f"{parent}/{name}" if parent else name
+
+# Containers can swap any directory in their workspace for a symlink, so
+# directories are opened one component at a time without following
+# symlinks, and listed through their descriptors
+_DIR_FLAGS = os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW | os.O_CLOEXEC
+# A directory that is gone or was replaced by something else
+_GONE = (errno.ENOENT, errno.ENOTDIR, errno.ELOOP)
+
+def _open_dir(root: str, rel: str) -> int:
+    """Descriptor of the directory `rel` under `root`"""
+    fd = os.open(root, _DIR_FLAGS)
+    try:
+        for part in rel.split("/") if rel else ():
+            child = os.open(part, _DIR_FLAGS, dir_fd=fd)
+            os.close(fd)
+            fd = child
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+def _dir_mtime_ns(root: str, rel: str) -> Optional[int]:
+    try:
+        fd = _open_dir(root, rel)
+    except OSError as e:
+        if e.errno in _GONE:
+            return None
+        raise
+    try:
+        return os.fstat(fd).st_mtime_ns
+    finally:
+        os.close(fd)
+
+class DiskUsageTracker:
+    """Per-workspace disk usage, kept current without rescanning everything
+
+    Each workspace's index records the bytes allocated directly in every
+    directory, like `du`. After the first scan, which runs for several
+    workspaces in parallel, only directories that changed are listed again:
+    inotify names them, and without inotify (or past the watch limit) a
+    directory's mtime does. A modified file is picked up by rescanning just
+    its directory.
+
+    Only one API process per host scans, chosen by a file lock; the others
+    read the figures it writes to container_metrics.
+    """
+
+    def __init__(self, db: Optional[Database] = None, mounts_root: str = USER_MOUNTS_ROOT,
+                 quotas: Optional[Dict[str, int]] = None, interval: float = DISK_USAGE_INTERVAL,
+                 threads: int = DISK_SCAN_THREADS, full_rescan_interval: float = DISK_FULL_RESCAN_INTERVAL,
+                 record_interval: float = DISK_USAGE_RECORD_INTERVAL, use_inotify: bool = DISK_USAGE_INOTIFY):
+        self.db = db
+        self.mounts_root = mounts_root
+        self.quotas = quotas or TIER_STORAGE_QUOTAS
+        self.interval = interval
+        self.full_rescan_interval = full_rescan_interval
+        self.record_interval = record_interval
+        self.use_inotify = use_inotify
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="disk-usage")
+        self._workspaces: Dict[Tuple[str, str], _Workspace] = {}
+        self._inotify: Optional[Inotify] = None
+        self._watches: Dict[int, Tuple[Tuple[str, str], str]] = {}
+        self._watch_lock = threading.Lock()
+        self._dirty: Dict[Tuple[str, str], Set[str]] = defaultdict(set)
+        self._rescan: Set[Tuple[str, str]] = set()
+        self._recorded_at = 0.0
+        self._lock_file = None
+        self._cache: Dict[str, Tuple[float, Optional[int]]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_scanner(self) -> bool:
+        return self._lock_file is not None
+
+    # Reading usage
+
+    async def usage(self, user_id: str, workspace_id: str) -> Optional[int]:
+        """Bytes used by the workspace directory, or None if not measured yet"""
+        if self.is_scanner:
+            workspace = self._workspaces.get((user_id, workspace_id))
+            return workspace.total if workspace and workspace.scanned_at else None
+        cached = self._cache.get(workspace_id)
+        if cached and time.monotonic() - cached[0] < self.record_interval:
+            return cached[1]
+        value = None
+        if self.db is not None and _UUID.match(workspace_id):
+            row = await self.db.fetchone(
+                """
+                SELECT disk_usage_mb FROM container_metrics
+                WHERE workspace_id = %s AND disk_usage_mb IS NOT NULL
+                ORDER BY recorded_at DESC LIMIT 1
+                """,
+                (workspace_id,)
+            )
+            value = row["disk_usage_mb"] * 1024 * 1024 if row else None
+        self._cache[workspace_id] = (time.monotonic(), value)
+        return value
+
+    def quota(self, tier: str) -> int:
+        return self.quotas.get(tier, self.quotas["free"])
+
+    async def check_quota(self, user_id: str, workspace_id: str, tier: str, incoming: int = 0) -> Optional[int]:
+        """Raise 507 if writing `incoming` more bytes would exceed the tier's quota
+
+        Returns the bytes that may still be written, or None if usage is not
+        measured yet.
+        """
+        used = await self.usage(user_id, workspace_id)
+        if used is None:
+            return None
+        quota = self.quota(tier)
+        if used + incoming > quota:
+            raise HTTPException(
+                status_code=507,
+                detail=f"Storage quota exceeded. {used // 1024 ** 2} MB used of {quota // 1024 ** 2} MB "
+                       f"for the {tier} tier."
+            )
+        return quota - used
+
+    def invalidate(self, user_id: str, workspace_id: str):
+        """Rescan the workspace on the next refresh, e.g. after an upload"""
+        self._rescan.add((user_id, workspace_id))
+
+    # Scanning
+
+    def _scan_dir(self, workspace: _Workspace, rel: str) -> Optional[_Dir]:
+        try:
+            fd = _open_dir(workspace.root, rel)
+        except OSError as e:
+            if e.errno in _GONE:
+                return None
+            raise
+        try:
+            st = os.fstat(fd)
+            size, subdirs = st.st_blocks * 512, []
+            with os.scandir(fd) as entries:
+                for entry in entries:
+                    try:
+                        child = os.stat(entry.name, dir_fd=fd, follow_symlinks=False)
+                    except FileNotFoundError:
+                        continue
+                    if stat.S_ISDIR(child.st_mode):
+                        subdirs.append(_join(rel, entry.name))
+                    else:
+                        size += child.st_blocks * 512
+        finally:
+            os.close(fd)
+        return _Dir(st.st_mtime_ns, size, frozenset(subdirs))
+
+    def _watch(self, key: Tuple[str, str], workspace: _Workspace, rel: str, directory: _Dir):
+        if not workspace.watched:
+            return
+        try:
+            wd = self._inotify.add_watch(os.path.join(workspace.root, rel) if rel else workspace.root)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                # Out of watches: this workspace falls back to mtime checks
+                logger.warning({"message": "inotify watch limit reached; using mtime rescans",
+                                "workspace_id": key[1]})
+                self._unwatch_all(workspace)
+                workspace.watched = False
+            return
+        directory.wd = wd
+        with self._watch_lock:
+            self._watches[wd] = (key, rel)
+
+    def _unwatch(self, directory: _Dir):
+        if directory.wd is not None:
+            with self._watch_lock:
+                self._watches.pop(directory.wd, None)
+            self._inotify.rm_watch(directory.wd)
+            directory.wd = None
+
+    def _unwatch_all(self, workspace: _Workspace):
+        for directory in workspace.dirs.values():
+            self._unwatch(directory)
+
+    def _scan_tree(self, key, workspace: _Workspace, rel: str):
+        pending = [rel]
+        while pending:
+            rel = pending.pop()
+            directory = self._scan_dir(workspace, rel)
+            if directory is None:
+                continue
+            workspace.dirs[rel] = directory
+            workspace.total += directory.bytes
+            self._watch(key, workspace, rel, directory)
+            pending.extend(directory.subdirs)
+
+    def _drop_tree(self, workspace: _Workspace, rel: str):
+        prefix = rel + "/"
+        for name in [name for name in workspace.dirs if name == rel or not rel or name.startswith(prefix)]:
+            directory = workspace.dirs.pop(name)
+            workspace.total -= directory.bytes
+            self._unwatch(directory)
+
+    def _rescan_dir(self, key, workspace: _Workspace, rel: str):
+        old = workspace.dirs.get(rel)
+        if old is None:
+            return  # listed when its parent is rescanned
+        new = self._scan_dir(workspace, rel)
+        if new is None:
+            self._drop_tree(workspace, rel)
+            return
+        new.wd = old.wd
+        workspace.dirs[rel] = new
+        workspace.total += new.bytes - old.bytes
+        for gone in old.subdirs - new.subdirs:
+            self._drop_tree(workspace, gone)
+        for added in new.subdirs - old.subdirs:
+            self._scan_tree(key, workspace, added)
+
+    def full_scan(self, key, workspace: _Workspace):
+        with workspace.lock, disk_scan_duration.labels(mode="full").time():
+            self._drop_tree(workspace, "")
+            workspace.watched = self._inotify is not None
+            self._scan_tree(key, workspace, "")
+            workspace.scanned_at = time.time()
+            jitter = 0.5 + random.random()
+            workspace.next_full_scan = time.monotonic() + self.full_rescan_interval * jitter
+
+    def refresh(self, key, workspace: _Workspace, dirty: Set[str]):
+        """Bring a scanned workspace up to date from events or directory mtimes"""
+        with workspace.lock, disk_scan_duration.labels(mode="incremental").time():
+            if not workspace.watched:
+                dirty = set()
+                for rel, directory in list(workspace.dirs.items()):
+                    if _dir_mtime_ns(workspace.root, rel) != directory.mtime_ns:
+                        dirty.add(rel)
+            # Parents first, so a removed tree is dropped before its children are visited
+            for rel in sorted(dirty, key=lambda rel: rel.count("/") if rel else -1):
+                self._rescan_dir(key, workspace, rel)
+            workspace.scanned_at = time.time()
+
+    def _discover(self) -> Dict[Tuple[str, str], str]:
+        found = {}
+        try:
+            users = [entry for entry in os.scandir(self.mounts_root) if entry.is_dir(follow_symlinks=False)]
+        except FileNotFoundError:
+            return found
+        for user in users:
+            if user.name.startswith("."):
+                continue  # e.g. the snapshot store
+            with os.scandir(user.path) as workspaces:
+                for workspace in workspaces:
+                    if workspace.is_dir(follow_symlinks=False):
+                        found[(user.name, workspace.name)] = workspace.path
+        return found
+
+    def _on_events(self):
+        for wd, mask, _ in self._inotify.read():
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost; rescan everything that is watched
+                self._rescan.update(key for key, workspace in self._workspaces.items() if workspace.watched)
+                continue
+            with self._watch_lock:
+                target = self._watches.get(wd)
+                if mask & IN_IGNORED:
+                    self._watches.pop(wd, None)
+            if target is not None:
+                self._dirty[target[0]].add(target[1])
+
+    async def update(self):
+        """One refresh: find new and removed workspaces, then rescan what changed"""
+        loop = asyncio.get_running_loop()
+        found = await loop.run_in_executor(self._executor, self._discover)
+        for key in set(self._workspaces) - set(found):
+            workspace = self._workspaces.pop(key)
+            with workspace.lock:
+                self._drop_tree(workspace, "")
+        for key, root in found.items():
+            if key not in self._workspaces:
+                self._workspaces[key] = _Workspace(root)
+
+        dirty, self._dirty = self._dirty, defaultdict(set)
+        rescan, self._rescan = self._rescan, set()
+        now = time.monotonic()
+        jobs = []
+        for key, workspace in self._workspaces.items():
+            if (workspace.scanned_at is None or key in rescan
+                    or (not workspace.watched and now >= workspace.next_full_scan)):
+                jobs.append(loop.run_in_executor(self._executor, self.full_scan, key, workspace))
+            elif not workspace.watched or key in dirty:
+                jobs.append(loop.run_in_executor(self._executor, self.refresh, key, workspace,
+                                                 dirty.get(key, set())))
+        results = await asyncio.gather(*jobs, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error({"message": "Disk usage scan failed", "error": str(result)})
+        workspace_disk_bytes.set(sum(workspace.total for workspace in self._workspaces.values()))
+
+    async def record(self):
+        """Append current usage to container_metrics for workspaces with a row in workspaces"""
+        ids, sizes = [], []
+        for (_, workspace_id), workspace in self._workspaces.items():
+            if workspace.scanned_at is not None and _UUID.match(workspace_id):
+                ids.append(workspace_id)
+                sizes.append(-(-workspace.total // (1024 * 1024)))
+        if not ids or self.db is None:
+            return
+        await self.db.execute(
+            """
+            INSERT INTO container_metrics (workspace_id, disk_usage_mb)
+            SELECT w.id, u.disk_usage_mb
+            FROM unnest(%s::uuid[], %s::integer[]) AS u(workspace_id, disk_usage_mb)
+            JOIN workspaces w ON w.id = u.workspace_id
+            """,
+            (ids, sizes)
+        )
+
+    # Lifecycle
+
+    def _acquire_scanner_lock(self) -> bool:
+        import fcntl
+
+        try:
+            lock_file = open(os.path.join(self.mounts_root, ".disk-usage.lock"), "a")
+        except OSError:
+            return False
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def start(self):
+        """Become this host's scanner if no other process is, and start refreshing"""
+        if self._task is not None or not os.path.isdir(self.mounts_root) or not self._acquire_scanner_lock():
+            return
+        if self.use_inotify:
+            try:
+                self._inotify = Inotify()
+                asyncio.get_running_loop().add_reader(self._inotify.fd, self._on_events)
+            except OSError as e:
+                logger.info({"message": "inotify unavailable; using mtime rescans", "error": str(e)})
+                self._inotify = None
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._inotify is not None:
+            asyncio.get_running_loop().remove_reader(self._inotify.fd)
+            self._inotify.close()
+            self._inotify = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.update()
+                if time.monotonic() - self._recorded_at >= self.record_interval:
+                    self._recorded_at = time.monotonic()
+                    await self.record()
+            except Exception as e:
+                logger.error({"message": "Disk usage refresh failed", "error": str(e)})
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,360 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional
+
+from prometheus_client import Counter, Gauge
+
+from ..logging import logger
+from .scheduler import WORKSPACE_LABEL, NodesUnavailable
+
+EVENTS_CHANNEL = os.getenv("EVENTS_CHANNEL", "claudeosaar:workspace-events")
+# Events buffered per connected client; a client further behind is told to resync
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "256"))
+# With Redis, one replica watches the Docker daemons and publishes for all;
+# it must renew its claim within this many seconds
+EVENTS_LEADER_TTL = float(os.getenv("EVENTS_LEADER_TTL", "15"))
+EVENTS_HEARTBEAT = float(os.getenv("EVENTS_HEARTBEAT", "15"))
+
+# Extend the leader key only while it still holds our claim.
+# KEYS: leader key; ARGV: instance, ttl in milliseconds
+_RENEW = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then return redis.call("PEXPIRE", KEYS[1], ARGV[2]) end
+return 0
+"""
+
+# Docker container actions and the workspace status they leave behind; "stop"
+# and "kill" are followed by "die", which is reported instead
+DOCKER_ACTIONS = {
+    "create": "created",
+    "start": "running",
+    "restart": "running",
+    "unpause": "running",
+    "pause": "paused",
+    "die": "exited",
+    "oom": "oom",
+    "destroy": "deleted",
+}
+
+event_subscribers = Gauge(
+    'claudeosaar_event_subscribers',
+    'Clients connected to the workspace event stream',
+    multiprocess_mode='livesum'
+)
+events_published_total = Counter(
+    'claudeosaar_workspace_events_published_total',
+    'Workspace events published to subscribers',
+    ['type']
+)
+events_dropped_total = Counter(
+    'claudeosaar_workspace_events_dropped_total',
+    'Events dropped for clients too far behind; each such client is sent a resync'
+)
+
+def sse_frame(event: Optional[dict]) -> str:
+    """Server-sent events encoding of an event; a comment line for a heartbeat"""
+    if event is None:
+        return ": ping\n\n"
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+def docker_event(message: dict) -> Optional[tuple]:
+    """(user_id, event) for a Docker container event about a workspace, else None"""
+    status = DOCKER_ACTIONS.get(message.get("Action") or message.get("status"))
+    attributes = (message.get("Actor") or {}).get("Attributes") or {}
+    user_id = attributes.get("claudeosaar.user_id")
+    workspace_id = attributes.get(WORKSPACE_LABEL)
+    if status is None or not user_id or not workspace_id:
+        return None
+    return user_id, {"type": "status", "workspace_id": workspace_id, "status": status,
+                     "action": message.get("Action"), "time": message.get("time") or time.time()}
+
+class Subscription:
+    """One client's queue of events"""
+
+    def __init__(self, user_id: str, size: int):
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=size)
+
+    def deliver(self, event: dict):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Replace the backlog with one marker; the client refetches state
+            events_dropped_total.inc(self.queue.qsize())
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(event if event["type"] == "shutdown" else {"type": "resync"})
+
+    async def next(self, timeout: Optional[float] = None) -> Optional[dict]:
+        """The next event, or None after `timeout` seconds without one"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+class WorkspaceEvents:
+    """Push workspace status and resource events to each user's clients
+
+    Docker container events are the source of truth for status changes;
+    resource figures come from the hibernation sweep's samples. With Redis,
+    a single elected replica watches the daemons and publishes to a pub/sub
+    channel that every replica fans out to its own clients, so the Docker
+    load does not grow with replicas or clients. Without Redis each process
+    watches and delivers locally.
+    """
+
+    def __init__(self, scheduler, get_redis: Optional[Callable] = None, channel: str = EVENTS_CHANNEL,
+                 queue_size: int = EVENT_QUEUE_SIZE, leader_ttl: float = EVENTS_LEADER_TTL):
+        self.scheduler = scheduler
+        self.get_redis = get_redis
+        self.channel = channel
+        self.queue_size = queue_size
+        self.leader_ttl = leader_ttl
+        self.instance = uuid.uuid4().hex
+        self.is_leader = False
+        self._subscribers: Dict[str, set] = {}
+        self._outbox: Optional[asyncio.Queue] = None
+        self._streams: List = []
+        self._generation = 0
+        self._closing = False
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def _leader_key(self) -> str:
+        return self.channel + ":leader"
+
+    # Subscribers
+
+    @asynccontextmanager
+    async def subscribe(self, user_id: str):
+        subscription = Subscription(user_id, self.queue_size)
+        self._subscribers.setdefault(user_id, set()).add(subscription)
+        event_subscribers.inc()
+        try:
+            yield subscription
+        finally:
+            subscribers = self._subscribers.get(user_id)
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[user_id]
+            event_subscribers.dec()
+
+    def _deliver(self, user_id: str, event: dict):
+        for subscription in self._subscribers.get(user_id, ()):
+            subscription.deliver(event)
+
+    def _resync_all(self):
+        for subscriptions in self._subscribers.values():
+            for subscription in subscriptions:
+                subscription.deliver({"type": "resync"})
+
+    async def snapshot(self, user_id: str) -> dict:
+        """Current status of the user's workspaces, sent when a client connects"""
+        try:
+            containers = await asyncio.to_thread(
+                self.scheduler.containers.list, all=True, filters={"label": f"claudeosaar.user_id={user_id}"}
+            )
+        except NodesUnavailable as e:
+            # Workspaces on reachable nodes; the rest show up once their events arrive
+            containers = e.containers
+        return {"type": "snapshot", "workspaces": [
+            {"workspace_id": c.labels.get(WORKSPACE_LABEL), "status": c.status} for c in containers
+        ]}
+
+    async def stream(self, user_id: str, heartbeat: float = EVENTS_HEARTBEAT):
+        """A snapshot, then live events for one client; None after each quiet `heartbeat`
+
+        Ends after a "shutdown" event, sent when this replica drains.
+        """
+        # Subscribed before the snapshot is read, so no change falls between them
+        async with self.subscribe(user_id) as subscription:
+            yield await self.snapshot(user_id)
+            if self._closing:
+                yield {"type": "shutdown"}
+                return
+            while True:
+                event = await subscription.next(heartbeat)
+                yield event
+                if event is not None and event["type"] == "shutdown":
+                    return
+
+    # Publishing
+
+    async def publish(self, user_id: str, event: dict):
+        """Send an event to the user's clients on every replica"""
+        events_published_total.labels(type=event["type"]).inc()
+        redis = self.get_redis() if self.get_redis else None
+        if redis is None:
+            self._deliver(user_id, event)
+            return
+        await redis.publish(self.channel, json.dumps({"user_id": user_id, "event": event}))
+
+    async def _publish_resync(self):
+        """Tell every client on every replica to refetch, after events may have been missed"""
+        redis = self.get_redis() if self.get_redis else None
+        if redis is None:
+            self._resync_all()
+        else:
+            await redis.publish(self.channel, json.dumps({"user_id": None, "event": {"type": "resync"}}))
+
+    def resource_sample(self, container, workspace_id: str, cpu_percent: float, network_rate: float):
+        """Hook for the hibernation sweep: publish a container's latest resource use"""
+        user_id = container.labels.get("claudeosaar.user_id")
+        if not self.is_leader or not user_id or self._outbox is None:
+            return
+        self._outbox.put_nowait((user_id, {
+            "type": "resources", "workspace_id": workspace_id, "cpu_percent": round(cpu_percent, 1),
+            "network_bytes_per_second": round(network_rate), "time": time.time()
+        }))
+
+    async def _drain_outbox(self):
+        # One consumer keeps events in the order the daemons reported them
+        while True:
+            user_id, event = await self._outbox.get()
+            try:
+                if user_id is None:
+                    await self._publish_resync()
+                else:
+                    await self.publish(user_id, event)
+            except Exception as e:
+                logger.warning({"message": "Failed to publish workspace event", "error": str(e)})
+
+    # Docker watchers
+
+    def _watch(self, node, loop: asyncio.AbstractEventLoop, generation: int):
+        # Runs until leadership is lost or handed over to a newer set of watchers
+        while self._generation == generation:
+            try:
+                stream = node.client.events(decode=True, filters={"type": "container", "label": WORKSPACE_LABEL})
+                self._streams.append(stream)
+                try:
+                    if self._generation != generation:
+                        stream.close()
+                    for message in stream:
+                        parsed = docker_event(message)
+                        if parsed is not None:
+                            loop.call_soon_threadsafe(self._outbox.put_nowait, parsed)
+                finally:
+                    try:
+                        self._streams.remove(stream)
+                    except ValueError:
+                        # Already closed and cleared by _stop_watching
+                        pass
+            except Exception as e:
+                if self._generation == generation:
+                    logger.warning({"message": "Docker event stream failed", "node": node.name,
+                                    "error": str(e)})
+            if self._generation == generation:
+                # Events during the gap are lost; clients refetch
+                loop.call_soon_threadsafe(self._outbox.put_nowait, (None, {"type": "resync"}))
+                time.sleep(1)
+
+    def _start_watching(self):
+        loop = asyncio.get_running_loop()
+        self.is_leader = True
+        self._generation += 1
+        for node in self.scheduler.nodes.values():
+            threading.Thread(target=self._watch, args=(node, loop, self._generation), daemon=True,
+                             name=f"docker-events-{node.name}").start()
+
+    def _stop_watching(self):
+        self.is_leader = False
+        self._generation += 1
+        for stream in list(self._streams):
+            try:
+                stream.close()
+            except Exception:
+                pass
+        self._streams.clear()
+
+    # Redis
+
+    async def _elect(self):
+        """Hold the leader key while alive; watch Docker only while holding it"""
+        redis = self.get_redis()
+        while True:
+            try:
+                px = int(self.leader_ttl * 1000)
+                if self.is_leader:
+                    # Renew only our own claim, checked and extended in one step
+                    held = bool(await redis.eval(_RENEW, 1, self._leader_key, self.instance, px))
+                else:
+                    held = await redis.set(self._leader_key, self.instance, nx=True, px=px)
+            except Exception as e:
+                logger.warning({"message": "Workspace events leader election failed", "error": str(e)})
+                held = False
+            if held and not self.is_leader:
+                logger.info({"message": "Watching Docker events for all replicas"})
+                self._start_watching()
+            elif not held and self.is_leader:
+                self._stop_watching()
+            await asyncio.sleep(self.leader_ttl / 3)
+
+    async def _listen(self):
+        """Fan events from the pub/sub channel out to local clients, resubscribing on errors"""
+        redis = self.get_redis()
+        while True:
+            pubsub = redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.channel)
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    payload = json.loads(message["data"])
+                    if payload["user_id"] is None:
+                        self._resync_all()
+                    else:
+                        self._deliver(payload["user_id"], payload["event"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning({"message": "Workspace event subscription failed", "error": str(e)})
+            finally:
+                close = getattr(pubsub, "aclose", None) or pubsub.close
+                try:
+                    await close()
+                except Exception:
+                    pass
+            self._resync_all()
+            await asyncio.sleep(1)
+
+    # Lifecycle
+
+    def start(self):
+        if self._tasks:
+            return
+        self._outbox = asyncio.Queue()
+        self._closing = False
+        self._tasks.append(asyncio.create_task(self._drain_outbox()))
+        if self.get_redis is not None and self.get_redis() is not None:
+            self._tasks.append(asyncio.create_task(self._listen()))
+            self._tasks.append(asyncio.create_task(self._elect()))
+        else:
+            self._start_watching()
+
+    async def stop(self):
+        was_leader = self.is_leader
+        self._stop_watching()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        if was_leader and self.get_redis is not None and self.get_redis() is not None:
+            try:
+                redis = self.get_redis()
+                if await redis.get(self._leader_key) in (self.instance, self.instance.encode()):
+                    await redis.delete(self._leader_key)
+            except Exception:
+                pass
+        self.close_streams()
+
+    def close_streams(self):
+        """End every open stream; clients reconnect, to another replica when draining"""
+        self._closing = True
+        for subscriptions in self._subscribers.values():
+            for subscription in subscriptions:
+                subscription.deliver({"type": "shutdown"})
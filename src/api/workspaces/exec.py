@@ -0,0 +1,275 @@
+import asyncio
+import codecs
+import json
+import os
+import shlex
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing, asynccontextmanager
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+from prometheus_client import Gauge, Histogram
+
+from ..logging import logger
+
+# Per-tier limits for commands run inside workspace containers
+TIER_EXEC_LIMITS = {
+    "free": {"concurrency": 2, "timeout": 60},
+    "pro": {"concurrency": 8, "timeout": 600},
+    "enterprise": {"concurrency": 32, "timeout": 3600},
+}
+
+# Chunks buffered between the Docker reader thread and the client. When the
+# client reads slowly the reader blocks, which stops reading from the Docker
+# socket and in turn pauses the process once its pipe fills up.
+EXEC_QUEUE_CHUNKS = int(os.getenv("EXEC_QUEUE_CHUNKS", "32"))
+# Upper bound on output kept for non-streaming requests
+EXEC_MAX_BUFFERED_BYTES = int(os.getenv("EXEC_MAX_BUFFERED_BYTES", str(1024 * 1024)))
+# Streams are long-lived and blocking, so they get their own threads rather
+# than tying up the default executor used for Docker and DB calls
+EXEC_MAX_STREAMS = int(os.getenv("EXEC_MAX_STREAMS", "256"))
+# Seconds to keep killing a command whose client went away before giving up
+# on it; its slot stays taken until then
+EXEC_KILL_TIMEOUT = float(os.getenv("EXEC_KILL_TIMEOUT", "30"))
+
+# Runs the command under coreutils timeout, which leads its own process
+# group; the shell records that group ($PPID) so the command and everything
+# it started can be killed when the client goes away
+_LAUNCH = 'echo $PPID > "$1"; sh -c "$2"; code=$?; rm -f "$1"; exit $code'
+_KILL = 'if [ -s "$1" ]; then kill -KILL -"$(cat "$1")"; rm -f "$1"; fi'
+
+exec_active = Gauge(
+    'claudeosaar_exec_active',
+    'Commands currently running in workspaces',
+    ['tier'],
+    multiprocess_mode='livesum'
+)
+exec_duration = Histogram(
+    'claudeosaar_exec_duration_seconds',
+    'Duration of workspace command executions',
+    ['tier', 'outcome']
+)
+
+_DONE = object()
+
+class ExecManager:
+    """Run commands in workspace containers and stream their output"""
+
+    def __init__(self, limits: Optional[Dict[str, dict]] = None,
+                 queue_chunks: int = EXEC_QUEUE_CHUNKS, max_streams: int = EXEC_MAX_STREAMS,
+                 kill_timeout: float = EXEC_KILL_TIMEOUT):
+        self.limits = limits or TIER_EXEC_LIMITS
+        self.queue_chunks = queue_chunks
+        self.kill_timeout = kill_timeout
+        self._active: Dict[str, int] = defaultdict(int)
+        self._executor = ThreadPoolExecutor(max_workers=max_streams, thread_name_prefix="exec")
+
+    def limits_for(self, tier: str) -> dict:
+        return self.limits.get(tier, self.limits["free"])
+
+    def check_capacity(self, user_id: str, tier: str):
+        """Raise 429 if the user already runs the tier's maximum of commands"""
+        concurrency = self.limits_for(tier)["concurrency"]
+        if self._active.get(user_id, 0) >= concurrency:
+            raise HTTPException(
+                status_code=429,
+                detail=f"Too many running commands. Maximum {concurrency} for the {tier} tier."
+            )
+
+    @asynccontextmanager
+    async def slot(self, user_id: str, tier: str):
+        """Reserve one of the user's concurrent exec slots or reject with 429"""
+        self.check_capacity(user_id, tier)
+        self._active[user_id] += 1
+        exec_active.labels(tier=tier).inc()
+        try:
+            yield
+        finally:
+            self._active[user_id] -= 1
+            if not self._active[user_id]:
+                del self._active[user_id]
+            exec_active.labels(tier=tier).dec()
+
+    async def stream(self, container, command: str, tier: str,
+                     workdir: str = "/workspace") -> AsyncIterator[Tuple[str, object]]:
+        """Yield ("stdout" | "stderr", text) chunks, then ("exit", code)
+
+        A command exceeding the tier timeout is killed inside the container by
+        coreutils `timeout`; the API stops relaying at the same deadline and
+        yields ("timeout", seconds) instead of an exit code. If the stream is
+        closed before the command exits, the command is killed, and closing
+        returns once it is gone, so a slot held around the stream covers the
+        whole life of the process.
+        """
+        timeout = self.limits_for(tier)["timeout"]
+        api = container.client.api
+        pidfile = f"/tmp/.claudeosaar-exec-{uuid.uuid4().hex}"
+        exec_id = await asyncio.to_thread(
+            api.exec_create,
+            container.id,
+            ["timeout", "--signal=KILL", str(timeout), "sh", "-c", _LAUNCH, "sh", pidfile, command],
+            stdout=True,
+            stderr=True,
+            workdir=workdir,
+        )
+        exec_id = exec_id["Id"] if isinstance(exec_id, dict) else exec_id
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_chunks)
+        cancelled = threading.Event()
+        pump = loop.run_in_executor(self._executor, self._pump, api, exec_id, loop, queue, cancelled)
+
+        decoders = {
+            "stdout": codecs.getincrementaldecoder("utf-8")(errors="replace"),
+            "stderr": codecs.getincrementaldecoder("utf-8")(errors="replace"),
+        }
+        start = time.monotonic()
+        deadline = start + timeout
+        outcome = "error"
+        exited = False
+
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout=max(remaining, 0))
+                except asyncio.TimeoutError:
+                    outcome = "timeout"
+                    yield "timeout", timeout
+                    return
+                if item is _DONE:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                name, data = item
+                text = decoders[name].decode(data)
+                if text:
+                    yield name, text
+
+            for name, decoder in decoders.items():
+                tail = decoder.decode(b"", final=True)
+                if tail:
+                    yield name, tail
+
+            inspect = await asyncio.to_thread(api.exec_inspect, exec_id)
+            exited = not inspect.get("Running")
+            exit_code = inspect.get("ExitCode")
+            # coreutils timeout reports a KILL as 128 + 9
+            outcome = "timeout" if exit_code == 137 and time.monotonic() >= deadline - 1 else "completed"
+            yield "exit", exit_code
+        finally:
+            cancelled.set()
+            # Unblock a reader waiting on a full queue so its thread can exit
+            while not queue.empty():
+                queue.get_nowait()
+            if not exited:
+                await self._kill(api, container.id, exec_id, pidfile, pump)
+            exec_duration.labels(tier=tier, outcome=outcome).observe(time.monotonic() - start)
+
+    async def _kill(self, api, container_id, exec_id, pidfile, pump):
+        """Kill an abandoned command's process group and wait until it has exited
+
+        The reader's stream ends when the process does. Kills are repeated
+        until then, which also catches a command that had not yet recorded
+        its process group at the first attempt.
+        """
+        deadline = time.monotonic() + self.kill_timeout
+        while not pump.done():
+            try:
+                killer = await asyncio.to_thread(api.exec_create, container_id, ["sh", "-c", _KILL, "sh", pidfile])
+                await asyncio.to_thread(api.exec_start, killer["Id"] if isinstance(killer, dict) else killer)
+            except Exception as e:
+                logger.warning({"message": "Failed to kill abandoned command", "exec_id": exec_id, "error": str(e)})
+            await asyncio.wait([pump], timeout=0.5)
+            if time.monotonic() >= deadline and not pump.done():
+                logger.warning({"message": "Abandoned command still running", "exec_id": exec_id})
+                return
+
+    @staticmethod
+    def _pump(api, exec_id, loop, queue, cancelled):
+        """Blocking reader: copy demultiplexed Docker frames onto the queue"""
+        def put(item):
+            future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+            while not cancelled.is_set():
+                try:
+                    return future.result(timeout=1)
+                except TimeoutError:
+                    continue
+            future.cancel()
+
+        if cancelled.is_set():
+            return
+        try:
+            for stdout, stderr in api.exec_start(exec_id, stream=True, demux=True):
+                if cancelled.is_set():
+                    return
+                if stdout:
+                    put(("stdout", stdout))
+                if stderr:
+                    put(("stderr", stderr))
+            put(_DONE)
+        except Exception as e:
+            if not cancelled.is_set():
+                put(e)
+
+    async def run(self, container, command: str, tier: str, workdir: str = "/workspace",
+                  max_bytes: int = EXEC_MAX_BUFFERED_BYTES) -> dict:
+        """Run a command and return its (size-capped) combined output"""
+        parts = []
+        size = 0
+        truncated = False
+        result = {"exit_code": None, "timed_out": False}
+
+        async with aclosing(self.stream(container, command, tier, workdir)) as chunks:
+            async for kind, value in chunks:
+                if kind == "exit":
+                    result["exit_code"] = value
+                elif kind == "timeout":
+                    result["timed_out"] = True
+                elif not truncated:
+                    if size + len(value) > max_bytes:
+                        value = value[:max_bytes - size]
+                        truncated = True
+                    parts.append(value)
+                    size += len(value)
+
+        result["output"] = "".join(parts)
+        result["truncated"] = truncated
+        return result
+
+    async def ndjson(self, container, command: str, tier: str,
+                     workdir: str = "/workspace") -> AsyncIterator[bytes]:
+        """Stream output as newline-delimited JSON for chunked HTTP responses"""
+        async with aclosing(self.stream(container, command, tier, workdir)) as chunks:
+            async for kind, value in chunks:
+                yield (json.dumps(exec_event(kind, value)) + "\n").encode()
+
+def exec_event(kind: str, value) -> dict:
+    """JSON-ready form of a chunk yielded by ExecManager.stream"""
+    if kind == "exit":
+        return {"type": "exit", "exit_code": value}
+    if kind == "timeout":
+        return {"type": "timeout", "seconds": value}
+    return {"type": kind, "data": value}
+
+def workspace_owner(container) -> Optional[str]:
+    """User id a workspace container was created for"""
+    labels = container.labels or {}
+    if "claudeosaar.user_id" in labels:
+        return labels["claudeosaar.user_id"]
+    # Containers created before labels were added only carry the env var
+    for entry in container.attrs.get("Config", {}).get("Env") or []:
+        if entry.startswith("USER_ID="):
+            return entry.split("=", 1)[1]
+    return None
+
+def describe(command: str) -> str:
+    """Short, log-safe form of a command"""
+    try:
+        return shlex.split(command)[0][:64] if command.strip() else ""
+    except ValueError:
+        return command.split(" ", 1)[0][:64]
@@ -0,0 +1,438 @@
+import asyncio
+import os
+import posixpath
+import re
+import tarfile
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Iterable, Iterator, Optional, Tuple
+
+from fastapi import HTTPException
+
+# Host directory holding the workspace bind mounts, when this process can
+# see it. Transfers then read the files directly instead of asking the
+# Docker daemon to build an archive.
+USER_MOUNTS_ROOT = os.getenv("USER_MOUNTS_ROOT", "/user_mounts")
+WORKSPACE_DIR = "/workspace"
+# Size of the chunks handed to the client or the daemon; smaller writes,
+# like tar's 512-byte headers, are collected up to this size first
+TRANSFER_CHUNK = int(os.getenv("TRANSFER_CHUNK_BYTES", str(256 * 1024)))
+# Chunks buffered between a transfer thread and the event loop; a slow
+# client stops the thread instead of growing memory
+TRANSFER_QUEUE_CHUNKS = int(os.getenv("TRANSFER_QUEUE_CHUNKS", "8"))
+TRANSFER_MAX_THREADS = int(os.getenv("TRANSFER_MAX_THREADS", "32"))
+
+COMPRESSIONS = ("gzip", "zstd")
+MEDIA_TYPES = {None: "application/x-tar", "gzip": "application/gzip", "zstd": "application/zstd"}
+EXTENSIONS = {None: ".tar", "gzip": ".tar.gz", "zstd": ".tar.zst"}
+
+_DONE = object()
+
+class _Cancelled(Exception):
+    pass
+
+class _TooLarge(Exception):
+    pass
+
+# Output is inflated this much at a time when measuring gzip uploads
+_INFLATE_CHUNK = 1024 * 1024
+
+def _inflated_size(decompressor, data: bytes) -> int:
+    size = 0
+    while data:
+        size += len(decompressor.decompress(data, _INFLATE_CHUNK))
+        data = decompressor.unconsumed_tail
+    return size
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise HTTPException(status_code=400, detail="zstd compression is not available on this server")
+    return zstandard
+
+class _Identity:
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b""
+
+def compressor(compression: Optional[str]):
+    """Object with compress(data) and flush() for a streaming response"""
+    if compression is None:
+        return _Identity()
+    if compression == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    if compression == "zstd":
+        return _zstd().ZstdCompressor(level=3).compressobj()
+    raise HTTPException(status_code=400, detail=f"Unsupported compression: {compression}")
+
+def check_compression(compression: Optional[str]) -> Optional[str]:
+    if compression in (None, "", "identity", "none"):
+        return None
+    if compression not in COMPRESSIONS:
+        raise HTTPException(status_code=400, detail=f"Unsupported compression: {compression}")
+    if compression == "zstd":
+        _zstd()
+    return compression
+
+def workspace_relpath(path: str) -> str:
+    """Normalize a path given relative to, or inside, /workspace; rejects escapes"""
+    path = path or "."
+    if path == WORKSPACE_DIR or path.startswith(WORKSPACE_DIR + "/"):
+        path = path[len(WORKSPACE_DIR):]
+    relative = posixpath.normpath(path.lstrip("/") or ".")
+    if relative == ".." or relative.startswith("../"):
+        raise HTTPException(status_code=400, detail="Path must stay inside /workspace")
+    return relative
+
+def archive_filename(path: str, compression: Optional[str]) -> str:
+    relative = workspace_relpath(path)
+    name = "workspace" if relative == "." else posixpath.basename(relative)
+    return name + EXTENSIONS[compression]
+
+class _ChunkWriter:
+    """File-like sink that compresses, batches and hands chunks to `emit`"""
+
+    def __init__(self, emit: Callable[[bytes], None], compression: Optional[str], chunk: int):
+        self.emit = emit
+        self.compressor = compressor(compression)
+        self.chunk = chunk
+        self.buffer = bytearray()
+
+    def write(self, data) -> int:
+        self.buffer += self.compressor.compress(bytes(data))
+        if len(self.buffer) >= self.chunk:
+            self.emit(bytes(self.buffer))
+            self.buffer.clear()
+        return len(data)
+
+    def close(self):
+        self.buffer += self.compressor.flush()
+        if self.buffer:
+            self.emit(bytes(self.buffer))
+            self.buffer.clear()
+
+class _IterReader:
+    """Readable file object over an iterator of byte chunks"""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self.chunks = iter(chunks)
+        self.pending = b""
+
+    def read(self, size: int = -1) -> bytes:
+        parts, wanted = [], size
+        while size < 0 or wanted > 0:
+            if not self.pending:
+                self.pending = next(self.chunks, b"")
+                if not self.pending:
+                    break
+            take = self.pending if size < 0 else self.pending[:wanted]
+            self.pending = self.pending[len(take):]
+            parts.append(take)
+            wanted -= len(take)
+        return b"".join(parts)
+
+class Range:
+    """A satisfiable single byte range of a file of `size` bytes"""
+
+    def __init__(self, start: int, end: int, size: int):
+        self.start = start
+        self.end = end
+        self.size = size
+
+    @property
+    def length(self) -> int:
+        return self.end - self.start + 1
+
+    @property
+    def content_range(self) -> str:
+        return f"bytes {self.start}-{self.end}/{self.size}"
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def parse_range(header: Optional[str], size: int) -> Optional[Range]:
+    """The range a Range header asks for; None to send the whole file
+
+    Multiple ranges are answered with the whole file, which RFC 9110
+    allows. An unsatisfiable range raises 416.
+    """
+    if not header:
+        return None
+    match = _RANGE.match(header.strip())
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return Range(start, end, size)
+
+class FileInfo:
+    def __init__(self, name: str, size: int, mtime: float):
+        self.name = name
+        self.size = size
+        self.mtime = mtime
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.size:x}-{int(self.mtime * 1000):x}"'
+
+class WorkspaceFiles:
+    """Stream files and directory trees in and out of workspaces
+
+    Downloads read the bind mount directly when it is visible to this
+    process and fall back to the Docker archive API otherwise. Uploads always
+    go through the daemon, so files get the ownership and paths the
+    container sees. Data moves in bounded chunks: neither direction holds a
+    whole archive in memory.
+    """
+
+    def __init__(self, mounts_root: str = USER_MOUNTS_ROOT, chunk: int = TRANSFER_CHUNK,
+                 queue_chunks: int = TRANSFER_QUEUE_CHUNKS, max_threads: int = TRANSFER_MAX_THREADS):
+        self.mounts_root = mounts_root
+        self.chunk = chunk
+        self.queue_chunks = queue_chunks
+        self._executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="transfer")
+
+    def local_root(self, user_id: str, workspace_id: str) -> Optional[str]:
+        root = os.path.join(self.mounts_root, user_id, workspace_id)
+        return os.path.realpath(root) if self.mounts_root and os.path.isdir(root) else None
+
+    @staticmethod
+    def local_path(root: str, relative: str) -> str:
+        """Host path for `relative`, refusing symlinks that lead out of the workspace"""
+        path = os.path.realpath(os.path.join(root, relative))
+        if path != root and not path.startswith(root + os.sep):
+            raise HTTPException(status_code=400, detail="Path must stay inside /workspace")
+        if not os.path.exists(path):
+            raise HTTPException(status_code=404, detail="File not found")
+        return path
+
+    async def _relay(self, produce: Callable[[Callable[[bytes], None]], None]) -> AsyncIterator[bytes]:
+        """Run blocking `produce(emit)` in a thread and yield the chunks it emits"""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_chunks)
+        cancelled = threading.Event()
+
+        def put(item):
+            future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+            while not cancelled.is_set():
+                try:
+                    return future.result(timeout=1)
+                except TimeoutError:
+                    continue
+            future.cancel()
+            raise _Cancelled()
+
+        def run():
+            try:
+                produce(put)
+                put(_DONE)
+            except _Cancelled:
+                pass
+            except BaseException as e:
+                if not cancelled.is_set():
+                    put(e)
+
+        loop.run_in_executor(self._executor, run)
+        try:
+            while True:
+                item = await queue.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            cancelled.set()
+            while not queue.empty():
+                queue.get_nowait()
+
+    async def archive(self, container, user_id: str, workspace_id: str, path: str,
+                      compression: Optional[str] = None) -> AsyncIterator[bytes]:
+        """Tar stream of a file or directory under /workspace"""
+        relative = workspace_relpath(path)
+        root = self.local_root(user_id, workspace_id)
+        if root is not None:
+            source = self.local_path(root, relative)
+
+            def produce(emit):
+                sink = _ChunkWriter(emit, compression, self.chunk)
+                with tarfile.open(fileobj=sink, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+                    tar.add(source, arcname=posixpath.basename(relative) if relative != "." else ".")
+                sink.close()
+        else:
+            chunks, _ = await self._get_archive(container, relative)
+
+            def produce(emit):
+                sink = _ChunkWriter(emit, compression, self.chunk)
+                for data in chunks:
+                    sink.write(data)
+                sink.close()
+
+        return self._relay(produce)
+
+    async def _get_archive(self, container, relative: str):
+        from .scheduler import NotFound
+
+        try:
+            return await asyncio.to_thread(container.get_archive, posixpath.join(WORKSPACE_DIR, relative),
+                                           chunk_size=self.chunk)
+        except NotFound:
+            raise HTTPException(status_code=404, detail="File not found")
+
+    async def extract(self, container, path: str, chunks: AsyncIterator[bytes],
+                      compression: Optional[str] = None, limit: Optional[int] = None):
+        """Unpack a tar stream into the directory `path` under /workspace
+
+        gzip passes through: the daemon decompresses it itself. zstd is
+        decompressed here on the fly. With `limit`, the upload is aborted
+        with 507 once the uncompressed tar exceeds that many bytes.
+        """
+        target = posixpath.join(WORKSPACE_DIR, workspace_relpath(path))
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_chunks)
+
+        async def feed():
+            try:
+                async for data in chunks:
+                    if data:
+                        await queue.put(data)
+                item = _DONE
+            except Exception as e:
+                # e.g. the client went away; fail the upload rather than
+                # letting the daemon extract a truncated archive
+                item = e
+            await queue.put(item)
+
+        cancelled = threading.Event()
+
+        def get():
+            future = asyncio.run_coroutine_threadsafe(queue.get(), loop)
+            while not cancelled.is_set():
+                try:
+                    return future.result(timeout=1)
+                except TimeoutError:
+                    continue
+            future.cancel()
+            raise _Cancelled()
+
+        too_large = threading.Event()
+
+        def body() -> Iterator[bytes]:
+            decompressor = _zstd().ZstdDecompressor().decompressobj() if compression == "zstd" else None
+            # Only measured: the daemon inflates gzip itself
+            measure_gzip = compression == "gzip" and limit is not None
+            inflater = zlib.decompressobj(zlib.MAX_WBITS | 16) if measure_gzip else None
+            written = 0
+            while True:
+                data = get()
+                if data is _DONE:
+                    return
+                if isinstance(data, BaseException):
+                    raise data
+                if decompressor:
+                    data = decompressor.decompress(data)
+                if limit is not None:
+                    written += _inflated_size(inflater, data) if inflater else len(data)
+                    if written > limit:
+                        # Fails the upload, so the daemon discards the archive
+                        too_large.set()
+                        raise _TooLarge()
+                yield data
+
+        feeder = asyncio.create_task(feed())
+        try:
+            ok = await loop.run_in_executor(self._executor, container.put_archive, target, body())
+        except Exception:
+            # The HTTP client may wrap the error raised in body()
+            if too_large.is_set():
+                raise HTTPException(status_code=507, detail="Storage quota exceeded by the upload")
+            raise
+        finally:
+            # If the request was cancelled the thread is still waiting for
+            # chunks: fail the upload there so the daemon discards it, and
+            # free the thread
+            cancelled.set()
+            feeder.cancel()
+            await asyncio.gather(feeder, return_exceptions=True)
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(_Cancelled())
+        if ok is False:
+            raise HTTPException(status_code=404, detail="Target directory not found")
+
+    async def stat(self, container, user_id: str, workspace_id: str, path: str) -> Tuple[FileInfo, object]:
+        """Size and mtime of a regular file, plus a handle for `read_range`"""
+        relative = workspace_relpath(path)
+        root = self.local_root(user_id, workspace_id)
+        if root is not None:
+            source = self.local_path(root, relative)
+            st = await asyncio.to_thread(os.stat, source)
+            if not os.path.isfile(source):
+                raise HTTPException(status_code=400, detail="Not a regular file")
+            return FileInfo(posixpath.basename(relative), st.st_size, st.st_mtime), source
+
+        chunks, stat = await self._get_archive(container, relative)
+        if stat.get("mode", 0) & 0o20000000000:  # os.ModeDir in Go's FileMode
+            chunks.close()
+            raise HTTPException(status_code=400, detail="Not a regular file")
+        return FileInfo(stat["name"], stat["size"], _parse_docker_time(stat.get("mtime"))), chunks
+
+    def read_range(self, handle, start: int, length: int) -> AsyncIterator[bytes]:
+        """Stream `length` bytes from `start` of a file opened by `stat`"""
+        if isinstance(handle, str):
+            def produce(emit):
+                with open(handle, "rb") as f:
+                    f.seek(start)
+                    remaining = length
+                    while remaining > 0:
+                        data = f.read(min(self.chunk, remaining))
+                        if not data:
+                            return
+                        remaining -= len(data)
+                        emit(data)
+        else:
+            # The daemon only returns whole files, wrapped in a tar stream;
+            # skip to the offset without sending what came before it
+            def produce(emit):
+                with tarfile.open(fileobj=_IterReader(handle), mode="r|") as tar:
+                    member = tar.next()
+                    f = tar.extractfile(member)
+                    skip = start
+                    while skip > 0:
+                        skipped = len(f.read(min(self.chunk, skip)))
+                        if not skipped:
+                            return
+                        skip -= skipped
+                    remaining = length
+                    while remaining > 0:
+                        data = f.read(min(self.chunk, remaining))
+                        if not data:
+                            return
+                        remaining -= len(data)
+                        emit(data)
+
+        return self._relay(produce)
+
+def _parse_docker_time(value: Optional[str]) -> float:
+    """Seconds since the epoch from the RFC 3339 mtime in X-Docker-Container-Path-Stat"""
+    if not value:
+        return 0.0
+    from datetime import datetime
+
+    # Go prints nanoseconds; datetime takes at most microseconds
+    value = re.sub(r"(\.\d{6})\d+", r"\1", value).replace("Z", "+00:00")
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return 0.0
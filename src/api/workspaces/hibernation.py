@@ -0,0 +1,257 @@
+import asyncio
+import os
+import time
+from collections import defaultdict
+from typing import Callable, Dict, Optional, Tuple
+
+from prometheus_client import Counter, Histogram
+
+from ..db import Database
+from ..logging import logger
+from .scheduler import WorkspaceScheduler
+
+def _minutes(name: str, default: Optional[int]) -> Optional[float]:
+    value = os.getenv(name)
+    if value is None:
+        return default * 60 if default is not None else None
+    return float(value) * 60 if value.strip() not in ("", "0", "off") else None
+
+# Seconds without activity before a workspace is hibernated; None disables it.
+# "stop" frees the container's memory; "pause" only freezes its processes
+# but resumes in milliseconds.
+TIER_IDLE_POLICY = {
+    "free": {"idle_after": _minutes("HIBERNATE_IDLE_MINUTES_FREE", 15), "action": "stop"},
+    "pro": {"idle_after": _minutes("HIBERNATE_IDLE_MINUTES_PRO", 60), "action": "stop"},
+    "enterprise": {"idle_after": _minutes("HIBERNATE_IDLE_MINUTES_ENTERPRISE", None), "action": "pause"},
+}
+
+HIBERNATE_SWEEP_INTERVAL = float(os.getenv("HIBERNATE_SWEEP_INTERVAL", "60"))
+# A workspace using more than this share of one CPU, or moving more than this
+# many bytes over the network between sweeps, counts as active
+IDLE_CPU_PERCENT = float(os.getenv("HIBERNATE_IDLE_CPU_PERCENT", "2"))
+IDLE_NETWORK_BYTES = int(os.getenv("HIBERNATE_IDLE_NETWORK_BYTES", str(64 * 1024)))
+# API accesses are recorded in memory and written to last_active_at at most this often
+TOUCH_WRITE_INTERVAL = 60
+STATS_CONCURRENCY = 8
+
+workspaces_hibernated_total = Counter(
+    'claudeosaar_workspaces_hibernated_total',
+    'Workspaces hibernated after being idle',
+    ['tier', 'action']
+)
+workspace_resume_duration = Histogram(
+    'claudeosaar_workspace_resume_seconds',
+    'Time to resume a hibernated workspace on access'
+)
+
+class HibernationManager:
+    """Hibernate idle workspace containers and wake them on access
+
+    A workspace is active if the API touched it, if workspace_usage_stats
+    says so, or if its CPU or network counters moved noticeably since the
+    previous sweep. Counters are compared between sweeps using one-shot stats,
+    so a sweep costs one cheap stats call per running container.
+    """
+
+    def __init__(self, docker_client, db: Optional[Database] = None,
+                 policy: Optional[Dict[str, dict]] = None, interval: float = HIBERNATE_SWEEP_INTERVAL,
+                 on_sample: Optional[Callable] = None):
+        self.docker = docker_client
+        self.db = db
+        self.policy = policy or TIER_IDLE_POLICY
+        self.interval = interval
+        # Called with (container, workspace_id, cpu_percent, network bytes/s) for each sample
+        self.on_sample = on_sample
+        self._last_activity: Dict[str, float] = {}
+        self._last_written: Dict[str, float] = {}
+        self._samples: Dict[str, Tuple[int, int, float]] = {}
+        self._resume_locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._task: Optional[asyncio.Task] = None
+
+    async def touch(self, workspace_id: str):
+        """Record API or terminal activity for a workspace"""
+        now = time.time()
+        self._last_activity[workspace_id] = now
+        if self.db is None or now - self._last_written.get(workspace_id, 0) < TOUCH_WRITE_INTERVAL:
+            return
+        self._last_written[workspace_id] = now
+        try:
+            await self.db.execute(
+                """
+                INSERT INTO workspace_usage_stats (workspace_id, last_active_at)
+                SELECT id, CURRENT_TIMESTAMP FROM workspaces WHERE id = %s
+                ON CONFLICT (workspace_id) DO UPDATE SET last_active_at = EXCLUDED.last_active_at
+                """,
+                (workspace_id,)
+            )
+        except Exception as e:
+            logger.warning({"message": "Failed to record workspace activity",
+                            "workspace_id": workspace_id, "error": str(e)})
+
+    async def ensure_running(self, container, workspace_id: str):
+        """Resume a hibernated container before it is used"""
+        await self.touch(workspace_id)
+        if container.status == "running":
+            return container
+
+        async with self._resume_locks[workspace_id]:
+            await asyncio.to_thread(container.reload)
+            if container.status == "running":
+                return container
+
+            if container.status == "paused":
+                resume = container.unpause
+            elif container.status in ("exited", "created"):
+                resume = container.start
+            else:
+                return container
+
+            start = time.monotonic()
+            # Hibernated workspaces gave up their share of the node; take it
+            # back first (503 if it has since filled up)
+            scheduler = self.docker if isinstance(self.docker, WorkspaceScheduler) else None
+            if scheduler is not None:
+                await asyncio.to_thread(scheduler.reclaim, container)
+            try:
+                await asyncio.to_thread(resume)
+            except BaseException:
+                if scheduler is not None:
+                    scheduler.release(container.name)
+                raise
+            if scheduler is not None:
+                scheduler.confirm(container.name)
+            await asyncio.to_thread(container.reload)
+            workspace_resume_duration.observe(time.monotonic() - start)
+
+        await self._set_status(workspace_id, "running")
+        logger.info({"message": "Workspace resumed", "workspace_id": workspace_id})
+        return container
+
+    def start(self):
+        """Start the periodic idle sweep"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error({"message": "Hibernation sweep failed", "error": str(e)})
+
+    async def sweep(self) -> int:
+        """Hibernate every running workspace idle past its tier threshold"""
+        containers = await asyncio.to_thread(
+            self.docker.containers.list,
+            filters={"label": "claudeosaar.workspace_id", "status": "running"}
+        )
+        if not containers:
+            return 0
+
+        now = time.time()
+        workspace_ids = [c.labels["claudeosaar.workspace_id"] for c in containers]
+        db_activity = await self._db_activity(workspace_ids)
+
+        semaphore = asyncio.Semaphore(STATS_CONCURRENCY)
+
+        async def check(container, workspace_id):
+            async with semaphore:
+                if await self._counters_moved(container, workspace_id):
+                    self._last_activity[workspace_id] = now
+
+        # Containers first seen by this process get a full grace period
+        for workspace_id in workspace_ids:
+            self._last_activity.setdefault(workspace_id, now)
+        await asyncio.gather(*(check(c, w) for c, w in zip(containers, workspace_ids)))
+
+        # Forget workspaces that are no longer running
+        running = set(workspace_ids)
+        for state in (self._last_activity, self._samples, self._last_written):
+            for workspace_id in [w for w in state if w not in running]:
+                del state[workspace_id]
+
+        hibernated = 0
+        for container, workspace_id in zip(containers, workspace_ids):
+            tier = container.labels.get("claudeosaar.tier", "free")
+            policy = self.policy.get(tier, self.policy["free"])
+            if policy["idle_after"] is None:
+                continue
+            last_active = max(self._last_activity[workspace_id], db_activity.get(workspace_id, 0))
+            if now - last_active >= policy["idle_after"]:
+                await self.hibernate(container, workspace_id, tier, policy["action"])
+                hibernated += 1
+        return hibernated
+
+    async def hibernate(self, container, workspace_id: str, tier: str, action: str):
+        if action == "pause":
+            await asyncio.to_thread(container.pause)
+        else:
+            await asyncio.to_thread(container.stop)
+        self._samples.pop(workspace_id, None)
+        self._last_activity.pop(workspace_id, None)
+        workspaces_hibernated_total.labels(tier=tier, action=action).inc()
+        await self._set_status(workspace_id, "hibernated")
+        logger.info({"message": "Workspace hibernated", "workspace_id": workspace_id,
+                     "tier": tier, "action": action})
+
+    async def _counters_moved(self, container, workspace_id: str) -> bool:
+        """Compare CPU and network counters with the previous sweep"""
+        try:
+            stats = await asyncio.to_thread(container.stats, stream=False, one_shot=True)
+        except Exception:
+            return False
+        cpu = stats.get("cpu_stats", {}).get("cpu_usage", {}).get("total_usage", 0)
+        network = sum(
+            iface.get("rx_bytes", 0) + iface.get("tx_bytes", 0)
+            for iface in (stats.get("networks") or {}).values()
+        )
+        previous = self._samples.get(workspace_id)
+        self._samples[workspace_id] = (cpu, network, time.time())
+        if previous is None:
+            return False
+        prev_cpu, prev_network, prev_time = previous
+        elapsed_ns = max(time.time() - prev_time, 1e-3) * 1e9
+        cpu_percent = (cpu - prev_cpu) / elapsed_ns * 100
+        if self.on_sample is not None:
+            self.on_sample(container, workspace_id, cpu_percent, (network - prev_network) * 1e9 / elapsed_ns)
+        return cpu_percent > IDLE_CPU_PERCENT or network - prev_network > IDLE_NETWORK_BYTES
+
+    async def _db_activity(self, workspace_ids) -> Dict[str, float]:
+        if self.db is None:
+            return {}
+        try:
+            rows = await self.db.fetchall(
+                """
+                SELECT workspace_id::text AS workspace_id, EXTRACT(EPOCH FROM last_active_at) AS last_active
+                FROM workspace_usage_stats
+                WHERE workspace_id = ANY(%s::uuid[]) AND last_active_at IS NOT NULL
+                """,
+                (list(workspace_ids),)
+            )
+        except Exception as e:
+            logger.warning({"message": "Failed to read workspace activity", "error": str(e)})
+            return {}
+        return {row["workspace_id"]: float(row["last_active"]) for row in rows}
+
+    async def _set_status(self, workspace_id: str, status: str):
+        if self.db is None:
+            return
+        try:
+            await self.db.execute(
+                """
+                UPDATE workspaces SET status = %s,
+                    hibernated_at = CASE WHEN %s = 'hibernated' THEN CURRENT_TIMESTAMP END
+                WHERE id = %s
+                """,
+                (status, status, workspace_id)
+            )
+        except Exception as e:
+            logger.warning({"message": "Failed to update workspace status",
+                            "workspace_id": workspace_id, "error": str(e)})
@@ -0,0 +1,176 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from ..logging import logger
+
+WORKSPACE_IMAGE = os.getenv("WORKSPACE_IMAGE", "claudeosaar/workspace:latest")
+# Images kept warm on every node; the workspace image is always included
+WORKSPACE_IMAGES = [WORKSPACE_IMAGE] + [
+    ref.strip() for ref in os.getenv("WORKSPACE_IMAGES", "").split(",")
+    if ref.strip() and ref.strip() != WORKSPACE_IMAGE
+]
+# Seconds between checks of the registry for a moved tag
+IMAGE_CHECK_INTERVAL = float(os.getenv("IMAGE_CHECK_INTERVAL", "300"))
+IMAGE_PULL_CONCURRENCY = int(os.getenv("IMAGE_PULL_CONCURRENCY", "4"))
+
+image_pull_duration = Histogram(
+    'claudeosaar_image_pull_seconds',
+    'Time to pull a workspace image onto a node',
+    ['image', 'reason'],
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, float("inf"))
+)
+image_pulls_total = Counter(
+    'claudeosaar_image_pulls_total',
+    'Workspace image pulls by why they ran and how they ended',
+    ['reason', 'result']
+)
+image_warm = Gauge(
+    'claudeosaar_image_warm',
+    'Whether an image is present on a node',
+    ['image', 'node'],
+    multiprocess_mode='livemax'
+)
+
+def split_ref(ref: str) -> Tuple[str, str]:
+    """("repo", "tag") of an image reference; the tag defaults to latest"""
+    repository, _, tag = ref.rpartition(":")
+    if not repository or "/" in tag:
+        return ref, "latest"
+    return repository, tag
+
+class ImageManager:
+    """Keep workspace images present on every node before requests need them
+
+    Images are pulled at startup and again when the registry's digest for
+    the tag changes; until the new image lands, workspaces keep starting
+    from the old one. Concurrent requests for the same image on the same
+    node share one pull. The scheduler prefers nodes where the image is
+    already warm, so a workspace only waits on a pull when no node has it.
+    """
+
+    def __init__(self, scheduler, images: Optional[List[str]] = None,
+                 interval: float = IMAGE_CHECK_INTERVAL, concurrency: int = IMAGE_PULL_CONCURRENCY):
+        self.scheduler = scheduler
+        self.images = images or WORKSPACE_IMAGES
+        self.interval = interval
+        # (node name, image ref) -> local image id
+        self.digests: Dict[Tuple[str, str], str] = {}
+        self._inflight: Dict[Tuple[str, str], Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="image-pull")
+        self._task: Optional[asyncio.Task] = None
+
+    def is_warm(self, node_name: str, ref: str) -> bool:
+        return (node_name, ref) in self.digests
+
+    def ensure(self, node, ref: str) -> str:
+        """Local image id of `ref` on `node`, pulling it first if it is missing"""
+        digest = self.digests.get((node.name, ref))
+        if digest is not None:
+            return digest
+        return self._single_flight(node, ref, "demand", self._resolve)
+
+    def _single_flight(self, node, ref: str, reason: str, work) -> str:
+        key = (node.name, ref)
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            digest = work(node, ref, reason)
+            future.set_result(digest)
+            return digest
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def _record(self, node, ref: str, image) -> str:
+        self.digests[(node.name, ref)] = image.id
+        image_warm.labels(image=ref, node=node.name).set(1)
+        return image.id
+
+    def _resolve(self, node, ref: str, reason: str) -> str:
+        from docker.errors import ImageNotFound
+
+        try:
+            return self._record(node, ref, node.client.images.get(ref))
+        except ImageNotFound:
+            return self._pull(node, ref, reason)
+
+    def _pull(self, node, ref: str, reason: str) -> str:
+        repository, tag = split_ref(ref)
+        start = time.perf_counter()
+        try:
+            image = node.client.images.pull(repository, tag=tag)
+        except Exception:
+            image_pulls_total.labels(reason=reason, result="error").inc()
+            raise
+        elapsed = time.perf_counter() - start
+        image_pull_duration.labels(image=ref, reason=reason).observe(elapsed)
+        image_pulls_total.labels(reason=reason, result="ok").inc()
+        logger.info({"message": "Pulled workspace image", "image": ref, "node": node.name,
+                     "reason": reason, "id": image.id, "duration": round(elapsed, 2)})
+        return self._record(node, ref, image)
+
+    def _update(self, node, ref: str, reason: str) -> str:
+        """Pull `ref` if the registry's digest for it is not the one on the node"""
+        image = node.client.images.get(ref)
+        remote = node.client.images.get_registry_data(ref).id
+        if any(digest.endswith("@" + remote) for digest in image.attrs.get("RepoDigests") or []):
+            return self._record(node, ref, image)
+        return self._pull(node, ref, reason)
+
+    def check(self, node, ref: str) -> Optional[str]:
+        """Warm `ref` on `node` or bring it up to date with its tag; None on failure"""
+        if self.is_warm(node.name, ref):
+            work, reason = self._update, "refresh"
+        else:
+            work, reason = self._resolve, "prepull"
+        try:
+            return self._single_flight(node, ref, reason, work)
+        except Exception as e:
+            logger.warning({"message": "Failed to prepare workspace image", "image": ref,
+                            "node": node.name, "error": str(e)})
+            return None
+
+    def check_all(self):
+        """Warm or refresh every configured image on every node, a few pulls at a time"""
+        jobs = [self._executor.submit(self.check, node, ref)
+                for node in self.scheduler.nodes.values() for ref in self.images]
+        for job in jobs:
+            job.result()
+
+    async def probe(self):
+        """Health check: every configured image is warm on at least one node"""
+        cold = [ref for ref in self.images
+                if not any(self.is_warm(node, ref) for node in self.scheduler.nodes)]
+        if cold:
+            raise RuntimeError(f"Not pulled yet: {', '.join(cold)}")
+
+    def start(self):
+        """Pre-pull now, then follow tag changes"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.to_thread(self.check_all)
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,215 @@
+import argparse
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from prometheus_client import Counter, Gauge
+
+from ..db import Database
+from ..logging import logger
+
+RECONCILE_INTERVAL = float(os.getenv("RECONCILE_INTERVAL", "300"))
+# Containers and rows younger than this may belong to a create in progress
+RECONCILE_GRACE_SECONDS = float(os.getenv("RECONCILE_GRACE_SECONDS", "600"))
+# Orphan removals per pass, and the pause between them
+RECONCILE_MAX_REMOVALS = int(os.getenv("RECONCILE_MAX_REMOVALS", "10"))
+RECONCILE_REMOVAL_DELAY = float(os.getenv("RECONCILE_REMOVAL_DELAY", "1"))
+RECONCILE_DRY_RUN = os.getenv("RECONCILE_DRY_RUN", "false").lower() == "true"
+
+reconcile_actions_total = Counter(
+    'claudeosaar_reconcile_actions_total',
+    'Corrections made by the workspace reconciler',
+    ['action']
+)
+reconcile_last_success = Gauge(
+    'claudeosaar_reconcile_last_success_timestamp',
+    'Unix time of the last completed reconcile pass',
+    multiprocess_mode='max'
+)
+
+def expected_status(container_status: str, row_status: str) -> str:
+    """Workspace status implied by the state of its container"""
+    if container_status == "running":
+        return "running"
+    if container_status == "paused":
+        return "hibernated"
+    if container_status in ("exited", "created"):
+        # Stopped by the idle detector or by the user
+        return row_status if row_status in ("hibernated", "stopped") else "stopped"
+    if container_status == "dead":
+        return "error"
+    # restarting / removing are transient
+    return row_status
+
+def container_age(container, now: float) -> float:
+    created = container.attrs.get("Created")
+    if not created:
+        return float("inf")
+    created_at = datetime.strptime(created[:19], "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc)
+    return now - created_at.timestamp()
+
+class ReconcilePlan:
+    """Differences found between Docker and the workspaces table"""
+
+    def __init__(self):
+        # Containers whose workspace row does not exist
+        self.orphans: List = []
+        # workspace id -> (current status, corrected status)
+        self.status_fixes: Dict[str, tuple] = {}
+
+    def summary(self) -> dict:
+        return {
+            "orphans": [container.name for container in self.orphans],
+            "status_fixes": {
+                workspace_id: f"{current} -> {status}"
+                for workspace_id, (current, status) in self.status_fixes.items()
+            },
+        }
+
+class Reconciler:
+    """Converge workspace containers and workspace rows
+
+    Each pass lists all workspace containers by label and loads the matching
+    rows in one query, then removes containers that have no row and corrects
+    row statuses in one bulk UPDATE. Rows whose container is gone are marked
+    'error'. Young containers and rows are left alone so a create in flight
+    is never mistaken for an orphan, and removals are capped and paced per
+    pass so a bad diff cannot wipe a node at once.
+    """
+
+    def __init__(self, docker_client, db: Database, released: Optional[Callable[[str], None]] = None,
+                 interval: float = RECONCILE_INTERVAL, grace: float = RECONCILE_GRACE_SECONDS,
+                 max_removals: int = RECONCILE_MAX_REMOVALS, removal_delay: float = RECONCILE_REMOVAL_DELAY,
+                 dry_run: bool = RECONCILE_DRY_RUN):
+        self.docker = docker_client
+        self.db = db
+        self.released = released
+        self.interval = interval
+        self.grace = grace
+        self.max_removals = max_removals
+        self.removal_delay = removal_delay
+        self.dry_run = dry_run
+        self._task: Optional[asyncio.Task] = None
+
+    async def plan(self) -> ReconcilePlan:
+        """Diff Docker state against the workspaces table"""
+        containers = await asyncio.to_thread(
+            self.docker.containers.list, all=True, filters={"label": "claudeosaar.workspace_id"}
+        )
+        by_workspace = {c.labels["claudeosaar.workspace_id"]: c for c in containers}
+        rows = await self.db.fetchall(
+            """
+            SELECT id::text AS id, status,
+                EXTRACT(EPOCH FROM LOCALTIMESTAMP - created_at) AS age
+            FROM workspaces
+            WHERE status <> 'error' OR id = ANY(%s::uuid[])
+            """,
+            (list(by_workspace),)
+        )
+        rows = {row["id"]: row for row in rows}
+
+        now = time.time()
+        plan = ReconcilePlan()
+        for workspace_id, container in by_workspace.items():
+            row = rows.get(workspace_id)
+            if row is None:
+                if container_age(container, now) >= self.grace:
+                    plan.orphans.append(container)
+                continue
+            status = expected_status(container.status, row["status"])
+            if status != row["status"]:
+                plan.status_fixes[workspace_id] = (row["status"], status)
+
+        for workspace_id, row in rows.items():
+            if workspace_id in by_workspace or row["status"] == "error":
+                continue
+            if float(row["age"] or 0) >= self.grace:
+                plan.status_fixes[workspace_id] = (row["status"], "error")
+        return plan
+
+    async def reconcile(self) -> ReconcilePlan:
+        """Run one pass; in dry-run mode only log what would change"""
+        plan = await self.plan()
+        if plan.orphans or plan.status_fixes:
+            logger.info({"message": "Workspace drift detected", "dry_run": self.dry_run, **plan.summary()})
+        if self.dry_run:
+            return plan
+
+        await self._fix_statuses(plan.status_fixes)
+        for i, container in enumerate(plan.orphans[:self.max_removals]):
+            if i:
+                await asyncio.sleep(self.removal_delay)
+            await self._remove(container)
+        reconcile_last_success.set_to_current_time()
+        return plan
+
+    async def _fix_statuses(self, fixes: Dict[str, tuple]):
+        if not fixes:
+            return
+        ids = list(fixes)
+        # Only rows still in the status we saw are changed, so a concurrent
+        # hibernate or resume is not overwritten
+        updated = await self.db.execute(
+            """
+            UPDATE workspaces w SET status = v.status, updated_at = CURRENT_TIMESTAMP
+            FROM (
+                SELECT unnest(%s::uuid[]) AS id, unnest(%s::text[]) AS seen, unnest(%s::text[]) AS status
+            ) v
+            WHERE w.id = v.id AND w.status = v.seen
+            """,
+            (ids, [fixes[i][0] for i in ids], [fixes[i][1] for i in ids])
+        )
+        reconcile_actions_total.labels(action="status").inc(updated)
+
+    async def _remove(self, container):
+        try:
+            await asyncio.to_thread(container.remove, force=True)
+        except Exception as e:
+            logger.warning({"message": "Failed to remove orphaned container",
+                            "container": container.name, "error": str(e)})
+            return
+        if self.released is not None:
+            self.released(container.name)
+        reconcile_actions_total.labels(action="remove").inc()
+        logger.info({"message": "Removed orphaned workspace container", "container": container.name})
+
+    def start(self):
+        """Start the periodic reconcile loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.error({"message": "Workspace reconcile failed", "error": str(e)})
+
+def main():
+    """Run a single reconcile pass from the command line"""
+    import json
+
+    from ..db import get_database
+    from .scheduler import WorkspaceScheduler
+
+    parser = argparse.ArgumentParser(description="Reconcile workspace containers with the database")
+    parser.add_argument("--dry-run", action="store_true", help="Report drift without changing anything")
+    parser.add_argument("--max-removals", type=int, default=RECONCILE_MAX_REMOVALS)
+    args = parser.parse_args()
+
+    reconciler = Reconciler(WorkspaceScheduler.from_env(), get_database(),
+                            max_removals=args.max_removals, dry_run=args.dry_run)
+    plan = asyncio.run(reconciler.reconcile())
+    print(json.dumps(plan.summary(), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+from typing import Tuple
+
+# Container resource limits by subscription tier
+TIER_RESOURCES = {
+    "free": {"mem_limit": "512m", "cpu_quota": 50000},
+    "pro": {"mem_limit": "2g", "cpu_quota": 200000},
+    "enterprise": {"mem_limit": "8g", "cpu_quota": 400000}
+}
+
+# Docker's default CFS period; cpu_quota / period = number of CPUs
+CPU_PERIOD = 100000
+
+_UNITS = {"b": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+
+def parse_memory(value) -> int:
+    """Convert a Docker memory limit such as "512m" or 2147483648 to bytes"""
+    if isinstance(value, int):
+        return value
+    value = str(value).strip().lower()
+    if value and value[-1] in _UNITS:
+        return int(float(value[:-1]) * _UNITS[value[-1]])
+    return int(value)
+
+def tier_resources(tier: str) -> dict:
+    return TIER_RESOURCES.get(tier, TIER_RESOURCES["free"])
+
+def reservation(mem_limit, cpu_quota) -> Tuple[int, float]:
+    """(memory bytes, CPUs) a container with these limits may consume"""
+    return parse_memory(mem_limit) if mem_limit else 0, (cpu_quota or 0) / CPU_PERIOD
@@ -0,0 +1,368 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from prometheus_client import Gauge
+
+from ..profiling import span
+from .resources import CPU_PERIOD, reservation
+
+WORKSPACE_LABEL = "claudeosaar.workspace_id"
+
+# "binpack" fills the fullest node that still fits, keeping whole nodes free
+# for large workspaces and scale-down; "spread" picks the least loaded node.
+SCHEDULER_POLICY = os.getenv("SCHEDULER_POLICY", "binpack")
+# Share of each node's memory and CPUs kept back for the daemon and the OS
+NODE_HEADROOM = float(os.getenv("SCHEDULER_NODE_HEADROOM", "0.1"))
+SCHEDULER_REFRESH_INTERVAL = float(os.getenv("SCHEDULER_REFRESH_INTERVAL", "30"))
+
+node_free_memory = Gauge(
+    'claudeosaar_node_free_memory_bytes',
+    'Memory on a Docker node not reserved by workspaces',
+    ['node'],
+    multiprocess_mode='livemostrecent'
+)
+node_free_cpus = Gauge(
+    'claudeosaar_node_free_cpus',
+    'CPUs on a Docker node not reserved by workspaces',
+    ['node'],
+    multiprocess_mode='livemostrecent'
+)
+
+def container_limits(container) -> Tuple[int, float]:
+    """(memory bytes, cpus) reserved by a container's limits"""
+    host_config = container.attrs.get("HostConfig", {})
+    return (
+        host_config.get("Memory") or 0,
+        (host_config.get("CpuQuota") or 0) / (host_config.get("CpuPeriod") or CPU_PERIOD),
+    )
+
+class NoCapacityError(HTTPException):
+    def __init__(self, memory: int, cpus: float):
+        super().__init__(
+            status_code=503,
+            detail=f"No node has capacity for {memory // 1024 ** 2} MiB / {cpus:g} CPUs",
+            headers={"Retry-After": "30"}
+        )
+
+class NodesUnavailable(HTTPException):
+    """Some nodes could not be listed; `containers` holds what the others returned
+
+    A partial listing must not be read as "these are all the containers":
+    callers that count or reconcile should skip the pass or refuse instead.
+    """
+
+    def __init__(self, failed: Dict[str, Exception], containers: List):
+        super().__init__(
+            status_code=503,
+            detail=f"Docker nodes unavailable: {', '.join(sorted(failed))}",
+            headers={"Retry-After": "5"}
+        )
+        self.failed = failed
+        self.containers = containers
+
+class DockerNode:
+    """One Docker daemon and the workspace resources reserved on it"""
+
+    def __init__(self, name: str, client=None, headroom: float = NODE_HEADROOM,
+                 base_url: Optional[str] = None):
+        self.name = name
+        self.base_url = base_url
+        self.headroom = headroom
+        self._client = client
+        self._client_lock = threading.Lock()
+        self.capacity_memory = 0
+        self.capacity_cpus = 0.0
+        # workspace container name -> (memory bytes, CPUs)
+        self.reservations: Dict[str, Tuple[int, float]] = {}
+        # Names reserved here whose containers may not be listed yet
+        self.pending: set = set()
+
+    @property
+    def client(self):
+        """Docker client, connected on first use"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import docker
+
+                    self._client = (docker.DockerClient(base_url=self.base_url)
+                                    if self.base_url else docker.from_env())
+        return self._client
+
+    @property
+    def reserved_memory(self) -> int:
+        return sum(memory for memory, _ in self.reservations.values())
+
+    @property
+    def reserved_cpus(self) -> float:
+        return sum(cpus for _, cpus in self.reservations.values())
+
+    @property
+    def free_memory(self) -> int:
+        return self.capacity_memory - self.reserved_memory
+
+    @property
+    def free_cpus(self) -> float:
+        return self.capacity_cpus - self.reserved_cpus
+
+    def fits(self, memory: int, cpus: float) -> bool:
+        return memory <= self.free_memory and cpus <= self.free_cpus + 1e-9
+
+    def fetch(self):
+        """Read capacity and the reservations of running workspaces from the daemon"""
+        info = self.client.info()
+        reservations = {}
+        for container in self.client.containers.list(filters={"label": WORKSPACE_LABEL}):
+            reservations[container.name] = container_limits(container)
+        return info["MemTotal"], info["NCPU"], reservations
+
+    def apply(self, memory_total: int, cpus_total: int, reservations: Dict[str, Tuple[int, float]]):
+        self.capacity_memory = int(memory_total * (1 - self.headroom))
+        self.capacity_cpus = cpus_total * (1 - self.headroom)
+        # Keep reservations for containers still being created
+        for name in self.pending:
+            if name in self.reservations:
+                reservations.setdefault(name, self.reservations[name])
+        self.reservations = reservations
+        self.report()
+
+    def report(self):
+        node_free_memory.labels(node=self.name).set(self.free_memory)
+        node_free_cpus.labels(node=self.name).set(self.free_cpus)
+
+class WorkspaceScheduler:
+    """Place workspaces across Docker nodes and route later calls to them
+
+    `scheduler.containers` has the same `run`/`get`/`list` interface as
+    `DockerClient.containers`, so callers do not need to know which node a
+    workspace lives on. Reservations are tracked in memory from container
+    limits and rebuilt from the daemons by `refresh()`.
+    """
+
+    def __init__(self, nodes: List[DockerNode], policy: str = SCHEDULER_POLICY):
+        if not nodes:
+            raise ValueError("At least one Docker node is required")
+        if policy not in ("binpack", "spread"):
+            raise ValueError(f"Unknown scheduling policy: {policy}")
+        self.nodes = {node.name: node for node in nodes}
+        self.policy = policy
+        self.containers = ClusterContainers(self)
+        # ImageManager, when set: nodes with the image already pulled are preferred
+        self.images = None
+        # container name -> node name
+        self._locations: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max(len(nodes), 1), thread_name_prefix="scheduler")
+        self._refreshed = False
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls, spec: Optional[str] = None) -> "WorkspaceScheduler":
+        """Build from DOCKER_NODES="name=url,name=url"; defaults to the local daemon
+
+        Nothing connects until a node is first used.
+        """
+        spec = spec if spec is not None else os.getenv("DOCKER_NODES", "")
+        nodes = []
+        for entry in filter(None, (part.strip() for part in spec.split(","))):
+            name, _, url = entry.partition("=")
+            nodes.append(DockerNode(name, base_url=url))
+        if not nodes:
+            nodes.append(DockerNode("local"))
+        return cls(nodes)
+
+    def _map(self, fn, nodes=None):
+        """Run fn(node) on every node in parallel, returning (node, result or exception)"""
+        nodes = list(nodes or self.nodes.values())
+        futures = [(node, self._pool.submit(fn, node)) for node in nodes]
+        results = []
+        for node, future in futures:
+            try:
+                results.append((node, future.result()))
+            except Exception as e:
+                results.append((node, e))
+        return results
+
+    def refresh(self):
+        """Refresh every node; unreachable nodes keep their last known state"""
+        errors = {}
+        results = self._map(lambda node: node.fetch())
+        with self._lock:
+            for node, result in results:
+                if isinstance(result, Exception):
+                    errors[node.name] = result
+                    continue
+                node.apply(*result)
+                for name in node.reservations:
+                    self._locations[name] = node.name
+        self._refreshed = True
+        return errors
+
+    def start(self, interval: float = SCHEDULER_REFRESH_INTERVAL):
+        """Periodically re-sync reservations with the daemons"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self, interval: float):
+        while True:
+            await asyncio.to_thread(self.refresh)
+            await asyncio.sleep(interval)
+
+    def choose(self, memory: int, cpus: float, image: Optional[str] = None) -> DockerNode:
+        """Pick a node for a new workspace according to the policy"""
+        candidates = [node for node in self.nodes.values() if node.fits(memory, cpus)]
+        if not candidates:
+            raise NoCapacityError(memory, cpus)
+        if image is not None and self.images is not None:
+            # A node that would pull the image inline is the last resort
+            candidates = [node for node in candidates if self.images.is_warm(node.name, image)] or candidates
+        if self.policy == "binpack":
+            return min(candidates, key=lambda node: (node.free_memory, node.free_cpus))
+        return max(candidates, key=lambda node: (
+            node.free_memory / max(node.capacity_memory, 1), node.free_cpus
+        ))
+
+    def has_capacity(self, memory: int, cpus: float) -> bool:
+        """Whether some node fits a workspace of this size right now"""
+        if not self._refreshed:
+            # Unknown until the first refresh; reserve() will find out
+            return True
+        with self._lock:
+            return any(node.fits(memory, cpus) for node in self.nodes.values())
+
+    def reserve(self, name: str, memory: int, cpus: float, image: Optional[str] = None) -> DockerNode:
+        """Choose a node and reserve resources on it atomically"""
+        if not self._refreshed:
+            self.refresh()
+        with self._lock:
+            node = self.choose(memory, cpus, image)
+            node.reservations[name] = (memory, cpus)
+            node.pending.add(name)
+            self._locations[name] = node.name
+        node.report()
+        return node
+
+    def confirm(self, name: str):
+        """Mark a reserved container as created"""
+        with self._lock:
+            node = self.nodes.get(self._locations.get(name))
+            if node is not None:
+                node.pending.discard(name)
+
+    def reclaim(self, container) -> DockerNode:
+        """Reserve a stopped container's limits on its node before it is started again
+
+        Refreshes only count running containers, so a stopped one has given
+        up its share. Raises NoCapacityError if its node no longer has room;
+        `confirm` once it runs, `release` if starting fails.
+        """
+        from docker.errors import NotFound
+
+        if not self._refreshed:
+            self.refresh()
+        node = self.locate(container.name)
+        if node is None:
+            raise NotFound(f"No such container: {container.name}")
+        memory, cpus = container_limits(container)
+        with self._lock:
+            if container.name not in node.reservations:
+                if not node.fits(memory, cpus):
+                    raise NoCapacityError(memory, cpus)
+                node.reservations[container.name] = (memory, cpus)
+            node.pending.add(container.name)
+            self._locations[container.name] = node.name
+        node.report()
+        return node
+
+    def release(self, name: str):
+        """Forget a removed workspace container"""
+        with self._lock:
+            node_name = self._locations.pop(name, None)
+            node = self.nodes.get(node_name)
+            if node is not None:
+                node.reservations.pop(name, None)
+                node.pending.discard(name)
+        if node is not None:
+            node.report()
+
+    def locate(self, name: str) -> Optional[DockerNode]:
+        """Node hosting a container, asking all nodes on a cache miss"""
+        node_name = self._locations.get(name)
+        if node_name is not None:
+            return self.nodes[node_name]
+
+        for node, result in self._map(lambda node: node.client.containers.get(name)):
+            if not isinstance(result, Exception):
+                with self._lock:
+                    self._locations[name] = node.name
+                return node
+        return None
+
+class ClusterContainers:
+    """`DockerClient.containers` lookalike spanning all scheduler nodes"""
+
+    def __init__(self, scheduler: WorkspaceScheduler):
+        self.scheduler = scheduler
+
+    def run(self, image, name: str, mem_limit=None, cpu_quota=None, **kwargs):
+        memory, cpus = reservation(mem_limit, cpu_quota)
+        node = self.scheduler.reserve(name, memory, cpus, image)
+        try:
+            if self.scheduler.images is not None:
+                # Joins a pull already running for this node and image
+                self.scheduler.images.ensure(node, image)
+            with span("docker.run"):
+                container = node.client.containers.run(
+                    image, name=name, mem_limit=mem_limit, cpu_quota=cpu_quota, **kwargs
+                )
+        except Exception:
+            self.scheduler.release(name)
+            raise
+        self.scheduler.confirm(name)
+        return container
+
+    def get(self, name: str):
+        from docker.errors import NotFound
+
+        node = self.scheduler.locate(name)
+        if node is None:
+            raise NotFound(f"No such container: {name}")
+        try:
+            with span("docker.get"):
+                return node.client.containers.get(name)
+        except NotFound:
+            # Removed behind our back; drop the stale route
+            self.scheduler.release(name)
+            raise
+
+    def list(self, **kwargs):
+        """Containers on every node; raises NodesUnavailable if any node fails"""
+        containers = []
+        failed = {}
+        with span("docker.list"):
+            results = self.scheduler._map(lambda node: node.client.containers.list(**kwargs))
+        for node, result in results:
+            if isinstance(result, Exception):
+                failed[node.name] = result
+                continue
+            containers.extend(result)
+        if failed:
+            raise NodesUnavailable(failed, containers)
+        return containers
+
+def __getattr__(name):
+    # `scheduler.NotFound` is docker.errors.NotFound, imported only once needed
+    if name == "NotFound":
+        from docker.errors import NotFound
+        return NotFound
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,583 @@
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import posixpath
+import re
+import shutil
+import stat
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException
+from prometheus_client import Counter, Histogram
+
+from ..logging import logger
+from . import chunking
+from .files import USER_MOUNTS_ROOT
+
+# Snapshots kept per workspace; the oldest must be deleted to take another
+TIER_SNAPSHOT_LIMITS = {"free": 3, "pro": 20, "enterprise": 100}
+
+# Outside every workspace's bind mount, so containers cannot see the store
+SNAPSHOT_ROOT = os.getenv("SNAPSHOT_ROOT", os.path.join(USER_MOUNTS_ROOT, ".snapshots"))
+SNAPSHOT_THREADS = int(os.getenv("SNAPSHOT_THREADS", "8"))
+# Worker processes finding chunk boundaries, which is CPU-bound Python that
+# would hold the API process's GIL; 0 computes them in the calling thread
+SNAPSHOT_PROCESSES = int(os.getenv("SNAPSHOT_PROCESSES", "2"))
+# Chunks unreferenced for this long are deleted by the collector; younger
+# ones may belong to a snapshot whose manifest is not written yet
+SNAPSHOT_GC_GRACE = float(os.getenv("SNAPSHOT_GC_GRACE_SECONDS", "3600"))
+SNAPSHOT_GC_INTERVAL = float(os.getenv("SNAPSHOT_GC_INTERVAL_SECONDS", "21600"))
+
+# Content-defined chunk sizes. Boundaries depend on the bytes around them,
+# not on offsets, so an insertion only changes the chunks it touches.
+CHUNK_MIN = 128 * 1024
+CHUNK_AVG = 512 * 1024
+CHUNK_MAX = 2 * 1024 * 1024
+
+snapshot_bytes_total = Counter(
+    'claudeosaar_snapshot_bytes_total',
+    'Workspace bytes handled by snapshots, by what happened to them',
+    ['kind']
+)
+snapshot_duration = Histogram(
+    'claudeosaar_snapshot_seconds',
+    'Time to take, restore or garbage-collect snapshots',
+    ['operation']
+)
+
+_SNAPSHOT_ID = re.compile(r"^\d{13}-[0-9a-f]{8}$")
+
+class Chunker:
+    """FastCDC-style content-defined chunking with normalized chunk sizes
+
+    Bytes before `min_size` are not hashed, and a stricter mask is used
+    until `avg_size`, so chunk sizes cluster around the average. `split`
+    hands the hashing to a pool of `processes` workers, started on first
+    use; the calling thread waits without holding the GIL.
+    """
+
+    def __init__(self, min_size: int = CHUNK_MIN, avg_size: int = CHUNK_AVG, max_size: int = CHUNK_MAX,
+                 processes: int = SNAPSHOT_PROCESSES):
+        self.min_size = min_size
+        self.avg_size = avg_size
+        self.max_size = max_size
+        # The hash shifts right, so its low bits depend on the last 64
+        # bytes and its high bits only on the last few
+        bits = avg_size.bit_length() - 1
+        self.mask_small = (1 << (bits + 2)) - 1
+        self.mask_large = (1 << (bits - 2)) - 1
+        self.processes = processes
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+    def _args(self) -> tuple:
+        return self.min_size, self.avg_size, self.max_size, self.mask_small, self.mask_large
+
+    def cut(self, data: bytes) -> int:
+        """Length of the first chunk of `data`, computed in this thread"""
+        return chunking.cut(data, *self._args())
+
+    def _cut_in_pool(self, data: bytes) -> int:
+        if self.processes <= 0 or len(data) <= self.min_size:
+            return self.cut(data)
+        with self._pool_lock:
+            if self._pool is None:
+                # Not forked: the API process has threads that may hold locks
+                self._pool = ProcessPoolExecutor(max_workers=self.processes,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        return self._pool.submit(chunking.cut, data, *self._args()).result()
+
+    def split(self, f) -> Iterator[bytes]:
+        pending = b""
+        while True:
+            data = pending + f.read(self.max_size - len(pending))
+            if not data:
+                return
+            cut = self._cut_in_pool(data)
+            yield data[:cut]
+            pending = data[cut:]
+
+    def close(self):
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+class ChunkStore:
+    """Content-addressed, zlib-compressed chunks; a stored chunk is never rewritten"""
+
+    def __init__(self, root: str):
+        self.root = os.path.join(root, "chunks")
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, data: bytes) -> Tuple[str, int]:
+        """Store `data`; returns its digest and the bytes written, 0 if already stored"""
+        digest = hashlib.sha256(data).hexdigest()
+        if self.touch(digest):
+            return digest, 0
+        path = self.path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        compressed = zlib.compress(data, 1)
+        tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(compressed)
+        os.replace(tmp, path)
+        return digest, len(compressed)
+
+    def touch(self, digest: str) -> bool:
+        """Whether the chunk is stored, renewing its grace period against the collector"""
+        try:
+            os.utime(self.path(digest))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def get(self, digest: str) -> bytes:
+        with open(self.path(digest), "rb") as f:
+            return zlib.decompress(f.read())
+
+    def digests(self) -> Iterator[os.DirEntry]:
+        if not os.path.isdir(self.root):
+            return
+        for prefix in os.scandir(self.root):
+            if prefix.is_dir():
+                yield from os.scandir(prefix.path)
+
+# Workspace directories are bind-mounted into running containers, which can
+# swap any directory for a symlink at any time. Everything below is done
+# relative to directory descriptors opened without following symlinks, so
+# the host never resolves a path the container controls.
+_DIR_FLAGS = os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW | os.O_CLOEXEC
+
+def _split(relative: str) -> Tuple[str, str]:
+    parent, name = posixpath.split(relative)
+    if name in ("", ".", ".."):
+        raise ValueError(f"Snapshot entry outside the workspace: {relative}")
+    return parent, name
+
+def _open_dir(root_fd: int, relative: str) -> int:
+    """Descriptor of the directory `relative` under `root_fd`, one component at a time"""
+    fd = os.dup(root_fd)
+    try:
+        for part in relative.split("/") if relative else ():
+            if part in ("", ".", ".."):
+                raise ValueError(f"Snapshot entry outside the workspace: {relative}")
+            child = os.open(part, _DIR_FLAGS, dir_fd=fd)
+            os.close(fd)
+            fd = child
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+class _Parents:
+    """Descriptor of an entry's parent directory, reusing the last one opened"""
+
+    def __init__(self, root_fd: int):
+        self.root_fd = root_fd
+        self.path: Optional[str] = None
+        self.fd: Optional[int] = None
+
+    def open(self, relative: str) -> Tuple[int, str]:
+        parent, name = _split(relative)
+        if parent != self.path:
+            self.close()
+            self.fd = _open_dir(self.root_fd, parent)
+            self.path = parent
+        return self.fd, name
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+        self.path = self.fd = None
+
+def _walk(dir_fd: int, relative: str = "") -> Iterator[tuple]:
+    """(relative path, lstat, parent descriptor) of everything under `dir_fd`, parents before children
+
+    The parent descriptor is only valid until the next item is taken.
+    """
+    with os.scandir(dir_fd) as entries:
+        entries = sorted(entries, key=lambda e: e.name)
+    for entry in entries:
+        path = f"{relative}/{entry.name}" if relative else entry.name
+        try:
+            st = os.stat(entry.name, dir_fd=dir_fd, follow_symlinks=False)
+        except FileNotFoundError:
+            continue
+        yield path, st, dir_fd
+        if stat.S_ISDIR(st.st_mode):
+            try:
+                child = os.open(entry.name, _DIR_FLAGS, dir_fd=dir_fd)
+            except OSError:
+                # Removed, or replaced by something else, since it was listed
+                continue
+            try:
+                yield from _walk(child, path)
+            finally:
+                os.close(child)
+
+class SnapshotManager:
+    """Incremental, deduplicated snapshots of workspace directories
+
+    Files are split into content-defined chunks kept once in a shared store;
+    a snapshot is a manifest listing each file's chunks. Files whose size and
+    mtime match the previous snapshot reuse its chunk list without being
+    read, and restore skips files that already match, so both scale with
+    the changed bytes rather than the workspace size. Workspace files are
+    only ever reached through directory descriptors, never by path, so a
+    running container cannot redirect reads or writes out of its workspace.
+    """
+
+    def __init__(self, root: str = SNAPSHOT_ROOT, mounts_root: str = USER_MOUNTS_ROOT,
+                 limits: Optional[Dict[str, int]] = None, threads: int = SNAPSHOT_THREADS,
+                 gc_grace: float = SNAPSHOT_GC_GRACE, gc_interval: float = SNAPSHOT_GC_INTERVAL,
+                 chunker: Optional[Chunker] = None):
+        self.root = root
+        self.mounts_root = mounts_root
+        self.limits = limits or TIER_SNAPSHOT_LIMITS
+        self.gc_grace = gc_grace
+        self.gc_interval = gc_interval
+        self.threads = threads
+        self.chunker = chunker or Chunker()
+        self.store = ChunkStore(root)
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="snapshot")
+        self._busy: set = set()
+        self._gc_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def workspace_root(self, user_id: str, workspace_id: str) -> str:
+        root = os.path.join(self.mounts_root, user_id, workspace_id)
+        if not os.path.isdir(root):
+            raise HTTPException(status_code=404, detail="Workspace files not found on this host")
+        return root
+
+    def _manifest_dir(self, user_id: str, workspace_id: str) -> str:
+        return os.path.join(self.root, "manifests", user_id, workspace_id)
+
+    def _manifest_path(self, user_id: str, workspace_id: str, snapshot_id: str) -> str:
+        if not _SNAPSHOT_ID.match(snapshot_id):
+            raise HTTPException(status_code=404, detail="Snapshot not found")
+        return os.path.join(self._manifest_dir(user_id, workspace_id), f"{snapshot_id}.json")
+
+    def _load(self, path: str) -> dict:
+        with open(path) as f:
+            return json.load(f)
+
+    def _snapshot_ids(self, user_id: str, workspace_id: str) -> List[str]:
+        try:
+            names = os.listdir(self._manifest_dir(user_id, workspace_id))
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-5] for name in names if name.endswith(".json"))
+
+    async def _exclusive(self, workspace_id: str, work, *args):
+        """Run blocking `work` in the pool, one snapshot or restore per workspace at a time"""
+        if workspace_id in self._busy:
+            raise HTTPException(status_code=409, detail="A snapshot or restore is already running")
+        self._busy.add(workspace_id)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, work, *args)
+        finally:
+            self._busy.discard(workspace_id)
+
+    # Taking snapshots
+
+    async def create(self, user_id: str, workspace_id: str, tier: str, name: Optional[str] = None) -> dict:
+        """Snapshot the workspace directory; returns the snapshot's summary"""
+        root = self.workspace_root(user_id, workspace_id)
+        limit = self.limits.get(tier, self.limits["free"])
+        if len(self._snapshot_ids(user_id, workspace_id)) >= limit:
+            raise HTTPException(status_code=403,
+                                detail=f"Snapshot limit reached. Maximum {limit} for the {tier} tier.")
+        with snapshot_duration.labels(operation="create").time():
+            manifest = await self._exclusive(workspace_id, self._create, root, user_id, workspace_id, name)
+        logger.info({"message": "Workspace snapshot taken", "workspace_id": workspace_id,
+                     "snapshot_id": manifest["id"], "bytes": manifest["bytes"],
+                     "new_bytes": manifest["new_bytes"]})
+        return summary(manifest)
+
+    def _create(self, root: str, user_id: str, workspace_id: str, name: Optional[str]) -> dict:
+        ids = self._snapshot_ids(user_id, workspace_id)
+        previous = {}
+        if ids:
+            parent = self._load(self._manifest_path(user_id, workspace_id, ids[-1]))
+            previous = {entry["path"]: entry for entry in parent["entries"] if entry["type"] == "file"}
+
+        root_fd = os.open(root, _DIR_FLAGS)
+        try:
+            entries, changed = self._list(root_fd, previous)
+            written = sum(self._executor_map(self._store_file, root_fd, changed))
+        finally:
+            os.close(root_fd)
+        manifest = {
+            "id": f"{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:8]}",
+            "name": name,
+            "created_at": time.time(),
+            "parent": ids[-1] if ids else None,
+            "bytes": sum(entry.get("size", 0) for entry in entries),
+            "changed_bytes": sum(entry["size"] for entry in changed),
+            "new_bytes": written,
+            "entries": entries,
+        }
+        path = self._manifest_path(user_id, workspace_id, manifest["id"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+        return manifest
+
+    def _list(self, root_fd: int, previous: Dict[str, dict]) -> Tuple[List[dict], List[dict]]:
+        """Manifest entries for the workspace, and the files among them whose content must be read"""
+        entries, changed = [], []
+        for path, st, dir_fd in _walk(root_fd):
+            name = posixpath.basename(path)
+            if stat.S_ISDIR(st.st_mode):
+                entries.append({"path": path, "type": "dir", "mode": stat.S_IMODE(st.st_mode)})
+            elif stat.S_ISLNK(st.st_mode):
+                entries.append({"path": path, "type": "symlink", "target": os.readlink(name, dir_fd=dir_fd)})
+            elif stat.S_ISREG(st.st_mode):
+                entry = {"path": path, "type": "file", "mode": stat.S_IMODE(st.st_mode),
+                         "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+                old = previous.get(path)
+                if (old and old["size"] == st.st_size and old["mtime_ns"] == st.st_mtime_ns
+                        and all(self.store.touch(digest) for digest in old["chunks"])):
+                    entry["chunks"] = old["chunks"]
+                    snapshot_bytes_total.labels(kind="unchanged").inc(st.st_size)
+                else:
+                    changed.append(entry)
+                entries.append(entry)
+            # Sockets, FIFOs and devices are not workspace content
+        return entries, changed
+
+    def _executor_map(self, fn, root_fd: int, entries: list) -> List[int]:
+        # Called from a pool thread; fanning out to the same pool could
+        # deadlock once every worker waits, so use a pool of its own
+        if len(entries) <= 1:
+            return [fn(root_fd, entry) for entry in entries]
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            return list(pool.map(lambda entry: fn(root_fd, entry), entries))
+
+    def _store_file(self, root_fd: int, entry: dict) -> int:
+        chunks, size, written = [], 0, 0
+        parent, name = _split(entry["path"])
+        dir_fd = _open_dir(root_fd, parent)
+        try:
+            # O_NONBLOCK: a FIFO swapped in since the listing must not block the open
+            fd = os.open(name, os.O_RDONLY | os.O_NOFOLLOW | os.O_NONBLOCK | os.O_CLOEXEC, dir_fd=dir_fd)
+        finally:
+            os.close(dir_fd)
+        with os.fdopen(fd, "rb") as f:
+            if not stat.S_ISREG(os.fstat(fd).st_mode):
+                raise OSError(f"No longer a regular file: {entry['path']}")
+            for data in self.chunker.split(f):
+                digest, stored = self.store.put(data)
+                chunks.append(digest)
+                size += len(data)
+                written += stored
+        # What was read, should the file have changed since it was listed
+        entry["chunks"] = chunks
+        entry["size"] = size
+        snapshot_bytes_total.labels(kind="read").inc(entry["size"])
+        snapshot_bytes_total.labels(kind="stored").inc(written)
+        return written
+
+    # Restoring
+
+    async def restore(self, user_id: str, workspace_id: str, snapshot_id: str) -> dict:
+        """Make the workspace directory match the snapshot
+
+        Run it on a stopped or idle workspace: processes writing files
+        meanwhile may leave a mix of both states, though never outside the
+        workspace.
+        """
+        root = self.workspace_root(user_id, workspace_id)
+        manifest = self._read(user_id, workspace_id, snapshot_id)
+        with snapshot_duration.labels(operation="restore").time():
+            restored = await self._exclusive(workspace_id, self._restore, root, manifest)
+        logger.info({"message": "Workspace snapshot restored", "workspace_id": workspace_id,
+                     "snapshot_id": snapshot_id, "restored_bytes": restored})
+        return {**summary(manifest), "restored_bytes": restored}
+
+    def _restore(self, root: str, manifest: dict) -> int:
+        wanted = {entry["path"]: entry for entry in manifest["entries"]}
+        root_fd = os.open(root, _DIR_FLAGS)
+        parents = _Parents(root_fd)
+        try:
+            # Remove what the snapshot does not have, or has as another type
+            for path, st, dir_fd in _walk(root_fd):
+                entry = wanted.get(path)
+                if entry is None or entry["type"] != _kind(st.st_mode):
+                    _remove(dir_fd, posixpath.basename(path), st)
+
+            stale = []
+            for entry in manifest["entries"]:
+                dir_fd, name = parents.open(entry["path"])
+                if entry["type"] == "dir":
+                    try:
+                        os.mkdir(name, 0o700, dir_fd=dir_fd)
+                    except FileExistsError:
+                        pass
+                    fd = os.open(name, _DIR_FLAGS, dir_fd=dir_fd)
+                    try:
+                        os.fchmod(fd, entry["mode"])
+                    finally:
+                        os.close(fd)
+                elif entry["type"] == "symlink":
+                    try:
+                        if os.readlink(name, dir_fd=dir_fd) == entry["target"]:
+                            continue
+                        os.unlink(name, dir_fd=dir_fd)
+                    except FileNotFoundError:
+                        pass
+                    os.symlink(entry["target"], name, dir_fd=dir_fd)
+                else:
+                    try:
+                        st = os.stat(name, dir_fd=dir_fd, follow_symlinks=False)
+                        if (stat.S_ISREG(st.st_mode) and st.st_size == entry["size"]
+                                and st.st_mtime_ns == entry["mtime_ns"]):
+                            continue
+                    except FileNotFoundError:
+                        pass
+                    stale.append(entry)
+            restored = sum(self._executor_map(self._restore_file, root_fd, stale))
+        finally:
+            parents.close()
+            os.close(root_fd)
+        snapshot_bytes_total.labels(kind="restored").inc(restored)
+        return restored
+
+    def _restore_file(self, root_fd: int, entry: dict) -> int:
+        parent, name = _split(entry["path"])
+        dir_fd = _open_dir(root_fd, parent)
+        try:
+            tmp = f".{name}.restore"
+            try:
+                os.unlink(tmp, dir_fd=dir_fd)
+            except FileNotFoundError:
+                pass
+            # O_EXCL with O_NOFOLLOW: a fresh file, never something planted there
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW | os.O_CLOEXEC, 0o600,
+                         dir_fd=dir_fd)
+            with os.fdopen(fd, "wb") as f:
+                for digest in entry["chunks"]:
+                    f.write(self.store.get(digest))
+                f.flush()
+                os.fchmod(fd, entry["mode"])
+                os.utime(fd, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+            os.replace(tmp, name, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
+        finally:
+            os.close(dir_fd)
+        return entry["size"]
+
+    # Listing and deleting
+
+    def _read(self, user_id: str, workspace_id: str, snapshot_id: str) -> dict:
+        try:
+            return self._load(self._manifest_path(user_id, workspace_id, snapshot_id))
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Snapshot not found")
+
+    async def list(self, user_id: str, workspace_id: str) -> List[dict]:
+        def read_all():
+            return [summary(self._load(self._manifest_path(user_id, workspace_id, snapshot_id)))
+                    for snapshot_id in self._snapshot_ids(user_id, workspace_id)]
+        return await asyncio.to_thread(read_all)
+
+    async def delete(self, user_id: str, workspace_id: str, snapshot_id: str):
+        """Delete a manifest; its chunks go with the next garbage collection"""
+        path = self._manifest_path(user_id, workspace_id, snapshot_id)
+        if workspace_id in self._busy:
+            raise HTTPException(status_code=409, detail="A snapshot or restore is already running")
+        try:
+            await asyncio.to_thread(os.unlink, path)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Snapshot not found")
+
+    async def delete_all(self, user_id: str, workspace_id: str):
+        """Drop every snapshot of a deleted workspace"""
+        await asyncio.to_thread(shutil.rmtree, self._manifest_dir(user_id, workspace_id), True)
+
+    # Garbage collection
+
+    def collect_garbage(self) -> dict:
+        """Delete chunks no manifest references; returns counts"""
+        with self._gc_lock, snapshot_duration.labels(operation="gc").time():
+            referenced = set()
+            manifests = os.path.join(self.root, "manifests")
+            for directory, _, names in os.walk(manifests):
+                for name in names:
+                    if name.endswith(".json"):
+                        for entry in self._load(os.path.join(directory, name))["entries"]:
+                            referenced.update(entry.get("chunks", ()))
+            cutoff = time.time() - self.gc_grace
+            removed = freed = kept = 0
+            for entry in self.store.digests():
+                if entry.name in referenced:
+                    kept += 1
+                    continue
+                st = entry.stat()
+                if st.st_mtime > cutoff:
+                    kept += 1
+                    continue
+                try:
+                    os.unlink(entry.path)
+                except FileNotFoundError:
+                    continue
+                removed += 1
+                freed += st.st_size
+        if removed:
+            logger.info({"message": "Collected snapshot chunks", "removed": removed,
+                         "freed_bytes": freed, "kept": kept})
+        return {"removed": removed, "freed_bytes": freed, "kept": kept}
+
+    def start(self):
+        """Start periodic garbage collection"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await asyncio.to_thread(self.chunker.close)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.gc_interval)
+            try:
+                await asyncio.get_running_loop().run_in_executor(self._executor, self.collect_garbage)
+            except Exception as e:
+                logger.error({"message": "Snapshot garbage collection failed", "error": str(e)})
+
+def summary(manifest: dict) -> dict:
+    """A manifest without its entries, as returned by the API"""
+    return {key: value for key, value in manifest.items() if key != "entries"}
+
+def _kind(mode: int) -> Optional[str]:
+    if stat.S_ISDIR(mode):
+        return "dir"
+    if stat.S_ISLNK(mode):
+        return "symlink"
+    if stat.S_ISREG(mode):
+        return "file"
+    return None
+
+def _remove(dir_fd: int, name: str, st: os.stat_result):
+    """Delete `name` in `dir_fd`; rmtree with dir_fd never follows symlinks"""
+    try:
+        if stat.S_ISDIR(st.st_mode):
+            shutil.rmtree(name, dir_fd=dir_fd)
+        else:
+            os.unlink(name, dir_fd=dir_fd)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,251 @@
+import asyncio
+import json
+import os
+import socket
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Optional
+
+from fastapi import HTTPException
+from prometheus_client import Counter, Gauge
+
+from ..logging import logger
+
+# Concurrent interactive shells per user
+TIER_TERMINAL_LIMITS = {"free": 2, "pro": 8, "enterprise": 32}
+
+TERMINAL_SHELL = os.getenv("TERMINAL_SHELL", "if command -v bash >/dev/null; then exec bash -l; else exec sh -l; fi")
+# Largest frame sent to the client; a read returns whatever the container
+# wrote since the last one, so bursts of small writes leave as one frame
+TERMINAL_READ_CHUNK = int(os.getenv("TERMINAL_READ_CHUNK", str(64 * 1024)))
+# Output buffered per session before reading from the container pauses. A
+# process like `cat bigfile` then blocks on its TTY instead of filling API
+# memory while a slow client catches up.
+TERMINAL_BUFFER_BYTES = int(os.getenv("TERMINAL_BUFFER_BYTES", str(256 * 1024)))
+# Sessions over sockets asyncio cannot adopt each park a thread in recv() for
+# their whole life. They get their own pool, two threads per session so
+# input is never stuck behind a blocked read, instead of the default
+# executor used for Docker and DB calls; beyond this many they are refused.
+TERMINAL_MAX_BLOCKING = int(os.getenv("TERMINAL_MAX_BLOCKING", "128"))
+
+terminal_sessions = Gauge(
+    'claudeosaar_terminal_sessions',
+    'Open interactive terminal sessions',
+    ['tier'],
+    multiprocess_mode='livesum'
+)
+terminal_bytes_total = Counter(
+    'claudeosaar_terminal_bytes_total',
+    'Bytes relayed between terminal clients and workspace TTYs',
+    ['direction']
+)
+_output_bytes = terminal_bytes_total.labels(direction="output")
+_input_bytes = terminal_bytes_total.labels(direction="input")
+
+class _SocketStream:
+    """asyncio streams over the exec socket; the event loop does the I/O"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    async def read(self, n: int) -> bytes:
+        return await self.reader.read(n)
+
+    async def write(self, data: bytes):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    def close(self):
+        self.writer.close()
+
+class _BlockingStream:
+    """Fallback for sockets asyncio cannot adopt, such as TLS to a remote daemon"""
+
+    def __init__(self, sock, executor: ThreadPoolExecutor, on_close: Callable[[], None]):
+        self.sock = sock
+        self.executor = executor
+        self.on_close = on_close
+
+    async def read(self, n: int) -> bytes:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.sock.recv, n)
+
+    async def write(self, data: bytes):
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.sock.sendall, data)
+
+    def close(self):
+        try:
+            # Wakes the pool thread parked in recv(); close() alone may not
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        if self.on_close is not None:
+            self.on_close()
+            self.on_close = None
+
+class TerminalSession:
+    """A TTY exec in a workspace container and the socket attached to it"""
+
+    def __init__(self, api, exec_id: str, stream):
+        self.api = api
+        self.exec_id = exec_id
+        self.stream = stream
+
+    async def resize(self, cols: int, rows: int):
+        await asyncio.to_thread(self.api.exec_resize, self.exec_id, height=rows, width=cols)
+
+    async def exit_code(self) -> Optional[int]:
+        inspect = await asyncio.to_thread(self.api.exec_inspect, self.exec_id)
+        return inspect.get("ExitCode")
+
+    def close(self):
+        self.stream.close()
+
+class TerminalProxy:
+    """Relay WebSocket clients to interactive shells in workspace containers
+
+    Binary frames carry raw terminal bytes in both directions. Text frames
+    from the client are JSON control messages, `{"type": "resize", "cols",
+    "rows"}` or `{"type": "input", "data"}`; any other text is typed as is.
+    The server sends `{"type": "exit", "exit_code"}` when the shell ends.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, int]] = None, read_chunk: int = TERMINAL_READ_CHUNK,
+                 buffer_bytes: int = TERMINAL_BUFFER_BYTES, shell: str = TERMINAL_SHELL,
+                 max_blocking: int = TERMINAL_MAX_BLOCKING):
+        self.limits = limits or TIER_TERMINAL_LIMITS
+        self.read_chunk = read_chunk
+        self.buffer_bytes = buffer_bytes
+        self.shell = shell
+        self.max_blocking = max_blocking
+        self._active: Dict[str, int] = defaultdict(int)
+        self._sessions: set = set()
+        self._blocking = 0
+        self._executor = ThreadPoolExecutor(max_workers=2 * max_blocking, thread_name_prefix="terminal")
+
+    @asynccontextmanager
+    async def open(self, user_id: str, tier: str, container, cols: int = 80, rows: int = 24,
+                   workdir: str = "/workspace"):
+        """Start a shell in `container`, or reject with 429 past the tier's session limit"""
+        limit = self.limits.get(tier, self.limits["free"])
+        if self._active[user_id] >= limit:
+            raise HTTPException(status_code=429,
+                                detail=f"Too many open terminals. Maximum {limit} for the {tier} tier.")
+        self._active[user_id] += 1
+        terminal_sessions.labels(tier=tier).inc()
+        session = None
+        try:
+            api = container.client.api
+            exec_id = await asyncio.to_thread(
+                api.exec_create, container.id, ["sh", "-c", self.shell],
+                stdin=True, tty=True, workdir=workdir, environment={"TERM": "xterm-256color"},
+            )
+            exec_id = exec_id["Id"] if isinstance(exec_id, dict) else exec_id
+            sock = await asyncio.to_thread(api.exec_start, exec_id, tty=True, socket=True)
+            session = TerminalSession(api, exec_id, await self._attach(sock))
+            self._sessions.add(session)
+            await session.resize(cols, rows)
+            yield session
+        finally:
+            if session is not None:
+                self._sessions.discard(session)
+                session.close()
+            self._active[user_id] -= 1
+            if not self._active[user_id]:
+                del self._active[user_id]
+            terminal_sessions.labels(tier=tier).dec()
+
+    async def _attach(self, sock):
+        # docker-py returns a SocketIO wrapper for local daemons
+        raw = getattr(sock, "_sock", sock)
+        if type(raw) is socket.socket:
+            raw.setblocking(False)
+            reader, writer = await asyncio.open_connection(sock=raw, limit=self.buffer_bytes)
+            return _SocketStream(reader, writer)
+        if self._blocking >= self.max_blocking:
+            raw.close()
+            raise HTTPException(status_code=503, detail="Too many open terminals, try again later",
+                                headers={"Retry-After": "5"})
+        self._blocking += 1
+        return _BlockingStream(raw, self._executor, self._release_blocking)
+
+    def _release_blocking(self):
+        self._blocking -= 1
+
+    async def relay(self, websocket, session: TerminalSession,
+                    on_input: Optional[Callable[[], Awaitable]] = None):
+        """Copy bytes both ways until the shell exits or the client goes away"""
+        output = asyncio.create_task(self._pump_output(websocket, session))
+        client = asyncio.create_task(self._pump_input(websocket, session, on_input))
+        try:
+            done, _ = await asyncio.wait({output, client}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (output, client):
+                task.cancel()
+            await asyncio.gather(output, client, return_exceptions=True)
+
+        if output not in done:
+            return
+        if output.exception() is not None:
+            logger.warning({"message": "Terminal relay failed", "error": repr(output.exception())})
+            await websocket.close(code=1011)
+            return
+        await websocket.send_text(json.dumps({"type": "exit", "exit_code": await session.exit_code()}))
+        await websocket.close()
+
+    async def _pump_output(self, websocket, session: TerminalSession):
+        # The next read waits for the send, and the stream stops reading from
+        # the socket once its buffer is full, so backpressure reaches the TTY
+        read, chunk = session.stream.read, self.read_chunk
+        while True:
+            data = await read(chunk)
+            if not data:
+                return
+            _output_bytes.inc(len(data))
+            await websocket.send_bytes(data)
+
+    async def _pump_input(self, websocket, session: TerminalSession, on_input):
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            data = message.get("bytes")
+            if data is None:
+                data = await self._control(session, message.get("text") or "")
+                if data is None:
+                    continue
+            if on_input is not None:
+                await on_input()
+            _input_bytes.inc(len(data))
+            await session.stream.write(data)
+
+    @staticmethod
+    async def _control(session: TerminalSession, text: str) -> Optional[bytes]:
+        """Apply a control message; returns bytes to type for input and plain text"""
+        if text.startswith("{"):
+            try:
+                message = json.loads(text)
+            except ValueError:
+                message = None
+            if isinstance(message, dict) and message.get("type") == "resize":
+                try:
+                    cols, rows = int(message["cols"]), int(message["rows"])
+                except (KeyError, TypeError, ValueError):
+                    return None
+                await session.resize(cols, rows)
+                return None
+            if isinstance(message, dict) and message.get("type") == "input":
+                return str(message.get("data", "")).encode()
+        return text.encode()
+
+    async def close_all(self, timeout: float = 0):
+        """Close every container socket; relays then end on their own"""
+        for session in list(self._sessions):
+            session.close()
+        if self._sessions:
+            logger.info({"message": "Closed terminal sessions", "count": len(self._sessions)})
@@ -22,6 +22,29 @@ export default function Dashboard() {
 
   useEffect(() => {
     fetchWorkspaces();
+
+    // Status changes are pushed by the server; the browser reconnects on its own
+    const events = new EventSource(`/api/events?token=${encodeURIComponent(localStorage.getItem('token') ?? '')}`);
+    events.addEventListener('status', (message) => {
+      const event = JSON.parse((message as MessageEvent).data);
+      if (event.status === 'created') {
+        fetchWorkspaces();  // possibly from another tab
+      } else if (event.status === 'deleted') {
+        setWorkspaces(current => current.filter(w => w.id !== event.workspace_id));
+      } else {
+        setWorkspaces(current => current.map(w => (
+          w.id === event.workspace_id ? { ...w, status: event.status } : w
+        )));
+      }
+    });
+    // A snapshot opens every connection; after a reconnect the list may be stale
+    let connected = false;
+    events.addEventListener('snapshot', () => {
+      if (connected) fetchWorkspaces();
+      connected = true;
+    });
+    events.addEventListener('resync', () => fetchWorkspaces());
+    return () => events.close();
   }, []);
 
   const fetchWorkspaces = async () => {
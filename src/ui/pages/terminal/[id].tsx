@@ -57,18 +57,31 @@ export default function TerminalPage() {
     term.open(terminalRef.current);
     fitAddon.fit();
 
-    // Connect to WebSocket
+    // Connect to the API's terminal relay: binary frames are raw TTY bytes,
+    // text frames are JSON control messages
     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    const wsUrl = `${protocol}//${window.location.hostname}:7681/ws/${workspaceId}`;
+    const token = encodeURIComponent(localStorage.getItem('token') || '');
+    const wsUrl = `${protocol}//${window.location.hostname}:6600/terminal/${workspaceId}` +
+      `?token=${token}&cols=${term.cols}&rows=${term.rows}`;
     const ws = new WebSocket(wsUrl);
+    ws.binaryType = 'arraybuffer';
+    const encoder = new TextEncoder();
 
     ws.onopen = () => {
       term.write('Connected to ClaudeOSaar workspace\r\n');
-      term.write('Type "help" for available commands\r\n\r\n');
     };
 
     ws.onmessage = (event) => {
-      term.write(event.data);
+      if (event.data instanceof ArrayBuffer) {
+        term.write(new Uint8Array(event.data));
+        return;
+      }
+      const message = JSON.parse(event.data);
+      if (message.type === 'exit') {
+        term.write(`\r\nProcess exited with code ${message.exit_code}\r\n`);
+      } else if (message.type === 'error') {
+        term.write(`\r\nError: ${message.detail}\r\n`);
+      }
     };
 
     ws.onerror = (error) => {
@@ -81,7 +94,13 @@ export default function TerminalPage() {
 
     term.onData((data) => {
       if (ws.readyState === WebSocket.OPEN) {
-        ws.send(data);
+        ws.send(encoder.encode(data));
+      }
+    });
+
+    term.onResize(({ cols, rows }) => {
+      if (ws.readyState === WebSocket.OPEN) {
+        ws.send(JSON.stringify({ type: 'resize', cols, rows }));
       }
     });
 
@@ -0,0 +1,199 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from src.api.workspaces.admission import AdmissionController
+from src.api.workspaces.scheduler import DockerNode, WorkspaceScheduler
+from tests.fakes.docker_client import FakeDockerClient
+from tests.fakes.redis_client import FakeRedis, FakeRedisServer
+
+GB = 1024 ** 3
+
+QUOTAS = {
+    "free": {"workspaces": 1, "memory": "1g", "cpus": 1},
+    "pro": {"workspaces": 3, "memory": "4g", "cpus": 4},
+}
+
+def make_controller(mem_gb=16, **kwargs):
+    client = FakeDockerClient(mem_total=mem_gb * GB, ncpu=16)
+    scheduler = WorkspaceScheduler([DockerNode("a", client, headroom=0)])
+    scheduler.refresh()
+    return AdmissionController(scheduler, quotas=QUOTAS, **kwargs), scheduler
+
+async def create(controller, scheduler, user_id, name, tier="pro", mem_limit="1g", delay=0):
+    async with controller.admit(user_id, tier, name, mem_limit=mem_limit, cpu_quota=100000):
+        await asyncio.sleep(delay)
+        await asyncio.to_thread(
+            scheduler.containers.run, "img", name=name, mem_limit=mem_limit, cpu_quota=100000,
+            labels={"claudeosaar.workspace_id": name, "claudeosaar.user_id": user_id}
+        )
+
+def test_workspace_count_quota():
+    controller, scheduler = make_controller()
+
+    async def scenario():
+        for i in range(3):
+            await create(controller, scheduler, "u1", f"w{i}")
+        with pytest.raises(HTTPException) as exc:
+            await create(controller, scheduler, "u1", "w3")
+        # Other users are unaffected
+        await create(controller, scheduler, "u2", "w4")
+        return exc.value
+
+    error = asyncio.run(scenario())
+    assert error.status_code == 403
+    assert controller.usage("u1") == (3, 3 * GB, 3.0)
+
+def test_concurrent_creates_cannot_overshoot_quota():
+    controller, scheduler = make_controller()
+
+    async def scenario():
+        return await asyncio.gather(
+            *(create(controller, scheduler, "u1", f"w{i}") for i in range(6)),
+            return_exceptions=True
+        )
+
+    results = asyncio.run(scenario())
+    assert sum(r is None for r in results) == 3
+    assert len(scheduler.containers.list()) == 3
+
+def test_memory_quota_counts_existing_containers_after_sync():
+    controller, scheduler = make_controller()
+    client = scheduler.nodes["a"].client
+    client.containers.run("img", name="old", mem_limit="4g", cpu_quota=100000,
+                          labels={"claudeosaar.user_id": "u1"})
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(create(controller, scheduler, "u1", "w1"))
+    assert "Memory quota" in exc.value.detail
+
+def test_failed_create_rolls_back_commitment():
+    controller, scheduler = make_controller()
+
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            async with controller.admit("u1", "free", "w1", mem_limit="512m", cpu_quota=50000):
+                raise RuntimeError("docker failed")
+        await create(controller, scheduler, "u1", "w1", tier="free", mem_limit="512m")
+
+    asyncio.run(scenario())
+    assert controller.usage("u1")[0] == 1
+
+def test_create_waits_for_capacity_then_proceeds():
+    controller, scheduler = make_controller(mem_gb=2, queue_timeout=5)
+
+    async def scenario():
+        await create(controller, scheduler, "u1", "w0", mem_limit="2g")
+        waiter = asyncio.create_task(create(controller, scheduler, "u2", "w1", mem_limit="2g"))
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+
+        scheduler.nodes["a"].client.containers.get("w0").remove(force=True)
+        scheduler.release("w0")
+        controller.release("w0")
+        await asyncio.wait_for(waiter, 1)
+
+    asyncio.run(scenario())
+    assert [c.name for c in scheduler.containers.list()] == ["w1"]
+
+def test_full_queue_rejects_immediately():
+    controller, scheduler = make_controller(mem_gb=1, queue_size=0)
+
+    async def scenario():
+        await create(controller, scheduler, "u1", "w0")
+        await create(controller, scheduler, "u2", "w1")
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(scenario())
+    assert exc.value.status_code == 503
+    assert controller.usage("u2") == (0, 0, 0)
+
+def test_creates_through_different_instances_share_the_quota():
+    client = FakeDockerClient(mem_total=16 * GB, ncpu=16)
+    server = FakeRedisServer()
+    instances = []
+    for _ in range(2):
+        scheduler = WorkspaceScheduler([DockerNode("a", client, headroom=0)])
+        scheduler.refresh()
+        controller = AdmissionController(scheduler, quotas=QUOTAS, get_redis=lambda r=FakeRedis(server): r)
+        instances.append((controller, scheduler))
+
+    async def scenario():
+        for controller, _ in instances:
+            await controller.sync()
+        return await asyncio.gather(
+            *(create(controller, scheduler, "u1", f"w{i}", tier="free", delay=0.05)
+              for i, (controller, scheduler) in enumerate(instances * 2)),
+            return_exceptions=True
+        )
+
+    results = asyncio.run(scenario())
+
+    assert sum(r is None for r in results) == 1
+    assert all(isinstance(r, HTTPException) and r.status_code == 403 for r in results if r is not None)
+    assert len(client.containers.list()) == 1
+    assert len(server.data["claudeosaar:admission:usage:u1"]) == 1
+
+def make_instances(server, count=2):
+    client = FakeDockerClient(mem_total=16 * GB, ncpu=16)
+    instances = []
+    for _ in range(count):
+        scheduler = WorkspaceScheduler([DockerNode("a", client, headroom=0)])
+        scheduler.refresh()
+        controller = AdmissionController(scheduler, quotas=QUOTAS, get_redis=lambda r=FakeRedis(server): r)
+        instances.append((controller, scheduler))
+    return client, instances
+
+def test_release_through_another_instance_frees_the_shared_quota():
+    server = FakeRedisServer()
+    client, [(first, first_scheduler), (second, second_scheduler)] = make_instances(server)
+
+    async def scenario():
+        await create(first, first_scheduler, "u1", "w0", tier="free")
+        client.containers.get("w0").remove(force=True)
+        # The second instance never saw w0 committed
+        second.release("w0")
+        await asyncio.gather(*second._releases)
+        await create(second, second_scheduler, "u1", "w1", tier="free")
+
+    asyncio.run(scenario())
+
+    assert list(server.data["claudeosaar:admission:usage:u1"]) == [b"w1"]
+    assert server.data["claudeosaar:admission:owners"] == {b"w1": b"u1"}
+
+def test_sync_drops_shared_commitments_without_a_container():
+    server = FakeRedisServer()
+    client, [(controller, scheduler)] = make_instances(server, count=1)
+    redis = FakeRedis(server)
+
+    async def scenario():
+        await controller.sync()
+        # Left behind by an instance that crashed before creating w0
+        await redis.hset("claudeosaar:admission:usage:u1", "w0", f"{GB} 1000 {time.time() - 60!r}")
+        await redis.hset("claudeosaar:admission:owners", "w0", "u1")
+        with pytest.raises(HTTPException):
+            await create(controller, scheduler, "u1", "w1", tier="free")
+        await controller.sync()
+        await create(controller, scheduler, "u1", "w1", tier="free")
+
+    asyncio.run(scenario())
+
+    assert list(server.data["claudeosaar:admission:usage:u1"]) == [b"w1"]
+    assert server.data["claudeosaar:admission:owners"] == {b"w1": b"u1"}
+
+def test_falls_back_to_local_quota_when_redis_is_down():
+    server = FakeRedisServer()
+    redis = FakeRedis(server)
+    redis.disconnect()
+    controller, scheduler = make_controller(get_redis=lambda: redis)
+
+    async def scenario():
+        await create(controller, scheduler, "u1", "w0", tier="free")
+        await create(controller, scheduler, "u1", "w1", tier="free")
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(scenario())
+    assert exc.value.status_code == 403
+    assert controller.usage("u1") == (1, GB, 1.0)
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+import stripe
+from fastapi import HTTPException
+
+from src.api.billing.service import BillingService
+from tests.fakes.stripe_server import FakeStripeServer
+
+class FakeDatabase:
+    """In-memory `users` table covering the billing queries"""
+
+    def __init__(self):
+        self.users = {"user-1": {"stripe_customer_id": None}}
+        self.queries = 0
+
+    async def fetchone(self, sql, params=()):
+        self.queries += 1
+        if sql.lstrip().startswith("SELECT stripe_customer_id"):
+            return self.users.get(params[0])
+        if sql.lstrip().startswith("UPDATE users SET stripe_customer_id"):
+            customer_id, user_id = params
+            user = self.users[user_id]
+            user["stripe_customer_id"] = user["stripe_customer_id"] or customer_id
+            return dict(user)
+        raise AssertionError(f"unexpected query: {sql}")
+
+@pytest.fixture
+def fake_stripe(monkeypatch):
+    with FakeStripeServer() as server:
+        monkeypatch.setattr(stripe, "api_key", "sk_test_fake")
+        monkeypatch.setattr(stripe, "api_base", server.url)
+        monkeypatch.setattr(stripe, "max_network_retries", 0)
+        yield server
+
+@pytest.fixture
+def billing():
+    return BillingService(FakeDatabase(), price_ids={"pro": "price_pro"})
+
+def test_customer_created_once_and_cached(fake_stripe, billing):
+    async def scenario():
+        first = await billing.get_or_create_customer("user-1", "a@example.com")
+        second = await billing.get_or_create_customer("user-1", "a@example.com")
+        return first, second
+
+    first, second = asyncio.run(scenario())
+
+    assert first == second
+    assert billing.db.users["user-1"]["stripe_customer_id"] == first
+    assert fake_stripe.count("POST", "/v1/customers") == 1
+    # Second lookup is served from the in-process cache
+    assert billing.db.queries == 2
+
+def test_existing_customer_id_skips_stripe(fake_stripe, billing):
+    billing.db.users["user-1"]["stripe_customer_id"] = "cus_existing"
+    customer_id = asyncio.run(billing.get_or_create_customer("user-1", "a@example.com"))
+    assert customer_id == "cus_existing"
+    assert fake_stripe.count("POST", "/v1/customers") == 0
+
+def test_concurrent_subscription_retries_are_idempotent(fake_stripe, billing):
+    async def scenario():
+        return await asyncio.gather(*[
+            billing.create_subscription("user-1", "a@example.com", "pro", idempotency_key="req-1")
+            for _ in range(3)
+        ])
+
+    results = asyncio.run(scenario())
+
+    assert len({r["subscription_id"] for r in results}) == 1
+    assert results[0]["client_secret"].startswith("pi_secret_")
+    assert len(fake_stripe.customers) == 1
+    assert len(fake_stripe.subscriptions) == 1
+
+def test_invalid_tier_rejected(billing):
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(billing.create_subscription("user-1", "a@example.com", "gold"))
+    assert exc.value.status_code == 400
+
+def test_requests_without_a_key_are_separate_attempts(fake_stripe, billing):
+    async def scenario():
+        # e.g. a retry after the first attempt's payment failed
+        first = await billing.create_subscription("user-1", "a@example.com", "pro")
+        second = await billing.create_subscription("user-1", "a@example.com", "pro")
+        return first, second
+
+    first, second = asyncio.run(scenario())
+
+    assert first["subscription_id"] != second["subscription_id"]
+    assert len(fake_stripe.customers) == 1
+
+def test_the_same_key_from_different_users_does_not_collide(fake_stripe, billing):
+    billing.db.users["user-2"] = {"stripe_customer_id": None}
+
+    async def scenario():
+        first = await billing.create_subscription("user-1", "a@example.com", "pro", idempotency_key="1")
+        second = await billing.create_subscription("user-2", "b@example.com", "pro", idempotency_key="1")
+        return first, second
+
+    first, second = asyncio.run(scenario())
+
+    assert first["subscription_id"] != second["subscription_id"]
+    assert len(fake_stripe.subscriptions) == 2
@@ -0,0 +1,93 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import Depends, FastAPI, HTTPException
+
+from src.api.coalesce import SingleFlight, coalesced
+
+class Backend:
+    def __init__(self, delay=0.05, fail=False):
+        self.calls = 0
+        self.delay = delay
+        self.fail = fail
+
+    async def read(self, value="result"):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise HTTPException(status_code=503, detail="backend down")
+        return {"value": value, "call": self.calls}
+
+def test_concurrent_reads_share_one_call():
+    backend = Backend()
+    flight = SingleFlight("test-share")
+
+    async def scenario():
+        results = await asyncio.gather(*(flight.do(("w", "u"), backend.read) for _ in range(20)))
+        again = await flight.do(("w", "u"), backend.read)
+        return results, again
+
+    results, again = asyncio.run(scenario())
+
+    assert backend.calls == 2
+    assert all(result is results[0] for result in results)
+    assert again["call"] == 2
+
+def test_ttl_caches_results_but_not_failures():
+    backend = Backend(delay=0)
+    flight = SingleFlight("test-ttl", ttl=60)
+
+    async def scenario():
+        await flight.do(("w",), backend.read)
+        await flight.do(("w",), backend.read)
+        assert backend.calls == 1
+        flight.invalidate("w")
+        await flight.do(("w",), backend.read)
+        assert backend.calls == 2
+
+        backend.fail = True
+        for _ in range(2):
+            with pytest.raises(HTTPException):
+                await flight.do(("x",), backend.read)
+        assert backend.calls == 4
+
+    asyncio.run(scenario())
+
+def test_leader_going_away_does_not_cancel_followers():
+    backend = Backend(delay=0.1)
+    flight = SingleFlight("test-cancel")
+
+    async def scenario():
+        leader = asyncio.create_task(flight.do(("w",), backend.read))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(flight.do(("w",), backend.read))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(scenario())["call"] == 1
+
+def test_endpoint_decorator_keys_by_params_and_user():
+    backend = Backend()
+    flight = SingleFlight("test-endpoint")
+    app = FastAPI()
+
+    def current(user: str):
+        return {"user_id": user}
+
+    @app.get("/items/{item_id}")
+    @coalesced(flight, "item_id")
+    async def get_item(item_id: str, current_user=Depends(current)):
+        return await backend.read(f"{item_id}:{current_user['user_id']}")
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            urls = ["/items/a?user=1"] * 10 + ["/items/a?user=2"] * 5 + ["/items/b?user=1"] * 5
+            return await asyncio.gather(*(client.get(url) for url in urls))
+
+    responses = asyncio.run(scenario())
+
+    assert backend.calls == 3
+    assert {r.json()["value"] for r in responses} == {"a:1", "a:2", "b:1"}
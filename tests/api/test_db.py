@@ -0,0 +1,74 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi import HTTPException
+from psycopg2.pool import PoolError
+
+from src.api.db import Database
+
+class FakeConnection:
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+class FakePool:
+    """Like ThreadedConnectionPool: raises instead of waiting when every connection is out"""
+
+    def __init__(self, size):
+        self.free = [FakeConnection() for _ in range(size)]
+        self.lock = threading.Lock()
+
+    def getconn(self):
+        with self.lock:
+            if not self.free:
+                raise PoolError("connection pool exhausted")
+            return self.free.pop()
+
+    def putconn(self, conn):
+        with self.lock:
+            self.free.append(conn)
+
+def database(size, timeout):
+    db = Database(maxconn=size, timeout=timeout)
+    db._pool = FakePool(size)
+    return db
+
+def test_borrowers_beyond_the_pool_wait_for_a_connection():
+    db = database(2, timeout=5)
+
+    def borrow(_):
+        with db.connection():
+            threading.Event().wait(0.02)
+        return True
+
+    with ThreadPoolExecutor(8) as executor:
+        assert all(executor.map(borrow, range(16)))
+    assert len(db._pool.free) == 2
+
+def test_waiting_too_long_for_a_connection_is_503():
+    db = database(1, timeout=0.05)
+    released = threading.Event()
+    held = threading.Event()
+
+    def hold():
+        with db.connection():
+            held.set()
+            released.wait(1)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    held.wait(1)
+    try:
+        with pytest.raises(HTTPException) as busy:
+            with db.connection():
+                pass
+    finally:
+        released.set()
+        holder.join()
+
+    assert busy.value.status_code == 503
+    with db.connection():
+        pass
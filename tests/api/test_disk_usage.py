@@ -0,0 +1,144 @@
+import asyncio
+import os
+import shutil
+
+import pytest
+from fastapi import HTTPException
+
+from src.api.workspaces.disk_usage import DiskUsageTracker
+
+WORKSPACE_ID = "6f1c2a9e-1d8b-4b7e-9a51-7d0f3c2b1a00"
+
+def du(path):
+    total = os.lstat(path).st_blocks * 512
+    for directory, dirs, files in os.walk(path):
+        for name in dirs + files:
+            total += os.lstat(os.path.join(directory, name)).st_blocks * 512
+    return total
+
+def make_workspace(tmp_path):
+    root = tmp_path / "user-1" / WORKSPACE_ID
+    (root / "src" / "pkg").mkdir(parents=True)
+    (root / "src" / "pkg" / "a.py").write_bytes(b"a" * 10000)
+    (root / "README").write_bytes(b"r" * 5000)
+    (tmp_path / ".snapshots").mkdir()
+    return root
+
+def count_scans(tracker, monkeypatch):
+    scanned = []
+    scan_dir = tracker._scan_dir
+
+    def counting(workspace, rel):
+        scanned.append(rel)
+        return scan_dir(workspace, rel)
+
+    monkeypatch.setattr(tracker, "_scan_dir", counting)
+    return scanned
+
+def test_mtime_mode_rescans_only_changed_directories(tmp_path, monkeypatch):
+    root = make_workspace(tmp_path)
+    tracker = DiskUsageTracker(mounts_root=str(tmp_path), use_inotify=False)
+    assert tracker._acquire_scanner_lock()
+    scanned = count_scans(tracker, monkeypatch)
+
+    async def scenario():
+        await tracker.update()
+        assert await tracker.usage("user-1", WORKSPACE_ID) == du(root)
+        assert sorted(scanned) == ["", "src", "src/pkg"]
+        assert list(tracker._workspaces) == [("user-1", WORKSPACE_ID)]
+
+        scanned.clear()
+        (root / "src" / "pkg" / "b.py").write_bytes(b"b" * 20000)
+        await tracker.update()
+        assert scanned == ["src/pkg"]
+        assert await tracker.usage("user-1", WORKSPACE_ID) == du(root)
+
+        shutil.rmtree(root / "src")
+        await tracker.update()
+        assert await tracker.usage("user-1", WORKSPACE_ID) == du(root)
+        assert set(tracker._workspaces[("user-1", WORKSPACE_ID)].dirs) == {""}
+
+    asyncio.run(scenario())
+    tracker._lock_file.close()
+
+def test_inotify_mode_picks_up_files_growing_in_place(tmp_path, monkeypatch):
+    root = make_workspace(tmp_path)
+    tracker = DiskUsageTracker(mounts_root=str(tmp_path), interval=3600)
+
+    async def scenario():
+        tracker.start()
+        if tracker._inotify is None:
+            pytest.skip("inotify is not available")
+        workspace = None
+        while workspace is None or workspace.scanned_at is None:
+            await asyncio.sleep(0.01)
+            workspace = tracker._workspaces.get(("user-1", WORKSPACE_ID))
+        scanned = count_scans(tracker, monkeypatch)
+
+        # Appending changes the file's size but not its directory's mtime
+        with open(root / "src" / "pkg" / "a.py", "ab") as f:
+            f.write(b"a" * 100000)
+        (root / "src" / "new").mkdir()
+        (root / "src" / "new" / "c.py").write_bytes(b"c" * 8000)
+        await asyncio.sleep(0.1)
+        await tracker.update()
+
+        assert sorted(scanned) == ["src", "src/new", "src/pkg"]
+        assert await tracker.usage("user-1", WORKSPACE_ID) == du(root)
+        await tracker.stop()
+
+    asyncio.run(scenario())
+
+def test_second_process_reads_usage_recorded_by_the_scanner(tmp_path):
+    make_workspace(tmp_path)
+
+    class RecordingDatabase:
+        def __init__(self):
+            self.rows = {}
+
+        async def execute(self, sql, params=()):
+            ids, sizes = params
+            self.rows.update(zip(ids, sizes))
+
+        async def fetchone(self, sql, params=()):
+            size = self.rows.get(params[0])
+            return {"disk_usage_mb": size} if size is not None else None
+
+    db = RecordingDatabase()
+    scanner = DiskUsageTracker(db, mounts_root=str(tmp_path), use_inotify=False)
+    other = DiskUsageTracker(db, mounts_root=str(tmp_path), quotas={"free": 1024 * 1024})
+
+    async def scenario():
+        assert scanner._acquire_scanner_lock()
+        assert not other._acquire_scanner_lock()
+        assert await other.usage("user-1", WORKSPACE_ID) is None
+        other._cache.clear()
+
+        await scanner.update()
+        await scanner.record()
+        assert await other.usage("user-1", WORKSPACE_ID) == 1024 * 1024
+        await other.check_quota("user-1", WORKSPACE_ID, "free")
+        with pytest.raises(HTTPException) as error:
+            await other.check_quota("user-1", WORKSPACE_ID, "free", incoming=1)
+        assert error.value.status_code == 507
+
+    asyncio.run(scenario())
+    scanner._lock_file.close()
+
+def test_scan_does_not_follow_directories_swapped_for_symlinks(tmp_path):
+    root = make_workspace(tmp_path)
+    outside = tmp_path / "outside"
+    (outside / "pkg").mkdir(parents=True)
+    (outside / "pkg" / "secret").write_bytes(b"s" * 100000)
+    tracker = DiskUsageTracker(mounts_root=str(tmp_path), use_inotify=False)
+    assert tracker._acquire_scanner_lock()
+
+    async def scenario():
+        await tracker.update()
+        # The container swaps a directory for a symlink between listing and scanning
+        shutil.rmtree(root / "src")
+        (root / "src").symlink_to(outside)
+        workspace = tracker._workspaces[("user-1", WORKSPACE_ID)]
+        return tracker._scan_dir(workspace, "src"), tracker._scan_dir(workspace, "src/pkg")
+
+    assert asyncio.run(scenario()) == (None, None)
@@ -0,0 +1,188 @@
+import asyncio
+
+from src.api.workspaces.events import WorkspaceEvents, docker_event, sse_frame
+from src.api.workspaces.scheduler import DockerNode, WorkspaceScheduler
+from tests.fakes.docker_client import FakeDockerClient
+from tests.fakes.redis_client import FakeRedis, FakeRedisServer
+
+def make_scheduler():
+    return WorkspaceScheduler([DockerNode("a", FakeDockerClient(), headroom=0)])
+
+def run_workspace(scheduler, workspace_id, user_id="u1"):
+    return scheduler.containers.run(
+        "claudeosaar/workspace:latest", name=f"claude-workspace-{workspace_id}", mem_limit="1g",
+        cpu_quota=100000, labels={"claudeosaar.workspace_id": workspace_id, "claudeosaar.user_id": user_id}
+    )
+
+async def collect(stream, count, timeout=2.0):
+    events = []
+    while len(events) < count:
+        event = await asyncio.wait_for(stream.__anext__(), timeout)
+        if event is not None:
+            events.append(event)
+    return events
+
+async def settle():
+    # Lets watcher threads and the outbox catch up
+    await asyncio.sleep(0.1)
+
+def test_docker_event_maps_actions_to_status():
+    message = {"Action": "pause", "time": 1700000000, "Actor": {"Attributes": {
+        "claudeosaar.workspace_id": "w1", "claudeosaar.user_id": "u1"}}}
+    assert docker_event(message) == ("u1", {"type": "status", "workspace_id": "w1", "status": "paused",
+                                            "action": "pause", "time": 1700000000})
+    assert docker_event({**message, "Action": "kill"}) is None
+    assert docker_event({**message, "Actor": {"Attributes": {"name": "other"}}}) is None
+    assert sse_frame(None) == ": ping\n\n"
+    assert sse_frame({"type": "resync"}) == 'event: resync\ndata: {"type": "resync"}\n\n'
+
+def test_stream_sends_snapshot_then_own_workspace_changes():
+    scheduler = make_scheduler()
+    run_workspace(scheduler, "w0")
+    hub = WorkspaceEvents(scheduler)
+
+    async def scenario():
+        hub.start()
+        stream = hub.stream("u1", heartbeat=0.05)
+        snapshot = await stream.__anext__()
+        await settle()
+        run_workspace(scheduler, "other", user_id="u2")
+        container = run_workspace(scheduler, "w1")
+        await asyncio.to_thread(container.pause)
+        events = await collect(stream, 3)
+        await stream.aclose()
+        await hub.stop()
+        return snapshot, events
+
+    snapshot, events = asyncio.run(scenario())
+
+    assert snapshot == {"type": "snapshot", "workspaces": [{"workspace_id": "w0", "status": "running"}]}
+    assert [(e["workspace_id"], e["status"]) for e in events] == [("w1", "created"), ("w1", "running"),
+                                                                 ("w1", "paused")]
+
+def test_one_replica_watches_docker_and_all_replicas_deliver():
+    scheduler = make_scheduler()
+    server = FakeRedisServer()
+    hubs = [WorkspaceEvents(scheduler, get_redis=lambda r=FakeRedis(server): r, leader_ttl=0.3)
+            for _ in range(3)]
+
+    async def scenario():
+        for hub in hubs:
+            hub.start()
+        await settle()
+        leaders = [hub for hub in hubs if hub.is_leader]
+        streams = [hub.stream("u1", heartbeat=0.05) for hub in hubs]
+        for stream in streams:
+            await stream.__anext__()
+        run_workspace(scheduler, "w1")
+        received = [await collect(stream, 2) for stream in streams]
+
+        # Another replica takes over when the leader goes away
+        await leaders[0].stop()
+        await asyncio.sleep(0.5)
+        successors = [hub for hub in hubs if hub.is_leader]
+        container = scheduler.containers.get("claude-workspace-w1")
+        await asyncio.to_thread(container.stop)
+        after = [await collect(stream, 1) for stream, hub in zip(streams, hubs) if hub is not leaders[0]]
+        for stream in streams:
+            await stream.aclose()
+        for hub in hubs:
+            await hub.stop()
+        return leaders, successors, received, after
+
+    leaders, successors, received, after = asyncio.run(scenario())
+
+    assert len(leaders) == 1 and len(successors) == 1 and successors != leaders
+    assert all([e["status"] for e in events] == ["created", "running"] for events in received)
+    assert all(events[0]["status"] == "exited" for events in after)
+
+def test_leader_does_not_renew_a_claim_taken_over_by_another_replica():
+    scheduler = make_scheduler()
+    server = FakeRedisServer()
+    redis = FakeRedis(server)
+    hub = WorkspaceEvents(scheduler, get_redis=lambda: redis, leader_ttl=0.3)
+
+    async def scenario():
+        hub.start()
+        await settle()
+        was_leader = hub.is_leader
+        # Our claim expired and another replica claimed the key before the renewal
+        await redis.set(hub._leader_key, "other", px=10000)
+        await asyncio.sleep(0.2)
+        still_leader = hub.is_leader
+        holder = await redis.get(hub._leader_key)
+        await hub.stop()
+        return was_leader, still_leader, holder
+
+    was_leader, still_leader, holder = asyncio.run(scenario())
+
+    assert was_leader and not still_leader
+    assert holder == b"other"
+
+def test_reconnected_event_streams_are_not_kept():
+    scheduler = make_scheduler()
+    client = scheduler.nodes["a"].client
+    hub = WorkspaceEvents(scheduler)
+
+    async def scenario():
+        hub.start()
+        await settle()
+        for _ in range(3):
+            # The daemon drops the connection and the watcher reconnects
+            client.event_streams[-1].close()
+            await asyncio.sleep(1.2)
+        streams = len(hub._streams)
+        await hub.stop()
+        return streams
+
+    assert asyncio.run(scenario()) == 1
+
+def test_slow_client_and_lost_subscription_get_resync():
+    scheduler = make_scheduler()
+    client = FakeRedis()
+    hub = WorkspaceEvents(scheduler, get_redis=lambda: client, queue_size=2, leader_ttl=0.3)
+
+    async def scenario():
+        hub.start()
+        await settle()
+        async with hub.subscribe("u1") as subscription:
+            for i in range(4):
+                await hub.publish("u1", {"type": "status", "workspace_id": f"w{i}", "status": "running"})
+            await settle()
+            overflow = [await subscription.next(0.1) for _ in range(2)]
+
+            client.disconnect()
+            await settle()
+            client.reconnect()
+            await asyncio.sleep(1.2)
+            lost = await subscription.next(0.1)
+            await hub.publish("u1", {"type": "status", "workspace_id": "w9", "status": "exited"})
+            resumed = await subscription.next(0.5)
+        await hub.stop()
+        return overflow, lost, resumed
+
+    overflow, lost, resumed = asyncio.run(scenario())
+
+    assert overflow[0] == {"type": "resync"}
+    assert overflow[1]["workspace_id"] == "w3"
+    assert lost == {"type": "resync"}
+    assert resumed["workspace_id"] == "w9"
+
+def test_draining_ends_streams():
+    scheduler = make_scheduler()
+    hub = WorkspaceEvents(scheduler)
+
+    async def scenario():
+        hub.start()
+        stream = hub.stream("u1", heartbeat=0.05)
+        await stream.__anext__()
+        hub.close_streams()
+        rest = [event async for event in stream if event is not None]
+        late = [event async for event in hub.stream("u1") if event is not None]
+        await hub.stop()
+        return rest, late
+
+    rest, late = asyncio.run(scenario())
+
+    assert rest == [{"type": "shutdown"}]
+    assert [event["type"] for event in late] == ["snapshot", "shutdown"]
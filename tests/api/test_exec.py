@@ -0,0 +1,162 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from src.api.workspaces.exec import ExecManager, workspace_owner
+
+class FakeExecApi:
+    """Low-level Docker API stub replaying demultiplexed frames"""
+
+    def __init__(self, frames, exit_code=0, delay=0.0):
+        self.frames = frames
+        self.exit_code = exit_code
+        self.delay = delay
+        self.commands = []
+        self.frames_read = 0
+
+    def exec_create(self, container_id, cmd, **kwargs):
+        self.commands.append(cmd)
+        return {"Id": "exec-1"}
+
+    def exec_start(self, exec_id, stream=False, demux=False):
+        assert stream and demux
+        for frame in self.frames:
+            if self.delay:
+                time.sleep(self.delay)
+            self.frames_read += 1
+            yield frame
+
+    def exec_inspect(self, exec_id):
+        return {"ExitCode": self.exit_code}
+
+class RunningExecApi:
+    """A command that prints once, then runs until a kill exec stops it"""
+
+    def __init__(self):
+        self.killed = threading.Event()
+        self.kills = []
+        self.commands = {}
+
+    def exec_create(self, container_id, cmd, **kwargs):
+        exec_id = f"exec-{len(self.commands) + 1}"
+        self.commands[exec_id] = cmd
+        return {"Id": exec_id}
+
+    def exec_start(self, exec_id, stream=False, demux=False):
+        if "kill -KILL" in self.commands[exec_id][2]:
+            # The launcher's pid file is the kill's argument
+            self.kills.append(self.commands[exec_id][-1])
+            self.killed.set()
+            return b""
+        return self._output()
+
+    def _output(self):
+        yield b"started\n", None
+        self.killed.wait(5)
+
+    def exec_inspect(self, exec_id):
+        return {"Running": not self.killed.is_set(), "ExitCode": 137 if self.killed.is_set() else None}
+
+class FakeContainer:
+    def __init__(self, api, labels=None, env=None):
+        self.id = "container-1"
+        self.client = type("Client", (), {"api": api})()
+        self.labels = labels or {}
+        self.attrs = {"Config": {"Env": env or []}}
+
+LIMITS = {"free": {"concurrency": 1, "timeout": 5}}
+
+def collect(manager, container, tier="free"):
+    async def scenario():
+        return [chunk async for chunk in manager.stream(container, "make", tier)]
+    return asyncio.run(scenario())
+
+def test_stream_demultiplexes_and_reports_exit_code():
+    api = FakeExecApi([(b"building\n", None), (None, b"warning\n"), (b"done\n", None)], exit_code=2)
+    chunks = collect(ExecManager(LIMITS), FakeContainer(api))
+
+    assert chunks == [("stdout", "building\n"), ("stderr", "warning\n"),
+                      ("stdout", "done\n"), ("exit", 2)]
+    assert api.commands[0][:4] == ["timeout", "--signal=KILL", "5", "sh"]
+
+def test_multibyte_characters_split_across_frames():
+    data = "größe ✓\n".encode()
+    api = FakeExecApi([(data[:3], None), (data[3:10], None), (data[10:], None)])
+    chunks = collect(ExecManager(LIMITS), FakeContainer(api))
+    assert "".join(v for k, v in chunks if k == "stdout") == "größe ✓\n"
+
+def test_reader_blocks_when_consumer_is_slow():
+    api = FakeExecApi([(b"x" * 10, None)] * 50)
+    manager = ExecManager(LIMITS, queue_chunks=4)
+
+    async def scenario():
+        stream = manager.stream(FakeContainer(api), "cat big", "free")
+        first = await stream.__anext__()
+        await asyncio.sleep(0.2)
+        frames_read = api.frames_read
+        await stream.aclose()
+        return first, frames_read
+
+    first, frames_read = asyncio.run(scenario())
+    assert first == ("stdout", "x" * 10)
+    # The queue holds 4 chunks; the reader stalls instead of reading all 50
+    assert frames_read <= 7
+
+def test_run_caps_buffered_output():
+    api = FakeExecApi([(b"a" * 600, None), (b"b" * 600, None)])
+    result = asyncio.run(ExecManager(LIMITS).run(FakeContainer(api), "cat", "free", max_bytes=1000))
+    assert result["truncated"]
+    assert len(result["output"]) == 1000
+    assert result["exit_code"] == 0
+
+def test_timeout_stops_relaying():
+    api = FakeExecApi([(b"tick\n", None)] * 20, delay=0.05)
+    manager = ExecManager({"free": {"concurrency": 1, "timeout": 0.2}})
+    chunks = collect(manager, FakeContainer(api))
+    assert chunks[-1] == ("timeout", 0.2)
+
+def test_concurrency_limit_per_user():
+    manager = ExecManager(LIMITS)
+
+    async def scenario():
+        async with manager.slot("user-1", "free"):
+            with pytest.raises(HTTPException) as exc:
+                async with manager.slot("user-1", "free"):
+                    pass
+            assert exc.value.status_code == 429
+            # Other users are unaffected
+            async with manager.slot("user-2", "free"):
+                pass
+        async with manager.slot("user-1", "free"):
+            pass
+
+    asyncio.run(scenario())
+
+def test_workspace_owner_from_label_or_env():
+    assert workspace_owner(FakeContainer(None, labels={"claudeosaar.user_id": "u1"})) == "u1"
+    assert workspace_owner(FakeContainer(None, env=["PATH=/bin", "USER_ID=u2"])) == "u2"
+    assert workspace_owner(FakeContainer(None)) is None
+
+def test_disconnect_kills_the_command_before_the_slot_is_released():
+    api = RunningExecApi()
+    manager = ExecManager(LIMITS)
+
+    async def scenario():
+        async with manager.slot("user-1", "free"):
+            stream = manager.stream(FakeContainer(api), "sleep 3600", "free")
+            first = await stream.__anext__()
+            # The client goes away mid-stream
+            await stream.aclose()
+            killed = api.killed.is_set()
+        return first, killed
+
+    first, killed = asyncio.run(scenario())
+
+    assert first == ("stdout", "started\n")
+    assert killed
+    launch = api.commands["exec-1"]
+    assert api.kills == [launch[-2]]
+    assert manager._active == {}
@@ -0,0 +1,174 @@
+import asyncio
+import gzip
+import io
+import os
+import tarfile
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from src.api.workspaces.files import WorkspaceFiles, parse_range, workspace_relpath
+from tests.fakes.docker_client import FakeDockerClient
+
+def make_container():
+    client = FakeDockerClient()
+    container = client.containers.run("claudeosaar/workspace:latest", name="claude-workspace-w")
+    container.files = {"/workspace/src/app.py": b"print('hi')\n", "/workspace/data.bin": bytes(range(256)) * 40}
+    return container
+
+async def collect(chunks) -> bytes:
+    return b"".join([chunk async for chunk in chunks])
+
+def tar_members(data: bytes) -> dict:
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r:*") as tar:
+        return {m.name: tar.extractfile(m).read() for m in tar if m.isfile()}
+
+def test_archive_from_daemon_round_trips_through_upload():
+    container = make_container()
+    files = WorkspaceFiles(mounts_root="", chunk=1024, queue_chunks=2)
+
+    async def scenario():
+        chunks = await files.archive(container, "user-1", "w", "/workspace/src", "gzip")
+        data = await collect(chunks)
+
+        async def body():
+            for i in range(0, len(data), 100):
+                yield data[i:i + 100]
+
+        await files.extract(container, "restored", body())
+        return data
+
+    data = asyncio.run(scenario())
+
+    assert tar_members(gzip.decompress(data)) == {"src/app.py": b"print('hi')\n"}
+    assert container.files["/workspace/restored/src/app.py"] == b"print('hi')\n"
+    # Handed over as it arrived, not joined first
+    assert container.put_archive_chunks > 1
+
+def test_upload_past_the_limit_is_aborted():
+    container = make_container()
+    files = WorkspaceFiles(mounts_root="")
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        info = tarfile.TarInfo("zeros")
+        info.size = 10 * 1024 * 1024
+        tar.addfile(info, io.BytesIO(bytes(info.size)))
+    data = buffer.getvalue()
+
+    async def upload(compression, limit):
+        async def body():
+            # Chunked: no Content-Length to check up front
+            for i in range(0, len(data), 1000):
+                yield data[i:i + 1000]
+
+        await files.extract(container, "big", body(), compression, limit=limit)
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(upload("gzip", 1024 * 1024))
+    assert exc.value.status_code == 507
+    assert "/workspace/big/zeros" not in container.files
+
+    asyncio.run(upload("gzip", 11 * 1024 * 1024))
+    assert len(container.files["/workspace/big/zeros"]) == 10 * 1024 * 1024
+
+class StreamingContainer:
+    """put_archive that consumes the upload as it arrives, like docker-py streaming to the daemon"""
+
+    def __init__(self):
+        self.received = threading.Event()
+        self.finished = threading.Event()
+        self.error = None
+
+    def put_archive(self, path, data):
+        try:
+            for _ in data:
+                self.received.set()
+        except Exception as e:
+            self.error = e
+            raise
+        finally:
+            self.finished.set()
+        return True
+
+def test_cancelled_upload_releases_the_extract_thread():
+    container = StreamingContainer()
+    files = WorkspaceFiles(mounts_root="", max_threads=1)
+
+    async def stalled_client():
+        yield b"x" * 1024
+        await asyncio.Event().wait()
+
+    async def scenario():
+        upload = asyncio.create_task(files.extract(container, "restored", stalled_client()))
+        await asyncio.to_thread(container.received.wait, 1)
+        upload.cancel()
+        await asyncio.gather(upload, return_exceptions=True)
+        return await asyncio.to_thread(container.finished.wait, 1)
+
+    assert asyncio.run(scenario())
+    # The daemon sees a failed upload, not a complete archive
+    assert container.error is not None
+
+def test_archive_reads_local_mount(tmp_path):
+    root = tmp_path / "user-1" / "w"
+    (root / "notes").mkdir(parents=True)
+    (root / "notes" / "a.txt").write_bytes(b"a" * 5000)
+    files = WorkspaceFiles(mounts_root=str(tmp_path), chunk=1024)
+
+    async def scenario():
+        return await collect(await files.archive(None, "user-1", "w", "notes"))
+
+    assert tar_members(asyncio.run(scenario())) == {"notes/a.txt": b"a" * 5000}
+
+def test_local_paths_cannot_escape_workspace(tmp_path):
+    root = tmp_path / "user-1" / "w"
+    root.mkdir(parents=True)
+    (tmp_path / "secret").write_text("x")
+    os.symlink(tmp_path / "secret", root / "link")
+    files = WorkspaceFiles(mounts_root=str(tmp_path))
+
+    for path in ("../../secret", "/workspace/../etc", "link"):
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(files.stat(None, "user-1", "w", path))
+        assert error.value.status_code == 400
+    assert workspace_relpath("/workspace/a/../b") == "b"
+
+def test_read_range_skips_to_offset_in_daemon_stream():
+    container = make_container()
+    files = WorkspaceFiles(mounts_root="", chunk=256)
+    expected = container.files["/workspace/data.bin"]
+
+    async def scenario():
+        info, handle = await files.stat(container, "user-1", "w", "data.bin")
+        return info, await collect(files.read_range(handle, 1000, 5000))
+
+    info, data = asyncio.run(scenario())
+
+    assert info.size == len(expected)
+    assert data == expected[1000:6000]
+
+def test_read_range_from_local_file(tmp_path):
+    root = tmp_path / "user-1" / "w"
+    root.mkdir(parents=True)
+    (root / "big").write_bytes(os.urandom(10000))
+    files = WorkspaceFiles(mounts_root=str(tmp_path), chunk=1000)
+
+    async def scenario():
+        info, handle = await files.stat(None, "user-1", "w", "big")
+        return await collect(files.read_range(handle, 9500, 500))
+
+    assert asyncio.run(scenario()) == (root / "big").read_bytes()[9500:]
+
+def test_parse_range():
+    assert parse_range(None, 100) is None
+    assert parse_range("bytes=0-0,5-9", 100) is None
+    r = parse_range("bytes=10-", 100)
+    assert (r.start, r.end, r.content_range) == (10, 99, "bytes 10-99/100")
+    r = parse_range("bytes=-30", 100)
+    assert (r.start, r.length) == (70, 30)
+    assert parse_range("bytes=90-500", 100).end == 99
+    with pytest.raises(HTTPException) as error:
+        parse_range("bytes=100-", 100)
+    assert error.value.status_code == 416
+    assert error.value.headers["Content-Range"] == "bytes */100"
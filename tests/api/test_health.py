@@ -0,0 +1,82 @@
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.api.health import HealthMonitor, Probe, docker_probe
+from src.api.workspaces.scheduler import DockerNode, WorkspaceScheduler
+from tests.fakes.docker_client import FakeDockerClient
+
+class Dependency:
+    def __init__(self):
+        self.calls = 0
+        self.healthy = True
+        self.delay = 0.0
+
+    async def check(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if not self.healthy:
+            raise ConnectionError("refused")
+
+def make_monitor(**deps):
+    probes = [Probe(name, dep.check, critical=(name == "postgres")) for name, dep in deps.items()]
+    return HealthMonitor(probes, interval=10, timeout=0.05)
+
+def test_status_is_down_until_first_probe():
+    monitor = make_monitor(postgres=Dependency())
+    assert monitor.status() == "down"
+    assert monitor.report()["dependencies"]["postgres"]["status"] == "unknown"
+
+    asyncio.run(monitor.probe_all())
+    assert monitor.status() == "ok"
+
+def test_non_critical_failure_degrades_and_critical_failure_downs():
+    postgres, redis = Dependency(), Dependency()
+    monitor = make_monitor(postgres=postgres, redis=redis)
+
+    redis.healthy = False
+    asyncio.run(monitor.probe_all())
+    assert monitor.status() == "degraded"
+    assert monitor.ready
+    assert "refused" in monitor.report()["dependencies"]["redis"]["error"]
+
+    postgres.delay = 1
+    asyncio.run(monitor.probe_all())
+    assert monitor.status() == "down"
+    assert monitor.report()["dependencies"]["postgres"]["error"] == "timeout"
+
+def test_stale_results_count_as_down():
+    monitor = make_monitor(postgres=Dependency())
+    asyncio.run(monitor.probe_all())
+    monitor.probes["postgres"].checked_at -= 31
+    assert monitor.status() == "down"
+
+def test_endpoint_reads_cache_without_probing():
+    postgres = Dependency()
+    monitor = make_monitor(postgres=postgres)
+    asyncio.run(monitor.probe_all())
+
+    app = FastAPI()
+
+    @app.get("/health/deep")
+    async def deep():
+        return monitor.report()
+
+    client = TestClient(app)
+    for _ in range(20):
+        assert client.get("/health/deep").json()["status"] == "ok"
+    assert postgres.calls == 1
+
+def test_docker_probe_up_while_any_node_answers():
+    class DownClient(FakeDockerClient):
+        def ping(self):
+            raise ConnectionError("daemon unreachable")
+
+    healthy = WorkspaceScheduler([DockerNode("a", DownClient()), DockerNode("b", FakeDockerClient())])
+    asyncio.run(docker_probe(healthy)())
+
+    down = WorkspaceScheduler([DockerNode("a", DownClient())])
+    monitor = HealthMonitor([Probe("docker", docker_probe(down), critical=True)])
+    asyncio.run(monitor.probe_all())
+    assert monitor.status() == "down"
@@ -0,0 +1,141 @@
+import asyncio
+
+from fastapi import HTTPException
+
+from src.api.workspaces.hibernation import HibernationManager
+from src.api.workspaces.scheduler import DockerNode, WorkspaceScheduler
+from tests.fakes.docker_client import FakeDockerClient
+
+class FakeContainer:
+    def __init__(self, workspace_id, tier="free", status="running"):
+        self.labels = {"claudeosaar.workspace_id": workspace_id, "claudeosaar.tier": tier}
+        self.status = status
+        self.cpu = 0
+        self.network = 0
+        self.calls = []
+
+    def stats(self, stream=True, one_shot=None):
+        return {
+            "cpu_stats": {"cpu_usage": {"total_usage": self.cpu}},
+            "networks": {"eth0": {"rx_bytes": self.network, "tx_bytes": 0}},
+        }
+
+    def stop(self):
+        self.calls.append("stop")
+        self.status = "exited"
+
+    def pause(self):
+        self.calls.append("pause")
+        self.status = "paused"
+
+    def start(self):
+        self.calls.append("start")
+        self.status = "running"
+
+    def unpause(self):
+        self.calls.append("unpause")
+        self.status = "running"
+
+    def reload(self):
+        pass
+
+class FakeDocker:
+    def __init__(self, containers):
+        self.all = containers
+        self.containers = self
+
+    def list(self, filters=None):
+        return [c for c in self.all if c.status == "running"]
+
+POLICY = {
+    "free": {"idle_after": 0, "action": "stop"},
+    "pro": {"idle_after": 0, "action": "pause"},
+    "enterprise": {"idle_after": None, "action": "pause"},
+}
+
+def sweep_twice(manager, between=lambda: None):
+    async def scenario():
+        await manager.sweep()
+        between()
+        return await manager.sweep()
+    return asyncio.run(scenario())
+
+def test_idle_workspaces_hibernated_by_tier_policy():
+    free, pro, enterprise = FakeContainer("w1"), FakeContainer("w2", "pro"), FakeContainer("w3", "enterprise")
+    manager = HibernationManager(FakeDocker([free, pro, enterprise]), policy=POLICY)
+
+    assert asyncio.run(manager.sweep()) == 2
+    assert free.calls == ["stop"]
+    assert pro.calls == ["pause"]
+    assert enterprise.calls == []
+
+def test_cpu_activity_keeps_workspace_running():
+    busy = FakeContainer("w1")
+    policy = dict(POLICY, free={"idle_after": 3600, "action": "stop"})
+    manager = HibernationManager(FakeDocker([busy]), policy=policy)
+
+    async def scenario():
+        await manager.sweep()
+        # Pretend the workspace has been quiet for two hours, then burns CPU
+        manager._last_activity["w1"] -= 7200
+        previous = manager._samples["w1"]
+        manager._samples["w1"] = (previous[0], previous[1], previous[2] - 60)
+        busy.cpu += 30 * 10 ** 9
+        return await manager.sweep()
+
+    assert asyncio.run(scenario()) == 0
+    assert busy.calls == []
+
+def test_quiet_workspace_hibernated_after_threshold():
+    quiet = FakeContainer("w1")
+    policy = dict(POLICY, free={"idle_after": 3600, "action": "stop"})
+    manager = HibernationManager(FakeDocker([quiet]), policy=policy)
+
+    def age():
+        manager._last_activity["w1"] -= 7200
+
+    assert sweep_twice(manager, age) == 1
+    assert quiet.calls == ["stop"]
+
+def test_access_resumes_hibernated_workspace():
+    stopped, paused = FakeContainer("w1", status="exited"), FakeContainer("w2", status="paused")
+    manager = HibernationManager(FakeDocker([stopped, paused]), policy=POLICY)
+
+    async def scenario():
+        await asyncio.gather(*[manager.ensure_running(stopped, "w1") for _ in range(3)])
+        await manager.ensure_running(paused, "w2")
+
+    asyncio.run(scenario())
+    assert stopped.calls == ["start"]
+    assert paused.calls == ["unpause"]
+    assert "w1" in manager._last_activity
+
+def test_resume_needs_room_on_the_node():
+    scheduler = WorkspaceScheduler([DockerNode("a", FakeDockerClient(mem_total=2 * 1024 ** 3, ncpu=8), headroom=0)])
+    manager = HibernationManager(scheduler, policy=POLICY)
+
+    def run(name):
+        return scheduler.containers.run("img", name=name, mem_limit="2g", cpu_quota=100000,
+                                        labels={"claudeosaar.workspace_id": name})
+
+    hibernated = run("w0")
+    hibernated.stop()
+    scheduler.refresh()
+    # Its memory went to a new workspace while it was stopped
+    other = run("w1")
+
+    async def scenario():
+        try:
+            await manager.ensure_running(hibernated, "w0")
+        except HTTPException as e:
+            rejected = e
+        other.remove(force=True)
+        scheduler.release("w1")
+        await manager.ensure_running(hibernated, "w0")
+        return rejected
+
+    rejected = asyncio.run(scenario())
+    assert rejected.status_code == 503 and "Retry-After" in rejected.headers
+    assert hibernated.status == "running"
+    scheduler.refresh()
+    assert scheduler.nodes["a"].reservations == {"w0": (2 * 1024 ** 3, 1.0)}
@@ -0,0 +1,85 @@
+import asyncio
+import threading
+
+from src.api.workspaces.images import ImageManager, split_ref
+from src.api.workspaces.scheduler import DockerNode, WorkspaceScheduler
+from tests.fakes.docker_client import FakeDockerClient, FakeRegistry
+
+IMAGE = "registry.local:5000/claudeosaar/workspace:latest"
+
+def make_cluster(registry, *names):
+    nodes = [DockerNode(name, FakeDockerClient(registry=registry), headroom=0) for name in names]
+    scheduler = WorkspaceScheduler(nodes)
+    images = ImageManager(scheduler, images=[IMAGE])
+    scheduler.images = images
+    return scheduler, images
+
+def pulls(scheduler, name):
+    return scheduler.nodes[name].client.images.pulls
+
+def test_split_ref():
+    assert split_ref("claudeosaar/workspace:latest") == ("claudeosaar/workspace", "latest")
+    assert split_ref("registry.local:5000/workspace") == ("registry.local:5000/workspace", "latest")
+    assert split_ref("workspace:v2") == ("workspace", "v2")
+
+def test_prepull_means_workspace_creation_never_pulls():
+    scheduler, images = make_cluster(FakeRegistry(), "a", "b")
+    images.check_all()
+    assert pulls(scheduler, "a") == pulls(scheduler, "b") == [IMAGE]
+
+    scheduler.containers.run(IMAGE, name="w1", mem_limit="1g", cpu_quota=100000)
+    assert pulls(scheduler, "a") == pulls(scheduler, "b") == [IMAGE]
+
+def test_concurrent_demand_shares_one_pull():
+    scheduler, images = make_cluster(FakeRegistry(pull_latency=0.2), "a")
+    node = scheduler.nodes["a"]
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(images.ensure(node, IMAGE))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert pulls(scheduler, "a") == [IMAGE]
+    assert len(set(results)) == 1 and len(results) == 8
+
+def test_scheduler_prefers_nodes_with_the_image():
+    scheduler, images = make_cluster(FakeRegistry(), "a", "b")
+    scheduler.containers.run("other:latest", name="w0", mem_limit="4g", cpu_quota=100000)
+    full = scheduler.locate("w0").name
+    empty = "b" if full == "a" else "a"
+    images.check(scheduler.nodes[empty], IMAGE)
+
+    # Binpack would choose the fuller node, but it would have to pull
+    scheduler.containers.run(IMAGE, name="w1", mem_limit="1g", cpu_quota=100000)
+    assert scheduler.locate("w1").name == empty
+    assert pulls(scheduler, full) == ["other:latest"]
+
+def test_moved_tag_is_pulled_in_the_background():
+    registry = FakeRegistry()
+    scheduler, images = make_cluster(registry, "a")
+    node = scheduler.nodes["a"]
+    images.check_all()
+    first = images.ensure(node, IMAGE)
+
+    images.check_all()
+    assert pulls(scheduler, "a") == [IMAGE]
+
+    registry.push(IMAGE)
+    images.check_all()
+    assert pulls(scheduler, "a") == [IMAGE, IMAGE]
+    assert images.ensure(node, IMAGE) != first
+
+def test_probe_reports_cold_images():
+    scheduler, images = make_cluster(FakeRegistry(), "a")
+
+    async def scenario():
+        try:
+            await images.probe()
+        except RuntimeError as e:
+            cold = str(e)
+        images.check_all()
+        await images.probe()
+        return cold
+
+    assert IMAGE in asyncio.run(scenario())
@@ -0,0 +1,101 @@
+import asyncio
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from starlette.responses import StreamingResponse
+
+from src.api.lifecycle import InFlightMiddleware, Lifecycle
+
+def make_app(lifecycle):
+    app = FastAPI()
+    app.add_middleware(InFlightMiddleware, lifecycle=lifecycle)
+
+    @app.get("/count")
+    async def count():
+        return {"in_flight": lifecycle.in_flight}
+
+    @app.get("/stream")
+    async def stream():
+        async def body():
+            for i in range(3):
+                yield f"{lifecycle.in_flight}\n"
+        return StreamingResponse(body())
+
+    return app
+
+def test_requests_counted_until_body_sent():
+    lifecycle = Lifecycle()
+    client = TestClient(make_app(lifecycle))
+
+    assert client.get("/count").json() == {"in_flight": 1}
+    assert client.get("/stream").text == "1\n1\n1\n"
+    assert lifecycle.in_flight == 0
+
+def test_draining_keeps_serving_but_closes_connections():
+    lifecycle = Lifecycle()
+    lifecycle.mark_ready()
+    client = TestClient(make_app(lifecycle))
+    assert "close" not in client.get("/count").headers.get("connection", "")
+
+    drained = []
+    lifecycle.on_drain(lambda: drained.append(lifecycle.state))
+    lifecycle.begin_drain()
+    lifecycle.begin_drain()
+    assert drained == ["draining"]
+    response = client.get("/count")
+    assert response.status_code == 200
+    assert response.headers["connection"] == "close"
+    assert not lifecycle.ready
+
+def test_shutdown_waits_for_requests_then_stops_in_reverse_order():
+    lifecycle = Lifecycle()
+    stopped = []
+
+    def stopper(name):
+        async def stop(timeout):
+            stopped.append((name, lifecycle.in_flight))
+        return stop
+
+    lifecycle.on_shutdown("database", stopper("database"))
+    lifecycle.on_shutdown("workers", stopper("workers"))
+
+    async def scenario():
+        lifecycle.in_flight = 1
+        lifecycle._idle.clear()
+
+        async def finish_request():
+            await asyncio.sleep(0.05)
+            lifecycle.in_flight = 0
+            lifecycle._idle.set()
+
+        asyncio.create_task(finish_request())
+        await lifecycle.shutdown(timeout=5)
+
+    asyncio.run(scenario())
+    assert stopped == [("workers", 0), ("database", 0)]
+    assert lifecycle.state == "stopped"
+
+def test_shutdown_respects_deadline():
+    lifecycle = Lifecycle()
+    stopped = []
+
+    async def hang(timeout):
+        await asyncio.sleep(60)
+
+    async def record(timeout):
+        stopped.append(timeout)
+
+    lifecycle.on_shutdown("database", record)
+    lifecycle.on_shutdown("stuck", hang)
+
+    async def scenario():
+        lifecycle.in_flight = 1
+        lifecycle._idle.clear()
+        await lifecycle.shutdown(timeout=0.1)
+
+    start = time.monotonic()
+    asyncio.run(scenario())
+    # The stuck step gets the remaining budget plus a second, then is abandoned
+    assert time.monotonic() - start < 2
+    assert stopped == [0]
@@ -0,0 +1,155 @@
+import asyncio
+
+import httpx
+from fastapi import FastAPI
+
+from src.api.middleware.load_shed import AdaptiveLimit, LoadShedder, LoadShedMiddleware, Shed
+
+TIERS = {
+    "enterprise": {"share": 1.0, "queue": 8, "timeout": 1.0},
+    "pro": {"share": 0.9, "queue": 8, "timeout": 1.0},
+    "free": {"share": 0.5, "queue": 1, "timeout": 0.05},
+}
+
+def fixed(limit):
+    return AdaptiveLimit(initial=limit, min_limit=limit, max_limit=limit)
+
+def test_limit_grows_while_fast_and_backs_off_once_per_round():
+    limit = AdaptiveLimit(initial=10, min_limit=2, max_limit=100, tolerance=2.0, backoff=0.5, slack=0)
+    for i in range(100):
+        limit.sample(started=i, latency=0.01, in_flight=10)
+    assert limit.limit > 15
+
+    grown = limit.limit
+    # Several slow responses from the same round cut only once
+    for _ in range(5):
+        limit.sample(started=100.0, latency=0.05, in_flight=10)
+    assert limit.limit == grown / 2
+
+    # Fast responses while the limit is mostly idle grow it back to where
+    # it started, but no further
+    for i in range(2000):
+        limit.sample(started=101.0 + i, latency=0.01, in_flight=1)
+    assert limit.limit == 10
+
+def test_slow_routes_under_light_traffic_keep_the_limit():
+    limit = AdaptiveLimit(initial=32, min_limit=4, max_limit=256, tolerance=2.0, backoff=0.9, slack=0.005)
+    now = 0.0
+    # Cheap reads, with the odd Stripe call and archive upload in between
+    for i in range(3000):
+        route, latency = [("GET /api/workspaces/{workspace_id}", 0.004), ("GET /api/events", 0.002),
+                          ("POST /api/billing/create-subscription", 0.8)][i % 3]
+        limit.sample(started=now, latency=latency * (1 + (i % 7) / 10), in_flight=1 + i % 2, route=route)
+        now += 0.05
+    assert limit.limit >= 32
+
+    # Real saturation: the cheap read queues behind everything else
+    for i in range(50):
+        limit.sample(started=now, latency=0.05, in_flight=32, route="GET /api/workspaces/{workspace_id}")
+        now += 0.06
+    saturated = limit.limit
+    assert saturated < 16
+
+    # Load drops away and the limit recovers without needing to be saturated
+    for i in range(2000):
+        limit.sample(started=now, latency=0.004, in_flight=1, route="GET /api/workspaces/{workspace_id}")
+        now += 0.05
+    assert limit.limit == 32
+
+def test_paid_tiers_get_the_last_slots_and_go_first():
+    shedder = LoadShedder(fixed(4), TIERS)
+    order = []
+
+    async def request(tier, name):
+        await shedder.acquire(tier)
+        order.append(name)
+
+    async def scenario():
+        # Free may fill half the limit; the rest is kept for paid tiers
+        await shedder.acquire("free")
+        await shedder.acquire("free")
+        try:
+            await shedder.acquire("free")
+        except Shed as e:
+            assert e.reason == "timeout"
+        await shedder.acquire("pro")
+        await shedder.acquire("enterprise")
+
+        waiting = [asyncio.create_task(request("pro", "pro")),
+                   asyncio.create_task(request("enterprise", "enterprise"))]
+        await asyncio.sleep(0)
+        shedder.release()
+        shedder.release()
+        await asyncio.gather(*waiting)
+
+    asyncio.run(scenario())
+
+    assert order == ["enterprise", "pro"]
+    assert shedder.in_flight == 4
+
+def test_full_queue_and_timeout_shed():
+    shedder = LoadShedder(fixed(2), TIERS)
+
+    async def scenario():
+        await shedder.acquire("free")
+        queued = asyncio.create_task(shedder.acquire("free"))
+        await asyncio.sleep(0)
+        reasons = []
+        for attempt in (shedder.acquire("anonymous"), queued):
+            try:
+                await attempt
+            except Shed as e:
+                reasons.append(e.reason)
+        return reasons
+
+    assert asyncio.run(scenario()) == ["queue_full", "timeout"]
+    assert shedder.in_flight == 1
+
+def test_middleware_answers_503_and_releases_at_first_byte():
+    shedder = LoadShedder(fixed(2), TIERS)
+    app = FastAPI()
+    gate = asyncio.Event()
+
+    @app.get("/slow")
+    async def slow():
+        await gate.wait()
+        return {"ok": True}
+
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy"}
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: str):
+        return {"id": item_id}
+
+    app.add_middleware(LoadShedMiddleware, shedder=shedder,
+                       classify=lambda scope: "pro" if b"tier=pro" in scope["query_string"] else "free",
+                       enabled=True)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            busy = asyncio.create_task(client.get("/slow"))
+            await asyncio.sleep(0.01)
+            shed = await client.get("/slow")
+            exempt = await client.get("/health")
+            paid = asyncio.create_task(client.get("/slow?tier=pro"))
+            await asyncio.sleep(0.01)
+            gate.set()
+            await busy
+            await paid
+            for i in range(3):
+                await client.get(f"/items/{i}")
+            await client.get("/missing")
+            return shed, exempt, busy.result(), paid.result()
+
+    shed, exempt, busy, paid = asyncio.run(scenario())
+
+    assert shed.status_code == 503
+    assert shed.headers["retry-after"] == "1"
+    assert shed.json()["reason"] == "timeout"
+    assert exempt.status_code == busy.status_code == paid.status_code == 200
+    assert shedder.in_flight == 0
+    # Latency is tracked per route template, not per concrete path
+    assert set(shedder.limit._baselines) == {"GET /slow", "GET /items/{item_id}", "unmatched"}
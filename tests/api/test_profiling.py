@@ -0,0 +1,115 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from src.api.profiling import Profiler, SamplingProfiler, collect_spans, folded, span
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+def test_sampler_counts_busy_stacks_and_skips_idle_threads():
+    stop = threading.Event()
+    busy = threading.Thread(target=busy_loop, args=(stop,), name="busy")
+    parked = threading.Thread(target=threading.Event().wait, args=(1,), name="parked", daemon=True)
+    sampler = SamplingProfiler(interval=0.002)
+    busy.start()
+    parked.start()
+    sampler.start()
+    time.sleep(0.3)
+    sampler.stop()
+    stop.set()
+    busy.join()
+
+    output = folded(sampler.stacks)
+    lines = output.splitlines()
+    assert sampler.samples > 10
+    assert any(line.startswith("busy;") and "busy_loop (test_profiling.py:" in line for line in lines)
+    assert not any(line.startswith("parked;") for line in lines)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+def test_spans_are_totalled_per_request_across_threads():
+    def query():
+        with span("db"):
+            time.sleep(0.01)
+
+    async def handler():
+        with collect_spans() as spans:
+            await asyncio.gather(asyncio.to_thread(query), asyncio.to_thread(query))
+            with span("docker.get"):
+                pass
+        return spans
+
+    spans = asyncio.run(handler())
+    with span("db"):
+        pass
+
+    assert spans["db"][0] == 2 and spans["db"][1] >= 0.02
+    assert spans["docker.get"][0] == 1
+
+def test_one_profile_at_a_time():
+    profiler = Profiler()
+
+    async def scenario():
+        first = asyncio.create_task(profiler.profile(0.1, interval=0.01))
+        await asyncio.sleep(0.01)
+        with pytest.raises(HTTPException) as busy:
+            await profiler.profile(0.1)
+        with pytest.raises(HTTPException) as too_long:
+            await profiler.profile(3600)
+        return await first, busy.value.status_code, too_long.value.status_code
+
+    sampler, busy, too_long = asyncio.run(scenario())
+
+    assert sampler.samples > 0
+    assert (busy, too_long) == (409, 400)
+
+def test_continuous_profiles_are_written_and_pruned(tmp_path):
+    profiler = Profiler(str(tmp_path), interval=0.002, period=0.05, keep=2)
+    stop = threading.Event()
+    busy = threading.Thread(target=busy_loop, args=(stop,))
+    busy.start()
+
+    async def scenario():
+        profiler.start()
+        await asyncio.sleep(0.35)
+        await profiler.stop()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        stop.set()
+        busy.join()
+
+    files = profiler.files()
+    assert len(files) == 2
+    assert all(f"-{os.getpid()}-" in path.name for path in files)
+    assert "busy_loop" in files[-1].read_text()
+
+def test_admin_endpoints_check_the_users_table(monkeypatch):
+    from src.api import main
+    from tests.fakes.database import InMemoryDatabase
+
+    db = InMemoryDatabase()
+    db.add_user("admin-1", is_admin=True)
+    db.add_user("user-1")
+    monkeypatch.setattr(main, "get_database", lambda: db)
+
+    async def scenario():
+        allowed = await main.verify_admin({"user_id": "admin-1"})
+        refused = []
+        # A role claim in the token is not enough
+        for claims in ({"user_id": "user-1", "role": "admin"}, {"user_id": "unknown"}):
+            with pytest.raises(HTTPException) as denied:
+                await main.verify_admin(claims)
+            refused.append(denied.value.status_code)
+        return allowed, refused
+
+    allowed, refused = asyncio.run(scenario())
+
+    assert allowed["user_id"] == "admin-1"
+    assert refused == [403, 403]
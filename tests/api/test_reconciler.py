@@ -0,0 +1,100 @@
+import asyncio
+
+from src.api.workspaces.reconciler import Reconciler, expected_status
+from tests.fakes.docker_client import FakeDockerClient
+
+class FakeDatabase:
+    """workspaces table keyed by id: {"status": ..., "age": seconds}"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = 0
+
+    async def fetchall(self, sql, params=()):
+        self.queries += 1
+        (container_ids,) = params
+        return [
+            {"id": workspace_id, "status": row["status"], "age": row["age"]}
+            for workspace_id, row in self.rows.items()
+            if row["status"] != "error" or workspace_id in container_ids
+        ]
+
+    async def execute(self, sql, params=()):
+        assert sql.strip().startswith("UPDATE workspaces w SET status")
+        updated = 0
+        for workspace_id, seen, status in zip(*params):
+            row = self.rows.get(workspace_id)
+            if row is not None and row["status"] == seen:
+                row["status"] = status
+                updated += 1
+        return updated
+
+def add_container(client, workspace_id, status="running"):
+    container = client.containers.run("img", name=f"claude-workspace-{workspace_id}",
+                                      labels={"claudeosaar.workspace_id": workspace_id})
+    container.status = status
+    container.attrs["Created"] = "2020-01-01T00:00:00.000000000Z"
+    return container
+
+def test_expected_status():
+    assert expected_status("running", "hibernated") == "running"
+    assert expected_status("paused", "running") == "hibernated"
+    assert expected_status("exited", "hibernated") == "hibernated"
+    assert expected_status("exited", "running") == "stopped"
+    assert expected_status("dead", "running") == "error"
+    assert expected_status("restarting", "running") == "running"
+
+def test_reconcile_removes_orphans_and_fixes_statuses():
+    client = FakeDockerClient()
+    add_container(client, "w-ok")
+    add_container(client, "w-exited", status="exited")
+    add_container(client, "w-orphan")
+    db = FakeDatabase({
+        "w-ok": {"status": "running", "age": 3600},
+        "w-exited": {"status": "running", "age": 3600},
+        "w-lost": {"status": "hibernated", "age": 3600},
+        "w-new": {"status": "running", "age": 5},
+    })
+    released = []
+
+    asyncio.run(Reconciler(client, db, released=released.append).reconcile())
+
+    assert [c.name for c in client.containers.list(all=True)] == [
+        "claude-workspace-w-ok", "claude-workspace-w-exited"
+    ]
+    assert released == ["claude-workspace-w-orphan"]
+    assert {k: v["status"] for k, v in db.rows.items()} == {
+        "w-ok": "running", "w-exited": "stopped", "w-lost": "error", "w-new": "running"
+    }
+    assert db.queries == 1
+
+def test_young_containers_are_not_orphans():
+    client = FakeDockerClient()
+    client.containers.run("img", name="claude-workspace-w1", labels={"claudeosaar.workspace_id": "w1"})
+
+    plan = asyncio.run(Reconciler(client, FakeDatabase({})).reconcile())
+    assert plan.orphans == []
+    assert len(client.containers.list()) == 1
+
+def test_dry_run_changes_nothing():
+    client = FakeDockerClient()
+    add_container(client, "w-orphan")
+    db = FakeDatabase({"w-lost": {"status": "running", "age": 3600}})
+
+    plan = asyncio.run(Reconciler(client, db, dry_run=True).reconcile())
+
+    assert plan.summary() == {
+        "orphans": ["claude-workspace-w-orphan"],
+        "status_fixes": {"w-lost": "running -> error"},
+    }
+    assert len(client.containers.list()) == 1
+    assert db.rows["w-lost"]["status"] == "running"
+
+def test_removals_capped_per_pass():
+    client = FakeDockerClient()
+    for i in range(5):
+        add_container(client, f"w{i}")
+
+    reconciler = Reconciler(client, FakeDatabase({}), max_removals=2, removal_delay=0)
+    asyncio.run(reconciler.reconcile())
+    assert len(client.containers.list()) == 3
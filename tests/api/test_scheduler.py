@@ -0,0 +1,98 @@
+import docker
+import pytest
+
+from src.api.workspaces.scheduler import DockerNode, NoCapacityError, NodesUnavailable, WorkspaceScheduler
+from tests.fakes.docker_client import FakeDockerClient
+
+GB = 1024 ** 3
+
+def make_scheduler(policy="binpack", **sizes):
+    nodes = [DockerNode(name, FakeDockerClient(mem_total=gb * GB, ncpu=8), headroom=0)
+             for name, gb in sizes.items()]
+    return WorkspaceScheduler(nodes, policy=policy)
+
+def run(scheduler, name, mem_limit="2g", cpu_quota=100000):
+    return scheduler.containers.run(
+        "claudeosaar/workspace:latest", name=name, mem_limit=mem_limit, cpu_quota=cpu_quota,
+        labels={"claudeosaar.workspace_id": name}, detach=True
+    )
+
+def test_binpack_fills_one_node_before_the_next():
+    scheduler = make_scheduler(a=8, b=8)
+    for i in range(4):
+        run(scheduler, f"w{i}")
+
+    placements = {scheduler.locate(f"w{i}").name for i in range(4)}
+    assert len(placements) == 1
+    full = scheduler.nodes[placements.pop()]
+    assert full.free_memory == 0
+
+    run(scheduler, "w4")
+    assert scheduler.locate("w4") is not full
+
+def test_spread_balances_across_nodes():
+    scheduler = make_scheduler(policy="spread", a=8, b=8)
+    for i in range(4):
+        run(scheduler, f"w{i}")
+
+    assert scheduler.nodes["a"].reserved_memory == scheduler.nodes["b"].reserved_memory == 4 * GB
+
+def test_no_capacity_raises_503():
+    scheduler = make_scheduler(a=2)
+    run(scheduler, "w0")
+    with pytest.raises(NoCapacityError) as exc:
+        run(scheduler, "w1")
+    assert exc.value.status_code == 503
+
+def test_failed_run_releases_reservation():
+    scheduler = make_scheduler(a=4)
+    run(scheduler, "w0")
+    with pytest.raises(docker.errors.APIError):
+        run(scheduler, "w0")
+
+    node = scheduler.nodes["a"]
+    assert "w0" not in node.reservations
+    # The original container is still found on refresh
+    scheduler.refresh()
+    assert node.reserved_memory == 2 * GB
+
+def test_get_routes_to_owning_node():
+    scheduler = make_scheduler(a=4, b=4)
+    run(scheduler, "w0", mem_limit="4g")
+    run(scheduler, "w1", mem_limit="4g")
+
+    for name in ("w0", "w1"):
+        node = scheduler.locate(name)
+        assert scheduler.containers.get(name) is node.client.containers.get(name)
+
+    # A fresh scheduler finds containers by asking every node
+    fresh = WorkspaceScheduler(list(scheduler.nodes.values()))
+    assert fresh.containers.get("w1").name == "w1"
+    with pytest.raises(docker.errors.NotFound):
+        fresh.containers.get("missing")
+
+def test_refresh_keeps_pending_and_drops_removed():
+    scheduler = make_scheduler(a=8)
+    run(scheduler, "w0")
+    node = scheduler.nodes["a"]
+    # A concurrent creation that the daemon does not list yet
+    scheduler.reserve("w1", 2 * GB, 1.0)
+    node.client.containers.get("w0").remove(force=True)
+
+    scheduler.refresh()
+    assert set(node.reservations) == {"w1"}
+    assert node.free_memory == 6 * GB
+
+def test_list_refuses_to_pass_off_a_partial_listing():
+    scheduler = make_scheduler(a=4, b=4)
+    run(scheduler, "w0", mem_limit="4g")
+    run(scheduler, "w1", mem_limit="4g")
+    down = scheduler.locate("w1")
+    down.client.containers.list = lambda **kwargs: (_ for _ in ()).throw(docker.errors.APIError("unreachable"))
+
+    with pytest.raises(NodesUnavailable) as exc:
+        scheduler.containers.list(all=True)
+
+    assert exc.value.status_code == 503
+    assert set(exc.value.failed) == {down.name}
+    assert [c.name for c in exc.value.containers] == ["w0"]
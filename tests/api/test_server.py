@@ -0,0 +1,80 @@
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import pytest
+
+from src.api.server import bind_socket, build_config
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def test_build_config_resolves_auto_choices():
+    config = build_config("tests.fakes.asgi_app:app", loop="auto", http="auto", backlog=128)
+    assert config.loop in ("uvloop", "asyncio")
+    assert config.http in ("httptools", "h11")
+    assert config.backlog == 128
+
+    config = build_config("tests.fakes.asgi_app:app", loop="asyncio", http="h11")
+    assert (config.loop, config.http) == ("asyncio", "h11")
+
+def test_accepted_connections_disable_nagle():
+    listener = bind_socket(build_config("tests.fakes.asgi_app:app", host="127.0.0.1", port=0))
+    nodelay = []
+
+    async def scenario():
+        async def accepted(reader, writer):
+            sock = writer.get_extra_info("socket")
+            nodelay.append(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY))
+            writer.close()
+
+        server = await asyncio.start_server(accepted, sock=listener)
+        async with server:
+            _, writer = await asyncio.open_connection(*listener.getsockname()[:2])
+            while not nodelay:
+                await asyncio.sleep(0.01)
+            writer.close()
+
+    asyncio.run(scenario())
+    assert nodelay == [1]
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def get(port, path="/"):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=5) as response:
+        return response.read().decode()
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="pre-fork supervisor needs fork")
+def test_workers_share_socket_and_aggregate_metrics(tmp_path):
+    port = free_port()
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path), SHUTDOWN_DRAIN_DELAY="0")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "src.api.server", "--app", "tests.fakes.asgi_app:app",
+         "--host", "127.0.0.1", "--port", str(port), "--workers", "2", "--loop", "asyncio"],
+        cwd=ROOT, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+    )
+    try:
+        deadline = time.monotonic() + 20
+        while True:
+            try:
+                get(port)
+                break
+            except OSError:
+                if time.monotonic() > deadline or process.poll() is not None:
+                    pytest.fail(process.stdout.read().decode() if process.poll() is not None else "no response")
+                time.sleep(0.1)
+
+        pids = {get(port) for _ in range(40)}
+        assert len(pids) <= 2
+        # 41 requests in total, whichever worker served them
+        assert "fake_app_requests_total 41.0" in get(port, "/metrics")
+    finally:
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=30) == 0
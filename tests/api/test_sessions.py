@@ -0,0 +1,141 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from src.api.sessions import SESSION_REVOKED_KEY, SessionStore
+from tests.fakes.database import InMemoryDatabase
+from tests.fakes.redis_client import FakeRedis, FakeRedisServer
+
+def payload(user_id="user-1", ttl=3600):
+    return {"user_id": user_id, "exp": int(time.time()) + ttl}
+
+def replicas(db, server, count=2):
+    return [SessionStore(db, get_redis=lambda r=FakeRedis(server): r, flush_interval=0.05) for _ in range(count)]
+
+def test_logout_reaches_every_process():
+    db, server = InMemoryDatabase(), FakeRedisServer()
+    first, second = replicas(db, server)
+    claims = payload()
+
+    async def scenario():
+        first.start()
+        second.start()
+        await asyncio.sleep(0.05)
+        second.check("token-a", claims)
+        await first.revoke("token-a", claims)
+        await asyncio.sleep(0.05)
+        revoked = second.is_revoked("token-a")
+        with pytest.raises(HTTPException) as refused:
+            second.check("token-a", claims)
+        second.check("token-b", claims)
+        await first.stop()
+        await second.stop()
+        return revoked, refused.value
+
+    revoked, refused = asyncio.run(scenario())
+
+    assert revoked
+    assert refused.status_code == 401 and refused.detail == "Token revoked"
+    assert len(db.sessions) == 2
+    assert sum(row["revoked_at"] is not None for row in db.sessions.values()) == 1
+
+def test_logout_all_includes_tokens_not_yet_recorded():
+    db = InMemoryDatabase()
+    store = SessionStore(db)
+
+    async def scenario():
+        store.check("token-a", payload())
+        store.check("token-b", payload())
+        store.check("token-c", payload("user-2"))
+        await store.flush()
+        store.check("token-d", payload())
+        active = await store.list("user-1")
+        revoked = await store.revoke_all("user-1")
+        return active, revoked
+
+    active, revoked = asyncio.run(scenario())
+
+    assert len(active) == 3
+    assert revoked == 3
+    assert [store.is_revoked(t) for t in ("token-a", "token-b", "token-c", "token-d")] == [True, True, False, True]
+
+def test_logout_all_refuses_tokens_never_seen_on_every_process():
+    db, server = InMemoryDatabase(), FakeRedisServer()
+    first, second = replicas(db, server)
+    issued = time.time() - 60
+    # Never used before logout-all, so not in the sessions table
+    unseen = {"user_id": "user-1", "iat": int(issued), "exp": int(issued) + 3600}
+    # No iat: issued token_lifetime before exp
+    legacy = {"user_id": "user-1", "exp": int(issued + second.token_lifetime)}
+
+    async def scenario():
+        first.start()
+        second.start()
+        await asyncio.sleep(0.05)
+        await first.revoke_all("user-1")
+        await asyncio.sleep(0.05)
+        refused = []
+        for token, claims in (("token-a", unseen), ("token-b", legacy)):
+            with pytest.raises(HTTPException) as denied:
+                second.check(token, claims)
+            refused.append(denied.value.status_code)
+        # Logging in again afterwards, and other users, are unaffected
+        second.check("token-c", payload("user-2"))
+        second.check("token-d", {"user_id": "user-1", "iat": int(time.time()) + 1, "exp": int(time.time()) + 3600})
+        await first.stop()
+        await second.stop()
+
+        # Without Redis a new process gets the cutoff from Postgres
+        fresh = SessionStore(db)
+        await fresh.load()
+        with pytest.raises(HTTPException):
+            fresh.check("token-a", unseen)
+        return refused
+
+    assert asyncio.run(scenario()) == [401, 401]
+    assert len(db.sessions) == 2
+
+def test_new_process_loads_revocations_from_redis_or_postgres():
+    db, server = InMemoryDatabase(), FakeRedisServer()
+    claims = payload()
+
+    async def scenario():
+        await SessionStore(db, get_redis=lambda r=FakeRedis(server): r).revoke("token-a", claims)
+        await SessionStore(db).revoke("token-b", claims)
+
+        from_redis = SessionStore(InMemoryDatabase(), get_redis=lambda r=FakeRedis(server): r)
+        await from_redis.load()
+        from_postgres = SessionStore(db)
+        await from_postgres.load()
+
+        # Redis lost its data: the periodic sync restores it from Postgres
+        server.data.pop(SESSION_REVOKED_KEY)
+        repairing = SessionStore(db, get_redis=lambda r=FakeRedis(server): r)
+        await repairing.sync()
+        restored = await FakeRedis(server).zrangebyscore(SESSION_REVOKED_KEY, 0, "+inf")
+        return from_redis, from_postgres, restored
+
+    from_redis, from_postgres, restored = asyncio.run(scenario())
+
+    assert from_redis.is_revoked("token-a") and not from_redis.is_revoked("token-b")
+    assert from_postgres.is_revoked("token-a") and from_postgres.is_revoked("token-b")
+    assert len(restored) == 2
+
+def test_expired_revocations_are_dropped():
+    store = SessionStore(InMemoryDatabase())
+    store._add([("old", time.time() - 1), ("new", time.time() + 60)])
+    store._revoked["stale"] = time.time() - 1
+    store._prune()
+    assert set(store._revoked) == {"new"}
+
+def test_check_is_cheap():
+    store = SessionStore(InMemoryDatabase())
+    claims = payload()
+    store.check("token-a", claims)
+    start = time.perf_counter()
+    for _ in range(10000):
+        store.check("token-a", claims)
+    # A hash and two lookups; generous bound for slow CI machines
+    assert (time.perf_counter() - start) / 10000 < 50e-6
@@ -0,0 +1,181 @@
+import asyncio
+import io
+import os
+import random
+
+import pytest
+from fastapi import HTTPException
+
+from src.api.workspaces.snapshots import Chunker, SnapshotManager
+
+def make_manager(tmp_path, **kwargs):
+    workspace = tmp_path / "mounts" / "user-1" / "w"
+    workspace.mkdir(parents=True)
+    manager = SnapshotManager(root=str(tmp_path / "store"), mounts_root=str(tmp_path / "mounts"),
+                              chunker=Chunker(min_size=1024, avg_size=4096, max_size=16384), **kwargs)
+    return manager, workspace
+
+def payload(size, seed=0):
+    return random.Random(seed).randbytes(size)
+
+def test_chunk_boundaries_survive_an_insertion():
+    chunker = Chunker(min_size=1024, avg_size=4096, max_size=16384)
+    data = payload(400 * 1024)
+    chunks = list(chunker.split(io.BytesIO(data)))
+    shifted = list(chunker.split(io.BytesIO(b"inserted" + data)))
+
+    assert b"".join(chunks) == data
+    assert all(1024 <= len(c) <= 16384 for c in chunks[:-1])
+    # Only the chunk holding the insertion differs
+    assert len(set(chunks) - set(shifted)) == 1
+
+def test_worker_processes_find_the_same_boundaries():
+    data = payload(400 * 1024)
+    local = Chunker(min_size=1024, avg_size=4096, max_size=16384, processes=0)
+    pooled = Chunker(min_size=1024, avg_size=4096, max_size=16384, processes=2)
+    try:
+        chunks = list(pooled.split(io.BytesIO(data)))
+        assert pooled._pool is not None
+    finally:
+        pooled.close()
+
+    assert chunks == list(local.split(io.BytesIO(data)))
+
+def test_second_snapshot_stores_only_changed_files(tmp_path):
+    manager, workspace = make_manager(tmp_path)
+    (workspace / "src").mkdir()
+    (workspace / "src" / "big.bin").write_bytes(payload(200 * 1024))
+    (workspace / "notes.txt").write_text("v1")
+
+    async def scenario():
+        first = await manager.create("user-1", "w", "pro")
+        (workspace / "notes.txt").write_text("v2 with more text")
+        second = await manager.create("user-1", "w", "pro", name="after edit")
+        return first, second
+
+    first, second = asyncio.run(scenario())
+
+    assert first["new_bytes"] > 0
+    assert second["changed_bytes"] == len("v2 with more text")
+    assert second["parent"] == first["id"]
+    assert second["name"] == "after edit"
+
+def test_restore_rolls_back_and_skips_matching_files(tmp_path):
+    manager, workspace = make_manager(tmp_path)
+    (workspace / "keep.bin").write_bytes(payload(100 * 1024, seed=1))
+    (workspace / "edit.txt").write_text("original")
+    os.symlink("keep.bin", workspace / "link")
+
+    async def scenario():
+        snapshot = await manager.create("user-1", "w", "pro")
+        (workspace / "edit.txt").write_text("changed")
+        (workspace / "new").mkdir()
+        (workspace / "new" / "file").write_text("x")
+        (workspace / "link").unlink()
+        return await manager.restore("user-1", "w", snapshot["id"])
+
+    result = asyncio.run(scenario())
+
+    assert (workspace / "edit.txt").read_text() == "original"
+    assert (workspace / "keep.bin").read_bytes() == payload(100 * 1024, seed=1)
+    assert os.readlink(workspace / "link") == "keep.bin"
+    assert not (workspace / "new").exists()
+    # keep.bin was untouched, so only edit.txt was rewritten
+    assert result["restored_bytes"] == len("original")
+
+def test_garbage_collection_frees_chunks_of_deleted_snapshots(tmp_path):
+    manager, workspace = make_manager(tmp_path, gc_grace=0)
+    (workspace / "a.bin").write_bytes(payload(50 * 1024, seed=2))
+
+    async def scenario():
+        first = await manager.create("user-1", "w", "pro")
+        (workspace / "a.bin").write_bytes(payload(50 * 1024, seed=3))
+        second = await manager.create("user-1", "w", "pro")
+        assert manager.collect_garbage()["removed"] == 0
+        await manager.delete("user-1", "w", first["id"])
+        collected = manager.collect_garbage()
+        await manager.restore("user-1", "w", second["id"])
+        return collected
+
+    collected = asyncio.run(scenario())
+
+    assert collected["removed"] > 0
+    assert (workspace / "a.bin").read_bytes() == payload(50 * 1024, seed=3)
+
+def test_limits_and_unknown_snapshots(tmp_path):
+    manager, workspace = make_manager(tmp_path, limits={"free": 1})
+
+    async def scenario():
+        await manager.create("user-1", "w", "free")
+        with pytest.raises(HTTPException) as error:
+            await manager.create("user-1", "w", "free")
+        assert error.value.status_code == 403
+        for snapshot_id in ("../../w", "0000000000000-00000000"):
+            with pytest.raises(HTTPException) as error:
+                await manager.restore("user-1", "w", snapshot_id)
+            assert error.value.status_code == 404
+
+    asyncio.run(scenario())
+
+def swap_for_symlink(directory, target):
+    """What a container can do to its bind mount at any moment"""
+    for child in directory.iterdir():
+        child.unlink()
+    directory.rmdir()
+    os.symlink(target, directory)
+
+def test_restore_never_writes_through_a_swapped_in_symlink(tmp_path):
+    manager, workspace = make_manager(tmp_path, threads=1)
+    host = tmp_path / "host"
+    host.mkdir()
+    (host / "f.txt").write_text("host file")
+    os.chmod(host / "f.txt", 0o600)
+    (workspace / "a.txt").write_text("a")
+    (workspace / "sub").mkdir()
+    (workspace / "sub" / "f.txt").write_text("workspace file")
+    os.chmod(workspace / "sub" / "f.txt", 0o777)
+
+    async def scenario():
+        snapshot = await manager.create("user-1", "w", "pro")
+        (workspace / "a.txt").write_text("changed")
+        (workspace / "sub" / "f.txt").write_text("changed too")
+        get = manager.store.get
+
+        def get_then_swap(digest):
+            # Restoring a.txt; sub/f.txt is next
+            if (workspace / "sub").is_dir() and not (workspace / "sub").is_symlink():
+                swap_for_symlink(workspace / "sub", host)
+            return get(digest)
+
+        manager.store.get = get_then_swap
+        with pytest.raises(OSError):
+            await manager.restore("user-1", "w", snapshot["id"])
+
+    asyncio.run(scenario())
+
+    assert (host / "f.txt").read_text() == "host file"
+    assert os.stat(host / "f.txt").st_mode & 0o777 == 0o600
+    assert sorted(os.listdir(host)) == ["f.txt"]
+
+def test_snapshot_never_reads_through_a_swapped_in_symlink(tmp_path):
+    manager, workspace = make_manager(tmp_path, threads=1)
+    host = tmp_path / "host"
+    host.mkdir()
+    (host / "f.txt").write_bytes(b"host secret" * 100)
+    (workspace / "a.txt").write_text("a")
+    (workspace / "sub").mkdir()
+    (workspace / "sub" / "f.txt").write_text("workspace file")
+    put = manager.store.put
+    stored = []
+
+    def put_then_swap(data):
+        stored.append(data)
+        if (workspace / "sub").is_dir() and not (workspace / "sub").is_symlink():
+            swap_for_symlink(workspace / "sub", host)
+        return put(data)
+
+    manager.store.put = put_then_swap
+    with pytest.raises(OSError):
+        asyncio.run(manager.create("user-1", "w", "pro"))
+
+    assert b"host secret" * 100 not in stored
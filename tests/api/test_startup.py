@@ -0,0 +1,19 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def test_importing_app_defers_sdks_and_side_effects(tmp_path):
+    code = (
+        "import json, os, sys\n"
+        "from src.api.main import app\n"
+        "print(json.dumps({'modules': [m for m in ('docker', 'stripe', 'jwt', 'psycopg2') if m in sys.modules],"
+        " 'logs': os.path.exists(os.environ['LOG_DIR'])}))\n"
+    )
+    env = dict(os.environ, LOG_DIR=str(tmp_path / "logs"), DOCKER_HOST="unix:///nonexistent.sock")
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+
+    assert json.loads(result.stdout.splitlines()[-1]) == {"modules": [], "logs": False}
@@ -0,0 +1,192 @@
+import asyncio
+import json
+import socket
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from src.api.workspaces.terminal import TerminalProxy
+
+class FakeTtyApi:
+    """Exec API whose TTY socket is one end of a socketpair"""
+
+    def __init__(self):
+        self.api_side, self.container_side = socket.socketpair()
+        self.resizes = []
+        self.exec_kwargs = None
+
+    def exec_create(self, container_id, cmd, **kwargs):
+        self.exec_kwargs = kwargs
+        return {"Id": "exec-1"}
+
+    def exec_start(self, exec_id, tty=False, socket=False):
+        assert tty and socket
+        return self.api_side
+
+    def exec_resize(self, exec_id, height, width):
+        self.resizes.append((width, height))
+
+    def exec_inspect(self, exec_id):
+        return {"ExitCode": 3}
+
+class FakeContainer:
+    def __init__(self, api):
+        self.id = "container-1"
+        self.client = type("Client", (), {"api": api})()
+
+class FakeWebSocket:
+    def __init__(self, blocked=False):
+        self.incoming = asyncio.Queue()
+        self.sent = []
+        self.closed = None
+        self.unblocked = asyncio.Event()
+        if not blocked:
+            self.unblocked.set()
+
+    async def receive(self):
+        return await self.incoming.get()
+
+    async def send_bytes(self, data):
+        await self.unblocked.wait()
+        self.sent.append(data)
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+    async def close(self, code=1000):
+        self.closed = code
+
+def test_relays_input_resizes_and_reports_exit():
+    api = FakeTtyApi()
+    received = bytearray()
+
+    def container():
+        while not received.endswith(b"pwd\n"):
+            received.extend(api.container_side.recv(1024))
+        api.container_side.sendall(b"/workspace\r\n")
+        api.container_side.close()
+
+    async def scenario():
+        websocket = FakeWebSocket()
+        for message in ({"type": "websocket.receive", "bytes": b"ls\n"},
+                        {"type": "websocket.receive", "text": '{"type": "resize", "cols": 120, "rows": 40}'},
+                        {"type": "websocket.receive", "text": '{"type": "input", "data": "pwd"}'},
+                        {"type": "websocket.receive", "text": "\n"}):
+            websocket.incoming.put_nowait(message)
+        thread = threading.Thread(target=container)
+        thread.start()
+        proxy = TerminalProxy()
+        async with proxy.open("user-1", "free", FakeContainer(api), cols=100, rows=30) as session:
+            await proxy.relay(websocket, session)
+        thread.join()
+        return websocket
+
+    websocket = asyncio.run(scenario())
+
+    assert bytes(received) == b"ls\npwd\n"
+    assert api.resizes == [(100, 30), (120, 40)]
+    assert api.exec_kwargs["tty"] and api.exec_kwargs["stdin"]
+    assert b"".join(f for f in websocket.sent if isinstance(f, bytes)) == b"/workspace\r\n"
+    assert websocket.sent[-1] == {"type": "exit", "exit_code": 3}
+    assert websocket.closed == 1000
+
+def test_slow_client_pauses_reading_from_container():
+    api = FakeTtyApi()
+    written = []
+    api.container_side.settimeout(0.5)
+
+    def chatty_process():
+        # Like `cat bigfile`: write until the TTY blocks
+        chunk = b"x" * 65536
+        try:
+            for _ in range(256):
+                api.container_side.sendall(chunk)
+                written.append(len(chunk))
+        except socket.timeout:
+            pass
+
+    async def scenario():
+        websocket = FakeWebSocket(blocked=True)
+        proxy = TerminalProxy(buffer_bytes=64 * 1024)
+        async with proxy.open("user-1", "free", FakeContainer(api)) as session:
+            relay = asyncio.create_task(proxy.relay(websocket, session))
+            await asyncio.to_thread(chatty_process)
+            websocket.incoming.put_nowait({"type": "websocket.disconnect"})
+            await relay
+        return websocket
+
+    websocket = asyncio.run(scenario())
+
+    # 16 MiB offered; only the stream buffer, one frame and the socket
+    # buffers in between were taken before the writer blocked
+    assert sum(written) < 4 * 1024 * 1024
+    assert websocket.sent == []
+
+def test_session_limit_per_user():
+    api = FakeTtyApi()
+
+    async def scenario():
+        proxy = TerminalProxy(limits={"free": 1})
+        async with proxy.open("user-1", "free", FakeContainer(api)):
+            with pytest.raises(HTTPException) as error:
+                async with proxy.open("user-1", "free", FakeContainer(api)):
+                    pass
+            assert error.value.status_code == 429
+        assert not proxy._active
+
+    asyncio.run(scenario())
+
+class TlsLikeSocket:
+    """A socket asyncio cannot adopt, like ssl.SSLSocket to a remote daemon"""
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def recv(self, n):
+        return self.sock.recv(n)
+
+    def sendall(self, data):
+        self.sock.sendall(data)
+
+    def shutdown(self, how):
+        self.sock.shutdown(how)
+
+    def close(self):
+        self.sock.close()
+
+def test_blocking_sockets_use_their_own_bounded_pool():
+    first, second, third = FakeTtyApi(), FakeTtyApi(), FakeTtyApi()
+    for api in (first, second, third):
+        api.api_side = TlsLikeSocket(api.api_side)
+    readers = []
+
+    def container():
+        first.container_side.recv(1024)
+        readers.extend(t.name for t in threading.enumerate() if t.name.startswith("terminal"))
+        first.container_side.sendall(b"ok")
+        first.container_side.close()
+
+    async def scenario():
+        proxy = TerminalProxy(max_blocking=1)
+        websocket = FakeWebSocket()
+        websocket.incoming.put_nowait({"type": "websocket.receive", "bytes": b"ls\n"})
+        thread = threading.Thread(target=container)
+        thread.start()
+        async with proxy.open("user-1", "free", FakeContainer(first)) as session:
+            with pytest.raises(HTTPException) as full:
+                async with proxy.open("user-2", "free", FakeContainer(second)):
+                    pass
+            await proxy.relay(websocket, session)
+        thread.join()
+        # The slot is free again once the session ends
+        async with proxy.open("user-2", "free", FakeContainer(third)):
+            blocking = proxy._blocking
+        return websocket, full.value, blocking, proxy._blocking
+
+    websocket, full, during, after = asyncio.run(scenario())
+
+    assert full.status_code == 503
+    assert readers
+    assert b"".join(f for f in websocket.sent if isinstance(f, bytes)) == b"ok"
+    assert (during, after) == (1, 0)
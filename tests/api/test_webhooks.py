@@ -0,0 +1,197 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.api.billing import webhooks
+from src.api.billing.tiers import TierCache
+from src.api.billing.webhooks import WebhookProcessor, get_webhook_processor
+from tests.fakes.redis_client import FakeRedis, FakeRedisServer
+from tests.fakes.stripe_server import sign_webhook
+
+SECRET = "whsec_test"
+
+class FakeDatabase:
+    """Covers the stripe_events, users and billing_records statements"""
+
+    def __init__(self):
+        self.events = {}
+        self.users = {"user-1": {"stripe_customer_id": "cus_1", "subscription_tier": "free"}}
+        self.billing_records = {}
+
+    async def execute(self, sql, params=()):
+        sql = " ".join(sql.split())
+        if sql.startswith("INSERT INTO stripe_events"):
+            event_id, event_type, payload = params
+            self.events.setdefault(event_id, {"type": event_type, "payload": payload,
+                                              "status": "pending", "attempts": 0})
+        elif sql.startswith("UPDATE stripe_events SET status = 'processed'"):
+            self.events[params[0]]["status"] = "processed"
+        elif sql.startswith("UPDATE stripe_events SET status = 'failed'"):
+            self.events[params[1]]["status"] = "failed"
+        elif sql.startswith("INSERT INTO billing_records"):
+            subscription, invoice, amount, currency, status, customer = params
+            self.billing_records[invoice] = (amount, currency, status)
+        else:
+            raise AssertionError(f"unexpected statement: {sql}")
+        return 1
+
+    async def fetchone(self, sql, params=()):
+        event = self.events.get(params[0])
+        if event is None or event["status"] not in ("pending", "failed"):
+            return None
+        event["status"] = "processing"
+        event["attempts"] += 1
+        return {"type": event["type"], "payload": event["payload"]}
+
+    async def fetchall(self, sql, params=()):
+        if "FROM stripe_events" in sql:
+            return []
+        tier, created_at, customer_id = params[:3]
+        rows = []
+        for user_id, user in self.users.items():
+            applied = user.get("subscription_event_at")
+            if user["stripe_customer_id"] != customer_id:
+                continue
+            if created_at is None or applied is None or applied <= created_at:
+                user["subscription_tier"] = tier
+                user["subscription_event_at"] = created_at or applied
+                rows.append({"id": user_id})
+        return rows
+
+class FakeTierCache:
+    def __init__(self):
+        self.entries = {}
+
+    async def publish(self, user_id, tier):
+        self.entries[user_id] = tier
+
+def event(event_id, event_type, obj, created=None):
+    return {"id": event_id, "type": event_type, "created": created, "data": {"object": obj}}
+
+@pytest.fixture
+def processor():
+    return WebhookProcessor(FakeDatabase(), FakeTierCache(), workers=2, price_ids={"pro": "price_pro"})
+
+def test_duplicate_events_processed_once(processor):
+    subscription = {"customer": "cus_1", "status": "active",
+                    "items": {"data": [{"price": {"id": "price_pro"}}]}}
+
+    async def scenario():
+        processor.start()
+        for _ in range(3):
+            await processor.ingest(event("evt_1", "customer.subscription.updated", subscription))
+        await processor.queue.join()
+        await processor.stop()
+
+    asyncio.run(scenario())
+
+    assert processor.db.events["evt_1"]["attempts"] == 1
+    assert processor.db.events["evt_1"]["status"] == "processed"
+    assert processor.db.users["user-1"]["subscription_tier"] == "pro"
+    assert processor.tiers.entries == {"user-1": "pro"}
+
+def test_cancelled_subscription_downgrades(processor):
+    processor.db.users["user-1"]["subscription_tier"] = "enterprise"
+
+    async def scenario():
+        await processor.ingest(event("evt_2", "customer.subscription.deleted", {"customer": "cus_1"}))
+        return await processor.process("evt_2")
+
+    assert asyncio.run(scenario())
+    assert processor.db.users["user-1"]["subscription_tier"] == "free"
+
+def test_out_of_order_subscription_events_keep_the_newest(processor):
+    incomplete = {"customer": "cus_1", "status": "incomplete",
+                  "items": {"data": [{"price": {"id": "price_pro"}}]}}
+    active = dict(incomplete, status="active")
+
+    async def scenario():
+        # Stripe sent created, then updated once the first invoice was paid;
+        # they arrive (or finish processing) the other way round
+        await processor.ingest(event("evt_u", "customer.subscription.updated", active, created=1_700_000_060))
+        await processor.ingest(event("evt_c", "customer.subscription.created", incomplete, created=1_700_000_000))
+        await processor.process("evt_u")
+        await processor.process("evt_c")
+
+    asyncio.run(scenario())
+
+    assert processor.db.users["user-1"]["subscription_tier"] == "pro"
+    assert processor.tiers.entries == {"user-1": "pro"}
+    assert all(e["status"] == "processed" for e in processor.db.events.values())
+
+def test_invoice_recorded_in_major_units(processor):
+    invoice = {"id": "in_1", "customer": "cus_1", "subscription": "sub_1",
+               "amount_paid": 2900, "currency": "eur"}
+
+    async def scenario():
+        await processor.ingest(event("evt_3", "invoice.paid", invoice))
+        await processor.process("evt_3")
+
+    asyncio.run(scenario())
+    amount, currency, status = processor.db.billing_records["in_1"]
+    assert (str(amount), currency, status) == ("29", "EUR", "paid")
+
+def test_stop_drains_queued_events(processor):
+    subscription = {"customer": "cus_1", "status": "active",
+                    "items": {"data": [{"price": {"id": "price_pro"}}]}}
+
+    async def scenario():
+        processor.start()
+        for i in range(5):
+            await processor.ingest(event(f"evt_d{i}", "customer.subscription.updated", subscription))
+        await processor.stop(timeout=5)
+
+    asyncio.run(scenario())
+    assert all(e["status"] == "processed" for e in processor.db.events.values())
+
+class RecordingProcessor:
+    def __init__(self):
+        self.events = []
+
+    async def ingest(self, event):
+        self.events.append(event)
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(webhooks, "STRIPE_WEBHOOK_SECRET", SECRET)
+    recorder = RecordingProcessor()
+    app = FastAPI()
+    app.include_router(webhooks.router)
+    app.dependency_overrides[get_webhook_processor] = lambda: recorder
+    client = TestClient(app)
+    client.recorder = recorder
+    return client
+
+def test_webhook_verifies_and_enqueues(client):
+    payload = json.dumps(event("evt_4", "invoice.paid", {"id": "in_4"}))
+    response = client.post("/api/billing/webhook", content=payload,
+                           headers={"Stripe-Signature": sign_webhook(payload, SECRET)})
+    assert response.status_code == 200
+    assert [e["id"] for e in client.recorder.events] == ["evt_4"]
+
+def test_webhook_rejects_bad_signature(client):
+    payload = json.dumps(event("evt_5", "invoice.paid", {"id": "in_5"}))
+    response = client.post("/api/billing/webhook", content=payload,
+                           headers={"Stripe-Signature": sign_webhook(payload, "whsec_other")})
+    assert response.status_code == 400
+    assert client.recorder.events == []
+
+def test_tier_changes_reach_other_processes():
+    server = FakeRedisServer()
+    first, second = (TierCache(None, get_redis=lambda r=FakeRedis(server): r) for _ in range(2))
+
+    async def scenario():
+        first.start()
+        second.start()
+        await asyncio.sleep(0.01)
+        second.set("user-1", "free")
+        await first.publish("user-1", "pro")
+        await asyncio.sleep(0.01)
+        await first.stop()
+        await second.stop()
+
+    asyncio.run(scenario())
+    assert second.peek("user-1") == "pro"
@@ -75,4 +75,39 @@ def test_rate_limiting(auth_headers):
         responses.append(response.status_code)
     
     # At least one should be rate limited
-    assert 429 in responses
\ No newline at end of file
+    assert 429 in responses
+def test_delete_checks_ownership_and_stays_off_the_event_loop(monkeypatch):
+    import asyncio
+    import threading
+    from types import SimpleNamespace
+
+    from fastapi import HTTPException
+
+    from src.api import main
+
+    calls = []
+
+    class Container:
+        labels = {"claudeosaar.user_id": "user-1"}
+
+        def stop(self):
+            calls.append(("stop", threading.current_thread() is threading.main_thread()))
+
+        def remove(self):
+            calls.append(("remove", threading.current_thread() is threading.main_thread()))
+
+    async def forget(*args):
+        pass
+
+    monkeypatch.setattr(main, "scheduler", SimpleNamespace(containers=SimpleNamespace(get=lambda name: Container())))
+    monkeypatch.setattr(main, "forget_workspace", lambda name: None)
+    monkeypatch.setattr(main, "delete_workspace_record", forget)
+    monkeypatch.setattr(main, "snapshots", SimpleNamespace(delete_all=forget))
+
+    with pytest.raises(HTTPException) as refused:
+        asyncio.run(main.delete_workspace("ws-1", {"user_id": "user-2"}))
+    assert refused.value.status_code == 404
+    assert calls == []
+
+    asyncio.run(main.delete_workspace("ws-1", {"user_id": "user-1"}))
+    assert calls == [("stop", False), ("remove", False)]
@@ -0,0 +1,27 @@
+"""Minimal ASGI app for exercising the server launcher"""
+
+import os
+
+from prometheus_client import Counter
+
+from src.api.metrics import render_metrics
+
+requests_total = Counter('fake_app_requests_total', 'Requests served by the fake app')
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    if scope["path"] == "/metrics":
+        body = render_metrics()
+    else:
+        requests_total.inc()
+        body = str(os.getpid()).encode()
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/plain")]})
+    await send({"type": "http.response.body", "body": body})
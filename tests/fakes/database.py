@@ -0,0 +1,118 @@
+"""In-memory stand-in for `src.api.db.Database`
+
+Answers the statements the API issues on its request paths from three small
+tables, `users`, `workspaces` and `sessions`; anything else is accepted and
+returns no rows. An optional `latency` simulates the round trip to Postgres.
+"""
+
+import asyncio
+import itertools
+import threading
+from datetime import datetime
+
+class InMemoryDatabase:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.users = {}
+        self.workspaces = {}
+        # token_hash -> row
+        self.sessions = {}
+        self._session_ids = itertools.count(1)
+        self.statements = 0
+        self._lock = threading.Lock()
+
+    def add_user(self, user_id, tier="free", stripe_customer_id=None, is_admin=False):
+        self.users[user_id] = {"subscription_tier": tier, "stripe_customer_id": stripe_customer_id,
+                               "is_admin": is_admin}
+
+    async def _query(self, sql, params):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        sql = " ".join(sql.split())
+        with self._lock:
+            self.statements += 1
+            return self._answer(sql, params)
+
+    def _answer(self, sql, params):
+        if sql.startswith("SELECT 1"):
+            return [{"?column?": 1}]
+        if sql.startswith("SELECT subscription_tier FROM users"):
+            user = self.users.get(params[0])
+            return [{"subscription_tier": user["subscription_tier"]}] if user else []
+        if sql.startswith("SELECT is_admin FROM users"):
+            user = self.users.get(params[0])
+            return [{"is_admin": user.get("is_admin", False)}] if user else []
+        if sql.startswith("UPDATE users SET sessions_revoked_before"):
+            cutoff, user_id = params
+            user = self.users.setdefault(user_id, {"subscription_tier": "free", "stripe_customer_id": None})
+            user["sessions_revoked_before"] = max(cutoff, user.get("sessions_revoked_before") or cutoff)
+            return 1
+        if sql.startswith("SELECT id::text AS user_id, sessions_revoked_before FROM users"):
+            return [{"user_id": user_id, "sessions_revoked_before": user["sessions_revoked_before"]}
+                    for user_id, user in self.users.items()
+                    if user.get("sessions_revoked_before") and user["sessions_revoked_before"] > params[0]]
+        if sql.startswith("SELECT stripe_customer_id FROM users"):
+            user = self.users.get(params[0])
+            return [{"stripe_customer_id": user["stripe_customer_id"]}] if user else []
+        if sql.startswith("UPDATE users SET stripe_customer_id"):
+            customer_id, user_id = params
+            user = self.users.setdefault(user_id, {"subscription_tier": "free", "stripe_customer_id": None})
+            user["stripe_customer_id"] = user["stripe_customer_id"] or customer_id
+            return [{"stripe_customer_id": user["stripe_customer_id"]}]
+        if sql.startswith("INSERT INTO workspaces"):
+            workspace_id, user_id, name, container_id, tier = params
+            self.workspaces[workspace_id] = {"id": workspace_id, "user_id": user_id, "status": "running",
+                                             "container_id": container_id, "resource_tier": tier}
+            return 1
+        if sql.startswith("DELETE FROM workspaces"):
+            return 1 if self.workspaces.pop(params[0], None) else 0
+        if sql.startswith("INSERT INTO sessions"):
+            return self._upsert_sessions(sql, params)
+        if sql.startswith("UPDATE sessions SET revoked_at"):
+            now = datetime.utcnow()
+            rows = [s for s in self.sessions.values()
+                    if s["user_id"] == params[0] and s["revoked_at"] is None and s["expires_at"] > now]
+            for row in rows:
+                row["revoked_at"] = now
+            return [{"token_hash": s["token_hash"], "expires_at": s["expires_at"]} for s in rows]
+        if sql.startswith("SELECT token_hash, expires_at FROM sessions"):
+            now = datetime.utcnow()
+            return [{"token_hash": s["token_hash"], "expires_at": s["expires_at"]} for s in self.sessions.values()
+                    if s["revoked_at"] is not None and s["expires_at"] > now]
+        if sql.startswith("SELECT id::text AS id, token_hash"):
+            now = datetime.utcnow()
+            return sorted((dict(s) for s in self.sessions.values() if s["user_id"] == params[0]
+                           and s["revoked_at"] is None and s["expires_at"] > now), key=lambda s: s["created_at"])
+        if sql.startswith("SELECT id::text AS id, status"):
+            return [{"id": w["id"], "status": w["status"], "age": 0} for w in self.workspaces.values()]
+        return [] if sql.startswith("SELECT") or "RETURNING" in sql else 0
+
+    def _upsert_sessions(self, sql, params):
+        if "unnest" in sql:
+            rows, revoked = list(zip(*params)), False
+        else:
+            rows, revoked = [params], True
+        for user_id, token_hash, expires_at in rows:
+            row = self.sessions.get(token_hash)
+            if row is None:
+                row = self.sessions[token_hash] = {
+                    "id": str(next(self._session_ids)), "user_id": user_id, "token_hash": token_hash,
+                    "expires_at": expires_at, "created_at": datetime.utcnow(), "revoked_at": None}
+            if revoked and row["revoked_at"] is None:
+                row["revoked_at"] = datetime.utcnow()
+        return len(rows)
+
+    async def fetchone(self, sql, params=()):
+        rows = await self._query(sql, params)
+        return rows[0] if isinstance(rows, list) and rows else None
+
+    async def fetchall(self, sql, params=()):
+        rows = await self._query(sql, params)
+        return rows if isinstance(rows, list) else []
+
+    async def execute(self, sql, params=()):
+        rows = await self._query(sql, params)
+        return len(rows) if isinstance(rows, list) else rows
+
+    def close(self):
+        pass
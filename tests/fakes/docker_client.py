@@ -0,0 +1,268 @@
+"""In-memory stand-in for `docker.DockerClient`
+
+Implements the subset of the container API the workspace code uses, with
+label filtering and resource limits recorded in `attrs["HostConfig"]` the
+way the real daemon reports them.
+"""
+
+import io
+import itertools
+import posixpath
+import queue
+import tarfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import docker
+
+from src.api.workspaces.resources import parse_memory
+
+_ids = itertools.count(1)
+
+class FakeContainer:
+    def __init__(self, client, name, labels=None, mem_limit=None, cpu_quota=None, environment=None):
+        self.client = client
+        self.id = f"fake{next(_ids):012d}"
+        self.name = name
+        self.labels = dict(labels or {})
+        self.status = "running"
+        self.files = {}
+        self.attrs = {
+            "Created": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            "Config": {"Env": [f"{k}={v}" for k, v in (environment or {}).items()]},
+            "HostConfig": {
+                "Memory": parse_memory(mem_limit) if mem_limit else 0,
+                "CpuQuota": cpu_quota or 0,
+                "CpuPeriod": 100000,
+            },
+        }
+
+    def reload(self):
+        pass
+
+    def start(self):
+        self.status = "running"
+        self.client.emit("start", self)
+
+    def stop(self, timeout=None):
+        self.status = "exited"
+        self.client.emit("die", self)
+
+    def pause(self):
+        self.status = "paused"
+        self.client.emit("pause", self)
+
+    def unpause(self):
+        self.status = "running"
+        self.client.emit("unpause", self)
+
+    def remove(self, force=False):
+        if self.status == "running" and not force:
+            raise docker.errors.APIError("cannot remove a running container")
+        self.client.containers.remove(self.name)
+        self.client.emit("destroy", self)
+
+    def get_archive(self, path, chunk_size=2 * 1024 * 1024):
+        """Tar of the file or tree at `path` from `self.files`, in `chunk_size` pieces"""
+        path = posixpath.normpath(path)
+        names = sorted(name for name in self.files if name == path or name.startswith(path + "/"))
+        if not names:
+            raise docker.errors.NotFound(f"Could not find the file {path} in container {self.name}")
+        base = posixpath.dirname(path)
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w") as tar:
+            for name in names:
+                info = tarfile.TarInfo(posixpath.relpath(name, base))
+                info.size = len(self.files[name])
+                info.mtime = 1700000000
+                tar.addfile(info, io.BytesIO(self.files[name]))
+        data = buffer.getvalue()
+        stat = {"name": posixpath.basename(path), "size": len(self.files.get(path, b"")),
+                "mode": 0 if path in self.files else 0o20000000000 | 0o755,
+                "mtime": "2023-11-14T22:13:20.123456789Z"}
+        return (data[i:i + chunk_size] for i in range(0, len(data), chunk_size)), stat
+
+    def put_archive(self, path, data):
+        """Extract a tar, plain or gzip, from bytes or an iterable of chunks into `self.files`"""
+        chunks = [data] if isinstance(data, bytes) else data
+        self.put_archive_chunks = 0
+        buffer = bytearray()
+        for chunk in chunks:
+            self.put_archive_chunks += 1
+            buffer += chunk
+        with tarfile.open(fileobj=io.BytesIO(bytes(buffer)), mode="r:*") as tar:
+            for member in tar:
+                if member.isfile():
+                    name = posixpath.normpath(posixpath.join(path, member.name))
+                    self.files[name] = tar.extractfile(member).read()
+        return True
+
+class FakeContainers:
+    def __init__(self, client):
+        self.client = client
+        self._containers = {}
+        self._lock = threading.Lock()
+
+    def run(self, image, name=None, labels=None, mem_limit=None, cpu_quota=None,
+            environment=None, **kwargs):
+        with self._lock:
+            if name in self._containers:
+                raise docker.errors.APIError(f"Conflict: name {name} already in use")
+            container = FakeContainer(self.client, name, labels, mem_limit, cpu_quota, environment)
+            self._containers[name] = container
+        self.client.emit("create", container)
+        self.client.emit("start", container)
+        return container
+
+    def get(self, name):
+        container = self._containers.get(name)
+        if container is None:
+            raise docker.errors.NotFound(f"No such container: {name}")
+        return container
+
+    def list(self, all=False, filters=None):
+        filters = filters or {}
+        label = filters.get("label")
+        labels = [label] if isinstance(label, str) else (label or [])
+        status = filters.get("status")
+        result = []
+        for container in list(self._containers.values()):
+            if not all and status is None and container.status != "running":
+                continue
+            if status is not None and container.status != status:
+                continue
+            if any(not _label_matches(container.labels, l) for l in labels):
+                continue
+            result.append(container)
+        return result
+
+    def remove(self, name):
+        with self._lock:
+            self._containers.pop(name, None)
+
+class FakeExecApi:
+    """Low-level exec API that echoes the command back on stdout"""
+
+    def __init__(self, latency=0.0, exit_code=0):
+        self.latency = latency
+        self.exit_code = exit_code
+        self._commands = {}
+        self._lock = threading.Lock()
+
+    def exec_create(self, container_id, cmd, **kwargs):
+        with self._lock:
+            exec_id = f"exec{next(_ids):012d}"
+            self._commands[exec_id] = cmd
+        return {"Id": exec_id}
+
+    def exec_start(self, exec_id, stream=False, demux=False):
+        if self.latency:
+            time.sleep(self.latency)
+        yield (self._commands[exec_id][-1] + "\n").encode(), None
+
+    def exec_inspect(self, exec_id):
+        with self._lock:
+            self._commands.pop(exec_id, None)
+        return {"ExitCode": self.exit_code}
+
+class FakeRegistry:
+    """Stand-in image registry shared by nodes; any tag exists once asked for"""
+
+    def __init__(self, pull_latency=0.0):
+        self.pull_latency = pull_latency
+        self.tags = {}
+        self._lock = threading.Lock()
+
+    def push(self, ref):
+        """Point `ref` at a new digest, as a CI build would"""
+        with self._lock:
+            self.tags[ref] = f"sha256:{next(_ids):064x}"
+            return self.tags[ref]
+
+    def digest(self, ref):
+        with self._lock:
+            if ref not in self.tags:
+                self.tags[ref] = f"sha256:{next(_ids):064x}"
+            return self.tags[ref]
+
+class FakeImage:
+    def __init__(self, ref, digest):
+        repository = ref.rpartition(":")[0] or ref
+        self.id = f"sha256:{next(_ids):064x}"
+        self.tags = [ref]
+        self.attrs = {"RepoDigests": [f"{repository}@{digest}"]}
+
+class FakeImages:
+    def __init__(self, registry):
+        self.registry = registry
+        self.local = {}
+        self.pulls = []
+
+    def get(self, ref):
+        image = self.local.get(ref)
+        if image is None:
+            raise docker.errors.ImageNotFound(f"No such image: {ref}")
+        return image
+
+    def pull(self, repository, tag=None):
+        ref = f"{repository}:{tag or 'latest'}"
+        self.pulls.append(ref)
+        if self.registry.pull_latency:
+            time.sleep(self.registry.pull_latency)
+        self.local[ref] = FakeImage(ref, self.registry.digest(ref))
+        return self.local[ref]
+
+    def get_registry_data(self, ref):
+        return type("RegistryData", (), {"id": self.registry.digest(ref)})()
+
+class FakeEventStream:
+    """Blocking iterator of decoded events, ended by `close()` from any thread"""
+
+    def __init__(self, filters):
+        self.filters = filters or {}
+        self._queue = queue.Queue()
+
+    def put(self, message):
+        label = self.filters.get("label")
+        labels = [label] if isinstance(label, str) else (label or [])
+        attributes = message["Actor"]["Attributes"]
+        if all(_label_matches(attributes, l) for l in labels):
+            self._queue.put(message)
+
+    def close(self):
+        self._queue.put(None)
+
+    def __iter__(self):
+        while (message := self._queue.get()) is not None:
+            yield message
+
+class FakeDockerClient:
+    def __init__(self, mem_total=16 * 1024 ** 3, ncpu=8, exec_latency=0.0, registry=None):
+        self.mem_total = mem_total
+        self.ncpu = ncpu
+        self.containers = FakeContainers(self)
+        self.api = FakeExecApi(exec_latency)
+        self.images = FakeImages(registry or FakeRegistry())
+        self.event_streams = []
+
+    def events(self, decode=False, filters=None):
+        stream = FakeEventStream(filters)
+        self.event_streams.append(stream)
+        return stream
+
+    def emit(self, action, container):
+        message = {"Type": "container", "Action": action, "time": int(time.time()),
+                   "Actor": {"ID": container.id, "Attributes": {"name": container.name, **container.labels}}}
+        for stream in self.event_streams:
+            stream.put(message)
+
+    def info(self):
+        return {"MemTotal": self.mem_total, "NCPU": self.ncpu}
+
+    def ping(self):
+        return True
+
+def _label_matches(labels, selector):
+    key, _, value = selector.partition("=")
+    return key in labels and (not value or labels[key] == value)
@@ -0,0 +1,246 @@
+"""In-memory stand-in for `redis.asyncio.Redis`
+
+Covers the commands the API uses: strings with expiry and NX/XX, hashes,
+sorted sets, pub/sub and EVAL. Scripts run in a real Lua interpreter (lupa),
+one at a time, with `redis.call` reaching the same keys, so they are as
+atomic as on a Redis server. Clients created on the same `FakeRedisServer`
+share keys and channels, like API replicas sharing one Redis. Values come
+back as bytes, as from a client without `decode_responses`.
+"""
+
+import asyncio
+import time
+
+import lupa
+import redis
+
+def _bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode()
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+def _from_lua(value):
+    """A script's return value as redis-py hands it back"""
+    if lupa.lua_type(value) == "table":
+        return [_from_lua(value[i]) for i in range(1, len(value) + 1)]
+    if value is None or value is False:
+        return None
+    if value is True:
+        return 1
+    if isinstance(value, float):
+        return int(value)
+    return value
+
+class FakeRedisServer:
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.subscribers = {}
+
+    def alive(self, key):
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def _hash(self, key):
+        if not self.alive(key):
+            self.data[key] = {}
+        return self.data[key]
+
+    # Commands scripts may call; keys and values as bytes
+
+    def call(self, command, *args):
+        command = command.decode().upper() if isinstance(command, bytes) else command.upper()
+        key = _text(args[0])
+        if command == "GET":
+            return self.data.get(key) if self.alive(key) else None
+        if command == "PEXPIRE":
+            if not self.alive(key):
+                return 0
+            self.expires[key] = time.monotonic() + int(args[1]) / 1000
+            return 1
+        if command == "DEL":
+            removed = 0
+            for name in map(_text, args):
+                removed += self.alive(name)
+                self.data.pop(name, None)
+                self.expires.pop(name, None)
+            return removed
+        if command == "HGET":
+            return self.data[key].get(_bytes(args[1])) if self.alive(key) else None
+        if command == "HEXISTS":
+            return int(self.alive(key) and _bytes(args[1]) in self.data[key])
+        if command == "HVALS":
+            return list(self.data[key].values()) if self.alive(key) else []
+        if command == "HGETALL":
+            return [item for pair in self.data[key].items() for item in pair] if self.alive(key) else []
+        if command == "HSET":
+            fields = self._hash(key)
+            pairs = list(zip(args[1::2], args[2::2]))
+            added = sum(1 for field, _ in pairs if _bytes(field) not in fields)
+            fields.update((_bytes(field), _bytes(value)) for field, value in pairs)
+            return added
+        if command == "HDEL":
+            if not self.alive(key):
+                return 0
+            fields = self.data[key]
+            removed = sum(1 for field in args[1:] if fields.pop(_bytes(field), None) is not None)
+            if not fields:
+                del self.data[key]
+            return removed
+        raise NotImplementedError(f"{command} is not supported in scripts")
+
+    def eval(self, script, keys, args):
+        runtime = lupa.LuaRuntime(unpack_returned_tuples=False, encoding=None)
+        to_lua = lambda value: runtime.table(*value) if isinstance(value, list) else (
+            False if value is None else value)
+        redis_table = runtime.table_from({b"call": lambda *command: to_lua(self.call(*command))})
+        function = runtime.eval("function(KEYS, ARGV, redis)\n" + script + "\nend")
+        result = function(runtime.table(*map(_bytes, keys)), runtime.table(*map(_bytes, args)), redis_table)
+        return _from_lua(result)
+
+class FakePubSub:
+    def __init__(self, client, ignore_subscribe_messages=False):
+        self.client = client
+        self.ignore_subscribe_messages = ignore_subscribe_messages
+        self.channels = set()
+        self.queue = asyncio.Queue()
+
+    async def subscribe(self, *channels):
+        self.client.check()
+        for channel in channels:
+            self.channels.add(channel)
+            self.client.server.subscribers.setdefault(channel, set()).add(self)
+            if not self.ignore_subscribe_messages:
+                self.queue.put_nowait({"type": "subscribe", "channel": _bytes(channel), "data": 1})
+
+    async def listen(self):
+        while True:
+            message = await self.queue.get()
+            if isinstance(message, Exception):
+                raise message
+            yield message
+
+    async def aclose(self):
+        for channel in self.channels:
+            self.client.server.subscribers.get(channel, set()).discard(self)
+        self.channels.clear()
+
+class FakeRedis:
+    def __init__(self, server=None):
+        self.server = server or FakeRedisServer()
+        self.down = False
+        self._pubsubs = []
+
+    def check(self):
+        if self.down:
+            raise redis.ConnectionError("Connection refused")
+
+    def disconnect(self):
+        """Drop the connection: subscriptions fail and commands raise until `reconnect()`"""
+        self.down = True
+        for pubsub in self._pubsubs:
+            pubsub.queue.put_nowait(redis.ConnectionError("Connection closed by server"))
+
+    def reconnect(self):
+        self.down = False
+
+    async def get(self, key):
+        self.check()
+        return self.server.data.get(key) if self.server.alive(key) else None
+
+    async def set(self, key, value, ex=None, px=None, nx=False, xx=False):
+        self.check()
+        exists = self.server.alive(key)
+        if (nx and exists) or (xx and not exists):
+            return None
+        self.server.data[key] = _bytes(value)
+        self.server.expires.pop(key, None)
+        if ex is not None or px is not None:
+            self.server.expires[key] = time.monotonic() + (ex if ex is not None else px / 1000)
+        return True
+
+    async def delete(self, *keys):
+        self.check()
+        removed = 0
+        for key in keys:
+            if self.server.alive(key):
+                removed += 1
+                del self.server.data[key]
+            self.server.expires.pop(key, None)
+        return removed
+
+    def _zset(self, key):
+        if not self.server.alive(key):
+            self.server.data[key] = {}
+        return self.server.data[key]
+
+    async def zadd(self, key, mapping):
+        self.check()
+        zset = self._zset(key)
+        added = sum(1 for member in mapping if _bytes(member) not in zset)
+        zset.update({_bytes(member): float(score) for member, score in mapping.items()})
+        return added
+
+    @staticmethod
+    def _in_range(score, low, high):
+        return float(low) <= score <= float(high)
+
+    async def zrangebyscore(self, key, low, high, withscores=False):
+        self.check()
+        if not self.server.alive(key):
+            return []
+        items = sorted((score, member) for member, score in self.server.data[key].items()
+                       if self._in_range(score, low, high))
+        return [(member, score) if withscores else member for score, member in items]
+
+    async def zremrangebyscore(self, key, low, high):
+        self.check()
+        if not self.server.alive(key):
+            return 0
+        zset = self.server.data[key]
+        doomed = [member for member, score in zset.items() if self._in_range(score, low, high)]
+        for member in doomed:
+            del zset[member]
+        return len(doomed)
+
+    async def hget(self, key, field):
+        self.check()
+        return self.server.call("HGET", key, field)
+
+    async def hgetall(self, key):
+        self.check()
+        items = self.server.call("HGETALL", key)
+        return dict(zip(items[::2], items[1::2]))
+
+    async def hset(self, key, field=None, value=None, mapping=None):
+        self.check()
+        pairs = dict(mapping or {})
+        if field is not None:
+            pairs[field] = value
+        return self.server.call("HSET", key, *[item for pair in pairs.items() for item in pair])
+
+    async def hdel(self, key, *fields):
+        self.check()
+        return self.server.call("HDEL", key, *fields)
+
+    async def eval(self, script, numkeys, *keys_and_args):
+        self.check()
+        return self.server.eval(script, keys_and_args[:numkeys], keys_and_args[numkeys:])
+
+    async def publish(self, channel, message):
+        self.check()
+        subscribers = list(self.server.subscribers.get(channel, ()))
+        for pubsub in subscribers:
+            pubsub.queue.put_nowait({"type": "message", "channel": _bytes(channel), "data": _bytes(message)})
+        return len(subscribers)
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        pubsub = FakePubSub(self, ignore_subscribe_messages)
+        self._pubsubs.append(pubsub)
+        return pubsub
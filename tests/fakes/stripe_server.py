@@ -0,0 +1,141 @@
+"""Minimal local stand-in for the Stripe API
+
+Point the SDK at it with `stripe.api_base = server.url`. It implements just
+the endpoints the API uses and honours `Idempotency-Key` the way Stripe does:
+a repeated key replays the first response instead of creating a new object.
+"""
+
+import hashlib
+import hmac
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qsl
+
+class FakeStripeServer:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.customers = {}
+        self.subscriptions = {}
+        self.requests = []
+        self._idempotent = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def count(self, method: str, path: str) -> int:
+        return sum(1 for m, p in self.requests if m == method and p == path)
+
+    def _create_customer(self, params):
+        customer = {
+            "id": f"cus_{uuid.uuid4().hex[:14]}",
+            "object": "customer",
+            "email": params.get("email"),
+            "metadata": _nested(params, "metadata"),
+        }
+        self.customers[customer["id"]] = customer
+        return 200, customer
+
+    def _create_subscription(self, params):
+        if params.get("customer") not in self.customers:
+            return 400, {"error": {"type": "invalid_request_error", "message": "No such customer"}}
+        subscription_id = f"sub_{uuid.uuid4().hex[:14]}"
+        subscription = {
+            "id": subscription_id,
+            "object": "subscription",
+            "customer": params["customer"],
+            "status": "incomplete",
+            "metadata": _nested(params, "metadata"),
+            "latest_invoice": {
+                "id": f"in_{uuid.uuid4().hex[:14]}",
+                "object": "invoice",
+                "payment_intent": {
+                    "id": f"pi_{uuid.uuid4().hex[:14]}",
+                    "object": "payment_intent",
+                    "client_secret": f"pi_secret_{subscription_id}",
+                },
+            },
+        }
+        self.subscriptions[subscription_id] = subscription
+        return 200, subscription
+
+    def _route(self, method, path, params, headers):
+        with self._lock:
+            self.requests.append((method, path))
+            key = headers.get("Idempotency-Key")
+            if method == "POST" and key and (path, key) in self._idempotent:
+                return self._idempotent[(path, key)]
+
+            if method == "POST" and path == "/v1/customers":
+                result = self._create_customer(params)
+            elif method == "POST" and path == "/v1/subscriptions":
+                result = self._create_subscription(params)
+            elif method == "GET" and path.startswith("/v1/customers/"):
+                customer = self.customers.get(path.rsplit("/", 1)[1])
+                result = (200, customer) if customer else (404, {"error": {"message": "No such customer"}})
+            else:
+                result = (404, {"error": {"message": f"Unrecognized request URL ({method}: {path})"}})
+
+            if method == "POST" and key:
+                self._idempotent[(path, key)] = result
+            return result
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _respond(self):
+                if fake.latency:
+                    threading.Event().wait(fake.latency)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length).decode() if length else ""
+                path, _, query = self.path.partition("?")
+                params = dict(parse_qsl(body or query))
+                status, payload = fake._route(self.command, path, params, self.headers)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = _respond
+            do_POST = _respond
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+def _nested(params, prefix):
+    """Collect form-encoded `prefix[key]=value` pairs into a dict"""
+    start = f"{prefix}["
+    return {k[len(start):-1]: v for k, v in params.items() if k.startswith(start) and k.endswith("]")}
+
+def sign_webhook(payload: str, secret: str, timestamp: Optional[int] = None) -> str:
+    """Build a `Stripe-Signature` header for a webhook payload"""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signature = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
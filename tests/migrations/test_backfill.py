@@ -0,0 +1,64 @@
+import pytest
+from migrations.backfill import Backfill, BackfillRunner, Throttle
+
+class FakeCursor:
+    """Replays scripted results for batch and throttle queries"""
+
+    def __init__(self, batches, lags=None):
+        self.batches = list(batches)
+        self.lags = list(lags or [])
+        self.executed = []
+        self.checkpoints = []
+        self.result = None
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+        if "pg_stat_replication" in sql:
+            self.result = {"lag": self.lags.pop(0) if self.lags else 0}
+        elif "WITH batch AS" in sql:
+            self.result = self.batches.pop(0)
+        elif "INSERT INTO backfill_progress" in sql:
+            self.checkpoints.append(params)
+        elif "FROM backfill_progress WHERE name" in sql:
+            self.result = None
+
+    def fetchone(self):
+        return self.result
+
+@pytest.fixture
+def runner(mocker):
+    def make(cursor, throttle=None):
+        conn = mocker.Mock()
+        conn.cursor.return_value = cursor
+        return BackfillRunner(conn, throttle=throttle or Throttle(sleep=lambda s: None),
+                              sleep=lambda s: None)
+    return make
+
+def test_rejects_unsafe_identifiers():
+    with pytest.raises(ValueError):
+        Backfill("x", "memory_bank; DROP TABLE users", "a = 1")
+
+def test_batch_sql_uses_keyset_only_when_resuming():
+    backfill = Backfill("x", "memory_bank", "metadata = '{}'", where="metadata IS NULL")
+    assert "id > %(last_key)s" not in backfill.batch_sql(resume=False)
+    assert "id > %(last_key)s AND (metadata IS NULL)" in backfill.batch_sql(resume=True)
+
+def test_run_checkpoints_each_batch(runner):
+    cursor = FakeCursor([
+        {"last_key": "a", "updated": 2},
+        {"last_key": "b", "updated": 1},
+        {"last_key": None, "updated": 0},
+    ])
+    total = runner(cursor).run(Backfill("fill", "memory_bank", "metadata = '{}'", batch_size=2))
+
+    assert total == 3
+    assert [c[1:] for c in cursor.checkpoints] == [
+        ("a", 2, "running"), ("b", 3, "running"), ("b", 3, "completed")
+    ]
+    batch_params = [p for sql, p in cursor.executed if "WITH batch AS" in sql]
+    assert [p["last_key"] for p in batch_params] == [None, "a", "b"]
+
+def test_throttle_waits_for_replicas():
+    cursor = FakeCursor([], lags=[12.0, 7.0, 0.5])
+    throttle = Throttle(max_replication_lag=5.0, check_interval=2.0, sleep=lambda s: None)
+    assert throttle.wait(cursor) == 4.0
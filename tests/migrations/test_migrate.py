@@ -0,0 +1,130 @@
+import hashlib
+
+import pytest
+from migrations.migrate import (
+    MIGRATION_LOCK_ID,
+    DatabaseMigration,
+    MigrationDriftError,
+    file_checksum,
+    is_transactional,
+    split_sql_statements,
+)
+
+FUNCTION_SQL = """
+-- trigger helper; semicolons inside the body must not split it
+CREATE OR REPLACE FUNCTION touch() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = CURRENT_TIMESTAMP;
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+INSERT INTO notes (body) VALUES ('a;b'), ('it''s; fine');
+"""
+
+@pytest.fixture
+def migrations_dir(tmp_path):
+    (tmp_path / "001_init.sql").write_text("CREATE TABLE a (id INT);\nCREATE TABLE b (id INT);")
+    (tmp_path / "002_index.sql").write_text(
+        "ALTER TABLE a ADD COLUMN name TEXT;\n"
+        "CREATE INDEX CONCURRENTLY idx_a_name ON a(name);\n"
+        "COMMENT ON COLUMN a.name IS 'x';"
+    )
+    (tmp_path / "rollback_002_index.sql").write_text("DROP INDEX idx_a_name;")
+    return tmp_path
+
+@pytest.fixture
+def migration(mocker, migrations_dir):
+    mocker.patch("migrations.migrate.psycopg2.connect")
+    return DatabaseMigration("postgresql://test", migrations_dir=migrations_dir)
+
+def test_split_respects_dollar_quotes_and_strings():
+    statements = split_sql_statements(FUNCTION_SQL)
+    assert len(statements) == 2
+    assert statements[0].rstrip().endswith("language 'plpgsql'")
+    assert "'it''s; fine'" in statements[1]
+
+def test_split_ignores_comment_only_tail():
+    assert split_sql_statements("SELECT 1; -- done;\n") == ["SELECT 1"]
+
+def test_concurrent_index_is_not_transactional():
+    assert not is_transactional("-- build online\nCREATE INDEX CONCURRENTLY i ON t(c)")
+    assert not is_transactional("create unique index concurrently i on t(c)")
+    assert is_transactional("CREATE INDEX i ON t(c)")
+
+def test_migration_files_excludes_rollback_scripts(migration):
+    assert migration.migration_files() == ["001_init.sql", "002_index.sql"]
+
+def test_plan_groups_statements_by_transactionality(migration):
+    steps = migration.plan_migration("002_index.sql")
+    assert [step["transactional"] for step in steps] == [True, False, True]
+    assert steps[1]["statements"] == ["CREATE INDEX CONCURRENTLY idx_a_name ON a(name)"]
+
+def test_detect_drift(migration, migrations_dir):
+    applied = {
+        "001_init.sql": file_checksum((migrations_dir / "001_init.sql").read_text()),
+        "002_index.sql": "0" * 64,
+        "000_legacy.sql": None,
+    }
+    assert migration.detect_drift(applied) == ["002_index.sql"]
+
+def test_run_migrations_refuses_drift_and_releases_lock(migration, mocker):
+    mocker.patch.object(migration, "create_migrations_table")
+    mocker.patch.object(migration, "acquire_lock")
+    release = mocker.patch.object(migration, "release_lock")
+    mocker.patch.object(migration, "get_applied_checksums", return_value={"001_init.sql": "0" * 64})
+
+    with pytest.raises(MigrationDriftError):
+        migration.run_migrations()
+    release.assert_called_once()
+
+def test_dry_run_applies_nothing(migration, mocker, capsys):
+    create = mocker.patch.object(migration, "create_migrations_table")
+    mocker.patch.object(migration, "acquire_lock")
+    mocker.patch.object(migration, "release_lock")
+    # No tracking table yet
+    migration.cursor.fetchone.return_value = {"tracked": False}
+    apply = mocker.patch.object(migration, "apply_migration")
+
+    migration.run_migrations(dry_run=True)
+
+    apply.assert_not_called()
+    create.assert_not_called()
+    assert not any("CREATE" in str(call) or "ALTER" in str(call) for call in migration.cursor.execute.call_args_list)
+    output = capsys.readouterr().out
+    assert "[autocommit] CREATE INDEX CONCURRENTLY idx_a_name ON a(name)" in output
+
+def test_lock_is_taken_before_the_migrations_table_is_created(migration, mocker):
+    calls = mocker.Mock()
+    mocker.patch.object(migration, "acquire_lock", calls.acquire_lock)
+    mocker.patch.object(migration, "create_migrations_table", calls.create_migrations_table)
+    mocker.patch.object(migration, "release_lock", calls.release_lock)
+    mocker.patch.object(migration, "get_applied_checksums", return_value={})
+    mocker.patch.object(migration, "record_missing_checksums")
+    mocker.patch.object(migration, "apply_migration")
+
+    migration.run_migrations()
+    migration.status()
+
+    names = [name for name, _, _ in calls.mock_calls]
+    assert names == ["acquire_lock", "create_migrations_table", "release_lock"] * 2
+
+def test_lock_key_is_derived_from_its_name():
+    digest = hashlib.sha256(b"claudeosaar.migrations").digest()
+    assert MIGRATION_LOCK_ID == int.from_bytes(digest[:8], "big", signed=True)
+    assert -2**63 <= MIGRATION_LOCK_ID < 2**63
+
+def test_session_index_is_deduplicated_first_and_checked_before_the_old_one_goes(mocker):
+    mocker.patch("migrations.migrate.psycopg2.connect")
+    steps = DatabaseMigration("postgresql://test").plan_migration("005_session_revocation.sql")
+    assert steps[0]["transactional"] and "DELETE FROM sessions" in steps[0]["statements"][0]
+    assert steps[0]["statements"][1].startswith("ALTER TABLE sessions")
+    assert "CREATE UNIQUE INDEX CONCURRENTLY" in steps[1]["statements"][0]
+    assert steps[2]["transactional"] and "NOT indisvalid" in steps[2]["statements"][0]
+    assert steps[3]["statements"][0].startswith("DROP INDEX CONCURRENTLY")
+
+@pytest.mark.parametrize("filename", ["003_stripe_events.sql", "004_workspace_hibernation.sql"])
+def test_concurrent_indexes_are_checked_for_failed_builds(mocker, filename):
+    mocker.patch("migrations.migrate.psycopg2.connect")
+    steps = DatabaseMigration("postgresql://test").plan_migration(filename)
+    assert not steps[-2]["transactional"]
+    assert steps[-1]["transactional"] and "NOT indisvalid" in steps[-1]["statements"][0]
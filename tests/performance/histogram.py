@@ -0,0 +1,90 @@
+"""Log-linear latency histogram in the style of HdrHistogram
+
+Values are integers (the load test records microseconds). Each power of two
+is split into equal-width buckets, so every recorded value is kept to within
+a fixed relative error at any magnitude, and memory grows with the number of
+distinct buckets hit, not with the number of samples. Bucket counts
+serialize to JSON, which makes two runs comparable bucket by bucket.
+"""
+
+import math
+from typing import Dict, Optional
+
+class LatencyHistogram:
+    def __init__(self, significant_digits: int = 3):
+        self.significant_digits = significant_digits
+        # Buckets per power of two, enough to resolve 1 part in 10**digits
+        self.bits = math.ceil(math.log2(2 * 10 ** significant_digits))
+        # lowest value in bucket -> count
+        self.counts: Dict[int, int] = {}
+        self.total = 0
+        self.sum = 0
+        self.min: Optional[int] = None
+        self.max: Optional[int] = None
+
+    def _shift(self, value: int) -> int:
+        return max(0, value.bit_length() - self.bits)
+
+    def lowest_equivalent(self, value: int) -> int:
+        shift = self._shift(value)
+        return (value >> shift) << shift
+
+    def highest_equivalent(self, value: int) -> int:
+        return self.lowest_equivalent(value) + (1 << self._shift(value)) - 1
+
+    def record(self, value: int, count: int = 1):
+        value = max(0, int(value))
+        key = self.lowest_equivalent(value)
+        self.counts[key] = self.counts.get(key, 0) + count
+        self.total += count
+        self.sum += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other: "LatencyHistogram"):
+        if other.bits != self.bits:
+            raise ValueError("Cannot merge histograms with different precision")
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        self.total += other.total
+        self.sum += other.sum
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percent: float) -> int:
+        """Smallest value at or below which `percent` of samples fall, to bucket precision"""
+        if not self.total:
+            return 0
+        rank = max(1, math.ceil(percent / 100 * self.total))
+        seen = 0
+        for key in sorted(self.counts):
+            seen += self.counts[key]
+            if seen >= rank:
+                return min(self.highest_equivalent(key), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.total if self.total else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "significant_digits": self.significant_digits,
+            "total": self.total,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "counts": [[key, self.counts[key]] for key in sorted(self.counts)],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LatencyHistogram":
+        histogram = cls(data["significant_digits"])
+        histogram.counts = {key: count for key, count in data["counts"]}
+        histogram.total = data["total"]
+        histogram.sum = data["sum"]
+        histogram.min = data["min"]
+        histogram.max = data["max"]
+        return histogram
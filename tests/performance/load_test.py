@@ -1,91 +1,413 @@
+"""Scenario-based load test for the API
+
+    python tests/performance/load_test.py --rate 50 --duration 60 --report load.json
+    python tests/performance/load_test.py --baseline previous.json --max-regression 20
+    python tests/performance/load_test.py --target https://api.staging.example --jwt-secret ...
+
+Sessions arrive open-loop: their start times follow a seeded Poisson process
+fixed before the run, and each one starts on schedule whether or not earlier
+sessions have finished. A session's first request is timed from its
+scheduled start, so a stalled server shows up as latency instead of quietly
+lowering the offered load (coordinated omission).
+
+Each simulated user holds a valid JWT for its tier and a workspace created
+during setup. Latencies go into one HDR-style histogram per route; the JSON
+report carries percentiles, status codes and the raw bucket counts, so two
+releases can be compared.
+
+Without --target the API runs in this process on a random port, with Docker,
+Postgres and Stripe replaced by the fakes in tests/fakes, so it runs in CI.
+Install its dependencies with `pip install -r src/api/requirements-dev.txt`.
+"""
+
+import argparse
 import asyncio
-import aiohttp
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
 import time
-import statistics
-from typing import List
-
-# Load test configuration
-BASE_URL = "http://localhost:6600"
-CONCURRENT_USERS = 50
-REQUESTS_PER_USER = 100
-AUTH_TOKEN = "test_token"  # In real tests, get this from auth endpoint
-
-async def make_request(session: aiohttp.ClientSession, endpoint: str) -> float:
-    """Make a single request and return response time"""
-    start_time = time.time()
-    
-    async with session.get(
-        f"{BASE_URL}{endpoint}",
-        headers={"Authorization": f"Bearer {AUTH_TOKEN}"}
-    ) as response:
-        await response.text()
-        end_time = time.time()
-        return end_time - start_time
-
-async def user_simulation(user_id: int) -> List[float]:
-    """Simulate a single user making multiple requests"""
-    response_times = []
-    
-    async with aiohttp.ClientSession() as session:
-        for _ in range(REQUESTS_PER_USER):
-            # Simulate different endpoints
-            endpoints = [
-                "/api/workspaces",
-                f"/api/workspaces/test-{user_id}",
-                "/api/memory-bank/search?query=test",
-                "/health"
-            ]
-            
-            for endpoint in endpoints:
-                try:
-                    response_time = await make_request(session, endpoint)
-                    response_times.append(response_time)
-                except Exception as e:
-                    print(f"Request failed: {e}")
-            
-            # Small delay between requests
-            await asyncio.sleep(0.1)
-    
-    return response_times
-
-async def run_load_test():
-    """Run the load test with multiple concurrent users"""
-    print(f"Starting load test with {CONCURRENT_USERS} users...")
-    
-    # Create user tasks
-    tasks = [
-        user_simulation(user_id) 
-        for user_id in range(CONCURRENT_USERS)
-    ]
-    
-    # Run all users concurrently
-    start_time = time.time()
-    all_response_times = await asyncio.gather(*tasks)
-    end_time = time.time()
-    
-    # Flatten response times
-    response_times = [
-        time for user_times in all_response_times 
-        for time in user_times
-    ]
-    
-    # Calculate statistics
-    total_requests = len(response_times)
-    total_time = end_time - start_time
-    avg_response_time = statistics.mean(response_times)
-    p95_response_time = statistics.quantiles(response_times, n=100)[94]
-    p99_response_time = statistics.quantiles(response_times, n=100)[98]
-    requests_per_second = total_requests / total_time
-    
-    print("\n=== Load Test Results ===")
-    print(f"Total Requests: {total_requests}")
-    print(f"Total Time: {total_time:.2f} seconds")
-    print(f"Requests/Second: {requests_per_second:.2f}")
-    print(f"Average Response Time: {avg_response_time:.3f} seconds")
-    print(f"95th Percentile: {p95_response_time:.3f} seconds")
-    print(f"99th Percentile: {p99_response_time:.3f} seconds")
-    print(f"Min Response Time: {min(response_times):.3f} seconds")
-    print(f"Max Response Time: {max(response_times):.3f} seconds")
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from tests.performance.histogram import LatencyHistogram  # noqa: E402
+
+REPORT_VERSION = 1
+PERCENTILES = (50, 90, 99, 99.9)
+
+# Relative session weights; each session is one or more requests
+DEFAULT_MIX = {"view": 50, "exec": 25, "ready": 10, "create_delete": 10, "subscribe": 5}
+DEFAULT_TIERS = {"free": 70, "pro": 25, "enterprise": 5}
+# Free users are at their one-workspace quota once setup has run
+CREATE_TIERS = ("pro", "enterprise")
+
+class User:
+    def __init__(self, tier: str, secret: str):
+        import jwt
+
+        self.id = str(uuid.uuid4())
+        self.tier = tier
+        self.email = f"load-{self.id[:8]}@example.com"
+        self.workspace_id: Optional[str] = None
+        token = jwt.encode({
+            "user_id": self.id,
+            "email": self.email,
+            "subscription_tier": tier,
+            "exp": datetime.now(timezone.utc) + timedelta(hours=2),
+        }, secret, algorithm="HS256")
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+class Recorder:
+    """Per-route latency histograms and status counts"""
+
+    def __init__(self):
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.statuses: Dict[str, Dict[str, int]] = {}
+
+    def record(self, route: str, status: str, seconds: float):
+        self.histograms.setdefault(route, LatencyHistogram()).record(round(seconds * 1_000_000))
+        counts = self.statuses.setdefault(route, {})
+        counts[status] = counts.get(status, 0) + 1
+
+class LoadClient:
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder):
+        self.client = client
+        self.recorder = recorder
+
+    async def request(self, route: str, method: str, path: str, user: Optional[User] = None,
+                      since: Optional[float] = None, **kwargs) -> Optional[httpx.Response]:
+        """Send one request; latency is measured from `since` when given"""
+        start = since if since is not None else time.perf_counter()
+        headers = dict(user.headers) if user else {}
+        headers.update(kwargs.pop("headers", {}))
+        try:
+            response = await self.client.request(method, path, headers=headers, **kwargs)
+            status = str(response.status_code)
+        except httpx.HTTPError as e:
+            response, status = None, type(e).__name__
+        self.recorder.record(route, status, time.perf_counter() - start)
+        return response
+
+async def view(load: LoadClient, user: User, since: float):
+    await load.request("GET /api/workspaces/{id}", "GET", f"/api/workspaces/{user.workspace_id}",
+                       user, since)
+
+async def execute(load: LoadClient, user: User, since: float):
+    await load.request("POST /api/workspaces/{id}/execute", "POST",
+                       f"/api/workspaces/{user.workspace_id}/execute", user, since,
+                       json={"command": "echo load"})
+
+async def ready(load: LoadClient, user: User, since: float):
+    await load.request("GET /ready", "GET", "/ready", since=since)
+
+async def create_delete(load: LoadClient, user: User, since: float):
+    response = await load.request("POST /api/workspaces", "POST", "/api/workspaces", user, since,
+                                  json={"name": "load", "claude_api_key": "sk-ant-load"})
+    if response is not None and response.status_code == 200:
+        await load.request("DELETE /api/workspaces/{id}", "DELETE",
+                           f"/api/workspaces/{response.json()['id']}", user)
+
+async def subscribe(load: LoadClient, user: User, since: float):
+    await load.request("POST /api/billing/create-subscription", "POST",
+                       "/api/billing/create-subscription", user, since,
+                       params={"tier": "pro"}, headers={"Idempotency-Key": str(uuid.uuid4())})
+
+SCENARIOS: Dict[str, Callable] = {
+    "view": view,
+    "exec": execute,
+    "ready": ready,
+    "create_delete": create_delete,
+    "subscribe": subscribe,
+}
+
+def arrivals(rng: random.Random, rate: float, duration: float) -> List[float]:
+    """Poisson arrival offsets in seconds: exponential gaps with mean 1/rate"""
+    offsets, t = [], 0.0
+    while True:
+        t += rng.expovariate(rate)
+        if t >= duration:
+            return offsets
+        offsets.append(t)
+
+def plan(rng: random.Random, users: List[User], mix: Dict[str, float], rate: float, duration: float):
+    """The full, reproducible schedule of (offset, scenario, user)"""
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    creators = [user for user in users if user.tier in CREATE_TIERS] or users
+    schedule = []
+    for offset in arrivals(rng, rate, duration):
+        scenario = rng.choices(names, weights)[0]
+        schedule.append((offset, scenario, rng.choice(creators if scenario == "create_delete" else users)))
+    return schedule
+
+def make_users(tiers: Dict[str, float], count: int, secret: str, rng: random.Random) -> List[User]:
+    names = list(tiers)
+    return [User(tier, secret) for tier in rng.choices(names, [tiers[n] for n in names], k=count)]
+
+async def setup_workspaces(client: httpx.AsyncClient, users: List[User], concurrency: int = 16):
+    """Give every user a workspace for the view and exec scenarios"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def create(user: User):
+        async with semaphore:
+            response = await client.post("/api/workspaces", headers=user.headers,
+                                         json={"name": "load-base", "claude_api_key": "sk-ant-load"})
+            response.raise_for_status()
+            user.workspace_id = response.json()["id"]
+
+    await asyncio.gather(*(create(user) for user in users))
+
+async def teardown_workspaces(client: httpx.AsyncClient, users: List[User]):
+    await asyncio.gather(*(client.delete(f"/api/workspaces/{user.workspace_id}", headers=user.headers)
+                           for user in users if user.workspace_id), return_exceptions=True)
+
+async def run_load(base_url: str, users: List[User], schedule, max_in_flight: int,
+                   timeout: float) -> dict:
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        await setup_workspaces(client, users)
+        load = LoadClient(client, recorder)
+        in_flight = set()
+        dropped = 0
+        max_lag = 0.0
+        started = time.perf_counter()
+        for offset, scenario, user in schedule:
+            due = started + offset
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            max_lag = max(max_lag, time.perf_counter() - due)
+            if len(in_flight) >= max_in_flight:
+                # Count instead of waiting, which would lower the offered rate
+                dropped += 1
+                continue
+            task = asyncio.create_task(SCENARIOS[scenario](load, user, due))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        await asyncio.gather(*in_flight)
+        elapsed = time.perf_counter() - started
+        await teardown_workspaces(client, users)
+
+    return {
+        "recorder": recorder,
+        "elapsed": elapsed,
+        "sessions": len(schedule),
+        "dropped": dropped,
+        "max_launch_lag_ms": round(max_lag * 1000, 2),
+    }
+
+def serve_with_fakes(conn, secret: str, db_latency: float, docker_latency: float,
+                     stripe_latency: float, log_path: Optional[str]):
+    """Child process: run the real app with Docker, Postgres and Stripe faked"""
+    # Request logs go to stdout; keep them out of the report
+    log = open(log_path or os.devnull, "ab")
+    os.dup2(log.fileno(), sys.stdout.fileno())
+    os.dup2(log.fileno(), sys.stderr.fileno())
+
+    from tests.fakes.database import InMemoryDatabase
+    from tests.fakes.docker_client import FakeDockerClient
+    from tests.fakes.stripe_server import FakeStripeServer
+
+    stripe_server = FakeStripeServer(latency=stripe_latency).start()
+    # Read by the app at import or on first use
+    os.environ.update({
+        "JWT_SECRET": secret,
+        "LOG_DIR": "",
+        "RATE_LIMIT_PER_MINUTE": str(10 ** 9),
+        "STRIPE_SECRET_KEY": "sk_test_load",
+        "STRIPE_API_BASE": stripe_server.url,
+    })
+    # Unknown users fall back to the tier in their token
+    from src.api import db
+
+    db._database = InMemoryDatabase(latency=db_latency)
+
+    from src.api import main
+    from src.api.server import DrainingServer, bind_socket, build_config
+
+    main.scheduler.nodes["local"]._client = FakeDockerClient(
+        mem_total=4096 * 1024 ** 3, ncpu=4096, exec_latency=docker_latency
+    )
+    config = build_config(main.app, host="127.0.0.1", port=0, log_level="warning", access_log=False)
+    sock = bind_socket(config)
+    conn.send(sock.getsockname()[1])
+    DrainingServer(config, drain_delay=0).run(sockets=[sock])
+
+@contextlib.contextmanager
+def local_api(secret: str, db_latency: float, docker_latency: float, stripe_latency: float,
+              log_path: Optional[str] = None, startup_timeout: float = 60.0):
+    """Run the API with fakes in a child process and yield its base URL
+
+    A separate process keeps the load generator and the server from
+    competing for one interpreter lock, which would inflate latencies.
+    """
+    context = multiprocessing.get_context("spawn")
+    parent, child = context.Pipe()
+    process = context.Process(target=serve_with_fakes, daemon=True,
+                              args=(child, secret, db_latency, docker_latency, stripe_latency, log_path))
+    process.start()
+    try:
+        if not parent.poll(startup_timeout):
+            raise RuntimeError("API did not start")
+        base_url = f"http://127.0.0.1:{parent.recv()}"
+        deadline = time.monotonic() + startup_timeout
+        while True:
+            try:
+                if httpx.get(f"{base_url}/ready").status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline or not process.is_alive():
+                raise RuntimeError("API did not become ready")
+            time.sleep(0.1)
+        yield base_url
+    finally:
+        process.terminate()
+        process.join(30)
+
+def latency_summary(histogram: LatencyHistogram) -> dict:
+    summary = {f"p{p:g}": histogram.percentile(p) / 1000 for p in PERCENTILES}
+    summary.update(min=(histogram.min or 0) / 1000, max=(histogram.max or 0) / 1000,
+                   mean=round(histogram.mean / 1000, 3))
+    return summary
+
+def build_report(result: dict, meta: dict) -> dict:
+    recorder: Recorder = result["recorder"]
+    routes = {}
+    for route in sorted(recorder.histograms):
+        histogram = recorder.histograms[route]
+        statuses = recorder.statuses[route]
+        # 4xx are the API working as intended (quotas, exec limits); 5xx and
+        # transport errors are failures
+        failed = sum(count for status, count in statuses.items()
+                     if not status.isdigit() or status.startswith("5"))
+        routes[route] = {
+            "count": histogram.total,
+            "rate": round(histogram.total / result["elapsed"], 2),
+            "status": dict(sorted(statuses.items())),
+            "error_rate": round(failed / histogram.total, 4),
+            "latency_ms": latency_summary(histogram),
+            "histogram_us": histogram.to_dict(),
+        }
+    requests = sum(route["count"] for route in routes.values())
+    return {
+        "version": REPORT_VERSION,
+        "meta": meta,
+        "summary": {
+            "sessions_scheduled": result["sessions"],
+            "sessions_dropped": result["dropped"],
+            "requests": requests,
+            "elapsed_s": round(result["elapsed"], 2),
+            "target_session_rate": meta["rate"],
+            "achieved_request_rate": round(requests / result["elapsed"], 2),
+            "max_launch_lag_ms": result["max_launch_lag_ms"],
+        },
+        "routes": routes,
+    }
+
+def compare(report: dict, baseline: dict, max_regression: Optional[float] = None) -> bool:
+    """Print per-route latency changes; False if a p99 regressed beyond `max_regression` percent"""
+    ok = True
+    print(f"{'route':42} {'p50 ms':>20} {'p99 ms':>24}")
+    for route, current in report["routes"].items():
+        previous = baseline.get("routes", {}).get(route)
+        if previous is None:
+            print(f"{route:42} {'(new)':>20}")
+            continue
+        cells = []
+        for key in ("p50", "p99"):
+            old, new = previous["latency_ms"][key], current["latency_ms"][key]
+            change = (new - old) / old * 100 if old else 0.0
+            cells.append(f"{old:.2f} -> {new:.2f} ({change:+.0f}%)")
+            if key == "p99" and max_regression is not None and change > max_regression:
+                ok = False
+        print(f"{route:42} {cells[0]:>20} {cells[1]:>24}")
+    return ok
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    weights = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, weight = part.partition("=")
+        weights[name] = float(weight or 1)
+    return weights
+
+def main():
+    parser = argparse.ArgumentParser(description="Open-loop load test for the API")
+    parser.add_argument("--target", help="Base URL of a running API; default runs it in-process with fakes")
+    parser.add_argument("--jwt-secret", default=os.getenv("JWT_SECRET", "load-test-secret-load-test-secret"))
+    parser.add_argument("--rate", type=float, default=20.0, help="Sessions started per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of load")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--mix", default=",".join(f"{k}={v}" for k, v in DEFAULT_MIX.items()))
+    parser.add_argument("--tiers", default=",".join(f"{k}={v}" for k, v in DEFAULT_TIERS.items()))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--max-in-flight", type=int, default=512)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--db-latency", type=float, default=0.002, help="Fake Postgres round trip (s)")
+    parser.add_argument("--docker-latency", type=float, default=0.01, help="Fake exec duration (s)")
+    parser.add_argument("--stripe-latency", type=float, default=0.05, help="Fake Stripe round trip (s)")
+    parser.add_argument("--server-log", help="With the in-process API, append its logs here")
+    parser.add_argument("--report", help="Write the JSON report here")
+    parser.add_argument("--baseline", help="Earlier JSON report to compare against")
+    parser.add_argument("--max-regression", type=float,
+                        help="With --baseline, exit 1 if any route's p99 grew by more than this percent")
+    args = parser.parse_args()
+
+    mix = parse_weights(args.mix)
+    unknown = set(mix) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    tiers = parse_weights(args.tiers)
+
+    rng = random.Random(args.seed)
+    users = make_users(tiers, args.users, args.jwt_secret, rng)
+    schedule = plan(rng, users, mix, args.rate, args.duration)
+    meta = {
+        "target": args.target or "in-process",
+        "seed": args.seed,
+        "rate": args.rate,
+        "duration": args.duration,
+        "users": args.users,
+        "mix": mix,
+        "tiers": tiers,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+    }
+
+    with contextlib.ExitStack() as stack:
+        if args.target:
+            base_url = args.target
+        else:
+            base_url = stack.enter_context(local_api(args.jwt_secret, args.db_latency, args.docker_latency,
+                                                     args.stripe_latency, args.server_log))
+            meta.update(db_latency=args.db_latency, docker_latency=args.docker_latency,
+                        stripe_latency=args.stripe_latency)
+        result = asyncio.run(run_load(base_url, users, schedule, args.max_in_flight, args.timeout))
+
+    report = build_report(result, meta)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps({"summary": report["summary"],
+                      "routes": {route: {k: v for k, v in data.items() if k != "histogram_us"}
+                                 for route, data in report["routes"].items()}}, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare(report, baseline, args.max_regression):
+            sys.exit(1)
 
 if __name__ == "__main__":
-    asyncio.run(run_load_test())
\ No newline at end of file
+    main()
@@ -0,0 +1,250 @@
+"""Micro-benchmarks for per-request hot paths, with regression gating
+
+    python tests/performance/microbenchmarks.py                 # compare with the baseline
+    python tests/performance/microbenchmarks.py --update        # record a new baseline
+    python tests/performance/microbenchmarks.py --only verify_token --threshold 0.1
+
+Each benchmark runs a fixed amount of work per round, with the garbage
+collector paused, and the median round is compared with the baseline. Exits
+non-zero when a benchmark got slower than the baseline by more than the
+threshold. Timings only compare on the same kind of machine: record the
+baseline with --update on the runner that enforces it.
+
+Docker, Postgres and Stripe are replaced by the fakes in tests/fakes; no
+network or daemon is touched.
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "microbenchmarks.json")
+DEFAULT_THRESHOLD = 0.3
+DEFAULT_ROUNDS = 15
+JWT_SECRET = "benchmark-secret-benchmark-secret"
+
+class Benchmark:
+    """`op` is awaited `number` times per round; `setup` runs before each round"""
+
+    def __init__(self, name: str, op: Callable[[], Awaitable], number: int,
+                 setup: Optional[Callable[[], None]] = None):
+        self.name = name
+        self.op = op
+        self.number = number
+        self.setup = setup
+
+    async def round(self) -> float:
+        if self.setup:
+            self.setup()
+        op = self.op
+        # Like timeit: a collection landing in one round skews it
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            for _ in range(self.number):
+                await op()
+            return (time.perf_counter() - start) / self.number
+        finally:
+            gc.enable()
+
+    async def measure(self, rounds: int) -> dict:
+        await self.round()  # warm caches and lazy imports
+        samples = sorted([await self.round() for _ in range(rounds)])
+        return {"median_us": statistics.median(samples) * 1e6, "min_us": samples[0] * 1e6}
+
+def http_scope(path: str, client: str = "10.0.0.1", method: str = "GET", headers=()) -> dict:
+    return {
+        "type": "http", "http_version": "1.1", "method": method, "scheme": "http",
+        "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers],
+        "client": (client, 50000), "server": ("127.0.0.1", 6600),
+    }
+
+def configure_environment():
+    """Settings read at import time; must run before src.api.main is imported"""
+    os.environ.update({
+        "JWT_SECRET": JWT_SECRET,
+        "LOG_DIR": "",
+        "RATE_LIMIT_PER_MINUTE": str(10 ** 9),
+        "STRIPE_SECRET_KEY": "sk_test_benchmark",
+    })
+
+def build_benchmarks() -> Dict[str, Benchmark]:
+    configure_environment()
+    import jwt
+    from fastapi.encoders import jsonable_encoder
+    from starlette.requests import Request
+    from starlette.responses import JSONResponse, Response
+
+    from src.api import db
+    from tests.fakes.database import InMemoryDatabase
+
+    db._database = InMemoryDatabase()
+
+    from src.api import main
+    from src.api.logging import log_requests, logger
+    from src.api.metrics import render_metrics
+    from src.api.middleware.rate_limit import RateLimitMiddleware
+    from tests.fakes.docker_client import FakeDockerClient
+
+    # Keep the formatter's cost but not the output
+    for handler in logger.handlers:
+        if hasattr(handler, "setStream"):
+            handler.setStream(open(os.devnull, "w"))
+
+    token = jwt.encode({"user_id": "user-1", "email": "a@example.com", "subscription_tier": "pro",
+                        "exp": int(time.time()) + 3600}, main.JWT_SECRET, algorithm="HS256")
+    auth = [("Authorization", f"Bearer {token}")]
+
+    async def call_next(request):
+        return Response(b"{}", media_type="application/json")
+
+    # 100 clients at 10 requests each per round, under a 60/minute limit
+    limiter = RateLimitMiddleware(None, calls_per_minute=60)
+    requests = [Request(http_scope("/api/workspaces/w", f"10.0.{i // 256}.{i % 256}")) for i in range(100)]
+    counter = iter(range(0))
+
+    def reset_limiter():
+        nonlocal counter
+        limiter.requests.clear()
+        counter = iter(range(10 ** 9))
+
+    async def rate_limit():
+        await limiter.dispatch(requests[next(counter) % 100], call_next)
+
+    async def verify_token():
+        main.decode_token(token)
+
+    log_request = Request(http_scope("/api/workspaces/w"))
+
+    async def logging_middleware():
+        await log_requests(log_request, call_next)
+
+    workspace = main.WorkspaceResponse(id="6f1c2a9e-1d8b-4b7e-9a51-7d0f3c2b1a00", name="claude-workspace-1",
+                                       status="running", container_id="f" * 64,
+                                       terminal_url="/terminal/6f1c2a9e-1d8b-4b7e-9a51-7d0f3c2b1a00")
+
+    async def workspace_json():
+        JSONResponse(jsonable_encoder(workspace))
+
+    # A realistic, fixed number of series: the workload must not grow as
+    # endpoints are added, or the baseline stops being comparable
+    routes = [
+        "/api/workspaces", "/api/workspaces/{workspace_id}", "/api/workspaces/{workspace_id}/execute",
+        "/api/workspaces/{workspace_id}/execute/ws", "/api/billing/create-subscription",
+        "/api/billing/webhook", "/api/memory-bank/search", "/api/memory-bank/store",
+        "/health", "/ready", "/health/deep", "/metrics",
+        "/openapi.json", "/docs", "/docs/oauth2-redirect", "/redoc",
+    ]
+    for path in routes:
+        for status in ("200", "401", "404", "500"):
+            main.http_requests_total.labels("GET", path, status).inc()
+        main.http_request_duration.labels("GET", path).observe(0.01)
+
+    async def metrics():
+        render_metrics()
+
+    # The whole middleware stack and route for GET /api/workspaces/{id}
+    docker = FakeDockerClient()
+    main.scheduler.nodes["local"]._client = docker
+    docker.containers.run("claudeosaar/workspace:latest", name="claude-workspace-w",
+                          labels={"claudeosaar.user_id": "user-1"})
+    scopes = [http_scope("/api/workspaces/w", f"10.1.0.{i}", headers=auth) for i in range(256)]
+    scope_counter = iter(range(0))
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    def reset_app():
+        nonlocal scope_counter
+        scope_counter = iter(range(10 ** 9))
+
+    async def get_workspace_request():
+        await main.app(scopes[next(scope_counter) % 256], receive, send)
+
+    benchmarks = [
+        Benchmark("rate_limit_dispatch", rate_limit, 1000, setup=reset_limiter),
+        Benchmark("verify_token", verify_token, 2000),
+        Benchmark("log_requests", logging_middleware, 2000),
+        Benchmark("workspace_response_json", workspace_json, 5000),
+        Benchmark("metrics_render", metrics, 50),
+        Benchmark("get_workspace_request", get_workspace_request, 500, setup=reset_app),
+    ]
+    return {benchmark.name: benchmark for benchmark in benchmarks}
+
+async def run_benchmarks(names=None, rounds: int = DEFAULT_ROUNDS) -> dict:
+    benchmarks = build_benchmarks()
+    results = {}
+    for name, benchmark in benchmarks.items():
+        if not names or name in names:
+            results[name] = await benchmark.measure(rounds)
+    return {"machine": machine(), "benchmarks": results}
+
+def machine() -> dict:
+    return {"python": platform.python_version(), "processor": platform.processor() or platform.machine(),
+            "cpus": os.cpu_count()}
+
+def compare(results: dict, baseline: dict, threshold: float = DEFAULT_THRESHOLD) -> list:
+    """Names of benchmarks slower than the baseline by more than `threshold`, printing a table"""
+    if baseline.get("machine") and baseline["machine"] != results.get("machine"):
+        print(f"Note: baseline was recorded on {baseline['machine']}, this is {results.get('machine')}")
+    regressions = []
+    print(f"{'benchmark':26} {'median us':>11} {'baseline':>11} {'change':>8}")
+    for name, result in results["benchmarks"].items():
+        previous = baseline.get("benchmarks", {}).get(name)
+        if previous is None:
+            print(f"{name:26} {result['median_us']:11.2f} {'(new)':>11}")
+            continue
+        change = result["median_us"] / previous["median_us"] - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:26} {result['median_us']:11.2f} {previous['median_us']:11.2f} {change:+8.0%}{flag}")
+    return regressions
+
+def load_baseline(path: str = BASELINE) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark API hot paths against a stored baseline")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--update", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Allowed slowdown as a fraction, e.g. 0.25 for 25%%")
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS)
+    parser.add_argument("--only", action="append", help="Run just this benchmark; repeatable")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_benchmarks(args.only, args.rounds))
+    if args.update:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(json.dumps(results, indent=2))
+        return
+
+    regressions = compare(results, load_baseline(args.baseline), args.threshold)
+    if regressions:
+        print(f"Slower than baseline by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
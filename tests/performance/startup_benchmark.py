@@ -0,0 +1,67 @@
+"""API cold-start benchmark
+
+Measures, in fresh interpreters, how long it takes to import the app and
+then to finish lifespan startup (the point where /ready turns green).
+
+    python tests/performance/startup_benchmark.py --runs 10 --target 1.0
+
+Exits non-zero when the median import-to-ready time exceeds the target.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Runs in the child interpreter; prints timings as JSON
+PROBE = """
+import asyncio, json, sys, time
+start = time.perf_counter()
+from src.api.main import app
+from src.api.lifecycle import lifecycle
+imported = time.perf_counter()
+
+async def startup():
+    async with app.router.lifespan_context(app):
+        assert lifecycle.ready
+        ready = time.perf_counter()
+        heavy = [m for m in ("docker", "stripe", "jwt", "psycopg2") if m in sys.modules]
+    return ready, heavy
+
+ready, heavy = asyncio.run(startup())
+print(json.dumps({"import": imported - start, "ready": ready - start, "heavy_modules": heavy}))
+"""
+
+def measure() -> dict:
+    env = dict(os.environ, LOG_DIR="", DATABASE_URL="postgresql://benchmark@127.0.0.1:1/none")
+    result = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure API import-to-ready time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--target", type=float, default=1.0, help="Median seconds allowed")
+    args = parser.parse_args()
+
+    # The first run warms the OS page cache and bytecode cache
+    measure()
+    samples = [measure() for _ in range(args.runs)]
+    ready = sorted(s["ready"] for s in samples)
+    report = {
+        "runs": args.runs,
+        "import_median": statistics.median(s["import"] for s in samples),
+        "ready_median": statistics.median(ready),
+        "ready_max": ready[-1],
+        "heavy_modules_at_ready": samples[-1]["heavy_modules"],
+        "target": args.target,
+    }
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["ready_median"] <= args.target else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import random
+
+import pytest
+
+from tests.performance.histogram import LatencyHistogram
+from tests.performance.load_test import arrivals, build_report, compare, Recorder
+
+def test_percentiles_within_precision():
+    histogram = LatencyHistogram(significant_digits=3)
+    for value in range(1, 100_001):
+        histogram.record(value)
+
+    assert histogram.total == 100_000
+    for percent in (50, 90, 99, 99.9):
+        exact = percent / 100 * 100_000
+        assert histogram.percentile(percent) == pytest.approx(exact, rel=1e-3)
+    assert histogram.percentile(100) == 100_000
+    # Memory grows with magnitude, not sample count
+    assert len(histogram.counts) < 20_000
+
+def test_round_trip_and_merge():
+    a, b = LatencyHistogram(), LatencyHistogram()
+    for value in (120, 5_000, 2_000_000):
+        a.record(value)
+    b.record(7, count=3)
+
+    restored = LatencyHistogram.from_dict(a.to_dict())
+    assert restored.percentile(50) == a.percentile(50)
+    restored.merge(b)
+    assert (restored.total, restored.min, restored.max) == (6, 7, 2_000_000)
+    assert restored.percentile(50) == 7
+
+def test_arrivals_are_seeded_poisson():
+    first = arrivals(random.Random(7), rate=200, duration=50)
+    assert first == arrivals(random.Random(7), rate=200, duration=50)
+    assert len(first) == pytest.approx(10_000, rel=0.05)
+    gaps = [b - a for a, b in zip(first, first[1:])]
+    assert sum(gaps) / len(gaps) == pytest.approx(1 / 200, rel=0.05)
+
+def test_report_flags_p99_regression(capsys):
+    def report(latency):
+        recorder = Recorder()
+        for _ in range(100):
+            recorder.record("GET /ready", "200", latency)
+        recorder.record("GET /ready", "ConnectTimeout", latency)
+        return build_report({"recorder": recorder, "elapsed": 10.0, "sessions": 101,
+                             "dropped": 0, "max_launch_lag_ms": 0.0}, {"rate": 10.1})
+
+    baseline = report(0.010)
+    assert baseline["routes"]["GET /ready"]["error_rate"] == pytest.approx(1 / 101, abs=1e-4)
+    assert compare(report(0.011), baseline, max_regression=20)
+    assert not compare(report(0.020), baseline, max_regression=20)
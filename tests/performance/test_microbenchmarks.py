@@ -0,0 +1,32 @@
+import json
+import os
+import subprocess
+import sys
+
+from tests.performance.microbenchmarks import BASELINE, compare
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def results(**median_us):
+    return {"benchmarks": {name: {"median_us": value, "min_us": value} for name, value in median_us.items()}}
+
+def test_compare_flags_only_regressions_beyond_threshold(capsys):
+    baseline = results(verify_token=2.0, metrics_render=400.0)
+    current = results(verify_token=2.4, metrics_render=600.0, log_requests=1.0)
+
+    assert compare(current, baseline, threshold=0.25) == ["metrics_render"]
+    assert "(new)" in capsys.readouterr().out
+
+def test_every_benchmark_runs_and_has_a_baseline():
+    # A separate interpreter: the suite configures the app through the environment
+    result = subprocess.run(
+        [sys.executable, "tests/performance/microbenchmarks.py", "--rounds", "1", "--threshold", "1000"],
+        cwd=ROOT, capture_output=True, text=True, env=dict(os.environ, LOG_DIR="")
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+
+    with open(BASELINE) as f:
+        baseline = json.load(f)["benchmarks"]
+    for name in baseline:
+        assert name in result.stdout
+    assert "(new)" not in result.stdout